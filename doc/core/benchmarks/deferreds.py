@@ -133,6 +133,111 @@ def pauseUnpause(n):
     d.unpause()
 pauseUnpause = benchmarkNFunc(20, ns)(pauseUnpause)
 
+def _identity(result, *args, **kwargs):
+    return result
+
+def _ignore(result):
+    return None
+
+chainNs = [1, 10, 100]
+
+def succeedAddCallback():
+    """
+    Create an already fired deferred with L{defer.succeed} and add a single
+    callback to it, which is how most deferreds are used.
+    """
+    defer.succeed(1).addCallback(_identity)
+succeedAddCallback = benchmarkFunc(100000)(succeedAddCallback)
+
+def failAddErrback():
+    """
+    Create an already failed deferred with L{defer.fail} and add an errback
+    which handles the failure.
+    """
+    defer.fail(ZeroDivisionError()).addErrback(_ignore)
+failAddErrback = benchmarkFunc(20000)(failAddErrback)
+
+def callbackChain(n):
+    """
+    Add the given number of callbacks which take no extra arguments to a
+    deferred, then fire it.
+    """
+    d = defer.Deferred()
+    for i in xrange(n):
+        d.addCallback(_identity)
+    d.callback(1)
+callbackChain = benchmarkNFunc(10000, chainNs)(callbackChain)
+
+def callbackChainWithArgs(n):
+    """
+    Add the given number of callbacks which take extra positional and
+    keyword arguments to a deferred, then fire it.
+    """
+    d = defer.Deferred()
+    for i in xrange(n):
+        d.addCallback(_identity, 1, key=2)
+    d.callback(1)
+callbackChainWithArgs = benchmarkNFunc(10000, chainNs)(callbackChainWithArgs)
+
+def nestedDeferreds(n):
+    """
+    Fire a deferred whose callbacks each return another deferred, which is
+    only fired afterwards, the given number of times.
+    """
+    d = defer.Deferred()
+    inner = []
+    def returnDeferred(result):
+        waiting = defer.Deferred()
+        inner.append(waiting)
+        return waiting
+    for i in xrange(n):
+        d.addCallback(returnDeferred)
+    d.callback(1)
+    while inner:
+        inner.pop().callback(1)
+nestedDeferreds = benchmarkNFunc(10000, chainNs)(nestedDeferreds)
+
+def inlineCallbacksYields(n):
+    """
+    Run an L{defer.inlineCallbacks} generator which yields the given number
+    of already fired deferreds.
+    """
+    def gen():
+        for i in xrange(n):
+            yield defer.succeed(i)
+    defer.inlineCallbacks(gen)()
+inlineCallbacksYields = benchmarkNFunc(10000, chainNs)(inlineCallbacksYields)
+
+def inlineCallbacksNested(n):
+    """
+    Run L{defer.inlineCallbacks} generators nested the given number of levels
+    deep, each of which returns a value to its caller with
+    L{defer.returnValue}.
+    """
+    def gen(depth):
+        if depth:
+            result = yield nested(depth - 1)
+        else:
+            result = yield defer.succeed(0)
+        defer.returnValue(result + 1)
+    nested = defer.inlineCallbacks(gen)
+    nested(n)
+inlineCallbacksNested = benchmarkNFunc(1000, chainNs)(inlineCallbacksNested)
+
+def inlineCallbacksFailures(n):
+    """
+    Run an L{defer.inlineCallbacks} generator which yields the given number
+    of already failed deferreds and handles each failure.
+    """
+    def gen():
+        for i in xrange(n):
+            try:
+                yield defer.fail(ZeroDivisionError())
+            except ZeroDivisionError:
+                pass
+    defer.inlineCallbacks(gen)()
+inlineCallbacksFailures = benchmarkNFunc(1000, chainNs)(inlineCallbacksFailures)
+
 def benchmark():
     """
     Run all of the benchmarks registered in the benchmarkFuncs list
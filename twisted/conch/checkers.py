@@ -129,6 +129,7 @@ class SSHPublicKeyDatabase:
     credentialInterfaces = (ISSHPrivateKey,)
 
     _userdb = pwd
+    _authorizedKeys = None
 
     def requestAvatarId(self, credentials):
         d = defer.maybeDeferred(self.checkKey, credentials)
@@ -201,25 +202,62 @@ class SSHPublicKeyDatabase:
         """
         ouid, ogid = self._userdb.getpwnam(credentials.username)[2:4]
         for filepath in self.getAuthorizedKeysFiles(credentials):
-            if not filepath.exists():
-                continue
             try:
-                lines = filepath.open()
-            except IOError, e:
-                if e.errno == errno.EACCES:
-                    lines = runAsEffectiveUser(ouid, ogid, filepath.open)
-                else:
-                    raise
+                filepath.restat()
+            except OSError:
+                continue
+            if credentials.blob in self._getAuthorizedKeys(
+                    filepath, ouid, ogid):
+                return True
+        return False
+
+
+    def _getAuthorizedKeys(self, filepath, ouid, ogid):
+        """
+        Get the key blobs listed in an I{authorized_keys} file.
+
+        The blobs are cached, and the file is only read again once its
+        modification time, size or inode number changes, so repeated
+        authentication attempts don't re-read and re-decode it.
+
+        @param filepath: The file, which has just been C{restat}ed.
+        @type filepath: L{FilePath}
+
+        @param ouid: The uid to read the file as if the server can't.
+        @param ogid: The gid to read the file as if the server can't.
+
+        @return: The blobs of the keys in the file.
+        @rtype: C{frozenset} of C{str}
+        """
+        if self._authorizedKeys is None:
+            self._authorizedKeys = {}
+        stat = filepath.statinfo
+        stamp = (stat.st_mtime, stat.st_size, stat.st_ino)
+        cached = self._authorizedKeys.get(filepath.path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        try:
+            lines = filepath.open()
+        except IOError, e:
+            if e.errno == errno.EACCES:
+                lines = runAsEffectiveUser(ouid, ogid, filepath.open)
+            else:
+                raise
+        blobs = set()
+        try:
             for l in lines:
                 l2 = l.split()
                 if len(l2) < 2:
                     continue
                 try:
-                    if base64.decodestring(l2[1]) == credentials.blob:
-                        return True
+                    blobs.add(base64.decodestring(l2[1]))
                 except binascii.Error:
                     continue
-        return False
+        finally:
+            lines.close()
+        blobs = frozenset(blobs)
+        self._authorizedKeys[filepath.path] = (stamp, blobs)
+        return blobs
 
     def _ebRequestAvatarId(self, f):
         if not f.check(UnauthorizedLogin):
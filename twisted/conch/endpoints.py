@@ -7,7 +7,8 @@ Endpoint implementations of various SSH interactions.
 """
 
 __all__ = [
-    'AuthenticationFailed', 'SSHCommandAddress', 'SSHCommandClientEndpoint']
+    'AuthenticationFailed', 'SSHCommandAddress', 'SSHCommandClientEndpoint',
+    'SSHConnectionPool']
 
 from struct import unpack
 from os.path import expanduser
@@ -112,9 +113,14 @@ class _CommandChannel(SSHChannel):
     @ivar _protocolFactory:  See L{__init__}
     @ivar _commandConnected:  See L{__init__}
     @ivar _protocol: An L{IProtocol} provider created using C{_protocolFactory}
-        which is hooked up to the running command's input and output streams.
+        which is hooked up to the running command's input and output streams,
+        or C{None} if the command never got that far.
+    @ivar _released: C{True} once this channel's hold on its connection has
+        been given back to C{_creator}.
     """
     name = b'session'
+    _protocol = None
+    _released = False
 
     def __init__(self, creator, command, protocolFactory, commandConnected):
         """
@@ -153,7 +159,13 @@ class _CommandChannel(SSHChannel):
         """
         When the request to open a new channel to run this command in succeeds,
         issue an C{"exec"} request to run the command.
+
+        If C{commandConnected} has already fired (because the attempt was
+        cancelled), close the channel instead.
         """
+        if self._commandConnected.called:
+            self.loseConnection()
+            return
         command = self.conn.sendRequest(
             self, 'exec', NS(self._command), wantReply=True)
         command.addCallbacks(self._execSuccess, self._execFailure)
@@ -167,7 +179,22 @@ class _CommandChannel(SSHChannel):
         @param reason: The cause of the command execution failure.
         @type reason: L{Failure}
         """
-        self._commandConnected.errback(reason)
+        if not self._commandConnected.called:
+            self._commandConnected.errback(reason)
+
+
+    def _release(self, connection, immediate):
+        """
+        Give this channel's hold on C{connection} back to C{_creator}, unless
+        that has already been done.
+
+        @param connection: The L{SSHConnection} this channel was opened on.
+
+        @param immediate: See L{_ISSHConnectionCreator.cleanupConnection}.
+        """
+        if not self._released:
+            self._released = True
+            self._creator.cleanupConnection(connection, immediate)
 
 
     def _execSuccess(self, ignored):
@@ -182,11 +209,15 @@ class _CommandChannel(SSHChannel):
 
         @param ignored: The (ignored) result of the execute request
         """
+        if self._commandConnected.called:
+            # Cancelled while the request was outstanding.
+            self.loseConnection()
+            return
         self._protocol = self._protocolFactory.buildProtocol(
             SSHCommandAddress(
                 self.conn.transport.transport.getPeer(),
                 self.conn.transport.creator.username,
-                self.conn.transport.creator.command))
+                self._command))
         self._protocol.makeConnection(self)
         self._commandConnected.callback(self._protocol)
 
@@ -234,7 +265,9 @@ class _CommandChannel(SSHChannel):
         When the channel closes, deliver disconnection notification to the
         protocol.
         """
-        self._creator.cleanupConnection(self.conn, False)
+        self._release(self.conn, False)
+        if self._protocol is None:
+            return
         if self._reason is None:
             reason = ConnectionDone("ssh channel closed")
         else:
@@ -602,6 +635,35 @@ class SSHCommandClientEndpoint(object):
         return cls(helper, command)
 
 
+    @classmethod
+    def pooledConnection(cls, pool, command, username, hostname, port=None,
+                         keys=None, password=None, agentEndpoint=None,
+                         knownHosts=None, ui=None):
+        """
+        Create and return a new endpoint which will open a new channel on a
+        connection from C{pool} and run a command over it.  The connection is
+        shared with other endpoints created from the same pool for the same
+        server and credentials, and is only set up if the pool has no
+        connection with room for another channel.  The connection is given
+        back to the pool after the command finishes.
+
+        @param pool: The pool to take the connection from.
+        @type pool: L{SSHConnectionPool}
+
+        @param command: See L{__init__}'s C{command} argument.
+
+        @return: A new instance of C{cls} (probably
+            L{SSHCommandClientEndpoint}).
+
+        @see: L{newConnection} for the other arguments.
+        """
+        helper = _NewConnectionHelper(
+            pool._reactor, hostname, port, command, username, keys, password,
+            agentEndpoint, knownHosts, ui)
+        return cls(
+            _PooledConnectionHelper(pool, helper, knownHosts, ui), command)
+
+
     def connect(self, protocolFactory):
         """
         Set up an SSH connection, use a channel from that connection to launch
@@ -641,7 +703,7 @@ class SSHCommandClientEndpoint(object):
             # Close the connection immediately in case of cancellation, since
             # that implies user wants it gone immediately (e.g. a timeout):
             immediate =  passthrough.check(CancelledError)
-            self._creator.cleanupConnection(connection, immediate)
+            channel._release(connection, immediate)
             return passthrough
         commandConnected.addErrback(disconnectOnFailure)
 
@@ -830,3 +892,309 @@ class _ExistingConnectionHelper(object):
         @param immediate: An argument which will be ignored.
         @type immediate: L{bool}.
         """
+
+
+class _PooledConnection(object):
+    """
+    A connection, or a connection attempt, belonging to an
+    L{SSHConnectionPool}.
+
+    @ivar helper: The L{_NewConnectionHelper} which set up the connection.
+
+    @ivar connection: The authenticated L{SSHConnection}, or C{None} while it
+        is being set up.
+
+    @ivar channels: The number of channels which have been handed this
+        connection and not yet given it back.
+
+    @ivar _waiting: L{Deferred}s to fire with the connection once it is set
+        up.
+
+    @ivar _connecting: The L{Deferred} from the helper's C{secureConnection}
+        while the connection is being set up.
+    """
+    connection = None
+    _connecting = None
+
+    def __init__(self, helper):
+        self.helper = helper
+        self.channels = 0
+        self._waiting = []
+
+
+    def usable(self):
+        """
+        @return: C{True} if the connection is being set up or is still open.
+        @rtype: L{bool}
+        """
+        if self.connection is None:
+            return True
+        transport = self.connection.transport.transport
+        return not (transport.disconnecting or transport.disconnected)
+
+
+    def reserve(self):
+        """
+        Count one more channel on this connection.
+
+        @return: A L{Deferred} which fires with the connection once it is set
+            up.
+        """
+        self.channels += 1
+        if self.connection is not None:
+            return succeed(self.connection)
+        d = Deferred(self._cancelWaiting)
+        self._waiting.append(d)
+        return d
+
+
+    def _cancelWaiting(self, d):
+        """
+        Stop waiting for the connection on behalf of C{d}, and give up on
+        setting it up if nothing else is waiting for it.
+        """
+        self._waiting.remove(d)
+        self.channels -= 1
+        d.errback(CancelledError())
+        if not self._waiting:
+            self._connecting.cancel()
+
+
+    def connected(self, connection):
+        """
+        The connection is set up: hand it to everything waiting for it.
+        """
+        self._connecting = None
+        self.connection = connection
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(connection)
+
+
+    def failed(self, reason):
+        """
+        The connection could not be set up: tell everything waiting for it.
+        """
+        self._connecting = None
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.errback(reason)
+
+
+
+class SSHConnectionPool(object):
+    """
+    A pool of authenticated SSH connections, for running many commands on the
+    same servers without paying for a new connection, key exchange and
+    authentication each time.
+
+    Connections are stored using keys made up of the server's hostname and
+    port and all of the credentials used to authenticate, so a connection is
+    only shared by endpoints which would have authenticated in exactly the
+    same way.  Each connection carries at most C{maxChannelsPerConnection}
+    channels at once; beyond that another connection to the same server is
+    opened.
+
+    Pass a pool to L{SSHCommandClientEndpoint.pooledConnection} to use it.
+
+    @ivar maxChannelsPerConnection: The maximum number of channels to open at
+        once on one connection.
+    @type maxChannelsPerConnection: C{int}
+
+    @ivar cachedConnectionTimeout: Number of seconds a connection with no
+        channels will stay open before disconnecting.
+
+    @ivar _connections: Map keys to lists of L{_PooledConnection} instances.
+
+    @ivar _timeouts: Map L{_PooledConnection} instances to an
+        C{IDelayedCall} instance of their timeout.
+    """
+    maxChannelsPerConnection = 10
+    cachedConnectionTimeout = 240
+
+    def __init__(self, reactor):
+        """
+        @param reactor: The reactor to use to establish connections and to
+            time out idle ones.
+        @type reactor: L{IReactorTCP} and L{IReactorTime} provider
+        """
+        self._reactor = reactor
+        self._connections = {}
+        self._timeouts = {}
+
+
+    def _getConnection(self, key, helper):
+        """
+        Supply a connection, newly created or shared with other channels, on
+        which to open one channel.
+
+        @param key: The key under which connections which can be used
+            interchangeably are stored.
+
+        @param helper: A L{_NewConnectionHelper} to set up a new connection
+            with if there is none with room for another channel.
+
+        @return: A L{Deferred} which fires with the L{SSHConnection}.
+        """
+        pooled = self._connections.get(key, [])
+        pooled = [p for p in pooled if p.usable()]
+        for p in pooled:
+            if p.channels < self.maxChannelsPerConnection:
+                break
+        else:
+            p = _PooledConnection(helper)
+            pooled.append(p)
+            p._connecting = helper.secureConnection()
+            p._connecting.addCallback(p.connected)
+            p._connecting.addErrback(self._failed, key, p)
+        self._connections[key] = pooled
+        if p in self._timeouts:
+            self._timeouts.pop(p).cancel()
+        return p.reserve()
+
+
+    def _failed(self, reason, key, pooled):
+        """
+        Forget a connection which could not be set up.
+        """
+        self._remove(key, pooled)
+        pooled.failed(reason)
+
+
+    def _remove(self, key, pooled):
+        """
+        Remove C{pooled} from the pool.
+        """
+        if pooled in self._connections.get(key, []):
+            self._connections[key].remove(pooled)
+            if not self._connections[key]:
+                del self._connections[key]
+        if pooled in self._timeouts:
+            self._timeouts.pop(pooled).cancel()
+
+
+    def _find(self, connection):
+        """
+        @return: The key and L{_PooledConnection} of C{connection}, or
+            C{(None, None)} if it is no longer in the pool.
+        """
+        for key, pooled in self._connections.iteritems():
+            for p in pooled:
+                if p.connection is connection:
+                    return key, p
+        return None, None
+
+
+    def _putConnection(self, connection, immediate):
+        """
+        Give back a connection on which a channel has finished or failed.
+
+        If no channels are left on it, it is closed after
+        C{cachedConnectionTimeout} seconds unless another channel is opened
+        on it first.
+
+        @param connection: The L{SSHConnection} being given back.
+
+        @param immediate: If C{True}, the channel was cancelled.  Other
+            commands may still be running on the connection, so only this
+            channel's use of it is given up; the connection is closed
+            immediately only if no channels are left on it.
+        """
+        key, pooled = self._find(connection)
+        if pooled is None:
+            return
+        pooled.channels = max(pooled.channels - 1, 0)
+        if immediate:
+            if pooled.channels == 0:
+                self._remove(key, pooled)
+                pooled.helper.cleanupConnection(connection, True)
+            return
+        if pooled.channels == 0 and pooled not in self._timeouts:
+            self._timeouts[pooled] = self._reactor.callLater(
+                self.cachedConnectionTimeout, self._expire, key, pooled)
+
+
+    def _expire(self, key, pooled):
+        """
+        Close a connection which has had no channels for
+        C{cachedConnectionTimeout} seconds.
+        """
+        del self._timeouts[pooled]
+        if pooled.connection.channels:
+            # Something is still using it, though it was given back as often
+            # as it was handed out.
+            return
+        self._remove(key, pooled)
+        pooled.helper.cleanupConnection(pooled.connection, False)
+
+
+    def closeCachedConnections(self):
+        """
+        Close all connections and remove them from the pool, including the
+        ones channels are still open on.
+        """
+        connections, self._connections = self._connections, {}
+        for dc in self._timeouts.values():
+            dc.cancel()
+        self._timeouts = {}
+        for pooled in connections.itervalues():
+            for p in pooled:
+                if p.connection is not None:
+                    p.helper.cleanupConnection(p.connection, False)
+
+
+
+@implementer(_ISSHConnectionCreator)
+class _PooledConnectionHelper(object):
+    """
+    L{_PooledConnectionHelper} implements L{_ISSHConnectionCreator} by
+    handing out connections from an L{SSHConnectionPool}, creating them as
+    necessary with a L{_NewConnectionHelper}.
+    """
+
+    def __init__(self, pool, helper, knownHosts=None, ui=None):
+        """
+        @param pool: The L{SSHConnectionPool} to take connections from.
+        @type pool: L{SSHConnectionPool}
+
+        @param helper: The L{_NewConnectionHelper} to create new connections
+            with.
+        @type helper: L{_NewConnectionHelper}
+
+        @param knownHosts: The C{knownHosts} argument C{helper} was created
+            with, before any default was filled in.
+
+        @param ui: The C{ui} argument C{helper} was created with, before any
+            default was filled in.
+        """
+        self.pool = pool
+        self.helper = helper
+        keys = tuple(key.fingerprint() for key in helper.keys or ())
+        # Only share a connection whose host key was checked the same way.
+        # The objects are compared by identity, and a connection in the pool
+        # keeps them alive through its helper, so their ids are not reused
+        # while it can be shared.
+        self.key = (helper.hostname, helper.port, helper.username, keys,
+                    helper.password, helper.agentEndpoint,
+                    id(knownHosts), id(ui))
+
+
+    def secureConnection(self):
+        """
+        @return: A L{Deferred} which fires with a ready-to-use connection from
+            the pool.
+        """
+        return self.pool._getConnection(self.key, self.helper)
+
+
+    def cleanupConnection(self, connection, immediate):
+        """
+        Give the connection back to the pool.
+
+        @param connection: The L{SSHConnection} given back.
+        @type connection: L{SSHConnection}
+
+        @param immediate: Whether to close the connection immediately.
+        @type immediate: L{bool}.
+        """
+        self.pool._putConnection(connection, immediate)
@@ -410,6 +410,181 @@ class TerminalBuffer(protocol.Protocol):
             lines.append(''.join(buf[:length]))
         return '\n'.join(lines)
 
+
+class VirtualScreen(TerminalBuffer):
+    """
+    An off-screen terminal which keeps a real one up to date by sending it
+    only what has changed.
+
+    Draw on a L{VirtualScreen} as on any L{insults.ITerminalTransport} (for
+    example, pass it to L{twisted.conch.insults.window.TopWindow.draw}), then
+    call L{flush}.  L{flush} compares the screen with the frame it last sent
+    and updates the real terminal with the fewest cursor movements,
+    character set and graphic rendition changes it can, in a single write.
+
+    Each character is assumed to take up one column, as in
+    L{TerminalBuffer}.
+
+    @ivar terminal: The L{insults.ITerminalTransport} provider to update.
+
+    @ivar _sent: The lines of the frame last sent to C{terminal}, or C{None}
+        if C{terminal} has to be redrawn from scratch.
+
+    @ivar _sentCursor: The C{(x, y)} position in which the last L{flush} left
+        the cursor of C{terminal}, or C{None} if it is not known.
+
+    @ivar _states: Map attribute tuples to L{_FormattingState} instances, so
+        that cells with the same attributes share one state and comparing
+        lines is cheap.
+    """
+    void = ' '
+
+    _charsetCodes = {
+        insults.CS_UK: 'A',
+        insults.CS_US: 'B',
+        insults.CS_DRAWING: '0',
+        insults.CS_ALTERNATE: '1',
+        insults.CS_ALTERNATE_SPECIAL: '2'}
+
+    def __init__(self, terminal, width=80, height=24):
+        """
+        @param terminal: See L{terminal}.
+        @param width: The width of C{terminal}.
+        @param height: The height of C{terminal}.
+        """
+        self.terminal = terminal
+        self.width = width
+        self.height = height
+        self._states = {}
+        self._sent = None
+        self._sentCursor = None
+        self.reset()
+
+
+    def _currentFormattingState(self):
+        """
+        Get the formatting state for new characters.  Unlike
+        L{TerminalBuffer}, its C{charset} is the character set itself
+        (C{CS_US}, C{CS_DRAWING}, ...) rather than the register (C{G0}, ...)
+        it was selected into.
+        """
+        gr = self.graphicRendition
+        key = (self.charsets[self.activeCharset], gr['bold'],
+               gr['underline'], gr['blink'], gr['reverseVideo'],
+               gr['foreground'], gr['background'])
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _FormattingState(*key)
+        return state
+
+
+    def resize(self, width, height):
+        """
+        Change the size of the screen, clearing it.  The next L{flush}
+        redraws the whole terminal.
+        """
+        self.width = width
+        self.height = height
+        self.x = min(self.x, width - 1)
+        self.y = min(self.y, height - 1)
+        self.eraseDisplay()
+        self.invalidate()
+
+
+    def invalidate(self):
+        """
+        Forget what the real terminal shows, for example because something
+        else has written to it, so that the next L{flush} redraws it from
+        scratch.
+        """
+        self._sent = None
+        self._sentCursor = None
+
+
+    def _graphicRendition(self, state):
+        """
+        @return: The escape sequence selecting exactly the attributes of
+            C{state}.
+        """
+        attrs = ['0']
+        if state.bold:
+            attrs.append(str(insults.BOLD))
+        if state.underline:
+            attrs.append(str(insults.UNDERLINE))
+        if state.blink:
+            attrs.append(str(insults.BLINK))
+        if state.reverseVideo:
+            attrs.append(str(insults.REVERSE_VIDEO))
+        if state.foreground != WHITE:
+            attrs.append(str(FOREGROUND + state.foreground))
+        if state.background != BLACK:
+            attrs.append(str(BACKGROUND + state.background))
+        return '\x1b[%sm' % (';'.join(attrs),)
+
+
+    def flush(self):
+        """
+        Bring the real terminal up to date with this screen in one write,
+        leaving its cursor where this screen's cursor is.
+        """
+        out = []
+        width = self.width
+        default = self._states.get((insults.CS_US, False, False, False, False,
+                                    WHITE, BLACK))
+        if default is None:
+            default = _FormattingState(insults.CS_US)
+        # What the real terminal's cursor position and attributes are.
+        cx = cy = None
+        sent = self._sent
+        if sent is None:
+            out.append('\x1b[0m\x1b(B\x1b[2J')
+            blank = [(' ', default)] * width
+            sent = [blank] * self.height
+        elif self._sentCursor is not None:
+            cx, cy = self._sentCursor
+        current = default
+        for y, (line, old) in enumerate(zip(self.lines, sent)):
+            if line == old:
+                continue
+            for x in xrange(width):
+                if line[x] == old[x]:
+                    continue
+                if cy == y and cx is not None and 0 < x - cx <= 3:
+                    # Rewriting a few unchanged cells is shorter than moving
+                    # the cursor over them.
+                    start = cx
+                else:
+                    if (cx, cy) != (x, y):
+                        out.append('\x1b[%d;%dH' % (y + 1, x + 1))
+                    start = x
+                for ch, state in line[start:x + 1]:
+                    if state is not current:
+                        if state.charset != current.charset:
+                            out.append('\x1b(' + self._charsetCodes.get(
+                                state.charset, 'B'))
+                        if (self._graphicRendition(state) !=
+                            self._graphicRendition(current)):
+                            out.append(self._graphicRendition(state))
+                        current = state
+                    out.append(ch)
+                cx, cy = x + 1, y
+                if cx >= width:
+                    # Whether the cursor wraps now depends on the terminal.
+                    cx = cy = None
+        if (self._graphicRendition(current) !=
+            self._graphicRendition(default)):
+            out.append('\x1b[0m')
+        if current.charset != default.charset:
+            out.append('\x1b(B')
+        x, y = min(self.x, width - 1), self.y
+        if (cx, cy) != (x, y):
+            out.append('\x1b[%d;%dH' % (y + 1, x + 1))
+        if out:
+            self.terminal.write(''.join(out))
+        self._sent = [list(line) for line in self.lines]
+        self._sentCursor = (x, y)
+
+
 class ExpectationTimeout(Exception):
     pass
 
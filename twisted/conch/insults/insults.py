@@ -991,7 +991,16 @@ class ClientProtocol(protocol.Protocol):
                 handler.unhandledControlSequence('\x1b[' + buf + 'K')
 
         def H(self, proto, handler, buf):
-            handler.cursorHome()
+            if not buf:
+                handler.cursorHome()
+            else:
+                parts = (buf.split(';') + [''])[:2]
+                try:
+                    line, column = [int(p or '1') for p in parts]
+                except ValueError:
+                    handler.unhandledControlSequence('\x1b[' + buf + 'H')
+                else:
+                    handler.cursorPosition(column - 1, line - 1)
 
         def J(self, proto, handler, buf):
             if not buf:
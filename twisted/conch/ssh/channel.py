@@ -26,7 +26,12 @@ class SSHChannel(log.Logger):
     @ivar name: the name of the channel.
     @type name: C{str}
     @ivar localWindowSize: the maximum size of the local window in bytes.
+        It grows, up to C{maxLocalWindowSize}, when the connection finds that
+        it limits how fast the other side can send.
     @type localWindowSize: C{int}
+    @ivar maxLocalWindowSize: the largest C{localWindowSize} may grow to.  Set
+        it to C{localWindowSize} or less to keep the window a fixed size.
+    @type maxLocalWindowSize: C{int}
     @ivar localWindowLeft: how many bytes are left in the local window.
     @type localWindowLeft: C{int}
     @ivar localMaxPacket: the maximum size of packet we will accept in bytes.
@@ -51,6 +56,8 @@ class SSHChannel(log.Logger):
     implements(interfaces.ITransport)
 
     name = None # only needed for client channels
+    maxLocalWindowSize = 16 * 1024 * 1024
+    _lastWindowAdjust = None # when the connection last refilled the window
 
     def __init__(self, localWindow = 0, localMaxPacket = 0,
                        remoteWindow = 0, remoteMaxPacket = 0,
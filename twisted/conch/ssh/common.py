@@ -9,7 +9,7 @@ Common functions for the SSH classes.
 Maintainer: Paul Swartz
 """
 
-import struct, warnings, __builtin__
+import binascii, struct, warnings, __builtin__
 
 try:
     from Crypto import Util
@@ -41,7 +41,11 @@ def getNS(s, count=1):
 def MP(number):
     if number==0: return '\000'*4
     assert number>0
-    bn = Util.number.long_to_bytes(number)
+    # Going through hex is much faster than Crypto.Util.number.long_to_bytes.
+    bn = '%x' % (number,)
+    if len(bn) % 2:
+        bn = '0' + bn
+    bn = binascii.unhexlify(bn)
     if ord(bn[0])&128:
         bn = '\000' + bn
     return struct.pack('>L',len(bn)) + bn
@@ -58,7 +62,7 @@ def getMP(data, count=1):
     c = 0
     for i in range(count):
         length, = struct.unpack('>L',data[c:c+4])
-        mp.append(Util.number.bytes_to_long(data[c+4:c+4+length]))
+        mp.append(long(binascii.hexlify(data[c+4:c+4+length]) or '0', 16))
         c += 4 + length
     return tuple(mp) + (data[c:],)
 
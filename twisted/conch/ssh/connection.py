@@ -10,6 +10,7 @@ Maintainer: Paul Swartz
 """
 
 import struct
+import time
 
 from twisted.conch.ssh import service, common
 from twisted.conch import error
@@ -35,8 +36,17 @@ class SSHConnection(service.SSHService):
     @ivar deferreds: a C{dict} mapping a local channel ID to a C{list} of
         C{Deferreds} for outstanding channel requests.  Also, the 'global'
         key stores the C{list} of pending global request C{Deferred}s.
+    @ivar _roundTripTime: the round trip time of the connection in seconds,
+        or C{None} if it has not been measured yet.
+    @type _roundTripTime: C{float}
+    @ivar _roundTripProbe: when the request measuring the round trip time
+        was sent, or C{None} if there is no such request outstanding.
+    @type _roundTripProbe: C{float}
     """
     name = 'ssh-connection'
+    _roundTripTime = None
+    _roundTripProbe = None
+    _seconds = staticmethod(time.time)
 
     def __init__(self):
         self.localChannelID = 0 # this is the current # to use for channel ID
@@ -233,12 +243,7 @@ class SSHConnection(service.SSHService):
             return
             #packet = packet[:channel.localWindowLeft+4]
         data = common.getNS(packet[4:])[0]
-        channel.localWindowLeft -= dataLength
-        if channel.localWindowLeft < channel.localWindowSize // 2:
-            self.adjustWindow(channel, channel.localWindowSize - \
-                                       channel.localWindowLeft)
-            #log.msg('local window left: %s/%s' % (channel.localWindowLeft,
-            #                                    channel.localWindowSize))
+        self._consumeWindow(channel, dataLength)
         log.callWithLogger(channel, channel.dataReceived, data)
 
     def ssh_CHANNEL_EXTENDED_DATA(self, packet):
@@ -262,11 +267,75 @@ class SSHConnection(service.SSHService):
             self.sendClose(channel)
             return
         data = common.getNS(packet[8:])[0]
+        self._consumeWindow(channel, dataLength)
+        log.callWithLogger(channel, channel.extReceived, typeCode, data)
+
+    def _consumeWindow(self, channel, dataLength):
+        """
+        Take C{dataLength} bytes out of the local window of C{channel}, and
+        give the other side more window once half of it has been used.
+
+        Before the window is refilled, it may be grown by L{_tuneWindow}.
+
+        @type channel:      subclass of L{SSHChannel}
+        @type dataLength:   C{int}
+        """
         channel.localWindowLeft -= dataLength
         if channel.localWindowLeft < channel.localWindowSize // 2:
+            self._tuneWindow(channel)
             self.adjustWindow(channel, channel.localWindowSize -
                                        channel.localWindowLeft)
-        log.callWithLogger(channel, channel.extReceived, typeCode, data)
+
+
+    def _tuneWindow(self, channel):
+        """
+        Grow the local window of C{channel} if it limits how fast the other
+        side can send.
+
+        The bytes used since the window was last refilled and the time that
+        took give the rate the other side is sending at.  Multiplied by the
+        round trip time, that is the amount of data in flight (the
+        bandwidth-delay product).  The window is refilled when half of it has
+        been used, so to keep data flowing while the adjustment travels to
+        the other side it must be at least twice that.  If it is not, its
+        size is doubled, up to C{channel.maxLocalWindowSize}.
+
+        The round trip time is measured the first time a channel would need
+        it, so channels which never refill their window more than once cost
+        nothing extra.
+
+        @type channel:      subclass of L{SSHChannel}
+        """
+        now = self._seconds()
+        lastAdjust, channel._lastWindowAdjust = channel._lastWindowAdjust, now
+        if (lastAdjust is None or
+                channel.localWindowSize >= channel.maxLocalWindowSize):
+            return
+        if self._roundTripTime is None:
+            self._measureRoundTrip()
+            return
+        used = channel.localWindowSize - channel.localWindowLeft
+        if used * self._roundTripTime * 2 > (
+                channel.localWindowSize * (now - lastAdjust)):
+            channel.localWindowSize = min(channel.localWindowSize * 2,
+                                          channel.maxLocalWindowSize)
+
+
+    def _measureRoundTrip(self):
+        """
+        Measure the round trip time of this connection by timing the reply to
+        a I{keepalive@openssh.com} global request.  Implementations reply to
+        requests they do not know with a failure, which does just as well.
+        """
+        if self._roundTripProbe is not None:
+            return
+        sent = self._roundTripProbe = self._seconds()
+        def measured(ignored):
+            self._roundTripProbe = None
+            self._roundTripTime = self._seconds() - sent
+        self.sendGlobalRequest(
+            'keepalive@openssh.com', '', wantReply=1).addBoth(measured)
+
 
     def ssh_CHANNEL_EOF(self, packet):
         """
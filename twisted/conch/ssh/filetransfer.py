@@ -4,9 +4,10 @@
 # See LICENSE for details.
 
 
-import struct, errno
+import struct, errno, time
 
 from twisted.internet import defer, protocol
+from twisted.internet.interfaces import IPushProducer
 from twisted.python import failure, log
 
 from common import NS, getNS
@@ -294,8 +295,7 @@ class FileTransferServer(FileTransferBase):
                     raise EOFError
                 return f
             if isinstance(info, defer.Deferred):
-                info.addCallback(self._cbScanDirectory, dirIter, f)
-                return
+                return info.addCallback(self._cbScanDirectory, dirIter, f)
             else:
                 f.append(info)
         return f
@@ -693,6 +693,57 @@ class FileTransferClient(FileTransferBase):
         """
         return self._sendRequest(FXP_EXTENDED, NS(request) + data)
 
+    def downloadFile(self, filename, consumer, chunkSize=32768,
+                     maxRequests=64):
+        """
+        Download a file, keeping several read requests outstanding so that
+        the transfer is not limited by the round trip time.
+
+        The data is written to C{consumer} in order, whatever order the
+        replies arrive in.  The download is registered with C{consumer} as a
+        streaming producer, so pausing it stops new requests being made.
+
+        @param filename: the name of the file to download.
+        @param consumer: the L{IConsumer} to write the contents of the file
+        to.
+        @param chunkSize: the number of bytes to ask for in each request.
+        @param maxRequests: the most read requests to have outstanding at once.
+
+        @return: a L{Deferred} which fires with a L{TransferStatistics} when
+        the file has been downloaded and closed.
+        """
+        d = self.openFile(filename, FXF_READ, {})
+        d.addCallback(
+            lambda remoteFile: _Download(
+                remoteFile, consumer, chunkSize, maxRequests).start())
+        return d
+
+
+    def uploadFile(self, filename, source, chunkSize=32768, maxRequests=64):
+        """
+        Upload a file, keeping several write requests outstanding so that the
+        transfer is not limited by the round trip time.
+
+        The remote file is created if it does not exist, and truncated if it
+        does.
+
+        @param filename: the name of the file to upload to.
+        @param source: a file-like object to read the contents of the file
+        from.
+        @param chunkSize: the number of bytes to send in each request.
+        @param maxRequests: the most write requests to have outstanding at
+        once.
+
+        @return: a L{Deferred} which fires with a L{TransferStatistics} when
+        the file has been uploaded and closed.
+        """
+        d = self.openFile(filename, FXF_WRITE | FXF_CREAT | FXF_TRUNC, {})
+        d.addCallback(
+            lambda remoteFile: _Upload(
+                remoteFile, source, chunkSize, maxRequests).start())
+        return d
+
+
     def packet_VERSION(self, data):
         version, = struct.unpack('!L', data[:4])
         data = data[4:]
@@ -833,6 +884,322 @@ class ClientDirectory:
         return reason
 
 
+class TransferStatistics:
+    """
+    Statistics about a transfer made with L{FileTransferClient.downloadFile}
+    or L{FileTransferClient.uploadFile}.
+
+    @ivar bytesTransferred: the number of bytes of the file transferred.
+    @type bytesTransferred: C{int}
+    @ivar requests: the number of read or write requests sent.
+    @type requests: C{int}
+    @ivar startTime: when the transfer started, in seconds since the epoch.
+    @type startTime: C{float}
+    @ivar endTime: when the transfer finished, or C{None} if it has not.
+    @type endTime: C{float}
+    """
+    _seconds = staticmethod(time.time)
+
+    def __init__(self):
+        self.bytesTransferred = 0
+        self.requests = 0
+        self.startTime = self._seconds()
+        self.endTime = None
+
+
+    def elapsed(self):
+        """
+        Return how long the transfer took, or has taken so far, in seconds.
+
+        @rtype: C{float}
+        """
+        endTime = self.endTime
+        if endTime is None:
+            endTime = self._seconds()
+        return endTime - self.startTime
+
+
+    def throughput(self):
+        """
+        Return the average number of bytes transferred per second.
+
+        @rtype: C{float}
+        """
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.bytesTransferred / elapsed
+
+
+
+class _PipelinedTransfer:
+    """
+    The part of a download or upload which keeps a number of requests
+    outstanding and closes the file when they are all answered.
+
+    @ivar file: the L{ClientFile} being transferred.
+    @ivar outstanding: the number of requests waiting for a reply.
+    @ivar failure: the first L{Failure} the transfer met, or C{None}.
+    @ivar paused: whether new requests are being held back.
+    @ivar statistics: the L{TransferStatistics} for the transfer.
+    """
+    paused = False
+    _sending = False
+
+    def __init__(self, file, chunkSize, maxRequests):
+        self.file = file
+        self.chunkSize = chunkSize
+        self.maxRequests = maxRequests
+        self.outstanding = 0
+        self.failure = None
+        self.statistics = TransferStatistics()
+        self._deferred = defer.Deferred()
+
+
+    def start(self):
+        """
+        Start sending requests.
+
+        @return: a L{Deferred} which fires with C{self.statistics} when the
+        transfer is finished and the file has been closed.
+        """
+        self._sendRequests()
+        return self._deferred
+
+
+    def _sendRequests(self):
+        """
+        Send requests until C{maxRequests} are outstanding or there is nothing
+        more to send, then finish the transfer if it is done.
+        """
+        if self._sending:
+            # A reply arrived synchronously; the loop below carries on.
+            return
+        self._sending = True
+        try:
+            while (self.failure is None and not self.paused and
+                   self.outstanding < self.maxRequests):
+                try:
+                    d = self._sendRequest()
+                except:
+                    self.failure = failure.Failure()
+                    break
+                if d is None:
+                    break
+                self.outstanding += 1
+                self.statistics.requests += 1
+                d.addErrback(self._requestFailed)
+                d.addCallback(self._requestDone)
+        finally:
+            self._sending = False
+        self._maybeFinish()
+
+
+    def _sendRequest(self):
+        """
+        Send the next request.
+
+        @return: the L{Deferred} for the reply, or C{None} if there is nothing
+        to send for now.
+        """
+        raise NotImplementedError()
+
+
+    def _isFinished(self):
+        """
+        Return whether the whole file has been transferred.
+
+        @rtype: C{bool}
+        """
+        raise NotImplementedError()
+
+
+    def _requestFailed(self, reason):
+        """
+        Record the first failed request, so that no more are sent.
+        """
+        if self.failure is None:
+            self.failure = reason
+
+
+    def _requestDone(self, ignored):
+        """
+        Count a reply and send more requests in its place.
+        """
+        self.outstanding -= 1
+        self._sendRequests()
+
+
+    def _maybeFinish(self):
+        """
+        Close the file once every request has been answered and either the
+        transfer is complete or it failed, then fire the L{Deferred} returned
+        by L{start}.
+        """
+        if (self._deferred is None or self.outstanding or
+                (self.failure is None and not self._isFinished())):
+            return
+        d, self._deferred = self._deferred, None
+        self._stopped()
+        closed = self.file.close()
+        def cbClosed(result):
+            self.statistics.endTime = self.statistics._seconds()
+            if self.failure is not None:
+                return self.failure
+            if isinstance(result, failure.Failure):
+                return result
+            return self.statistics
+        closed.addBoth(cbClosed)
+        closed.chainDeferred(d)
+
+
+    def _stopped(self):
+        """
+        Called when the last request has been answered, before the file is
+        closed.
+        """
+
+
+
+class _Download(_PipelinedTransfer):
+    """
+    A download which writes the data it reads to a consumer in order.
+
+    @ivar consumer: the L{IConsumer} the file is written to.
+    @ivar readOffset: the offset of the next new chunk to ask for.
+    @ivar writeOffset: the offset of the next byte to write to C{consumer}.
+    @ivar received: a C{dict} mapping offsets past C{writeOffset} to the data
+        read from them, waiting for the data in front of them.
+    @ivar holes: a C{list} of (offset, length) for the parts of chunks left
+        out of short replies, which have to be asked for again.
+    @ivar eof: whether a read has been answered with end of file.
+    """
+    interface.implements(IPushProducer)
+
+    def __init__(self, file, consumer, chunkSize, maxRequests):
+        _PipelinedTransfer.__init__(self, file, chunkSize, maxRequests)
+        self.consumer = consumer
+        self.readOffset = 0
+        self.writeOffset = 0
+        self.received = {}
+        self.holes = []
+        self.eof = False
+        consumer.registerProducer(self, True)
+
+
+    def _sendRequest(self):
+        if self.holes:
+            offset, length = self.holes.pop()
+        elif self.eof:
+            return None
+        else:
+            offset, length = self.readOffset, self.chunkSize
+            self.readOffset += length
+        d = self.file.readChunk(offset, length)
+        d.addCallbacks(self._cbRead, self._ebRead,
+                       (offset, length), None, (offset,), None)
+        return d
+
+
+    def _cbRead(self, data, offset, length):
+        """
+        Write the data read from C{offset} to the consumer, along with any
+        data after it which arrived earlier.
+        """
+        if not data:
+            self.eof = True
+            return
+        self.statistics.bytesTransferred += len(data)
+        if len(data) < length:
+            self.holes.append((offset + len(data), length - len(data)))
+        self.received[offset] = data
+        while self.writeOffset in self.received:
+            data = self.received.pop(self.writeOffset)
+            self.writeOffset += len(data)
+            self.consumer.write(data)
+
+
+    def _ebRead(self, reason, offset):
+        """
+        Stop asking for new chunks at the end of the file.
+        """
+        reason.trap(EOFError)
+        self.eof = True
+
+
+    def _isFinished(self):
+        return self.eof and not self.holes
+
+
+    def _stopped(self):
+        self.consumer.unregisterProducer()
+
+
+    def pauseProducing(self):
+        """
+        Stop sending read requests until L{resumeProducing} is called.
+        Replies to requests already sent are still written to the consumer.
+        """
+        self.paused = True
+
+
+    def resumeProducing(self):
+        """
+        Start sending read requests again.
+        """
+        self.paused = False
+        self._sendRequests()
+
+
+    def stopProducing(self):
+        """
+        Stop the download and fail the L{Deferred} returned by L{start}.
+        """
+        self._requestFailed(failure.Failure(
+            Exception("Consumer asked us to stop producing")))
+        self._maybeFinish()
+
+
+
+class _Upload(_PipelinedTransfer):
+    """
+    An upload which reads the data it writes from a file-like object.
+
+    @ivar source: the file-like object the data is read from.
+    @ivar offset: the offset of the next chunk to write.
+    @ivar exhausted: whether everything has been read from C{source}.
+    """
+
+    def __init__(self, file, source, chunkSize, maxRequests):
+        _PipelinedTransfer.__init__(self, file, chunkSize, maxRequests)
+        self.source = source
+        self.offset = 0
+        self.exhausted = False
+
+
+    def _sendRequest(self):
+        if self.exhausted:
+            return None
+        chunk = self.source.read(self.chunkSize)
+        if not chunk:
+            self.exhausted = True
+            return None
+        offset = self.offset
+        self.offset += len(chunk)
+        d = self.file.writeChunk(offset, chunk)
+        d.addCallback(self._cbWrite, len(chunk))
+        return d
+
+
+    def _cbWrite(self, ignored, length):
+        self.statistics.bytesTransferred += length
+
+
+    def _isFinished(self):
+        return self.exhausted
+
+
+
 class SFTPError(Exception):
 
     def __init__(self, errorCode, errorMessage, lang = ''):
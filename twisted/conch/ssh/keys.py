@@ -22,6 +22,16 @@ from pyasn1.type import univ
 from pyasn1.codec.ber import decoder as berDecoder
 from pyasn1.codec.ber import encoder as berEncoder
 
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import dsa, padding, rsa
+    from cryptography.hazmat.primitives.asymmetric.utils import (
+        encode_dss_signature)
+except ImportError:
+    default_backend = None
+
 # twisted
 from twisted.python import randbytes
 
@@ -76,11 +86,19 @@ class Key(object):
         to guess a type.  If the key is encrypted, passphrase is used as
         the decryption key.
 
+        Public keys are cached, so parsing the same string again is cheap;
+        the same L{Key} may be returned each time.
+
         @type data: C{str}
         @type type: C{None}/C{str}
         @type passphrase: C{None}/C{str}
         @rtype: C{Key}
         """
+        cacheKey = (Class, type, data)
+        if passphrase is None:
+            key = _publicKeyCache.get(cacheKey)
+            if key is not None:
+                return key
         if type is None:
             type = Class._guessStringType(data)
         if type is None:
@@ -91,9 +109,12 @@ class Key(object):
         if method.func_code.co_argcount == 2:  # no passphrase
             if passphrase:
                 raise BadKeyError('key not encrypted')
-            return method(data)
+            key = method(data)
         else:
-            return method(data, passphrase)
+            key = method(data, passphrase)
+        if passphrase is None and key.isPublic():
+            _publicKeyCache.add(cacheKey, key)
+        return key
     fromString = classmethod(fromString)
 
 
@@ -419,6 +440,7 @@ class Key(object):
         @type keyObject: C{Crypto.PublicKey.pubkey.pubkey}
         """
         self.keyObject = keyObject
+        self._nativePublicKey = None
 
 
     def __eq__(self, other):
@@ -789,6 +811,9 @@ class Key(object):
             signatureType, signature = common.getNS(signature)
         if signatureType != self.sshType():
             return False
+        nativeKey = self._getNativePublicKey()
+        if nativeKey is not None:
+            return self._verifyNative(nativeKey, signature, data)
         if self.type() == 'RSA':
             numbers = common.getMP(signature)
             digest = pkcs1Digest(data, self.keyObject.size() / 8)
@@ -800,6 +825,120 @@ class Key(object):
         return self.keyObject.verify(digest, numbers)
 
 
+    def _getNativePublicKey(self):
+        """
+        Get the public part of this key as a C{cryptography} key object,
+        which verifies signatures much faster than PyCrypto.
+
+        @return: The key object, or C{None} if the C{cryptography} package is
+            not installed or doesn't support this key (for example, DSA keys
+            of unusual sizes).
+        """
+        if self._nativePublicKey is None:
+            self._nativePublicKey = False
+            if default_backend is not None:
+                keyData = self.data()
+                if self.type() == 'RSA':
+                    numbers = rsa.RSAPublicNumbers(keyData['e'], keyData['n'])
+                else:
+                    numbers = dsa.DSAPublicNumbers(
+                        keyData['y'], dsa.DSAParameterNumbers(
+                            keyData['p'], keyData['q'], keyData['g']))
+                try:
+                    self._nativePublicKey = numbers.public_key(
+                        default_backend())
+                except ValueError:
+                    pass
+        return self._nativePublicKey or None
+
+
+    def _verifyNative(self, nativeKey, signature, data):
+        """
+        Verify a signature with a C{cryptography} key object.
+
+        @param nativeKey: The result of L{_getNativePublicKey}.
+
+        @param signature: The signature blob, without its type.
+        @type signature: C{str}
+
+        @type data: C{str}
+        @rtype: C{bool}
+        """
+        signature = common.getNS(signature)[0]
+        try:
+            if self.type() == 'RSA':
+                # Signatures with leading zero bytes are sometimes sent
+                # without them.  Pad to the size of the modulus, which
+                # lenSig() can count one byte short.
+                signature = signature.rjust(
+                    (nativeKey.key_size + 7) // 8, '\x00')
+                nativeKey.verify(
+                    signature, data, padding.PKCS1v15(), hashes.SHA1())
+            else:
+                r = Util.number.bytes_to_long(signature[:20])
+                s = Util.number.bytes_to_long(signature[20:])
+                nativeKey.verify(
+                    encode_dss_signature(r, s), data, hashes.SHA1())
+        except InvalidSignature:
+            return False
+        return True
+
+
+
+class _KeyCache(object):
+    """
+    A cache of the most recently used L{Key}s.
+
+    @ivar size: The number of keys to keep.
+    @type size: C{int}
+
+    @ivar _keys: Map cache keys to L{Key}s.
+    @ivar _used: Map cache keys to when their key was last used.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._keys = {}
+        self._used = {}
+        self._clock = itertools.count()
+
+
+    def get(self, cacheKey):
+        """
+        @return: The L{Key} cached under C{cacheKey}, or C{None}.
+        """
+        key = self._keys.get(cacheKey)
+        if key is not None:
+            self._used[cacheKey] = next(self._clock)
+        return key
+
+
+    def add(self, cacheKey, key):
+        """
+        Cache C{key} under C{cacheKey}.  If the cache is full, forget the
+        least recently used half of it first, so that making room costs little
+        per key.
+        """
+        if cacheKey not in self._keys and len(self._keys) >= self.size:
+            byAge = sorted(self._used, key=self._used.__getitem__)
+            for old in byAge[:max(len(byAge) // 2, 1)]:
+                del self._keys[old], self._used[old]
+        self._keys[cacheKey] = key
+        self._used[cacheKey] = next(self._clock)
+
+
+    def clear(self):
+        """
+        Forget every cached key.
+        """
+        self._keys.clear()
+        self._used.clear()
+
+
+
+_publicKeyCache = _KeyCache(1024)
+
+
 
 def objectType(obj):
     """
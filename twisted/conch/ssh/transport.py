@@ -14,13 +14,22 @@ Maintainer: Paul Swartz
 import struct
 import zlib
 import array
-from hashlib import md5, sha1
+from hashlib import md5, sha1, sha256, sha512
 import string
 import hmac
 
 # external library imports
 from Crypto import Util
 
+try:
+    from cryptography.exceptions import InvalidSignature, InvalidTag
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.poly1305 import Poly1305
+except ImportError:
+    default_backend = None
+
 # twisted imports
 from twisted.internet import protocol, defer
 
@@ -105,7 +114,10 @@ class SSHTransportBase(protocol.Protocol):
         server or client.
 
     @ivar supportedCiphers: A list of strings representing the encryption
-        algorithms supported, in order from most-preferred to least.
+        algorithms supported, in order from most-preferred to least.  The
+        authenticated encryption ciphers C{chacha20-poly1305@openssh.com} and
+        C{aes128-gcm@openssh.com} are only included if the C{cryptography}
+        package is available.
 
     @ivar supportedMACs: A list of strings representing the message
         authentication codes (hashes) supported, in order from most-preferred
@@ -214,7 +226,14 @@ class SSHTransportBase(protocol.Protocol):
                         'aes128-ctr', 'aes128-cbc', 'cast128-ctr',
                         'cast128-cbc', 'blowfish-ctr', 'blowfish-cbc',
                         '3des-ctr', '3des-cbc'] # ,'none']
-    supportedMACs = ['hmac-sha1', 'hmac-md5'] # , 'none']
+    if default_backend is not None:
+        supportedCiphers[:0] = ['chacha20-poly1305@openssh.com',
+                                'aes128-gcm@openssh.com']
+    supportedMACs = ['hmac-sha2-512-etm@openssh.com',
+                     'hmac-sha2-256-etm@openssh.com',
+                     'hmac-sha2-512', 'hmac-sha2-256',
+                     'hmac-sha1-etm@openssh.com', 'hmac-sha1',
+                     'hmac-md5'] # , 'none']
     # both of the above support 'none', but for security are disabled by
     # default.  to enable them, subclass this class and add it, or do:
     #   SSHTransportBase.supportedCiphers.append('none')
@@ -227,6 +246,7 @@ class SSHTransportBase(protocol.Protocol):
     isClient = False
     gotVersion = False
     buf = ''
+    _bufOffset = 0
     outgoingPacketSequence = 0
     incomingPacketSequence = 0
     outgoingCompression = None
@@ -348,18 +368,34 @@ class SSHTransportBase(protocol.Protocol):
             payload = (self.outgoingCompression.compress(payload)
                        + self.outgoingCompression.flush(2))
         bs = self.currentEncryptions.encBlockSize
-        # 4 for the packet length and 1 for the padding length
+        etm = self.currentEncryptions.outETM
+        aead = self.currentEncryptions.outAEAD
+        # 4 for the packet length and 1 for the padding length.  With
+        # encrypt-then-MAC and authenticated encryption the packet length is
+        # handled apart from the rest of the packet, so it is left out of the
+        # blocks.
         totalSize = 5 + len(payload)
+        if etm or aead:
+            totalSize -= 4
         lenPad = bs - (totalSize % bs)
         if lenPad < 4:
             lenPad = lenPad + bs
         packet = (struct.pack('!LB',
-                              totalSize + lenPad - 4, lenPad) +
+                              1 + len(payload) + lenPad, lenPad) +
                   payload + randbytes.secureRandom(lenPad))
-        encPacket = (
-            self.currentEncryptions.encrypt(packet) +
-            self.currentEncryptions.makeMAC(
-                self.outgoingPacketSequence, packet))
+        if aead:
+            encPacket = self.currentEncryptions.seal(
+                self.outgoingPacketSequence, packet)
+        elif etm:
+            encPacket = (
+                packet[:4] + self.currentEncryptions.encrypt(packet[4:]))
+            encPacket += self.currentEncryptions.makeMAC(
+                self.outgoingPacketSequence, encPacket)
+        else:
+            encPacket = (
+                self.currentEncryptions.encrypt(packet) +
+                self.currentEncryptions.makeMAC(
+                    self.outgoingPacketSequence, packet))
         self.transport.write(encPacket)
         self.outgoingPacketSequence += 1
 
@@ -371,11 +407,43 @@ class SSHTransportBase(protocol.Protocol):
 
         @rtype: C{str}/C{None}
         """
+        try:
+            return self._nextPacket()
+        finally:
+            self._compactBuffer()
+
+
+    def _compactBuffer(self):
+        """
+        Drop the packets which L{_nextPacket} has already consumed from the
+        front of C{self.buf}.
+        """
+        if self._bufOffset:
+            self.buf = self.buf[self._bufOffset:]
+            self._bufOffset = 0
+
+
+    def _nextPacket(self):
+        """
+        Like L{getPacket}, but leave the packet in C{self.buf} and only move
+        C{self._bufOffset} past it, so that reading several packets out of
+        one buffer does not copy the rest of the buffer for each of them.
+        L{_compactBuffer} must be called before C{self.buf} is used by
+        anything else.
+
+        @rtype: C{str}/C{None}
+        """
+        if self.currentEncryptions.inAEAD:
+            return self._nextAEADPacket()
+        if self.currentEncryptions.inETM:
+            return self._nextETMPacket()
+        buf = self.buf
+        offset = self._bufOffset
         bs = self.currentEncryptions.decBlockSize
         ms = self.currentEncryptions.verifyDigestSize
-        if len(self.buf) < bs: return # not enough data
+        if len(buf) - offset < bs: return # not enough data
         if not hasattr(self, 'first'):
-            first = self.currentEncryptions.decrypt(self.buf[:bs])
+            first = self.currentEncryptions.decrypt(buf[offset:offset + bs])
         else:
             first = self.first
             del self.first
@@ -384,7 +452,7 @@ class SSHTransportBase(protocol.Protocol):
             self.sendDisconnect(DISCONNECT_PROTOCOL_ERROR,
                                 'bad packet length %s' % packetLen)
             return
-        if len(self.buf) < packetLen + 4 + ms:
+        if len(buf) - offset < packetLen + 4 + ms:
             self.first = first
             return # not enough packet
         if(packetLen + 4) % bs != 0:
@@ -393,19 +461,113 @@ class SSHTransportBase(protocol.Protocol):
                 'bad packet mod (%i%%%i == %i)' % (packetLen + 4, bs,
                                                    (packetLen + 4) % bs))
             return
-        encData, self.buf = self.buf[:4 + packetLen], self.buf[4 + packetLen:]
-        packet = first + self.currentEncryptions.decrypt(encData[bs:])
+        end = self._bufOffset = offset + 4 + packetLen
+        packet = first + self.currentEncryptions.decrypt(buf[offset + bs:end])
         if len(packet) != 4 + packetLen:
             self.sendDisconnect(DISCONNECT_PROTOCOL_ERROR,
                                 'bad decryption')
             return
         if ms:
-            macData, self.buf = self.buf[:ms], self.buf[ms:]
+            macData = buf[end:end + ms]
+            self._bufOffset = end + ms
             if not self.currentEncryptions.verify(self.incomingPacketSequence,
                                                   packet, macData):
                 self.sendDisconnect(DISCONNECT_MAC_ERROR, 'bad MAC')
                 return
-        payload = packet[5:-paddingLen]
+        return self._finishPacket(packet[5:-paddingLen])
+
+
+    def _nextETMPacket(self):
+        """
+        Like L{_nextPacket}, but for a packet protected with an
+        encrypt-then-MAC algorithm: the packet length is not encrypted, and
+        the MAC covers the encrypted packet, so it is checked before anything
+        is decrypted.
+
+        @rtype: C{str}/C{None}
+        """
+        buf = self.buf
+        offset = self._bufOffset
+        bs = self.currentEncryptions.decBlockSize
+        ms = self.currentEncryptions.verifyDigestSize
+        if len(buf) - offset < 4: return # not enough data
+        packetLen, = struct.unpack('!L', buf[offset:offset + 4])
+        if packetLen > 1048576: # 1024 ** 2
+            self.sendDisconnect(DISCONNECT_PROTOCOL_ERROR,
+                                'bad packet length %s' % packetLen)
+            return
+        if len(buf) - offset < packetLen + 4 + ms:
+            return # not enough packet
+        if packetLen % bs != 0:
+            self.sendDisconnect(
+                DISCONNECT_PROTOCOL_ERROR,
+                'bad packet mod (%i%%%i == %i)' % (packetLen, bs,
+                                                   packetLen % bs))
+            return
+        end = offset + 4 + packetLen
+        self._bufOffset = end + ms
+        encPacket = buf[offset:end]
+        if not self.currentEncryptions.verify(self.incomingPacketSequence,
+                                              encPacket, buf[end:end + ms]):
+            self.sendDisconnect(DISCONNECT_MAC_ERROR, 'bad MAC')
+            return
+        packet = self.currentEncryptions.decrypt(encPacket[4:])
+        if len(packet) != packetLen:
+            self.sendDisconnect(DISCONNECT_PROTOCOL_ERROR,
+                                'bad decryption')
+            return
+        paddingLen = ord(packet[0])
+        return self._finishPacket(packet[1:-paddingLen])
+
+
+    def _nextAEADPacket(self):
+        """
+        Like L{_nextPacket}, but for a packet protected with an authenticated
+        encryption cipher: the packet length is handled apart from the rest
+        of the packet, and the cipher's tag, which takes the place of the MAC,
+        is checked before the packet is used.
+
+        @rtype: C{str}/C{None}
+        """
+        buf = self.buf
+        offset = self._bufOffset
+        bs = self.currentEncryptions.decBlockSize
+        ts = self.currentEncryptions.verifyDigestSize
+        seqid = self.incomingPacketSequence
+        if len(buf) - offset < 4: return # not enough data
+        packetLen, = struct.unpack('!L', self.currentEncryptions.openLength(
+            seqid, buf[offset:offset + 4]))
+        if packetLen > 1048576: # 1024 ** 2
+            self.sendDisconnect(DISCONNECT_PROTOCOL_ERROR,
+                                'bad packet length %s' % packetLen)
+            return
+        if len(buf) - offset < packetLen + 4 + ts:
+            return # not enough packet
+        if packetLen % bs != 0:
+            self.sendDisconnect(
+                DISCONNECT_PROTOCOL_ERROR,
+                'bad packet mod (%i%%%i == %i)' % (packetLen, bs,
+                                                   packetLen % bs))
+            return
+        end = offset + 4 + packetLen
+        self._bufOffset = end + ts
+        packet = self.currentEncryptions.open(
+            seqid, buf[offset:end], buf[end:end + ts])
+        if packet is None:
+            self.sendDisconnect(DISCONNECT_MAC_ERROR, 'bad MAC')
+            return
+        paddingLen = ord(packet[0])
+        return self._finishPacket(packet[1:-paddingLen])
+
+
+    def _finishPacket(self, payload):
+        """
+        Decompress the payload of an authenticated packet and count the
+        packet as received.
+
+        @type payload: C{str}
+        @rtype: C{str}/C{None}
+        """
         if self.incomingCompression:
             try:
                 payload = self.incomingCompression.decompress(payload)
@@ -455,11 +617,14 @@ class SSHTransportBase(protocol.Protocol):
                         return
                     i = lines.index(p)
                     self.buf = '\n'.join(lines[i + 1:])
-        packet = self.getPacket()
-        while packet:
-            messageNum = ord(packet[0])
-            self.dispatchMessage(messageNum, packet[1:])
-            packet = self.getPacket()
+        try:
+            packet = self._nextPacket()
+            while packet:
+                messageNum = ord(packet[0])
+                self.dispatchMessage(messageNum, packet[1:])
+                packet = self._nextPacket()
+        finally:
+            self._compactBuffer()
 
 
     def dispatchMessage(self, messageNum, payload):
@@ -713,18 +878,25 @@ class SSHTransportBase(protocol.Protocol):
         self.transport.loseConnection()
 
 
-    def _getKey(self, c, sharedSecret, exchangeHash):
+    def _getKey(self, c, sharedSecret, exchangeHash, size=0):
         """
         Get one of the keys for authentication/encryption.
 
         @type c: C{str}
         @type sharedSecret: C{str}
         @type exchangeHash: C{str}
+        @param size: the minimum length of the key.  Keys are two hashes long
+            unless more is needed, in which case they are extended as
+            described in RFC 4253 section 7.2.
+        @type size: C{int}
         """
         k1 = sha1(sharedSecret + exchangeHash + c + self.sessionID)
         k1 = k1.digest()
         k2 = sha1(sharedSecret + exchangeHash + k1).digest()
-        return k1 + k2
+        key = k1 + k2
+        while len(key) < size:
+            key += sha1(sharedSecret + exchangeHash + key).digest()
+        return key
 
 
     def _keySetup(self, sharedSecret, exchangeHash):
@@ -743,10 +915,14 @@ class SSHTransportBase(protocol.Protocol):
             self.sessionID = exchangeHash
         initIVCS = self._getKey('A', sharedSecret, exchangeHash)
         initIVSC = self._getKey('B', sharedSecret, exchangeHash)
-        encKeyCS = self._getKey('C', sharedSecret, exchangeHash)
-        encKeySC = self._getKey('D', sharedSecret, exchangeHash)
-        integKeyCS = self._getKey('E', sharedSecret, exchangeHash)
-        integKeySC = self._getKey('F', sharedSecret, exchangeHash)
+        encKeySize = self.nextEncryptions.encryptionKeySize()
+        encKeyCS = self._getKey('C', sharedSecret, exchangeHash, encKeySize)
+        encKeySC = self._getKey('D', sharedSecret, exchangeHash, encKeySize)
+        integKeySize = self.nextEncryptions.integrityKeySize()
+        integKeyCS = self._getKey('E', sharedSecret, exchangeHash,
+                                  integKeySize)
+        integKeySC = self._getKey('F', sharedSecret, exchangeHash,
+                                  integKeySize)
         outs = [initIVSC, encKeySC, integKeySC]
         ins = [initIVCS, encKeyCS, integKeyCS]
         if self.isClient: # reverse for the client
@@ -799,9 +975,11 @@ class SSHTransportBase(protocol.Protocol):
         given direction.  Direction must be one of ["out", "in", "both"].
         """
         if direction == "out":
-            return self.currentEncryptions.outMACType != 'none'
+            return (self.currentEncryptions.outMACType != 'none' or
+                    self.currentEncryptions.outAEAD)
         elif direction == "in":
-            return self.currentEncryptions.inMACType != 'none'
+            return (self.currentEncryptions.inMACType != 'none' or
+                    self.currentEncryptions.inAEAD)
         elif direction == "both":
             return self.isVerified("in")and self.isVerified("out")
         else:
@@ -1361,14 +1539,195 @@ class _DummyCipher:
     decrypt = encrypt
 
 
+
+class _AESGCMCipher(object):
+    """
+    The C{aes128-gcm@openssh.com} authenticated encryption cipher, as
+    described in RFC 5647 and amended by OpenSSH's PROTOCOL file: the packet
+    length is sent unencrypted but authenticated, and the nonce is a fixed
+    field followed by a counter incremented for every packet.
+
+    @ivar block_size: the block size of the cipher.
+    @ivar tagSize: the size of the authentication tag sent after each packet.
+    """
+    block_size = 16
+    tagSize = 16
+
+
+    def __init__(self, key, iv):
+        """
+        @param key: the encryption key.
+        @type key: C{str}
+        @param iv: the initial nonce; only its first 12 bytes are used.
+        @type iv: C{str}
+        """
+        self._aead = AESGCM(key)
+        self._fixed = iv[:4]
+        (self._invocation,) = struct.unpack('!Q', iv[4:12])
+
+
+    def _nextNonce(self):
+        """
+        Return the nonce for the next packet and advance the counter.
+
+        @rtype: C{str}
+        """
+        nonce = self._fixed + struct.pack('!Q', self._invocation)
+        self._invocation = (self._invocation + 1) % 2 ** 64
+        return nonce
+
+
+    def seal(self, seqid, packet):
+        """
+        Encrypt and authenticate a packet.
+
+        @param seqid: the sequence ID of the packet; unused.
+        @param packet: the packet, starting with its length.
+        @type packet: C{str}
+        @return: the packet as it is sent, including its tag.
+        @rtype: C{str}
+        """
+        length = packet[:4]
+        return length + self._aead.encrypt(
+            self._nextNonce(), packet[4:], length)
+
+
+    def openLength(self, seqid, data):
+        """
+        Return the packet length from the first four bytes of a packet, which
+        this cipher leaves unencrypted.
+
+        @rtype: C{str}
+        """
+        return data
+
+
+    def open(self, seqid, data, tag):
+        """
+        Authenticate and decrypt a packet.
+
+        @param seqid: the sequence ID of the packet; unused.
+        @param data: the packet as it was received, starting with its length
+            and without its tag.
+        @type data: C{str}
+        @param tag: the tag received after the packet.
+        @type tag: C{str}
+        @return: the decrypted packet without its length, or C{None} if it
+            fails authentication.
+        @rtype: C{str}/C{None}
+        """
+        nonce = self._nextNonce()
+        try:
+            return self._aead.decrypt(nonce, data[4:] + tag, data[:4])
+        except InvalidTag:
+            return None
+
+
+
+class _ChaCha20Poly1305Cipher(object):
+    """
+    The C{chacha20-poly1305@openssh.com} authenticated encryption cipher, as
+    described in OpenSSH's PROTOCOL.chacha20poly1305 file.  The packet length
+    and the rest of the packet are encrypted with ChaCha20 under separate
+    keys, using the packet's sequence number as the nonce, and the whole
+    encrypted packet is authenticated with Poly1305.
+
+    @ivar block_size: the block size used to pad packets.
+    @ivar tagSize: the size of the authentication tag sent after each packet.
+    """
+    block_size = 8
+    tagSize = 16
+
+
+    def __init__(self, key, iv):
+        """
+        @param key: the 64 byte encryption key: the key for the packet
+            followed by the key for the packet length.
+        @type key: C{str}
+        @param iv: unused; the nonce is the sequence number.
+        """
+        self._mainKey = key[:32]
+        self._lengthKey = key[32:64]
+
+
+    def _chacha20(self, key, seqid, counter, data):
+        """
+        Encrypt or decrypt C{data} with ChaCha20, starting at block
+        C{counter} of the key stream for the given sequence number.
+
+        @rtype: C{str}
+        """
+        nonce = struct.pack('<Q', counter) + struct.pack('!Q', seqid)
+        cipher = Cipher(algorithms.ChaCha20(key, nonce), None,
+                        default_backend())
+        return cipher.encryptor().update(data)
+
+
+    def seal(self, seqid, packet):
+        """
+        Encrypt and authenticate a packet.
+
+        @param seqid: the sequence ID of the packet.
+        @type seqid: C{int}
+        @param packet: the packet, starting with its length.
+        @type packet: C{str}
+        @return: the packet as it is sent, including its tag.
+        @rtype: C{str}
+        """
+        encrypted = (self._chacha20(self._lengthKey, seqid, 0, packet[:4]) +
+                     self._chacha20(self._mainKey, seqid, 1, packet[4:]))
+        polyKey = self._chacha20(self._mainKey, seqid, 0, '\x00' * 32)
+        return encrypted + Poly1305.generate_tag(polyKey, encrypted)
+
+
+    def openLength(self, seqid, data):
+        """
+        Decrypt the packet length from the first four bytes of a packet.
+
+        @rtype: C{str}
+        """
+        return self._chacha20(self._lengthKey, seqid, 0, data)
+
+
+    def open(self, seqid, data, tag):
+        """
+        Authenticate and decrypt a packet.
+
+        @param seqid: the sequence ID of the packet.
+        @type seqid: C{int}
+        @param data: the packet as it was received, starting with its length
+            and without its tag.
+        @type data: C{str}
+        @param tag: the tag received after the packet.
+        @type tag: C{str}
+        @return: the decrypted packet without its length, or C{None} if it
+            fails authentication.
+        @rtype: C{str}/C{None}
+        """
+        polyKey = self._chacha20(self._mainKey, seqid, 0, '\x00' * 32)
+        try:
+            Poly1305.verify_tag(polyKey, data, tag)
+        except InvalidSignature:
+            return None
+        return self._chacha20(self._mainKey, seqid, 1, data[4:])
+
+
+
 class SSHCiphers:
     """
     SSHCiphers represents all the encryption operations that need to occur
     to encrypt and authenticate the SSH connection.
 
     @cvar cipherMap: A dictionary mapping SSH encryption names to 3-tuples of
-                     (<Crypto.Cipher.* name>, <block size>, <counter mode>)
+                     (<Crypto.Cipher.* name>, <key size>, <counter mode>).
+                     For the names in C{aeadCiphers}, the first element is
+                     the class implementing the cipher instead.
+    @cvar aeadCiphers: The names of the authenticated encryption ciphers,
+        whose tag takes the place of the MAC.  They are only in C{cipherMap}
+        if the C{cryptography} package is available.
     @cvar macMap: A dictionary mapping SSH MAC names to hash modules.
+    @cvar etmMACs: The names in C{macMap} of the encrypt-then-MAC algorithms,
+        which authenticate the encrypted packet instead of the plain one.
 
     @ivar outCipType: the string type of the outgoing cipher.
     @ivar inCipType: the string type of the incoming cipher.
@@ -1377,6 +1736,12 @@ class SSHCiphers:
     @ivar encBlockSize: the block size of the outgoing cipher.
     @ivar decBlockSize: the block size of the incoming cipher.
     @ivar verifyDigestSize: the size of the incoming MAC.
+    @ivar outETM: whether the outgoing MAC is an encrypt-then-MAC algorithm.
+    @ivar inETM: whether the incoming MAC is an encrypt-then-MAC algorithm.
+    @ivar outAEAD: whether the outgoing cipher is an authenticated encryption
+        cipher.  If it is, the outgoing MAC is C{'none'}.
+    @ivar inAEAD: whether the incoming cipher is an authenticated encryption
+        cipher.  If it is, the incoming MAC is C{'none'}.
     @ivar outMAC: a tuple of (<hash module>, <inner key>, <outer key>,
         <digest size>) representing the outgoing MAC.
     @ivar inMAc: see outMAC, but for the incoming MAC.
@@ -1397,14 +1762,40 @@ class SSHCiphers:
         'cast128-ctr':('CAST', 16, 1),
         'none':(None, 0, 0),
     }
+    aeadCiphers = frozenset([
+        'aes128-gcm@openssh.com',
+        'chacha20-poly1305@openssh.com',
+    ])
+    if default_backend is not None:
+        cipherMap['aes128-gcm@openssh.com'] = (_AESGCMCipher, 16, 0)
+        cipherMap['chacha20-poly1305@openssh.com'] = (
+            _ChaCha20Poly1305Cipher, 64, 0)
     macMap = {
+        'hmac-sha2-512': sha512,
+        'hmac-sha2-256': sha256,
         'hmac-sha1': sha1,
         'hmac-md5': md5,
+        'hmac-sha2-512-etm@openssh.com': sha512,
+        'hmac-sha2-256-etm@openssh.com': sha256,
+        'hmac-sha1-etm@openssh.com': sha1,
         'none': None
      }
+    etmMACs = frozenset([
+        'hmac-sha2-512-etm@openssh.com',
+        'hmac-sha2-256-etm@openssh.com',
+        'hmac-sha1-etm@openssh.com',
+    ])
 
 
     def __init__(self, outCip, inCip, outMac, inMac):
+        self.outAEAD = outCip in self.aeadCiphers
+        self.inAEAD = inCip in self.aeadCiphers
+        # An authenticated encryption cipher replaces the MAC, whichever one
+        # was negotiated.
+        if self.outAEAD:
+            outMac = 'none'
+        if self.inAEAD:
+            inMac = 'none'
         self.outCipType = outCip
         self.inCipType = inCip
         self.outMACType = outMac
@@ -1414,6 +1805,37 @@ class SSHCiphers:
         self.verifyDigestSize = 0
         self.outMAC = (None, '', '', 0)
         self.inMAC = (None, '', '', 0)
+        self.outETM = outMac in self.etmMACs
+        self.inETM = inMac in self.etmMACs
+
+
+    def integrityKeySize(self):
+        """
+        Return the number of bytes needed for the integrity keys of both
+        MACs, which is the largest of their digest sizes.
+
+        @rtype: C{int}
+        """
+        size = 0
+        for mac in (self.outMACType, self.inMACType):
+            mod = self.macMap.get(mac)
+            if mod:
+                size = max(size, mod().digest_size)
+        return size
+
+
+    def encryptionKeySize(self):
+        """
+        Return the number of bytes needed for the encryption keys of both
+        ciphers, which is the largest of their key sizes.
+
+        @rtype: C{int}
+        """
+        size = 0
+        for cip in (self.outCipType, self.inCipType):
+            if cip in self.cipherMap:
+                size = max(size, self.cipherMap[cip][1])
+        return size
 
 
     def setKeys(self, outIV, outKey, inIV, inKey, outInteg, inInteg):
@@ -1428,14 +1850,23 @@ class SSHCiphers:
         @param inInteg: the incoming integrity key.
         """
         o = self._getCipher(self.outCipType, outIV, outKey)
-        self.encrypt = o.encrypt
+        if self.outAEAD:
+            self.seal = o.seal
+        else:
+            self.encrypt = o.encrypt
         self.encBlockSize = o.block_size
         o = self._getCipher(self.inCipType, inIV, inKey)
-        self.decrypt = o.decrypt
+        if self.inAEAD:
+            self.openLength = o.openLength
+            self.open = o.open
+        else:
+            self.decrypt = o.decrypt
         self.decBlockSize = o.block_size
         self.outMAC = self._getMAC(self.outMACType, outInteg)
         self.inMAC = self._getMAC(self.inMACType, inInteg)
-        if self.inMAC:
+        if self.inAEAD:
+            self.verifyDigestSize = o.tagSize
+        elif self.inMAC:
             self.verifyDigestSize = self.inMAC[3]
 
 
@@ -1450,6 +1881,8 @@ class SSHCiphers:
         modName, keySize, counterMode = self.cipherMap[cip]
         if not modName: # no cipher
             return _DummyCipher()
+        if cip in self.aeadCiphers:
+            return modName(key[:keySize], iv)
         mod = __import__('Crypto.Cipher.%s'%modName, {}, {}, 'x')
         if counterMode:
             return mod.new(key[:keySize], mod.MODE_CTR, iv[:mod.block_size],
@@ -1472,12 +1905,13 @@ class SSHCiphers:
         mod = self.macMap[mac]
         if not mod:
             return (None, '', '', 0)
-        ds = mod().digest_size
+        digest = mod()
+        ds = digest.digest_size
 
         # Truncation here appears to contravene RFC 2104, section 2.  However,
         # implementing the hashing behavior prescribed by the RFC breaks
         # interoperability with OpenSSH (at least version 5.5p1).
-        key = key[:ds] + ('\x00' * (64 - ds))
+        key = key[:ds] + ('\x00' * (digest.block_size - ds))
         i = string.translate(key, hmac.trans_36)
         o = string.translate(key, hmac.trans_5C)
         result = _MACParams((mod,  i, o, ds))
@@ -1504,6 +1938,53 @@ class SSHCiphers:
         raise NotImplementedError()
 
 
+    def seal(self, seqid, packet):
+        """
+        Encrypt and authenticate a packet with an authenticated encryption
+        cipher.  Overridden in setKeys().
+
+        @param seqid: the sequence ID of the outgoing packet
+        @type seqid: C{int}
+        @param packet: the packet, starting with its length
+        @type packet: C{str}
+        @return: the packet as it is sent, including its tag
+        @rtype: C{str}
+        """
+        raise NotImplementedError()
+
+
+    def openLength(self, seqid, data):
+        """
+        Get the packet length from the first four bytes of a packet protected
+        with an authenticated encryption cipher.  Overridden in setKeys().
+
+        @param seqid: the sequence ID of the incoming packet
+        @type seqid: C{int}
+        @type data: C{str}
+        @return: the packet length, as four bytes
+        @rtype: C{str}
+        """
+        raise NotImplementedError()
+
+
+    def open(self, seqid, data, tag):
+        """
+        Authenticate and decrypt a packet protected with an authenticated
+        encryption cipher.  Overridden in setKeys().
+
+        @param seqid: the sequence ID of the incoming packet
+        @type seqid: C{int}
+        @param data: the packet, starting with its length, without its tag
+        @type data: C{str}
+        @param tag: the tag sent after the packet
+        @type tag: C{str}
+        @return: the packet without its length, or C{None} if it fails
+            authentication
+        @rtype: C{str}/C{None}
+        """
+        raise NotImplementedError()
+
+
     def makeMAC(self, seqid, data):
         """
         Create a message authentication code (MAC) for the given packet using
@@ -1536,9 +2017,10 @@ class SSHCiphers:
         """
         if not self.inMAC[0]:
             return mac == ''
-        data = struct.pack('>L', seqid) + data
-        outer = hmac.HMAC(self.inMAC.key, data, self.inMAC[0]).digest()
-        return mac == outer
+        outer = hmac.HMAC(self.inMAC.key, struct.pack('>L', seqid),
+                          self.inMAC[0])
+        outer.update(data)
+        return mac == outer.digest()
 
 
 class _Counter:
@@ -508,16 +508,48 @@ class Telnet(protocol.Protocol):
 
     def dataReceived(self, data):
         appDataBuffer = []
-
-        for b in data:
+        i = 0
+        end = len(data)
+        # The positions of the next IAC and CR at or after i, or end if there
+        # are none.  Runs of bytes between them are handled as a whole; the
+        # state machine below only sees the bytes around them.
+        nextIAC = nextCR = -1
+
+        while i < end:
             if self.state == 'data':
-                if b == IAC:
+                if nextIAC < i:
+                    nextIAC = data.find(IAC, i)
+                    if nextIAC == -1:
+                        nextIAC = end
+                if nextCR < i:
+                    nextCR = data.find('\r', i)
+                    if nextCR == -1:
+                        nextCR = end
+                j = min(nextIAC, nextCR)
+                if j > i:
+                    appDataBuffer.append(data[i:j])
+                if j == end:
+                    break
+                if j == nextIAC:
                     self.state = 'escaped'
-                elif b == '\r':
-                    self.state = 'newline'
                 else:
-                    appDataBuffer.append(b)
-            elif self.state == 'escaped':
+                    self.state = 'newline'
+                i = j + 1
+                continue
+            elif self.state == 'subnegotiation':
+                j = data.find(IAC, i)
+                if j == -1:
+                    j = end
+                self.commands.extend(data[i:j])
+                if j == end:
+                    break
+                self.state = 'subnegotiation-escaped'
+                i = j + 1
+                continue
+
+            b = data[i]
+            i += 1
+            if self.state == 'escaped':
                 if b == IAC:
                     appDataBuffer.append(b)
                     self.state = 'data'
@@ -564,11 +596,6 @@ class Telnet(protocol.Protocol):
                     self.state = 'escaped'
                 else:
                     appDataBuffer.append('\r' + b)
-            elif self.state == 'subnegotiation':
-                if b == IAC:
-                    self.state = 'subnegotiation-escaped'
-                else:
-                    self.commands.append(b)
             elif self.state == 'subnegotiation-escaped':
                 if b == SE:
                     self.state = 'data'
@@ -84,7 +84,8 @@ class ChannelTestCase(unittest.TestCase):
         """
         Test that SSHChannel initializes correctly.  localWindowSize defaults
         to 131072 (2**17) and localMaxPacket to 32768 (2**15) as reasonable
-        defaults (what OpenSSH uses for those variables).
+        defaults (what OpenSSH uses for those variables).  The local window
+        may grow to 16MB (2**24), the most OpenSSH uses.
 
         The values in the second set of assertions are meaningless; they serve
         only to verify that the instance variables are assigned in the correct
@@ -93,6 +94,7 @@ class ChannelTestCase(unittest.TestCase):
         c = channel.SSHChannel(conn=self.conn)
         self.assertEqual(c.localWindowSize, 131072)
         self.assertEqual(c.localWindowLeft, 131072)
+        self.assertEqual(c.maxLocalWindowSize, 16 * 1024 * 1024)
         self.assertEqual(c.localMaxPacket, 32768)
         self.assertEqual(c.remoteWindowLeft, 0)
         self.assertEqual(c.remoteMaxPacket, 0)
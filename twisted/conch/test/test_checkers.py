@@ -228,6 +228,35 @@ class SSHPublicKeyDatabaseTestCase(TestCase):
         self.assertEqual(self.mockos.setegidCalls, [])
 
 
+    def test_checkKeyCached(self):
+        """
+        L{SSHPublicKeyDatabase.checkKey} doesn't read an I{authorized_keys}
+        file again while it is unchanged.
+        """
+        self._testCheckKey("authorized_keys")
+        def open(self):
+            raise AssertionError("%s was read again" % (self.path,))
+        self.patch(FilePath, "open", open)
+        user = UsernamePassword("user", "password")
+        user.blob = "foobar"
+        self.assertTrue(self.checker.checkKey(user))
+
+
+    def test_checkKeyChanged(self):
+        """
+        L{SSHPublicKeyDatabase.checkKey} reads an I{authorized_keys} file
+        again once it has changed.
+        """
+        keyFile = self.sshDir.child("authorized_keys")
+        self._testCheckKey("authorized_keys")
+        keyFile.setContent("t3 %s foo\n" % (base64.encodestring("baz"),))
+        user = UsernamePassword("user", "password")
+        user.blob = "baz"
+        self.assertTrue(self.checker.checkKey(user))
+        user.blob = "foobar"
+        self.assertFalse(self.checker.checkKey(user))
+
+
     def test_checkKeyAsRoot(self):
         """
         If the key file is readable, L{SSHPublicKeyDatabase.checkKey} should
@@ -9,6 +9,7 @@ import struct
 
 from twisted.conch import error
 from twisted.conch.ssh import channel, common, connection
+from twisted.internet.task import Clock
 from twisted.trial import unittest
 from twisted.conch.test import test_userauth
 
@@ -600,6 +601,104 @@ class ConnectionTestCase(unittest.TestCase):
                 [(connection.MSG_CHANNEL_WINDOW_ADJUST, '\x00\x00\x00\xff'
                     '\x00\x00\x00\x01')])
 
+    def _sendWindowFull(self, channel):
+        """
+        Have the other side send data into C{channel} until the connection
+        refills its window, and return the C{MSG_CHANNEL_WINDOW_ADJUST} packets
+        sent.
+        """
+        self.transport.packets = []
+        size = channel.localWindowLeft - channel.localWindowSize // 2 + 1
+        self.conn.ssh_CHANNEL_DATA(
+            struct.pack('>L', channel.id) + common.NS('a' * size))
+        return [packet for packet in self.transport.packets
+                if packet[0] == connection.MSG_CHANNEL_WINDOW_ADJUST]
+
+
+    def test_windowGrows(self):
+        """
+        When the other side uses the local window of a channel faster than
+        twice the window per round trip, the window is limiting it and is
+        doubled when it is next refilled.
+        """
+        clock = Clock()
+        self.conn._seconds = clock.seconds
+        self.conn._roundTripTime = 1.0
+        channel = TestChannel(localWindow=8, localMaxPacket=8)
+        self._openChannel(channel)
+        self.assertEqual(len(self._sendWindowFull(channel)), 1)
+        self.assertEqual(channel.localWindowSize, 8)
+        clock.advance(0.5)
+        self.assertEqual(
+            self._sendWindowFull(channel),
+            [(connection.MSG_CHANNEL_WINDOW_ADJUST,
+              '\x00\x00\x00\xff\x00\x00\x00\x0d')])
+        self.assertEqual(channel.localWindowSize, 16)
+        self.assertEqual(channel.localWindowLeft, 16)
+
+
+    def test_windowDoesNotGrowWhenNotLimiting(self):
+        """
+        When the other side uses the local window of a channel more slowly
+        than twice the window per round trip, the window is not grown.
+        """
+        clock = Clock()
+        self.conn._seconds = clock.seconds
+        self.conn._roundTripTime = 1.0
+        channel = TestChannel(localWindow=8, localMaxPacket=8)
+        self._openChannel(channel)
+        self._sendWindowFull(channel)
+        clock.advance(2)
+        self._sendWindowFull(channel)
+        self.assertEqual(channel.localWindowSize, 8)
+        self.assertEqual(channel.localWindowLeft, 8)
+
+
+    def test_windowGrowthCapped(self):
+        """
+        The local window of a channel does not grow beyond
+        C{maxLocalWindowSize}.
+        """
+        clock = Clock()
+        self.conn._seconds = clock.seconds
+        self.conn._roundTripTime = 1.0
+        channel = TestChannel(localWindow=8, localMaxPacket=8)
+        channel.maxLocalWindowSize = 12
+        self._openChannel(channel)
+        for i in range(3):
+            self._sendWindowFull(channel)
+        self.assertEqual(channel.localWindowSize, 12)
+
+
+    def test_roundTripMeasured(self):
+        """
+        The first time a channel would grow its window, the connection measures
+        its round trip time with a I{keepalive@openssh.com} global request.
+        Either reply to it gives the time.
+        """
+        clock = Clock()
+        self.conn._seconds = clock.seconds
+        channel = TestChannel(localWindow=8, localMaxPacket=8)
+        self._openChannel(channel)
+        self._sendWindowFull(channel)
+        self.assertNotIn(connection.MSG_GLOBAL_REQUEST,
+                         [packet[0] for packet in self.transport.packets])
+        self._sendWindowFull(channel)
+        self.assertEqual(
+            self.transport.packets[0],
+            (connection.MSG_GLOBAL_REQUEST,
+             common.NS('keepalive@openssh.com') + '\xff'))
+        self.assertEqual(channel.localWindowSize, 8)
+        self._sendWindowFull(channel)
+        self.assertNotIn(connection.MSG_GLOBAL_REQUEST,
+                         [packet[0] for packet in self.transport.packets])
+        clock.advance(0.25)
+        self.conn.ssh_REQUEST_FAILURE('')
+        self.assertEqual(self.conn._roundTripTime, 0.25)
+        self._sendWindowFull(channel)
+        self.assertEqual(channel.localWindowSize, 16)
+
+
     def test_sendData(self):
         """
         Test that channel data messages are sent in the right format.
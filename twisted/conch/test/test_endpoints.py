@@ -54,8 +54,8 @@ else:
 
     from twisted.conch.endpoints import (
         _ISSHConnectionCreator, AuthenticationFailed, SSHCommandAddress,
-        SSHCommandClientEndpoint, _ReadFile, _NewConnectionHelper,
-        _ExistingConnectionHelper)
+        SSHCommandClientEndpoint, SSHConnectionPool, _ReadFile,
+        _NewConnectionHelper, _ExistingConnectionHelper)
 
     from twisted.conch.ssh.transport import SSHClientTransport
 
@@ -1276,6 +1276,275 @@ class ExistingConnectionTests(TestCase, SSHCommandClientEndpointTestsMixin):
 
 
 
+class PooledConnectionTests(TestCase, SSHCommandClientEndpointTestsMixin):
+    """
+    Tests for L{SSHCommandClientEndpoint} when using the C{pooledConnection}
+    constructor, and for L{SSHConnectionPool}.
+    """
+    def setUp(self):
+        """
+        Configure an SSH server with password authentication enabled for a
+        well-known (to the tests) account, and a pool to connect to it with.
+        """
+        SSHCommandClientEndpointTestsMixin.setUp(self)
+        self.knownHosts = KnownHostsFile(FilePath(self.mktemp()))
+        self.knownHosts.addHostKey(
+            self.hostname, self.factory.publicKeys['ssh-rsa'])
+        self.knownHosts.addHostKey(
+            self.serverAddress.host, self.factory.publicKeys['ssh-rsa'])
+        self.ui = FixedResponseUI(False)
+        self.pool = SSHConnectionPool(self.reactor)
+
+
+    def create(self, command=b"/bin/ls -l", user=None, knownHosts=None,
+               ui=None):
+        """
+        Create and return a new L{SSHCommandClientEndpoint} using the
+        C{pooledConnection} constructor.
+        """
+        if user is None:
+            user = self.user
+        if knownHosts is None:
+            knownHosts = self.knownHosts
+        if ui is None:
+            ui = self.ui
+        return SSHCommandClientEndpoint.pooledConnection(
+            self.pool, command, user, self.hostname, self.port,
+            password=self.password, knownHosts=knownHosts, ui=ui)
+
+
+    def finishConnection(self, index=0):
+        """
+        Establish an attempted TCP connection, the first by default, using the
+        SSH server which C{self.factory} can create.
+        """
+        return self.connectedServerAndClient(
+            self.factory, self.reactor.tcpClients[index][2])
+
+
+    def assertClientTransportState(self, client, immediateClose):
+        """
+        Assert that the transport for the given protocol has been aborted if
+        the connection was closed immediately, and otherwise that it is still
+        connected, waiting in the pool to be used again.
+        """
+        if immediateClose:
+            self.assertTrue(client.transport.aborted)
+        else:
+            self.assertFalse(client.transport.disconnecting)
+
+
+    def _connect(self, endpoint):
+        factory = Factory()
+        factory.protocol = Protocol
+        return endpoint.connect(factory)
+
+
+    def test_sharedConnection(self):
+        """
+        Commands run through endpoints created from the same pool for the
+        same server and credentials share one connection.
+        """
+        self.realm.channelLookup[b'session'] = WorkingExecSession
+        first = self._connect(self.create())
+        second = self._connect(self.create(b"/bin/true"))
+        server, client, pump = self.finishConnection()
+        pump.flush()
+
+        self.assertEqual(1, len(self.reactor.tcpClients))
+        firstProtocol = self.successResultOf(first)
+        secondProtocol = self.successResultOf(second)
+        self.assertIs(firstProtocol.transport.conn,
+                      secondProtocol.transport.conn)
+        self.assertNotEqual(firstProtocol.transport.id,
+                            secondProtocol.transport.id)
+
+        third = self._connect(self.create())
+        pump.flush()
+        self.successResultOf(third)
+        self.assertEqual(1, len(self.reactor.tcpClients))
+
+
+    def test_address(self):
+        """
+        The address a protocol is built with names the command run by its own
+        endpoint, not the command which set up the shared connection.
+        """
+        self.realm.channelLookup[b'session'] = WorkingExecSession
+        self._connect(self.create())
+        server, client, pump = self.finishConnection()
+        factory = AddressSpyFactory()
+        factory.protocol = Protocol
+        self.create(b"/bin/true").connect(factory)
+        pump.flush()
+        self.assertEqual(b"/bin/true", factory.address.command)
+
+
+    def test_maxChannelsPerConnection(self):
+        """
+        Once a connection carries C{maxChannelsPerConnection} channels, the
+        pool opens another connection to the same server.
+        """
+        self.realm.channelLookup[b'session'] = WorkingExecSession
+        self.pool.maxChannelsPerConnection = 1
+        first = self._connect(self.create())
+        second = self._connect(self.create())
+        self.assertEqual(2, len(self.reactor.tcpClients))
+        self.finishConnection(0)
+        self.finishConnection(1)
+        self.assertIsNot(self.successResultOf(first).transport.conn,
+                         self.successResultOf(second).transport.conn)
+
+
+    def test_differentCredentials(self):
+        """
+        Endpoints which authenticate differently don't share connections.
+        """
+        self.passwdDB.addUser(b"other", self.password)
+        self._connect(self.create())
+        self._connect(self.create(user=b"other"))
+        self.assertEqual(2, len(self.reactor.tcpClients))
+
+
+    def test_differentHostKeyChecks(self):
+        """
+        Endpoints which check the server's host key against different known
+        hosts files, or ask a different user interface about it, don't share
+        connections.
+        """
+        otherKnownHosts = KnownHostsFile(FilePath(self.mktemp()))
+        self._connect(self.create())
+        self._connect(self.create(knownHosts=otherKnownHosts))
+        self._connect(self.create(ui=FixedResponseUI(True)))
+        self.assertEqual(3, len(self.reactor.tcpClients))
+
+
+    def test_failedConnection(self):
+        """
+        If the connection cannot be set up, every command waiting for it
+        fails, and the next command tries a new connection.
+        """
+        first = self._connect(self.create())
+        second = self._connect(self.create())
+        self.reactor.tcpClients[0][2].clientConnectionFailed(
+            None, Failure(ConnectionRefusedError()))
+        self.failureResultOf(first).trap(ConnectionRefusedError)
+        self.failureResultOf(second).trap(ConnectionRefusedError)
+
+        self._connect(self.create())
+        self.assertEqual(2, len(self.reactor.tcpClients))
+
+
+    def test_cancelOneWaiting(self):
+        """
+        Cancelling one of several commands waiting for a connection leaves
+        the connection attempt going for the others.
+        """
+        self.realm.channelLookup[b'session'] = WorkingExecSession
+        first = self._connect(self.create())
+        second = self._connect(self.create())
+        first.cancel()
+        self.failureResultOf(first).trap(CancelledError)
+        self.finishConnection()
+        self.successResultOf(second)
+
+
+    def test_cancelOneCommand(self):
+        """
+        Cancelling a command whose channel is being set up on a shared
+        connection closes only that channel; the connection and the other
+        commands running on it are unaffected.
+        """
+        self.realm.channelLookup[b'session'] = WorkingExecSession
+        first = self._connect(self.create())
+        server, client, pump = self.finishConnection()
+        pump.flush()
+        firstProtocol = self.successResultOf(first)
+
+        second = self._connect(self.create(b"/bin/true"))
+        second.cancel()
+        self.failureResultOf(second).trap(CancelledError)
+        pump.flush()
+
+        self.assertClientTransportState(client, False)
+        self.assertEqual(
+            [firstProtocol.transport.id],
+            list(firstProtocol.transport.conn.channels))
+        self.assertFalse(firstProtocol.transport.closing)
+
+        third = self._connect(self.create())
+        pump.flush()
+        self.assertIs(firstProtocol.transport.conn,
+                      self.successResultOf(third).transport.conn)
+        self.assertEqual(1, len(self.reactor.tcpClients))
+
+
+    def _runAndClose(self):
+        """
+        Run a command and have the server close its channel.
+
+        @return: The client and the pump of the connection it ran on.
+        """
+        self.realm.channelLookup[b'session'] = WorkingExecSession
+        connected = self._connect(self.create())
+        server, client, pump = self.finishConnection()
+        protocol = self.successResultOf(connected)
+        server.service.channels[protocol.transport.id].loseConnection()
+        pump.pump()
+        return client, pump
+
+
+    def test_idleTimeout(self):
+        """
+        A connection with no channels is closed after
+        C{cachedConnectionTimeout} seconds.
+        """
+        client, pump = self._runAndClose()
+        self.reactor.advance(self.pool.cachedConnectionTimeout - 1)
+        self.assertFalse(client.transport.disconnecting)
+        self.reactor.advance(1)
+        self.assertTrue(client.transport.disconnecting)
+
+
+    def test_reuseCancelsTimeout(self):
+        """
+        A connection with no channels which is used again before
+        C{cachedConnectionTimeout} seconds pass stays open.
+        """
+        client, pump = self._runAndClose()
+        self.reactor.advance(self.pool.cachedConnectionTimeout - 1)
+        connected = self._connect(self.create())
+        pump.flush()
+        self.successResultOf(connected)
+        self.reactor.advance(self.pool.cachedConnectionTimeout)
+        self.assertFalse(client.transport.disconnecting)
+        self.assertEqual(1, len(self.reactor.tcpClients))
+
+
+    def test_closedConnectionNotReused(self):
+        """
+        A connection which has been closed is not handed out again.
+        """
+        client, pump = self._runAndClose()
+        client.transport.loseConnection()
+        self._connect(self.create())
+        self.assertEqual(2, len(self.reactor.tcpClients))
+
+
+    def test_closeCachedConnections(self):
+        """
+        L{SSHConnectionPool.closeCachedConnections} closes the connections in
+        the pool and cancels their timeouts.
+        """
+        client, pump = self._runAndClose()
+        self.pool.closeCachedConnections()
+        self.assertTrue(client.transport.disconnecting)
+        self.assertEqual([], self.reactor.getDelayedCalls())
+        self._connect(self.create())
+        self.assertEqual(2, len(self.reactor.tcpClients))
+
+
+
 class ExistingConnectionHelperTests(TestCase):
     """
     Tests for L{_ExistingConnectionHelper}.
@@ -10,6 +10,7 @@ import os
 import re
 import struct
 import sys
+from StringIO import StringIO
 
 from twisted.trial import unittest
 try:
@@ -22,7 +23,8 @@ from twisted.conch import avatar
 from twisted.conch.ssh import common, connection, filetransfer, session
 from twisted.internet import defer
 from twisted.protocols import loopback
-from twisted.python import components
+from twisted.python import components, failure
+from twisted.test.proto_helpers import StringTransport
 
 
 class TestAvatar(avatar.ConchUser):
@@ -463,6 +465,539 @@ class TestOurServerOurClient(SFTPTestBase):
         return self.assertFailure(d, NotImplementedError)
 
 
+    def test_downloadFile(self):
+        """
+        L{filetransfer.FileTransferClient.downloadFile} writes the contents of
+        the file to the consumer and fires with statistics about the transfer.
+        """
+        consumer = StringTransport()
+        d = self.client.downloadFile('testfile1', consumer, chunkSize=1000,
+                                     maxRequests=8)
+        self._emptyBuffers()
+        def _downloaded(statistics):
+            expected = file(os.path.join(self.testDir, 'testfile1')).read()
+            self.assertEqual(consumer.value(), expected)
+            self.assertIdentical(consumer.producer, None)
+            self.assertEqual(statistics.bytesTransferred, len(expected))
+            self.assertTrue(statistics.requests > len(expected) // 1000)
+            self.assertNotIdentical(statistics.endTime, None)
+            self.assertEqual(self.server.openFiles, {})
+        d.addCallback(_downloaded)
+        return d
+
+
+    def test_uploadFile(self):
+        """
+        L{filetransfer.FileTransferClient.uploadFile} writes the contents of
+        the source to the remote file and fires with statistics about the
+        transfer.
+        """
+        data = 'abcdefghij' * 1000
+        d = self.client.uploadFile('testfile1', StringIO(data),
+                                   chunkSize=1000, maxRequests=4)
+        self._emptyBuffers()
+        def _uploaded(statistics):
+            self.assertEqual(
+                file(os.path.join(self.testDir, 'testfile1')).read(), data)
+            self.assertEqual(statistics.bytesTransferred, len(data))
+            self.assertEqual(statistics.requests, 10)
+            self.assertEqual(self.server.openFiles, {})
+        d.addCallback(_uploaded)
+        return d
+
+
+
+class FakeClientFile:
+    """
+    A L{filetransfer.ClientFile} which records the requests made with it.
+
+    @ivar reads: a C{list} of (offset, length, Deferred) for each read.
+    @ivar writes: a C{list} of (offset, data, Deferred) for each write.
+    @ivar closed: whether C{close} was called.
+    """
+
+    def __init__(self):
+        self.reads = []
+        self.writes = []
+        self.closed = False
+
+
+    def readChunk(self, offset, length):
+        d = defer.Deferred()
+        self.reads.append((offset, length, d))
+        return d
+
+
+    def writeChunk(self, offset, data):
+        d = defer.Deferred()
+        self.writes.append((offset, data, d))
+        return d
+
+
+    def close(self):
+        self.closed = True
+        return defer.succeed(None)
+
+
+
+class PipelinedTransferTests(unittest.TestCase):
+    """
+    Tests for the transfers made by
+    L{filetransfer.FileTransferClient.downloadFile} and
+    L{filetransfer.FileTransferClient.uploadFile}.
+    """
+
+    def setUp(self):
+        self.file = FakeClientFile()
+        self.consumer = StringTransport()
+
+
+    def test_downloadRequestsInFlight(self):
+        """
+        A download keeps up to C{maxRequests} reads outstanding, and makes a
+        new one each time a reply arrives.
+        """
+        filetransfer._Download(self.file, self.consumer, 10, 3).start()
+        self.assertEqual([read[:2] for read in self.file.reads],
+                         [(0, 10), (10, 10), (20, 10)])
+        self.file.reads[0][2].callback('a' * 10)
+        self.assertEqual(self.file.reads[3][:2], (30, 10))
+        self.assertEqual(len(self.file.reads), 4)
+
+
+    def test_downloadOutOfOrder(self):
+        """
+        Data which arrives ahead of earlier data is written to the consumer
+        once the earlier data arrives.
+        """
+        filetransfer._Download(self.file, self.consumer, 10, 3).start()
+        self.file.reads[2][2].callback('c' * 10)
+        self.file.reads[1][2].callback('b' * 10)
+        self.assertEqual(self.consumer.value(), '')
+        self.file.reads[0][2].callback('a' * 10)
+        self.assertEqual(self.consumer.value(),
+                         'a' * 10 + 'b' * 10 + 'c' * 10)
+
+
+    def test_downloadShortRead(self):
+        """
+        When a server returns less data than was asked for, the rest of the
+        chunk is asked for again.
+        """
+        filetransfer._Download(self.file, self.consumer, 10, 1).start()
+        self.file.reads[0][2].callback('a' * 4)
+        self.assertEqual(self.file.reads[1][:2], (4, 6))
+        self.file.reads[1][2].callback('b' * 6)
+        self.assertEqual(self.file.reads[2][:2], (10, 10))
+        self.assertEqual(self.consumer.value(), 'a' * 4 + 'b' * 6)
+
+
+    def test_downloadFinished(self):
+        """
+        Once end of file is reached and every outstanding read is answered,
+        the file is closed, the download unregisters from the consumer and its
+        L{Deferred} fires with its statistics.
+        """
+        d = filetransfer._Download(self.file, self.consumer, 10, 3).start()
+        self.assertIsInstance(self.consumer.producer, filetransfer._Download)
+        self.assertTrue(self.consumer.streaming)
+        self.file.reads[1][2].callback('b' * 5)
+        self.file.reads[2][2].errback(EOFError())
+        self.assertFalse(self.file.closed)
+        self.file.reads[0][2].callback('a' * 10)
+        self.assertEqual(len(self.file.reads), 4)
+        self.file.reads[3][2].errback(EOFError())
+        self.assertTrue(self.file.closed)
+        self.assertIdentical(self.consumer.producer, None)
+        self.assertEqual(self.consumer.value(), 'a' * 10 + 'b' * 5)
+        statistics = self.successResultOf(d)
+        self.assertEqual(statistics.bytesTransferred, 15)
+        self.assertEqual(statistics.requests, 4)
+
+
+    def test_downloadPaused(self):
+        """
+        While the consumer has paused the download, no new reads are made.
+        """
+        filetransfer._Download(self.file, self.consumer, 10, 2).start()
+        self.consumer.producer.pauseProducing()
+        self.file.reads[0][2].callback('a' * 10)
+        self.assertEqual(len(self.file.reads), 2)
+        self.consumer.producer.resumeProducing()
+        self.assertEqual(len(self.file.reads), 3)
+
+
+    def test_downloadFailed(self):
+        """
+        When a read fails, no more reads are made, and once the outstanding
+        ones are answered the file is closed and the download fails.
+        """
+        d = filetransfer._Download(self.file, self.consumer, 10, 2).start()
+        self.file.reads[0][2].errback(
+            filetransfer.SFTPError(filetransfer.FX_FAILURE, 'oops'))
+        self.assertEqual(len(self.file.reads), 2)
+        self.assertFalse(self.file.closed)
+        self.file.reads[1][2].callback('b' * 10)
+        self.assertTrue(self.file.closed)
+        self.failureResultOf(d).trap(filetransfer.SFTPError)
+
+
+    def test_uploadRequestsInFlight(self):
+        """
+        An upload keeps up to C{maxRequests} writes outstanding, and finishes
+        once the source is exhausted and every write is answered.
+        """
+        d = filetransfer._Upload(
+            self.file, StringIO('a' * 25), 10, 2).start()
+        self.assertEqual([write[:2] for write in self.file.writes],
+                         [(0, 'a' * 10), (10, 'a' * 10)])
+        self.file.writes[1][2].callback(None)
+        self.assertEqual(self.file.writes[2][:2], (20, 'a' * 5))
+        self.file.writes[0][2].callback(None)
+        self.assertFalse(self.file.closed)
+        self.file.writes[2][2].callback(None)
+        self.assertTrue(self.file.closed)
+        statistics = self.successResultOf(d)
+        self.assertEqual(statistics.bytesTransferred, 25)
+        self.assertEqual(statistics.requests, 3)
+
+
+    def test_statistics(self):
+        """
+        L{filetransfer.TransferStatistics.throughput} is the number of bytes
+        transferred per second.
+        """
+        statistics = filetransfer.TransferStatistics()
+        statistics.startTime = 10.0
+        statistics.endTime = 14.0
+        statistics.bytesTransferred = 1000
+        self.assertEqual(statistics.elapsed(), 4.0)
+        self.assertEqual(statistics.throughput(), 250.0)
+
+
+
+class NonThreadPool:
+    """
+    A thread pool stand-in which runs everything at once, in the calling
+    thread.
+    """
+
+    def callInThreadWithCallback(self, onResult, f, *a, **kw):
+        try:
+            result = f(*a, **kw)
+        except Exception:
+            onResult(False, failure.Failure())
+        else:
+            onResult(True, result)
+
+
+
+class NonThreadReactor:
+    """
+    A reactor stand-in which delivers the results of L{NonThreadPool} at once.
+    """
+
+    def callFromThread(self, f, *a, **kw):
+        f(*a, **kw)
+
+
+if unix:
+    class NonThreadSFTPServer(unix.ThreadedSFTPServerForUnixConchUser):
+        """
+        A L{unix.ThreadedSFTPServerForUnixConchUser} which runs its work
+        synchronously.
+        """
+        threadPool = NonThreadPool()
+        reactor = NonThreadReactor()
+
+
+    class ThreadedFileTransferForTestAvatar(NonThreadSFTPServer):
+        """
+        A L{NonThreadSFTPServer} which, like L{TestAvatar}, doesn't switch
+        users.
+        """
+
+        def _isRunningAsUser(self):
+            return True
+
+
+
+class ThreadedSFTPServerTests(TestOurServerOurClient):
+    """
+    Tests for L{unix.ThreadedSFTPServerForUnixConchUser}, run over the same
+    protocol as L{TestOurServerOurClient}.
+    """
+
+    def setUp(self):
+        TestOurServerOurClient.setUp(self)
+        self.server.client = ThreadedFileTransferForTestAvatar(self.avatar)
+
+
+    def testServerVersion(self):
+        """
+        The threaded server was swapped in after version negotiation, so
+        there is nothing of its own to check.
+        """
+
+
+    def testExtendedRequest(self):
+        """
+        The threaded server supports no extended requests.
+        """
+        d = self.client.extendedRequest('testExtendedRequest', 'foo')
+        self._emptyBuffers()
+        return self.assertFailure(d, NotImplementedError)
+
+
+    def _openFile(self, flags):
+        d = self.client.openFile("testfile1", flags, {})
+        self._emptyBuffers()
+        openFile = self.successResultOf(d)
+        return self.server.openFiles[openFile.handle[4:]]
+
+
+    def _close(self, serverFile):
+        for handle, openFile in self.server.openFiles.items():
+            if openFile is serverFile:
+                del self.server.openFiles[handle]
+        return serverFile.close()
+
+
+    def test_readAhead(self):
+        """
+        A sequential read starts reading the next C{readAheadChunks} chunks,
+        and the following read is answered from them.
+        """
+        reads = []
+        readAt = unix._readAt
+        def recordingReadAt(fd, offset, length):
+            reads.append((offset, length))
+            return readAt(fd, offset, length)
+        self.patch(unix, "_readAt", recordingReadAt)
+
+        serverFile = self._openFile(filetransfer.FXF_READ)
+        serverFile.readAheadChunks = 2
+        self.assertEqual(self.successResultOf(serverFile.readChunk(0, 10)),
+                         'a' * 10)
+        self.assertEqual(reads, [(0, 10), (10, 10), (20, 10)])
+        self.assertEqual(self.successResultOf(serverFile.readChunk(10, 10)),
+                         'b' * 10)
+        self.assertEqual(reads[3:], [(30, 10)])
+        self.successResultOf(self._close(serverFile))
+
+
+    def test_readAheadDiscardedBySeek(self):
+        """
+        A read elsewhere in the file discards the chunks read ahead, and
+        doesn't read ahead itself.
+        """
+        serverFile = self._openFile(filetransfer.FXF_READ)
+        serverFile.readChunk(0, 10)
+        self.assertNotEqual(serverFile._readAhead, {})
+        self.assertEqual(self.successResultOf(serverFile.readChunk(5, 10)),
+                         'a' * 5 + 'b' * 5)
+        self.assertEqual(serverFile._readAhead, {})
+        self.successResultOf(self._close(serverFile))
+
+
+    def test_writeBehind(self):
+        """
+        Contiguous writes are acknowledged at once and written out together
+        when the file is closed.
+        """
+        writes = []
+        writeAt = unix._writeAt
+        def recordingWriteAt(fd, offset, data):
+            writes.append((offset, data))
+            return writeAt(fd, offset, data)
+        self.patch(unix, "_writeAt", recordingWriteAt)
+
+        serverFile = self._openFile(filetransfer.FXF_WRITE)
+        self.successResultOf(serverFile.writeChunk(0, 'c' * 10))
+        self.successResultOf(serverFile.writeChunk(10, 'd' * 10))
+        self.assertEqual(writes, [])
+        self.successResultOf(self._close(serverFile))
+        self.assertEqual(writes, [(0, 'c' * 10 + 'd' * 10)])
+        f = open(os.path.join(self.testDir, 'testfile1'))
+        self.assertEqual(f.read(20), 'c' * 10 + 'd' * 10)
+        f.close()
+
+
+    def test_writeBehindFlushes(self):
+        """
+        The buffered writes are written out by a write elsewhere in the file,
+        by a read, and by a write which fills the buffer; that write is
+        acknowledged only once the buffer is written.
+        """
+        writes = []
+        writeAt = unix._writeAt
+        def recordingWriteAt(fd, offset, data):
+            writes.append((offset, data))
+            return writeAt(fd, offset, data)
+        self.patch(unix, "_writeAt", recordingWriteAt)
+
+        serverFile = self._openFile(filetransfer.FXF_READ |
+                                    filetransfer.FXF_WRITE)
+        serverFile.writeBehindSize = 15
+        serverFile.writeChunk(0, 'c' * 10)
+        serverFile.writeChunk(20, 'd' * 10)
+        self.assertEqual(writes, [(0, 'c' * 10)])
+        serverFile.writeChunk(30, 'e' * 2)
+        self.assertEqual(self.successResultOf(serverFile.readChunk(30, 2)),
+                         'e' * 2)
+        self.assertEqual(writes[1:], [(20, 'd' * 10 + 'e' * 2)])
+        self.successResultOf(serverFile.writeChunk(40, 'f' * 20))
+        self.assertEqual(writes[2:], [(40, 'f' * 20)])
+        self.successResultOf(self._close(serverFile))
+
+
+    def test_writeBehindError(self):
+        """
+        An error writing out buffered data is reported when the file is
+        closed.
+        """
+        def failingWriteAt(fd, offset, data):
+            raise OSError(28, "No space left on device")
+        self.patch(unix, "_writeAt", failingWriteAt)
+
+        serverFile = self._openFile(filetransfer.FXF_WRITE)
+        self.successResultOf(serverFile.writeChunk(0, 'c' * 10))
+        self.failureResultOf(self._close(serverFile), OSError)
+
+
+    def test_openDirectoryInBatches(self):
+        """
+        A large directory is described in batches of C{batchSize} entries,
+        one batch per C{READDIR} request.
+        """
+        for i in range(300):
+            open(os.path.join(self.testDir, 'testDirectory', str(i)),
+                 'w').close()
+        d = self.client.openDirectory('testDirectory')
+        self._emptyBuffers()
+        openDir = self.successResultOf(d)
+        serverDir = self.server.openDirs.values()[0][0]
+        self.assertIsInstance(serverDir, unix.ThreadedUnixSFTPDirectory)
+        batches = []
+        describe = serverDir._describe
+        def recordingDescribe(names):
+            batches.append(len(names))
+            return describe(names)
+        serverDir._describe = recordingDescribe
+
+        names = []
+        while True:
+            entry = openDir.next()
+            if isinstance(entry, defer.Deferred):
+                self._emptyBuffers()
+                result = []
+                entry.addBoth(result.append)
+                if isinstance(result[0], failure.Failure):
+                    result[0].trap(EOFError)
+                    break
+                entry = result[0]
+            names.append(entry[0])
+        self.assertEqual(sorted(names), sorted(str(i) for i in range(300)))
+        self.assertEqual(batches, [250, 50])
+        openDir.close()
+        self._emptyBuffers()
+
+
+
+class ThreadedSFTPServerUserTests(SFTPTestBase):
+    """
+    Tests for how L{unix.ThreadedSFTPServerForUnixConchUser} runs operations
+    as the logged-in user.
+    """
+
+    if not unix:
+        skip = "can't run on non-posix computers"
+
+    def setUp(self):
+        SFTPTestBase.setUp(self)
+        self.avatar = FileTransferTestAvatar(self.testDir)
+        self.calls = []
+        runAsUser = self.avatar._runAsUser
+        def recordingRunAsUser(f, *args):
+            self.calls.append(f)
+            return runAsUser(f, *args)
+        self.avatar._runAsUser = recordingRunAsUser
+
+
+    def _server(self, uid, gid, groups):
+        self.avatar.getUserGroupId = lambda: (uid, gid)
+        self.avatar.getOtherGroups = lambda: groups
+        return NonThreadSFTPServer(self.avatar)
+
+
+    def test_runningAsUser(self):
+        """
+        When the process runs as the user, operations on paths are run in the
+        thread pool.
+        """
+        server = self._server(os.geteuid(), os.getegid(), os.getgroups())
+        d = server.getAttrs('testfile1', True)
+        self.assertEqual(self.successResultOf(d)['size'], 20 + 1024 * 64)
+        self.assertEqual(self.calls, [])
+
+
+    def test_otherUser(self):
+        """
+        When the process doesn't run as the user, operations on paths are run
+        in the reactor thread as the user.
+        """
+        server = self._server(os.geteuid() + 1, os.getegid(), os.getgroups())
+        d = server.getAttrs('testfile1', True)
+        self.assertEqual(self.successResultOf(d)['size'], 20 + 1024 * 64)
+        self.assertEqual(self.calls, [os.stat])
+
+
+    def test_extraGroups(self):
+        """
+        When the process has groups the user doesn't, operations on paths
+        are run in the reactor thread as the user.
+        """
+        server = self._server(os.geteuid(), os.getegid(), [])
+        if set(os.getgroups()) <= set([os.getegid()]):
+            raise unittest.SkipTest("The process has no supplementary groups.")
+        server.getAttrs('testfile1', True)
+        self.assertEqual(self.calls, [os.stat])
+
+
+    def test_root(self):
+        """
+        When the process runs as root and serves another user, every
+        operation which takes a path, including listing a directory and
+        describing its entries, is run in the reactor thread as the user.
+        Only operations on open files are run in the thread pool.
+        """
+        self.patch(os, 'geteuid', lambda: 0)
+        self.patch(os, 'getegid', lambda: 0)
+        server = self._server(1000, 1000, [])
+        pooled = []
+        pool = server.threadPool
+        def recordingCallInThreadWithCallback(onResult, f, *args):
+            pooled.append(f)
+            return pool.callInThreadWithCallback(onResult, f, *args)
+        server.threadPool = NonThreadPool()
+        server.threadPool.callInThreadWithCallback = (
+            recordingCallInThreadWithCallback)
+
+        openDir = self.successResultOf(server.openDirectory('.'))
+        self.successResultOf(openDir.next())
+        openFile = self.successResultOf(
+            server.openFile('testfile1', filetransfer.FXF_READ, {}))
+        self.successResultOf(server.getAttrs('testfile1', False))
+        self.assertEqual(
+            self.calls,
+            [os.listdir, openDir._describe, server._open, os.lstat])
+        self.assertEqual(pooled, [])
+
+        self.successResultOf(openFile.close())
+        self.assertEqual(pooled, [os.close])
+
+
+
 class FakeConn:
     def sendClose(self, channel):
         pass
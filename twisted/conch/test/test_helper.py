@@ -4,6 +4,7 @@
 
 from twisted.conch.insults import helper
 from twisted.conch.insults.insults import G0, G1, G2, G3
+from twisted.conch.insults.insults import CS_DRAWING, ClientProtocol
 from twisted.conch.insults.insults import modes, privateModes
 from twisted.conch.insults.insults import (
     NORMAL, BOLD, UNDERLINE, BLINK, REVERSE_VIDEO)
@@ -612,3 +613,193 @@ class CharacterAttributeTests(unittest.TestCase):
             warningsShown[0]['message'],
             'twisted.conch.insults.helper.wantOne was deprecated in '
             'Twisted 13.1.0')
+
+
+
+class RecordingTerminal:
+    """
+    A terminal which records what is written to it.
+
+    @ivar writes: The strings passed to C{write}, in order.
+    """
+    def __init__(self):
+        self.writes = []
+
+
+    def write(self, bytes):
+        self.writes.append(bytes)
+
+
+
+class VirtualScreenTests(unittest.TestCase):
+    """
+    Tests for L{helper.VirtualScreen}.
+    """
+    def setUp(self):
+        self.real = RecordingTerminal()
+        self.screen = helper.VirtualScreen(self.real, 20, 5)
+        # An emulator fed everything the screen writes to the real terminal.
+        self.mirror = helper.VirtualScreen(None, 20, 5)
+        self.parser = ClientProtocol(lambda: self.mirror)
+        self.parser.factory = None
+        self.parser.makeConnection(None)
+
+
+    def flush(self):
+        """
+        Flush C{self.screen} and feed what it wrote to C{self.mirror}.
+
+        @return: The bytes written by the flush.
+        """
+        del self.real.writes[:]
+        self.screen.flush()
+        self.assertTrue(len(self.real.writes) <= 1)
+        bytes = ''.join(self.real.writes)
+        self.parser.dataReceived(bytes)
+        self.assertEqual(self.mirror.lines, self.screen.lines)
+        self.assertEqual(
+            self.mirror.reportCursorPosition(),
+            self.screen.reportCursorPosition())
+        return bytes
+
+
+    def test_firstFlush(self):
+        """
+        The first L{helper.VirtualScreen.flush} clears the real terminal and
+        draws everything, in one write.
+        """
+        self.screen.cursorPosition(3, 1)
+        self.screen.write('hello')
+        self.screen.selectGraphicRendition(BOLD, '32')
+        self.screen.write('world')
+        self.assertTrue(self.flush().startswith('\x1b[0m\x1b(B\x1b[2J'))
+        self.assertEqual(str(self.mirror), '\n   helloworld\n\n\n')
+
+
+    def test_unchanged(self):
+        """
+        Nothing is written if the screen has not changed since the last
+        flush, even if it was drawn again.
+        """
+        self.screen.write('hello')
+        self.flush()
+        self.screen.cursorHome()
+        self.screen.write('hello')
+        self.assertEqual(self.flush(), '')
+        self.assertEqual(self.real.writes, [])
+
+
+    def test_cursorMoved(self):
+        """
+        If only the cursor has moved since the last flush, the cursor of the
+        real terminal is moved.
+        """
+        self.screen.write('hi')
+        self.flush()
+        self.screen.cursorPosition(5, 2)
+        self.assertEqual(self.flush(), '\x1b[3;6H')
+        self.assertEqual(self.flush(), '')
+
+
+    def test_singleCell(self):
+        """
+        Changing one character only moves the cursor to it and writes it.
+        """
+        self.screen.write('hello')
+        self.screen.cursorPosition(0, 3)
+        self.flush()
+        self.screen.cursorPosition(1, 0)
+        self.screen.write('a')
+        self.screen.cursorPosition(0, 3)
+        self.assertEqual(self.flush(), '\x1b[1;2Ha\x1b[4;1H')
+        self.assertEqual(str(self.mirror), 'hallo\n\n\n\n')
+
+
+    def test_smallGap(self):
+        """
+        Unchanged characters between two nearby changes are rewritten rather
+        than skipped with a cursor movement.
+        """
+        self.screen.write('abcdefghij')
+        self.flush()
+        self.screen.cursorPosition(1, 0)
+        self.screen.write('B')
+        self.screen.cursorPosition(4, 0)
+        self.screen.write('E')
+        self.screen.cursorPosition(9, 0)
+        self.screen.write('J')
+        self.assertEqual(
+            self.flush(), '\x1b[1;2HBcdE\x1b[1;10HJ')
+
+
+    def test_attributes(self):
+        """
+        Graphic renditions and character sets are only changed when they
+        differ from those of the previous character written, and are reset
+        at the end of the flush if they differ from the defaults.
+        """
+        self.screen.write('a')
+        self.screen.selectGraphicRendition(REVERSE_VIDEO)
+        self.screen.write('bc')
+        self.screen.selectCharacterSet(CS_DRAWING, G0)
+        self.screen.write('q')
+        self.screen.selectGraphicRendition(NORMAL)
+        self.screen.write('q')
+        bytes = self.flush()
+        self.assertEqual(bytes.count('\x1b[0;7m'), 1)
+        self.assertEqual(bytes.count('\x1b(0'), 1)
+        self.assertTrue(bytes.endswith('q\x1b(B'))
+
+
+    def test_lastColumn(self):
+        """
+        After writing to the last column the cursor is positioned explicitly,
+        since terminals differ in whether it wraps.
+        """
+        self.flush()
+        self.screen.cursorPosition(19, 0)
+        self.screen.write('x')
+        self.screen.cursorPosition(0, 1)
+        self.screen.write('y')
+        self.assertEqual(self.flush(), '\x1b[1;20Hx\x1b[2;1Hy')
+
+
+    def test_scroll(self):
+        """
+        Scrolling the screen rewrites the lines which changed.
+        """
+        for i in range(5):
+            self.screen.write('line %d\n' % (i,))
+        self.flush()
+        self.screen.write('line 5')
+        self.flush()
+        self.assertEqual(
+            str(self.mirror), 'line 1\nline 2\nline 3\nline 4\nline 5')
+
+
+    def test_invalidate(self):
+        """
+        After L{helper.VirtualScreen.invalidate}, the next flush redraws the
+        whole screen.
+        """
+        self.screen.write('hello')
+        self.flush()
+        self.screen.invalidate()
+        self.mirror.eraseDisplay()
+        self.assertTrue(self.flush().startswith('\x1b[0m\x1b(B\x1b[2J'))
+        self.assertEqual(str(self.mirror), 'hello\n\n\n\n')
+
+
+    def test_resize(self):
+        """
+        L{helper.VirtualScreen.resize} clears the screen and changes its
+        size, keeping the cursor where it is if it still fits, and the next
+        flush redraws the real terminal.
+        """
+        self.screen.write('hello')
+        self.flush()
+        self.screen.resize(10, 3)
+        self.mirror.width, self.mirror.height = 10, 3
+        self.screen.write('bye')
+        self.assertTrue(self.flush().startswith('\x1b[0m\x1b(B\x1b[2J'))
+        self.assertEqual(str(self.mirror), '     bye\n\n')
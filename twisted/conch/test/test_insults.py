@@ -363,6 +363,23 @@ class ClientControlSequences(unittest.TestCase, MockMixin):
         self.assertEqual(result, (6, 7))
 
 
+    def test_cursorPositioning(self):
+        """
+        A CUP sequence is delivered as a call to C{cursorPosition} with
+        zero-based coordinates, omitted coordinates defaulting to the first
+        line or column.  Without parameters it is delivered as a call to
+        C{cursorHome}.
+        """
+        self.parser.dataReceived("\x1b[2;4H\x1b[3H\x1b[;5H\x1b[H")
+        occs = occurrences(self.proto)
+
+        self.assertCall(occs.pop(0), "cursorPosition", (3, 1))
+        self.assertCall(occs.pop(0), "cursorPosition", (0, 2))
+        self.assertCall(occs.pop(0), "cursorPosition", (4, 0))
+        self.assertCall(occs.pop(0), "cursorHome")
+        self.assertFalse(occs)
+
+
     def test_applicationDataBytes(self):
         """
         Contiguous non-control bytes are passed to a single call to the
@@ -624,6 +624,65 @@ xEm4DxjEoaIp8dW/JOzXQ2EF+WaSOgdYsw3Ac+rnnjnNptCdOEDGP6QBkt+oXj4P
         self.assertTrue(key.verify(self.dsaSignature[-40:], ''))
 
 
+    def test_fromStringCached(self):
+        """
+        Parsing the same public key string twice gives back the same L{Key}.
+        """
+        key = keys.Key.fromString(keydata.publicRSA_openssh)
+        self.assertIs(key, keys.Key.fromString(keydata.publicRSA_openssh))
+        blob = key.blob()
+        self.assertIs(keys.Key.fromString(blob), keys.Key.fromString(blob))
+
+
+    def test_fromStringPrivateNotCached(self):
+        """
+        Private keys are not cached.
+        """
+        self.assertIsNot(keys.Key.fromString(keydata.privateRSA_openssh),
+                         keys.Key.fromString(keydata.privateRSA_openssh))
+
+
+    def test_verifyWithoutNative(self):
+        """
+        Signatures are verified with PyCrypto when the C{cryptography} package
+        is not installed.
+        """
+        self.patch(keys, "default_backend", None)
+        for publicKey, signature, otherSignature in [
+            (keydata.publicRSA_openssh, self.rsaSignature, self.dsaSignature),
+            (keydata.publicDSA_openssh, self.dsaSignature, self.rsaSignature)]:
+            key = keys.Key(keys.Key.fromString(publicKey).keyObject)
+            self.assertTrue(key.verify(signature, ''))
+            self.assertFalse(key.verify(signature, 'a'))
+            self.assertFalse(key.verify(otherSignature, ''))
+            self.assertIdentical(key._getNativePublicKey(), None)
+
+
+    def test_verifyNative(self):
+        """
+        RSA signatures are verified with the C{cryptography} package when it
+        is installed, including signatures sent without their leading zero
+        bytes.
+        """
+        if keys.default_backend is None:
+            raise unittest.SkipTest("cryptography is not installed")
+        privateKey = keys.Key.fromString(keydata.privateRSA_openssh)
+        key = keys.Key(privateKey.public().keyObject)
+        self.assertNotIdentical(key._getNativePublicKey(), None)
+        self.assertTrue(key.verify(self.rsaSignature, ''))
+        self.assertFalse(key.verify(self.rsaSignature, 'a'))
+        fullLength = len(common.getNS(privateKey.sign(''), 2)[1])
+        for i in range(4096):
+            data = str(i)
+            signature = privateKey.sign(data)
+            if len(common.getNS(signature, 2)[1]) < fullLength:
+                break
+        else:
+            self.fail("no signature is short enough")
+        self.assertTrue(key.verify(signature, data))
+
+
+
     def test_repr(self):
         """
         Test the pretty representation of Key.
@@ -642,3 +701,51 @@ attr q:
 \t05
 attr u:
 \t04>""")
+
+
+
+class KeyCacheTestCase(unittest.TestCase):
+    """
+    Tests for L{keys._KeyCache}.
+    """
+
+    if Crypto is None:
+        skip = "cannot run w/o PyCrypto"
+    if pyasn1 is None:
+        skip = "Cannot run without PyASN1"
+
+    def test_get(self):
+        """
+        L{keys._KeyCache.get} returns the key added under a cache key, or
+        C{None}.
+        """
+        cache = keys._KeyCache(2)
+        key = object()
+        cache.add('a', key)
+        self.assertIs(cache.get('a'), key)
+        self.assertIs(cache.get('b'), None)
+
+
+    def test_evictLeastRecentlyUsed(self):
+        """
+        When the cache is full, the least recently used half of it is
+        forgotten to make room.
+        """
+        cache = keys._KeyCache(4)
+        for name in 'abcd':
+            cache.add(name, name.upper())
+        cache.get('a')
+        cache.get('c')
+        cache.add('e', 'E')
+        self.assertEqual([cache.get(name) for name in 'abcde'],
+                         ['A', None, 'C', None, 'E'])
+
+
+    def test_clear(self):
+        """
+        L{keys._KeyCache.clear} forgets every key.
+        """
+        cache = keys._KeyCache(4)
+        cache.add('a', 'A')
+        cache.clear()
+        self.assertIs(cache.get('a'), None)
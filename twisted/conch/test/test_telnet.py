@@ -765,3 +765,29 @@ class TelnetTests(unittest.TestCase):
         self._deliver(
             'z' + telnet.IAC + telnet.SB + 'Qx' + telnet.IAC + telnet.SE,
             ('bytes', 'z'), ('negotiate', 'Q', ['x']))
+
+
+    def test_applicationDataRun(self):
+        """
+        A run of application bytes containing no IAC or carriage return is
+        delivered unchanged, in one call, along with the bytes around any
+        newlines and escaped IACs it is broken up by.
+        """
+        data = 'hostname router1\n' * 100
+        self._deliver(data, ('bytes', data))
+        self._deliver(
+            'a\r\nb' + telnet.IAC + telnet.IAC + 'c\r\0d',
+            ('bytes', 'a\nb' + telnet.IAC + 'c\rd'))
+
+
+    def test_subnegotiationRun(self):
+        """
+        The bytes of a subnegotiation are collected up to the I{IAC} ending
+        it, whether or not it is split across calls, and escaped I{IAC}s in
+        it are unescaped.
+        """
+        self._deliver(telnet.IAC + telnet.SB + 'Qabc')
+        self._deliver(
+            'de' + telnet.IAC + telnet.IAC + 'f' + telnet.IAC + telnet.SE + 'g',
+            ('negotiate', 'Q', list('abcde' + telnet.IAC + 'f')),
+            ('bytes', 'g'))
@@ -131,6 +131,10 @@ class MockCipher(object):
     inMACType = 'test'
     outMACType = 'test'
     verifyDigestSize = 1
+    outETM = False
+    inETM = False
+    outAEAD = False
+    inAEAD = False
     usedEncrypt = False
     usedDecrypt = False
     outMAC = (None, '', '', 1)
@@ -178,6 +182,47 @@ class MockCipher(object):
         return chr(incomingPacketSequence) == macData
 
 
+    def seal(self, seqid, packet):
+        """
+        Act as an authenticated encryption cipher by recording that
+        encryption was used and appending the sequence number as the tag.
+        """
+        self.usedEncrypt = True
+        return packet + chr(seqid)
+
+
+    def openLength(self, seqid, data):
+        """
+        The packet length is sent unchanged.
+        """
+        return data
+
+
+    def open(self, seqid, data, tag):
+        """
+        Check the tag appended by L{seal}, returning the packet without its
+        length if it matches.
+        """
+        if tag != chr(seqid):
+            return None
+        self.usedDecrypt = True
+        return data[4:]
+
+
+    def integrityKeySize(self):
+        """
+        The test MAC does not use its keys, so any length will do.
+        """
+        return 0
+
+
+    def encryptionKeySize(self):
+        """
+        The test cipher does not use its keys, so any length will do.
+        """
+        return 0
+
+
     def setKeys(self, ivOut, keyOut, ivIn, keyIn, macIn, macOut):
         """
         Record the keys.
@@ -462,6 +507,62 @@ class BaseSSHTransportTestCase(TransportTestCase):
             '\x02')
 
 
+    def test_sendPacketEncryptThenMAC(self):
+        """
+        With an encrypt-then-MAC algorithm, the packet length is sent
+        unencrypted and the rest of the packet is padded to a whole number of
+        blocks on its own.
+        """
+        proto = MockTransportBase()
+        proto.makeConnection(self.transport)
+        self.finishKeyExchange(proto)
+        proto.currentEncryptions = testCipher = MockCipher()
+        testCipher.outETM = True
+        self.transport.clear()
+        proto.sendPacket(ord('A'), 'BC')
+        self.assertTrue(testCipher.usedEncrypt)
+        self.assertEqual(
+            self.transport.value(),
+            # Four byte length prefix, not encrypted
+            '\x00\x00\x00\x0c'
+            # One byte padding length
+            '\x08'
+            # The actual application data
+            'ABC'
+            # "Random" padding - see the secureRandom monkeypatch in setUp
+            '\x99\x99\x99\x99\x99\x99\x99\x99'
+            # The MAC
+            '\x02')
+
+
+    def test_sendPacketAEAD(self):
+        """
+        With an authenticated encryption cipher, the packet is handed to the
+        cipher whole, with the part after the packet length padded to a whole
+        number of blocks on its own, and no MAC is added.
+        """
+        proto = MockTransportBase()
+        proto.makeConnection(self.transport)
+        self.finishKeyExchange(proto)
+        proto.currentEncryptions = testCipher = MockCipher()
+        testCipher.outAEAD = True
+        self.transport.clear()
+        proto.sendPacket(ord('A'), 'BC')
+        self.assertTrue(testCipher.usedEncrypt)
+        self.assertEqual(
+            self.transport.value(),
+            # Four byte length prefix
+            '\x00\x00\x00\x0c'
+            # One byte padding length
+            '\x08'
+            # The actual application data
+            'ABC'
+            # "Random" padding - see the secureRandom monkeypatch in setUp
+            '\x99\x99\x99\x99\x99\x99\x99\x99'
+            # The tag
+            '\x02')
+
+
     def test_sendPacketCompressed(self):
         """
         Test that packets sent while compression is enabled are sent
@@ -546,6 +647,86 @@ class BaseSSHTransportTestCase(TransportTestCase):
         self.assertEqual(proto.buf, '')
 
 
+    def test_getPacketEncryptThenMAC(self):
+        """
+        Packets protected with an encrypt-then-MAC algorithm are retrieved
+        correctly.  See test_sendPacketEncryptThenMAC.
+        """
+        proto = MockTransportBase()
+        proto.sendKexInit = lambda: None
+        proto.makeConnection(self.transport)
+        self.transport.clear()
+        proto.currentEncryptions = testCipher = MockCipher()
+        testCipher.outETM = testCipher.inETM = True
+        proto.sendPacket(ord('A'), 'BCD')
+        value = self.transport.value()
+        proto.buf = value[:-1]
+        self.assertEqual(proto.getPacket(), None)
+        self.assertFalse(testCipher.usedDecrypt)
+        proto.buf += value[-1:]
+        self.assertEqual(proto.getPacket(), 'ABCD')
+        self.assertTrue(testCipher.usedDecrypt)
+        self.assertEqual(proto.buf, '')
+
+
+    def test_getPacketEncryptThenMACBadMAC(self):
+        """
+        With an encrypt-then-MAC algorithm, a packet with a bad MAC is
+        rejected before it is decrypted.
+        """
+        proto = MockTransportBase()
+        proto.sendKexInit = lambda: None
+        proto.makeConnection(self.transport)
+        self.transport.clear()
+        proto.currentEncryptions = testCipher = MockCipher()
+        testCipher.inETM = True
+        proto.buf = '\x00\x00\x00\x06\x04AB1234' '\x05'
+        self.assertEqual(proto.getPacket(), None)
+        self.assertFalse(testCipher.usedDecrypt)
+        self.assertEqual(self.transport.value()[9],
+                         chr(transport.DISCONNECT_MAC_ERROR))
+
+
+    def test_getPacketAEAD(self):
+        """
+        Packets protected with an authenticated encryption cipher are
+        retrieved correctly.  See test_sendPacketAEAD.
+        """
+        proto = MockTransportBase()
+        proto.sendKexInit = lambda: None
+        proto.makeConnection(self.transport)
+        self.transport.clear()
+        proto.currentEncryptions = testCipher = MockCipher()
+        testCipher.outAEAD = testCipher.inAEAD = True
+        proto.sendPacket(ord('A'), 'BCD')
+        value = self.transport.value()
+        proto.buf = value[:-1]
+        self.assertEqual(proto.getPacket(), None)
+        self.assertFalse(testCipher.usedDecrypt)
+        proto.buf += value[-1:] + 'extra'
+        self.assertEqual(proto.getPacket(), 'ABCD')
+        self.assertTrue(testCipher.usedDecrypt)
+        self.assertEqual(proto.buf, 'extra')
+
+
+    def test_getPacketAEADBadTag(self):
+        """
+        With an authenticated encryption cipher, a packet which fails
+        authentication is rejected.
+        """
+        proto = MockTransportBase()
+        proto.sendKexInit = lambda: None
+        proto.makeConnection(self.transport)
+        self.transport.clear()
+        proto.currentEncryptions = testCipher = MockCipher()
+        testCipher.inAEAD = True
+        proto.buf = '\x00\x00\x00\x06\x04AB1234' '\x05'
+        self.assertEqual(proto.getPacket(), None)
+        self.assertFalse(testCipher.usedDecrypt)
+        self.assertEqual(self.transport.value()[9],
+                         chr(transport.DISCONNECT_MAC_ERROR))
+
+
     def test_getPacketCompressed(self):
         """
         Test that compressed packets are retrieved correctly.  See
@@ -579,12 +760,47 @@ class BaseSSHTransportTestCase(TransportTestCase):
         self.assertEqual(proto.getPacket(), 'ABCDEFG')
 
 
+    def test_dataReceivedSeveralPackets(self):
+        """
+        When several packets arrive at once, L{transport.SSHTransportBase}
+        dispatches each of them without copying the rest of the buffer after
+        every packet, and keeps any incomplete packet for the next call to
+        C{dataReceived}.
+        """
+        proto = MockTransportBase()
+        proto.sendKexInit = lambda: None
+        proto.makeConnection(self.transport)
+        self.transport.clear()
+        proto.gotVersion = True
+        proto.currentEncryptions = MockCipher()
+        for payload in ['BC', 'DEF', 'GHIJ']:
+            proto.sendPacket(ord('A'), payload)
+        lastPacket = len(self.transport.value())
+        proto.sendPacket(ord('A'), 'KL')
+        value = self.transport.value()
+        received = []
+        def dispatchMessage(messageNum, payload):
+            received.append((messageNum, payload, proto.buf))
+        proto.dispatchMessage = dispatchMessage
+        data = value[:-1]
+        proto.dataReceived(data)
+        self.assertEqual(received, [(ord('A'), 'BC', data),
+                                    (ord('A'), 'DEF', data),
+                                    (ord('A'), 'GHIJ', data)])
+        self.assertEqual(proto.buf, value[lastPacket:-1])
+        del received[:]
+        proto.dataReceived(value[-1:])
+        self.assertEqual(received, [(ord('A'), 'KL', value[lastPacket:])])
+        self.assertEqual(proto.buf, '')
+
+
     def test_ciphersAreValid(self):
         """
         Test that all the supportedCiphers are valid.
         """
         ciphers = transport.SSHCiphers('A', 'B', 'C', 'D')
-        iv = key = '\x00' * 16
+        iv = '\x00' * 16
+        key = '\x00' * 64
         for cipName in self.proto.supportedCiphers:
             self.assertTrue(ciphers._getCipher(cipName, iv, key))
 
@@ -1048,6 +1264,22 @@ here's some other stuff
         self.assertEqual(self.proto._getKey('K', 'AB', 'CD'), k1 + k2)
 
 
+    def test_getKeyExtended(self):
+        """
+        When asked for a key longer than two hashes, _getKey extends it with
+        further hashes as described in RFC 4253 section 7.2.
+        """
+        self.proto.sessionID = 'EF'
+
+        k1 = sha1('AB' + 'CD' + 'K' + self.proto.sessionID).digest()
+        k2 = sha1('ABCD' + k1).digest()
+        k3 = sha1('ABCD' + k1 + k2).digest()
+        k4 = sha1('ABCD' + k1 + k2 + k3).digest()
+        self.assertEqual(self.proto._getKey('K', 'AB', 'CD', 40), k1 + k2)
+        self.assertEqual(self.proto._getKey('K', 'AB', 'CD', 64),
+                         k1 + k2 + k3 + k4)
+
+
     def test_multipleClasses(self):
         """
         Test that multiple instances have distinct states.
@@ -1148,9 +1380,32 @@ class ServerAndClientSSHTransportBaseCase:
         Like test_disconnectIfCantMatchKex, but for the MAC.
         """
         def blankMACs(proto2):
+            proto2.supportedCiphers = [
+                cipName for cipName in proto2.supportedCiphers
+                if cipName not in transport.SSHCiphers.aeadCiphers]
             proto2.supportedMACs = []
         self.connectModifiedProtocol(blankMACs)
 
+
+    def test_noMACNeededWithAEAD(self):
+        """
+        If an authenticated encryption cipher is agreed on, the key exchange
+        goes ahead even if no MAC can be matched, since the cipher's tag
+        takes the place of the MAC.
+        """
+        def blankMACs(proto2):
+            proto2.supportedCiphers = ['aes128-gcm@openssh.com']
+            proto2.supportedMACs = []
+        self.connectModifiedProtocol(blankMACs, kind=0)
+        self.assertNotIn(transport.MSG_DISCONNECT,
+                         [messageType for messageType, _ in self.packets])
+        self.assertEqual(
+            self.proto.nextEncryptions.outCipType, 'aes128-gcm@openssh.com')
+        self.assertEqual(self.proto.nextEncryptions.outMACType, 'none')
+
+    if dependencySkip is None and transport.default_backend is None:
+        test_noMACNeededWithAEAD.skip = "cryptography is not installed"
+
     def test_getPeer(self):
         """
         Test that the transport's L{getPeer} method returns an
@@ -1907,6 +2162,8 @@ class SSHCiphersTestCase(unittest.TestCase):
         ciphers = transport.SSHCiphers('A', 'B', 'C', 'D')
         iv = key = '\x00' * 16
         for cipName, (modName, keySize, counter) in ciphers.cipherMap.items():
+            if cipName in ciphers.aeadCiphers:
+                continue
             cip = ciphers._getCipher(cipName, iv, key)
             if cipName == 'none':
                 self.assertIsInstance(cip, transport._DummyCipher)
@@ -1921,6 +2178,8 @@ class SSHCiphersTestCase(unittest.TestCase):
         key = '\x00' * 64
         cipherItems = transport.SSHCiphers.cipherMap.items()
         for cipName, (modName, keySize, counter) in cipherItems:
+            if cipName in transport.SSHCiphers.aeadCiphers:
+                continue
             encCipher = transport.SSHCiphers(cipName, 'none', 'none', 'none')
             decCipher = transport.SSHCiphers('none', cipName, 'none', 'none')
             cip = encCipher._getCipher(cipName, key, key)
@@ -1993,6 +2252,122 @@ class SSHCiphersTestCase(unittest.TestCase):
 
 
 
+    def test_makeMACSHA2(self):
+        """
+        L{SSHCiphers.makeMAC} computes HMAC-SHA-256 and HMAC-SHA-512 for the
+        C{hmac-sha2-*} MACs and their encrypt-then-MAC variants.
+        """
+        # The second test case of RFC 4231.
+        key = b"Jefe"
+        data = b"what do ya want for nothing?"
+        vectors = [
+            ("hmac-sha2-256",
+             b"5bdcc146bf60754e6a042426089575c7"
+             b"5a003f089d2739839dec58b964ec3843"),
+            ("hmac-sha2-512",
+             b"164b7a7bfcf819e2e395fbe73b56e0a3"
+             b"87bd64222e831fd610270cd7ea250554"
+             b"9758bf75c05a994a6d034f65f8f0e6fd"
+             b"caeab1a34d4a6b4b636e070a38bce737"),
+            ]
+        (seqid,) = struct.unpack('>L', data[:4])
+        for name, mac in vectors:
+            for macName in [name, name + "-etm@openssh.com"]:
+                outMAC = transport.SSHCiphers('none', 'none', macName, 'none')
+                outMAC.outMAC = outMAC._getMAC(macName, key)
+                self.assertEqual(
+                    mac, outMAC.makeMAC(seqid, data[4:]).encode("hex"))
+
+
+    def test_encryptThenMAC(self):
+        """
+        L{SSHCiphers} records which of its MACs are encrypt-then-MAC
+        algorithms, and how long their integrity keys must be.
+        """
+        ciphers = transport.SSHCiphers(
+            'none', 'none', 'hmac-sha2-256-etm@openssh.com', 'hmac-sha1')
+        self.assertTrue(ciphers.outETM)
+        self.assertFalse(ciphers.inETM)
+        self.assertEqual(ciphers.integrityKeySize(), 32)
+        ciphers = transport.SSHCiphers(
+            'none', 'none', 'none', 'hmac-sha2-512-etm@openssh.com')
+        self.assertFalse(ciphers.outETM)
+        self.assertTrue(ciphers.inETM)
+        self.assertEqual(ciphers.integrityKeySize(), 64)
+
+
+    def test_authenticatedEncryption(self):
+        """
+        L{SSHCiphers} records which of its ciphers are authenticated
+        encryption ciphers, and uses no MAC alongside them, whatever MAC was
+        negotiated.
+        """
+        ciphers = transport.SSHCiphers(
+            'aes128-gcm@openssh.com', 'aes128-ctr', 'hmac-sha1', None)
+        self.assertTrue(ciphers.outAEAD)
+        self.assertFalse(ciphers.inAEAD)
+        self.assertEqual(ciphers.outMACType, 'none')
+        self.assertEqual(ciphers.inMACType, None)
+        ciphers = transport.SSHCiphers(
+            'aes128-ctr', 'chacha20-poly1305@openssh.com', 'hmac-sha1', None)
+        self.assertFalse(ciphers.outAEAD)
+        self.assertTrue(ciphers.inAEAD)
+        self.assertEqual(ciphers.outMACType, 'hmac-sha1')
+        self.assertEqual(ciphers.inMACType, 'none')
+
+
+    def test_authenticatedEncryptionAdvertised(self):
+        """
+        The authenticated encryption ciphers are supported, and preferred,
+        if and only if the C{cryptography} package is available.
+        """
+        supported = transport.SSHTransportBase.supportedCiphers
+        if transport.default_backend is None:
+            for cipName in transport.SSHCiphers.aeadCiphers:
+                self.assertNotIn(cipName, supported)
+                self.assertNotIn(cipName, transport.SSHCiphers.cipherMap)
+        else:
+            self.assertEqual(
+                set(supported[:2]), transport.SSHCiphers.aeadCiphers)
+
+
+    def test_sealAndOpen(self):
+        """
+        A packet sealed by an authenticated encryption cipher is encrypted,
+        and is authenticated and decrypted by the same cipher with the same
+        keys and sequence number.  If it has been tampered with, C{open}
+        returns C{None}.
+        """
+        iv = '\x01' * 40
+        key = '\x02' * 64
+        packet = '\x00\x00\x00\x0c\x08ABC' + '\x99' * 8
+        for cipName in transport.SSHCiphers.aeadCiphers:
+            encCipher = transport.SSHCiphers(cipName, 'none', 'none', 'none')
+            decCipher = transport.SSHCiphers('none', cipName, 'none', 'none')
+            self.assertEqual(encCipher.encryptionKeySize(),
+                             encCipher.cipherMap[cipName][1])
+            encCipher.setKeys(iv, key, '', '', '', '')
+            decCipher.setKeys('', '', iv, key, '', '')
+            self.assertEqual(decCipher.verifyDigestSize, 16)
+            for seqid in range(3):
+                sealed = encCipher.seal(seqid, packet)
+                self.assertEqual(len(sealed), len(packet) + 16)
+                self.assertNotIn('ABC', sealed)
+                self.assertEqual(
+                    decCipher.openLength(seqid, sealed[:4]), packet[:4])
+                self.assertEqual(
+                    decCipher.open(seqid, sealed[:-16], sealed[-16:]),
+                    packet[4:])
+            sealed = encCipher.seal(3, packet)
+            tampered = sealed[:5] + chr(ord(sealed[5]) ^ 1) + sealed[6:-16]
+            self.assertIdentical(
+                decCipher.open(3, tampered, sealed[-16:]), None)
+
+    if dependencySkip is None and transport.default_backend is None:
+        test_sealAndOpen.skip = "cryptography is not installed"
+
+
+
 class CounterTestCase(unittest.TestCase):
     """
     Tests for the _Counter helper class.
@@ -2068,7 +2443,8 @@ class TransportLoopbackTestCase(unittest.TestCase):
             else:
                 self.assertTrue(server.isEncrypted(), name)
                 self.assertTrue(client.isEncrypted(), name)
-            if server.supportedMACs[0] == 'none':
+            if (server.supportedMACs[0] == 'none' and
+                    not server.currentEncryptions.outAEAD):
                 self.assertFalse(server.isVerified(), name)
                 self.assertFalse(client.isVerified(), name)
             else:
@@ -2,7 +2,8 @@
 # See LICENSE for details.
 
 from twisted.cred import portal
-from twisted.python import components, log
+from twisted.python import components, log, threadpool
+from twisted.internet import defer, threads
 from twisted.internet.error import ProcessExitedAlready
 from zope import interface
 from ssh import session, forwarding, filetransfer
@@ -378,27 +379,39 @@ class SFTPServerForUnixConchUser:
     def extendedRequest(self, extName, extData):
         raise NotImplementedError
 
+def _openFlags(flags):
+    """
+    Translate SFTP open flags into the flags for C{os.open}.
+
+    @param flags: a bitmask of the C{FXF_*} constants.
+    @type flags: C{int}
+
+    @rtype: C{int}
+    """
+    openFlags = 0
+    if flags & FXF_READ == FXF_READ and flags & FXF_WRITE == 0:
+        openFlags = os.O_RDONLY
+    if flags & FXF_WRITE == FXF_WRITE and flags & FXF_READ == 0:
+        openFlags = os.O_WRONLY
+    if flags & FXF_WRITE == FXF_WRITE and flags & FXF_READ == FXF_READ:
+        openFlags = os.O_RDWR
+    if flags & FXF_APPEND == FXF_APPEND:
+        openFlags |= os.O_APPEND
+    if flags & FXF_CREAT == FXF_CREAT:
+        openFlags |= os.O_CREAT
+    if flags & FXF_TRUNC == FXF_TRUNC:
+        openFlags |= os.O_TRUNC
+    if flags & FXF_EXCL == FXF_EXCL:
+        openFlags |= os.O_EXCL
+    return openFlags
+
 class UnixSFTPFile:
 
     interface.implements(ISFTPFile)
 
     def __init__(self, server, filename, flags, attrs):
         self.server = server
-        openFlags = 0
-        if flags & FXF_READ == FXF_READ and flags & FXF_WRITE == 0:
-            openFlags = os.O_RDONLY
-        if flags & FXF_WRITE == FXF_WRITE and flags & FXF_READ == 0:
-            openFlags = os.O_WRONLY
-        if flags & FXF_WRITE == FXF_WRITE and flags & FXF_READ == FXF_READ:
-            openFlags = os.O_RDWR
-        if flags & FXF_APPEND == FXF_APPEND:
-            openFlags |= os.O_APPEND
-        if flags & FXF_CREAT == FXF_CREAT:
-            openFlags |= os.O_CREAT
-        if flags & FXF_TRUNC == FXF_TRUNC:
-            openFlags |= os.O_TRUNC
-        if flags & FXF_EXCL == FXF_EXCL:
-            openFlags |= os.O_EXCL
+        openFlags = _openFlags(flags)
         if "permissions" in attrs:
             mode = attrs["permissions"]
             del attrs["permissions"]
@@ -453,5 +466,397 @@ class UnixSFTPDirectory:
         self.files = []
 
 
+_sftpThreadPool = None
+
+def _getSFTPThreadPool(reactor, maxThreads):
+    """
+    Return the thread pool shared by L{ThreadedSFTPServerForUnixConchUser}
+    instances, creating it the first time and arranging for it to be stopped
+    when C{reactor} shuts down.
+
+    @param maxThreads: the size of the pool, if it has to be created.
+    @type maxThreads: C{int}
+
+    @rtype: L{twisted.python.threadpool.ThreadPool}
+    """
+    global _sftpThreadPool
+    if _sftpThreadPool is None:
+        _sftpThreadPool = threadpool.ThreadPool(
+            0, maxThreads, 'twisted.conch.unix.sftp')
+        reactor.callWhenRunning(_sftpThreadPool.start)
+        reactor.addSystemEventTrigger('during', 'shutdown',
+                                      _sftpThreadPool.stop)
+    return _sftpThreadPool
+
+
+def _readAt(fd, offset, length):
+    """
+    Read up to C{length} bytes at C{offset} from the file descriptor C{fd}.
+    """
+    os.lseek(fd, offset, 0)
+    return os.read(fd, length)
+
+
+def _writeAt(fd, offset, data):
+    """
+    Write all of C{data} at C{offset} to the file descriptor C{fd}.
+    """
+    os.lseek(fd, offset, 0)
+    while data:
+        data = data[os.write(fd, data):]
+
+
+class ThreadedSFTPServerForUnixConchUser(SFTPServerForUnixConchUser):
+    """
+    An SFTP server for a L{UnixConchUser} which does its filesystem work in a
+    bounded thread pool, so that a slow disk or a large directory doesn't
+    stall every other connection served by the reactor.
+
+    The effective uid is process-wide, so the thread pool cannot switch to
+    the user the way L{UnixConchUser._runAsUser} does.  Operations which
+    depend on the user's credentials are therefore only moved into the pool
+    when the process already runs as that user and has no other groups.
+    Reading and writing open files doesn't depend on the credentials, so it
+    always happens in the pool.
+
+    This limits how this class should be deployed.  In a server running as
+    root for many users, as sshd does, everything which takes a path runs
+    in the reactor thread under C{_runAsUser}, just as
+    L{SFTPServerForUnixConchUser} runs it.  That covers opening files,
+    C{stat}, listing directories and C{lstat}ing their entries.  A slow
+    disk or a large directory then still stalls the reactor.  To move that
+    work off the reactor thread too, run the server as the user it serves,
+    for example one unprivileged process per user.
+
+    This is not the default adapter for L{UnixConchUser}; register it with
+    L{components.registerAdapter} (or create it from a custom avatar's
+    subsystem) to use it.
+
+    @ivar threadPool: the L{twisted.python.threadpool.ThreadPool} used.  By
+        default this is a pool of C{maxThreads} threads shared by all
+        servers.
+    @ivar reactor: the reactor used to deliver results from the pool.
+    @ivar maxThreads: the size of the shared pool.
+    """
+
+    threadPool = None
+    reactor = None
+    maxThreads = 8
+
+    def __init__(self, avatar):
+        SFTPServerForUnixConchUser.__init__(self, avatar)
+        if self.reactor is None:
+            from twisted.internet import reactor
+            self.reactor = reactor
+        if self.threadPool is None:
+            self.threadPool = _getSFTPThreadPool(self.reactor, self.maxThreads)
+        self._inPoolAsUser = self._isRunningAsUser()
+
+
+    def _isRunningAsUser(self):
+        """
+        Return C{True} if the process already has the credentials
+        C{_runAsUser} would give it, and no others.
+        """
+        uid, gid = self.avatar.getUserGroupId()
+        if (os.geteuid(), os.getegid()) != (uid, gid):
+            return False
+        groups = set(self.avatar.getOtherGroups())
+        groups.add(gid)
+        return set(os.getgroups()) <= groups
+
+
+    def _inPool(self, f, *args):
+        """
+        Call C{f} in the thread pool.
+
+        @return: a L{defer.Deferred} which fires with the result of C{f}.
+        """
+        return threads.deferToThreadPool(self.reactor, self.threadPool,
+                                         f, *args)
+
+
+    def _runAsUser(self, f, *args):
+        """
+        Call C{f} as the logged-in user: in the thread pool if the process
+        is already running as that user, in the reactor thread otherwise.
+
+        @return: a L{defer.Deferred} which fires with the result of C{f}.
+        """
+        if self._inPoolAsUser:
+            return self._inPool(f, *args)
+        return defer.maybeDeferred(self.avatar._runAsUser, f, *args)
+
+
+    def _open(self, filename, flags, mode, attrs):
+        fd = os.open(filename, flags, mode)
+        if attrs:
+            self._setAttrs(filename, attrs)
+        return fd
+
+
+    def openFile(self, filename, flags, attrs):
+        filename = self._absPath(filename)
+        attrs = attrs.copy()
+        mode = attrs.pop("permissions", 0777)
+        d = self._runAsUser(self._open, filename, _openFlags(flags), mode,
+                            attrs)
+        d.addCallback(lambda fd: ThreadedUnixSFTPFile(self, fd))
+        return d
+
+
+    def removeFile(self, filename):
+        return self._runAsUser(os.remove, self._absPath(filename))
+
+
+    def renameFile(self, oldpath, newpath):
+        return self._runAsUser(os.rename, self._absPath(oldpath),
+                               self._absPath(newpath))
+
+
+    def _makeDirectory(self, path, attrs):
+        os.mkdir(path)
+        self._setAttrs(path, attrs)
+
+
+    def makeDirectory(self, path, attrs):
+        return self._runAsUser(self._makeDirectory, self._absPath(path), attrs)
+
+
+    def removeDirectory(self, path):
+        return self._runAsUser(os.rmdir, self._absPath(path))
+
+
+    def openDirectory(self, path):
+        path = self._absPath(path)
+        d = self._runAsUser(os.listdir, path)
+        d.addCallback(lambda files: ThreadedUnixSFTPDirectory(self, path,
+                                                              files))
+        return d
+
+
+    def getAttrs(self, path, followLinks):
+        if followLinks:
+            stat = os.stat
+        else:
+            stat = os.lstat
+        d = self._runAsUser(stat, self._absPath(path))
+        d.addCallback(self._getAttrs)
+        return d
+
+
+    def setAttrs(self, path, attrs):
+        return self._runAsUser(self._setAttrs, self._absPath(path), attrs)
+
+
+    def readLink(self, path):
+        return self._runAsUser(os.readlink, self._absPath(path))
+
+
+    def makeLink(self, linkPath, targetPath):
+        return self._runAsUser(os.symlink, self._absPath(targetPath),
+                               self._absPath(linkPath))
+
+
+    def realPath(self, path):
+        return self._runAsUser(os.path.realpath, self._absPath(path))
+
+
+
+class ThreadedUnixSFTPFile:
+    """
+    An open file of a L{ThreadedSFTPServerForUnixConchUser}.
+
+    The file descriptor's offset is shared by every operation on it, so the
+    operations on one file are run in the pool one at a time, in the order
+    they were requested; different files proceed in parallel.
+
+    Sequential reads start reading the following C{readAheadChunks} chunks
+    in the background, so they are ready by the time the client asks for
+    them.  Contiguous writes are acknowledged at once and coalesced into a
+    single write of up to C{writeBehindSize} bytes; the write which fills
+    the buffer is not acknowledged until the buffer is on disk, which keeps
+    a fast client from queueing unbounded amounts of data.  An error while
+    writing buffered data is reported by the next write or by L{close}.
+
+    @ivar server: the L{ThreadedSFTPServerForUnixConchUser} which opened the
+        file.
+    @ivar fd: the file descriptor.
+    @ivar readAheadChunks: how many chunks to read ahead of a sequential
+        reader.
+    @ivar writeBehindSize: how many bytes of contiguous writes to buffer.
+    """
+
+    interface.implements(ISFTPFile)
+
+    readAheadChunks = 4
+    writeBehindSize = 256 * 1024
+
+    def __init__(self, server, fd):
+        self.server = server
+        self.fd = fd
+        self._lock = defer.DeferredLock()
+        self._readAhead = {}
+        self._nextReadOffset = 0
+        self._pending = []
+        self._pendingOffset = 0
+        self._pendingLength = 0
+        self._writeError = None
+
+
+    def _run(self, f, *args):
+        """
+        Call C{f} in the thread pool once this file's earlier operations are
+        done.
+        """
+        return self._lock.run(self.server._inPool, f, *args)
+
+
+    def _read(self, offset, length):
+        self._flushBehind()
+        return self._run(_readAt, self.fd, offset, length)
+
+
+    def _discardReadAhead(self):
+        for d in self._readAhead.itervalues():
+            d.addErrback(lambda ignored: None)
+        self._readAhead.clear()
+
+
+    def _flush(self):
+        """
+        Write out the buffered data.
+
+        @return: a L{defer.Deferred} which fires when it has been written.
+        """
+        if not self._pending:
+            return defer.succeed(None)
+        data = ''.join(self._pending)
+        offset = self._pendingOffset
+        self._pending = []
+        self._pendingLength = 0
+        return self._run(_writeAt, self.fd, offset, data)
+
+
+    def _flushBehind(self):
+        """
+        Write out the buffered data, keeping any error for the next write or
+        L{close} to report.
+        """
+        def ebWrite(reason):
+            if self._writeError is None:
+                self._writeError = reason
+        self._flush().addErrback(ebWrite)
+
+
+    def readChunk(self, offset, length):
+        d = self._readAhead.pop((offset, length), None)
+        if offset != self._nextReadOffset:
+            self._discardReadAhead()
+        if d is None:
+            d = self._read(offset, length)
+        if offset == self._nextReadOffset:
+            for i in range(1, self.readAheadChunks + 1):
+                key = (offset + i * length, length)
+                if key not in self._readAhead:
+                    self._readAhead[key] = self._read(*key)
+        self._nextReadOffset = offset + length
+        return d
+
+
+    def writeChunk(self, offset, data):
+        self._discardReadAhead()
+        if self._writeError is not None:
+            reason, self._writeError = self._writeError, None
+            return defer.fail(reason)
+        if self._pending and (
+            offset != self._pendingOffset + self._pendingLength):
+            self._flushBehind()
+        if not self._pending:
+            self._pendingOffset = offset
+        self._pending.append(data)
+        self._pendingLength += len(data)
+        if self._pendingLength >= self.writeBehindSize:
+            return self._flush()
+        return defer.succeed(None)
+
+
+    def close(self):
+        self._discardReadAhead()
+        self._flushBehind()
+        def cbClosed(ignored):
+            if self._writeError is not None:
+                reason, self._writeError = self._writeError, None
+                return reason
+        return self._run(os.close, self.fd).addCallback(cbClosed)
+
+
+    def getAttrs(self):
+        self._flushBehind()
+        return self._run(os.fstat, self.fd).addCallback(
+            self.server._getAttrs)
+
+
+    def setAttrs(self, attrs):
+        raise NotImplementedError
+
+
+
+class ThreadedUnixSFTPDirectory:
+    """
+    An open directory of a L{ThreadedSFTPServerForUnixConchUser}.
+
+    The entries are described (C{lstat}ed) in the thread pool in batches of
+    C{batchSize}, the number of entries the server puts in a single reply,
+    so each C{READDIR} request costs one trip to the pool.
+
+    @ivar batchSize: how many entries to describe at a time.
+    """
+
+    batchSize = 250
+
+    def __init__(self, server, directory, files):
+        self.server = server
+        self.dir = directory
+        self.files = files
+        self._batch = []
+
+
+    def __iter__(self):
+        return self
+
+
+    def _describe(self, names):
+        entries = []
+        for f in names:
+            s = os.lstat(os.path.join(self.dir, f))
+            entries.append((f, lsLine(f, s), self.server._getAttrs(s)))
+        return entries
+
+
+    def _cbDescribed(self, entries):
+        entries.reverse()
+        self._batch = entries
+        return self._batch.pop()
+
+
+    def next(self):
+        if self._batch:
+            return self._batch.pop()
+        if not self.files:
+            raise StopIteration
+        names = self.files[:self.batchSize]
+        del self.files[:self.batchSize]
+        d = self.server._runAsUser(self._describe, names)
+        d.addCallback(self._cbDescribed)
+        return d
+
+
+    def close(self):
+        self.files = []
+        self._batch = []
+
+
+
 components.registerAdapter(SFTPServerForUnixConchUser, UnixConchUser, filetransfer.ISFTPServer)
 components.registerAdapter(SSHSessionForUnixConchUser, UnixConchUser, session.ISession)
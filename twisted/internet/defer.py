@@ -74,7 +74,13 @@ def succeed(result):
     @rtype: L{Deferred}
     """
     d = Deferred()
-    d.callback(result)
+    if d.debug:
+        d.callback(result)
+    else:
+        # Nothing can have been added to the callback chain yet, so there is
+        # nothing to run.
+        d.called = True
+        d.result = result
     return d
 
 
@@ -181,9 +187,13 @@ def getDebugging():
 _NO_RESULT = object()
 _CONTINUE = object()
 
+# The other half of an entry in Deferred.callbacks for a callback which was
+# added without an errback, or vice versa.
+_PASSTHRU = (passthru, None, None)
+
 
 
-class Deferred:
+class Deferred(object):
     """
     This is a callback which will be put off until later.
 
@@ -227,22 +237,29 @@ class Deferred:
         Deferred, this is a reference to the other Deferred.  Otherwise, C{None}.
     """
 
-    called = False
-    paused = 0
-    _debugInfo = None
-    _suppressAlreadyCalled = False
-
-    # Are we currently running a user-installed callback?  Meant to prevent
-    # recursive running of callbacks when a reentrant call to add a callback is
-    # used.
-    _runningCallbacks = False
+    # Every attribute a Deferred uses gets a slot, so creating one does not
+    # need to allocate an instance dictionary.  __dict__ remains available for
+    # subclasses and for code which attaches its own attributes.
+    __slots__ = ('callbacks', 'result', 'called', 'paused', '_canceller',
+                 '_debugInfo', '_suppressAlreadyCalled', '_runningCallbacks',
+                 '_chainedTo', '__dict__', '__weakref__')
+
+    # These used to be class attributes, which a slot cannot also be.  They
+    # are looked up here if a subclass which does not call Deferred.__init__
+    # has not set them.
+    _slotDefaults = {
+        'called': False,
+        'paused': 0,
+        '_debugInfo': None,
+        '_suppressAlreadyCalled': False,
+        '_runningCallbacks': False,
+        '_chainedTo': None,
+        }
 
     # Keep this class attribute for now, for compatibility with code that
     # sets it directly.
     debug = False
 
-    _chainedTo = None
-
     def __init__(self, canceller=None):
         """
         Initialize a L{Deferred}.
@@ -268,10 +285,33 @@ class Deferred:
             return result is ignored.
         """
         self.callbacks = []
+        self.called = False
+        self.paused = 0
         self._canceller = canceller
+        self._suppressAlreadyCalled = False
+        # Are we currently running a user-installed callback?  Meant to
+        # prevent recursive running of callbacks when a reentrant call to add a
+        # callback is used.
+        self._runningCallbacks = False
+        self._chainedTo = None
         if self.debug:
             self._debugInfo = DebugInfo()
             self._debugInfo.creator = traceback.format_stack()[:-1]
+        else:
+            self._debugInfo = None
+
+
+    def __getattr__(self, name):
+        """
+        Get the default value of an attribute which was a class attribute
+        before it was given a slot, if it has not been set.
+        """
+        try:
+            return self._slotDefaults[name]
+        except KeyError:
+            raise AttributeError(
+                "%r object has no attribute %r" % (
+                    self.__class__.__name__, name))
 
 
     def addCallbacks(self, callback, errback=None,
@@ -287,9 +327,11 @@ class Deferred:
         """
         assert callable(callback)
         assert errback == None or callable(errback)
-        cbs = ((callback, callbackArgs, callbackKeywords),
-               (errback or (passthru), errbackArgs, errbackKeywords))
-        self.callbacks.append(cbs)
+        if errback is None and errbackArgs is None and errbackKeywords is None:
+            eb = _PASSTHRU
+        else:
+            eb = (errback or passthru, errbackArgs, errbackKeywords)
+        self.callbacks.append(((callback, callbackArgs, callbackKeywords), eb))
 
         if self.called:
             self._runCallbacks()
@@ -302,8 +344,11 @@ class Deferred:
 
         See L{addCallbacks}.
         """
-        return self.addCallbacks(callback, callbackArgs=args,
-                                 callbackKeywords=kw)
+        assert callable(callback)
+        self.callbacks.append(((callback, args, kw), _PASSTHRU))
+        if self.called:
+            self._runCallbacks()
+        return self
 
 
     def addErrback(self, errback, *args, **kw):
@@ -312,9 +357,11 @@ class Deferred:
 
         See L{addCallbacks}.
         """
-        return self.addCallbacks(passthru, errback,
-                                 errbackArgs=args,
-                                 errbackKeywords=kw)
+        assert callable(errback)
+        self.callbacks.append((_PASSTHRU, (errback, args, kw)))
+        if self.called:
+            self._runCallbacks()
+        return self
 
 
     def addBoth(self, callback, *args, **kw):
@@ -324,9 +371,12 @@ class Deferred:
 
         See L{addCallbacks}.
         """
-        return self.addCallbacks(callback, callback,
-                                 callbackArgs=args, errbackArgs=args,
-                                 callbackKeywords=kw, errbackKeywords=kw)
+        assert callable(callback)
+        both = (callback, args, kw)
+        self.callbacks.append((both, both))
+        if self.called:
+            self._runCallbacks()
+        return self
 
 
     def chainDeferred(self, d):
@@ -487,7 +537,12 @@ class Deferred:
             self._debugInfo.invoker = traceback.format_stack()[:-2]
         self.called = True
         self.result = result
-        self._runCallbacks()
+        if (self.callbacks or self.paused or self._debugInfo is not None or
+            isinstance(result, failure.Failure)):
+            self._runCallbacks()
+        else:
+            # There is nothing to run, and no failure to keep track of.
+            self._chainedTo = None
 
 
     def _continuation(self):
@@ -495,8 +550,8 @@ class Deferred:
         Build a tuple of callback and errback with L{_continue} to be used by
         L{_addContinue} and L{_removeContinue} on another Deferred.
         """
-        return ((_CONTINUE, (self,), None),
-                (_CONTINUE, (self,), None))
+        continuation = (_CONTINUE, (self,), None)
+        return (continuation, continuation)
 
 
     def _runCallbacks(self):
@@ -535,6 +590,7 @@ class Deferred:
         # and then that second Deferred being fired.  ie, if ever had _chainedTo
         # set to something other than None, you might end up on this stack.
         chain = [self]
+        Failure = failure.Failure
 
         while chain:
             current = chain[-1]
@@ -547,76 +603,94 @@ class Deferred:
 
             finished = True
             current._chainedTo = None
-            while current.callbacks:
-                item = current.callbacks.pop(0)
-                callback, args, kw = item[
-                    isinstance(current.result, failure.Failure)]
-                args = args or ()
-                kw = kw or {}
-
-                # Avoid recursion if we can.
-                if callback is _CONTINUE:
-                    # Give the waiting Deferred our current result and then
-                    # forget about that result ourselves.
-                    chainee = args[0]
-                    chainee.result = current.result
-                    current.result = None
-                    # Making sure to update _debugInfo
-                    if current._debugInfo is not None:
-                        current._debugInfo.failResult = None
-                    chainee.paused -= 1
-                    chain.append(chainee)
-                    # Delay cleaning this Deferred and popping it from the chain
-                    # until after we've dealt with chainee.
-                    finished = False
-                    break
+            # Walk the callbacks by index and discard the ones which have run
+            # all at once afterwards, rather than popping each from the front
+            # of the list.  Callbacks added while this loop runs are appended
+            # to the same list, so they are picked up too.
+            callbacks = current.callbacks
+            index = 0
+            try:
+                while index < len(callbacks):
+                    callback, args, kw = callbacks[index][
+                        isinstance(current.result, Failure)]
+                    index += 1
+
+                    # Avoid recursion if we can.
+                    if callback is _CONTINUE:
+                        # Give the waiting Deferred our current result and then
+                        # forget about that result ourselves.
+                        chainee = args[0]
+                        chainee.result = current.result
+                        current.result = None
+                        # Making sure to update _debugInfo
+                        if current._debugInfo is not None:
+                            current._debugInfo.failResult = None
+                        chainee.paused -= 1
+                        chain.append(chainee)
+                        # Delay cleaning this Deferred and popping it from the
+                        # chain until after we've dealt with chainee.
+                        finished = False
+                        break
 
-                try:
-                    current._runningCallbacks = True
                     try:
-                        current.result = callback(current.result, *args, **kw)
-                        if current.result is current:
-                            warnAboutFunction(
-                                callback,
-                                "Callback returned the Deferred "
-                                "it was attached to; this breaks the "
-                                "callback chain and will raise an "
-                                "exception in the future.")
-                    finally:
-                        current._runningCallbacks = False
-                except:
-                    # Including full frame information in the Failure is quite
-                    # expensive, so we avoid it unless self.debug is set.
-                    current.result = failure.Failure(captureVars=self.debug)
-                else:
-                    if isinstance(current.result, Deferred):
-                        # The result is another Deferred.  If it has a result,
-                        # we can take it and keep going.
-                        resultResult = getattr(current.result, 'result', _NO_RESULT)
-                        if resultResult is _NO_RESULT or isinstance(resultResult, Deferred) or current.result.paused:
-                            # Nope, it didn't.  Pause and chain.
-                            current.pause()
-                            current._chainedTo = current.result
-                            # Note: current.result has no result, so it's not
-                            # running its callbacks right now.  Therefore we can
-                            # append to the callbacks list directly instead of
-                            # using addCallbacks.
-                            current.result.callbacks.append(current._continuation())
-                            break
-                        else:
-                            # Yep, it did.  Steal it.
-                            current.result.result = None
-                            # Make sure _debugInfo's failure state is updated.
-                            if current.result._debugInfo is not None:
-                                current.result._debugInfo.failResult = None
-                            current.result = resultResult
+                        current._runningCallbacks = True
+                        try:
+                            if args or kw:
+                                current.result = callback(
+                                    current.result, *(args or ()),
+                                    **(kw or {}))
+                            else:
+                                current.result = callback(current.result)
+                            if current.result is current:
+                                warnAboutFunction(
+                                    callback,
+                                    "Callback returned the Deferred "
+                                    "it was attached to; this breaks the "
+                                    "callback chain and will raise an "
+                                    "exception in the future.")
+                        finally:
+                            current._runningCallbacks = False
+                    except:
+                        # Including full frame information in the Failure is
+                        # quite expensive, so we avoid it unless self.debug is
+                        # set.
+                        current.result = Failure(captureVars=self.debug)
+                    else:
+                        if isinstance(current.result, Deferred):
+                            # The result is another Deferred.  If it has a
+                            # result, we can take it and keep going.
+                            resultResult = getattr(
+                                current.result, 'result', _NO_RESULT)
+                            if (resultResult is _NO_RESULT or
+                                isinstance(resultResult, Deferred) or
+                                current.result.paused):
+                                # Nope, it didn't.  Pause and chain.
+                                current.pause()
+                                current._chainedTo = current.result
+                                # Note: current.result has no result, so it's
+                                # not running its callbacks right now.
+                                # Therefore we can append to the callbacks list
+                                # directly instead of using addCallbacks.
+                                current.result.callbacks.append(
+                                    current._continuation())
+                                break
+                            else:
+                                # Yep, it did.  Steal it.
+                                current.result.result = None
+                                # Make sure _debugInfo's failure state is
+                                # updated.
+                                if current.result._debugInfo is not None:
+                                    current.result._debugInfo.failResult = None
+                                current.result = resultResult
+            finally:
+                del callbacks[:index]
 
             if finished:
                 # As much of the callback chain - perhaps all of it - as can be
                 # processed right now has been.  The current Deferred is waiting on
                 # another Deferred or for more callbacks.  Before finishing with it,
                 # make sure its _debugInfo is in the proper state.
-                if isinstance(current.result, failure.Failure):
+                if isinstance(current.result, Failure):
                     # Stash the Failure in the _debugInfo for unhandled error
                     # reporting.
                     current.result.cleanFailure()
@@ -1089,10 +1163,22 @@ def _inlineCallbacks(result, g, deferred):
     waiting = [True, # waiting for result?
                None] # result
 
+    # A single callback serves every Deferred yielded during this run of the
+    # loop.  Once the loop has returned, a Deferred firing later starts a new
+    # run, with its own waiting list.
+    def gotResult(r):
+        if waiting[0]:
+            waiting[0] = False
+            waiting[1] = r
+        else:
+            _inlineCallbacks(r, g, deferred)
+
+    Failure = failure.Failure
+
     while 1:
         try:
             # Send the last result back as the result of the yield expression.
-            isFailure = isinstance(result, failure.Failure)
+            isFailure = isinstance(result, Failure)
             if isFailure:
                 result = result.throwExceptionIntoGenerator(g)
             else:
@@ -1147,12 +1233,18 @@ def _inlineCallbacks(result, g, deferred):
 
         if isinstance(result, Deferred):
             # a deferred was yielded, get the result.
-            def gotResult(r):
-                if waiting[0]:
-                    waiting[0] = False
-                    waiting[1] = r
-                else:
-                    _inlineCallbacks(r, g, deferred)
+            if (result.called and not result.paused and
+                not result.callbacks and not result._runningCallbacks):
+                # It already has its final result, so take that directly
+                # instead of adding a callback to collect it.  This leaves the
+                # Deferred as it would be after that callback had run: with a
+                # result of None, and no unhandled failure to report.
+                fired = result
+                result = fired.result
+                fired.result = None
+                if fired._debugInfo is not None:
+                    fired._debugInfo.failResult = None
+                continue
 
             result.addBoth(gotResult)
             if waiting[0]:
@@ -222,14 +222,16 @@ class _SIGCHLDWaker(_FDWaker):
     def doRead(self):
         """
         Having woken up the reactor in response to receipt of
-        C{SIGCHLD}, reap the process which exited.
+        C{SIGCHLD}, reap the process which exited.  Processes watched with a
+        pidfd are reaped when it becomes readable instead, so only the others
+        need checking.
 
         This is called whenever the reactor notices the waker pipe is
         writeable, which happens soon after any call to the C{wakeUp}
         method.
         """
         _FDWaker.doRead(self)
-        process.reapAllProcesses()
+        process._reapPolledProcesses()
 
 
 
@@ -547,6 +549,18 @@ class PosixReactorBase(_SignalReactorMixin, _DisconnectSelectableMixin,
         for reader in removedReaders:
             self.removeReader(reader)
 
+        if platformType == 'posix' and processEnabled:
+            # The pidfds which processes are watched with belong to the
+            # reactor's process support rather than to any connection.  Close
+            # them and go back to polling their processes, which are still
+            # reaped when SIGCHLD is received.
+            reapers = set([
+                    reader for reader in removedReaders
+                    if isinstance(reader, process._PidfdReaper)])
+            for reaper in reapers:
+                reaper.connectionLost(failure.Failure(CONNECTION_DONE))
+            removedReaders -= reapers
+
         removedWriters = set(writers)
         for writer in removedWriters:
             self.removeWriter(writer)
@@ -11,7 +11,7 @@ Maintainer: Itamar Shtull-Trauring
 """
 
 # System Imports
-import gc, os, sys, stat, traceback, select, signal, errno
+import gc, os, sys, stat, traceback, select, signal, errno, platform
 
 try:
     import pty
@@ -30,7 +30,8 @@ from twisted.python.util import switchUID
 from twisted.internet import fdesc, abstract, error
 from twisted.internet.main import CONNECTION_LOST, CONNECTION_DONE
 from twisted.internet._baseprocess import BaseProcess
-from twisted.internet.interfaces import IProcessTransport
+from twisted.internet.interfaces import (
+    IProcessTransport, IReactorFDSet, IReadDescriptor)
 
 # Some people were importing this, which is incorrect, just keeping it
 # here for backwards compatibility:
@@ -38,6 +39,13 @@ ProcessExitedAlready = error.ProcessExitedAlready
 
 reapProcessHandlers = {}
 
+# The registered processes which are not watched with a pidfd, and so must be
+# polled whenever any child exits.
+_polledProcesses = {}
+
+# The _PidfdReapers of the registered processes which are watched with one.
+_pidfdReapers = {}
+
 def reapAllProcesses():
     """
     Reap all registered processes.
@@ -46,13 +54,27 @@ def reapAllProcesses():
         process.reapProcess()
 
 
-def registerReapProcessHandler(pid, process):
+def _reapPolledProcesses():
+    """
+    Reap the registered processes which are not watched with a pidfd.  This is
+    what needs doing when C{SIGCHLD} is received: the others are reaped as
+    soon as their own pidfd reports that they exited.
+    """
+    for process in _polledProcesses.values():
+        process.reapProcess()
+
+
+def registerReapProcessHandler(pid, process, reactor=None):
     """
     Register a process handler for the given pid, in case L{reapAllProcesses}
     is called.
 
     @param pid: the pid of the process.
     @param process: a process handler.
+    @param reactor: If given, a reactor providing L{IReactorFDSet} which will
+        watch a pidfd for the process (where the platform supports them), so
+        that it is reaped as soon as it exits without polling every other
+        process.
     """
     if pid in reapProcessHandlers:
         raise RuntimeError("Try to register an already registered process.")
@@ -67,6 +89,13 @@ def registerReapProcessHandler(pid, process):
     else:
         # if auxPID is 0, there are children but none have exited
         reapProcessHandlers[pid] = process
+        fd = None
+        if IReactorFDSet.providedBy(reactor):
+            fd = _openPidfd(pid)
+        if fd is None:
+            _polledProcesses[pid] = process
+        else:
+            _pidfdReapers[pid] = _PidfdReaper(reactor, process, fd)
 
 
 def unregisterReapProcessHandler(pid, process):
@@ -78,6 +107,134 @@ def unregisterReapProcessHandler(pid, process):
             and reapProcessHandlers[pid] == process):
         raise RuntimeError("Try to unregister a process not registered.")
     del reapProcessHandlers[pid]
+    _polledProcesses.pop(pid, None)
+    reaper = _pidfdReapers.pop(pid, None)
+    if reaper is not None:
+        reaper.stopWatching()
+
+
+
+class _PidfdOpener(object):
+    """
+    Open pidfds with Linux's C{pidfd_open} system call (Linux 5.3 and later).
+
+    A pidfd refers to one process, unlike its process ID which may be reused,
+    and becomes readable when the process exits.
+
+    @ivar _syscall: The C library's C{syscall} function, or C{None} if pidfds
+        are not available.  Only valid once C{_loaded} is C{True}.
+    """
+
+    # pidfd_open's number in the system call table shared by most
+    # architectures.  Others, such as alpha, ia64 and MIPS, number it
+    # differently, so pidfds are only used on machines known to share it.
+    _SYS_pidfd_open = 434
+    _machines = frozenset([
+            'x86_64', 'amd64', 'i386', 'i486', 'i586', 'i686',
+            'aarch64', 'arm64', 'armv6l', 'armv7l', 'armv8l',
+            'ppc', 'ppc64', 'ppc64le', 's390x', 'riscv64'])
+
+    _loaded = False
+    _syscall = None
+
+    def __call__(self, pid):
+        """
+        Open a pidfd for a process.
+
+        @param pid: The process ID of a child process.
+
+        @return: The pidfd, which is close-on-exec, or C{None} if one could
+            not be opened.
+        """
+        if not self._loaded:
+            self._loaded = True
+            if (sys.platform.startswith('linux') and
+                platform.machine() in self._machines):
+                try:
+                    import ctypes
+                    self._syscall = ctypes.CDLL(None, use_errno=True).syscall
+                except (ImportError, OSError, AttributeError):
+                    pass
+        if self._syscall is None:
+            return None
+        fd = self._syscall(self._SYS_pidfd_open, pid, 0)
+        if fd < 0:
+            import ctypes
+            if ctypes.get_errno() in (errno.ENOSYS, errno.EPERM):
+                # The kernel is too old, or a seccomp filter forbids it.
+                self._syscall = None
+            return None
+        return fd
+
+
+
+_openPidfd = _PidfdOpener()
+
+
+
+class _PidfdReaper(object):
+    """
+    Watch a pidfd with the reactor and reap its process once it becomes
+    readable, which it does when the process exits.
+
+    @ivar _fd: The pidfd, or C{None} once it has been closed.
+    """
+    implements(IReadDescriptor)
+
+    def __init__(self, reactor, process, fd):
+        self._reactor = reactor
+        self._process = process
+        self._fd = fd
+        reactor.addReader(self)
+
+
+    def fileno(self):
+        return self._fd
+
+
+    def logPrefix(self):
+        return "pidfd"
+
+
+    def doRead(self):
+        """
+        The process exited: reap it.
+
+        If it could not be reaped, for example because something else already
+        waited for it, the pidfd would stay readable forever; stop watching it
+        and leave the process to be polled like those without a pidfd.
+        """
+        self._process.reapProcess()
+        pid = self._process.pid
+        if _pidfdReapers.get(pid) is self:
+            del _pidfdReapers[pid]
+            self.stopWatching()
+            _polledProcesses[pid] = self._process
+
+
+    def stopWatching(self):
+        """
+        Stop watching the pidfd and close it.
+        """
+        if self._fd is not None:
+            self._reactor.removeReader(self)
+            os.close(self._fd)
+            self._fd = None
+
+
+    def connectionLost(self, reason):
+        """
+        The reactor is shutting down, or had all of its readers removed, and
+        no longer watches the pidfd: close it and go back to polling the
+        process, so it still gets reaped.
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        pid = self._process.pid
+        if _pidfdReapers.get(pid) is self:
+            del _pidfdReapers[pid]
+            _polledProcesses[pid] = self._process
 
 
 def detectLinuxBrokenPipeBehavior():
@@ -583,6 +740,228 @@ def _listOpenFDs():
     return detector._listOpenFDs()
 
 
+
+def _findExecutable(executable, environment):
+    """
+    Find the file C{os.execvpe} would run for C{executable}.
+
+    @param executable: The name or path of the executable.
+    @type executable: C{str}
+
+    @param environment: The environment the executable will run in, whose
+        C{PATH} is searched.
+    @type environment: C{dict}
+
+    @return: The path to the executable, or C{None} if it cannot be found.
+    """
+    if os.path.dirname(executable):
+        return executable
+    for directory in environment.get('PATH', os.defpath).split(os.pathsep):
+        candidate = os.path.join(directory, executable)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+    return None
+
+
+
+def _spawnFileActions(fdmap, openFDs=None):
+    """
+    Work out how to give a child process started by C{posix_spawn} exactly
+    the file descriptors described by C{fdmap}, as L{Process._setupChild} does
+    for a forked child.
+
+    Each descriptor the child needs is first copied out of the way, above all
+    of the descriptors in C{fdmap}, so that moving them into place cannot
+    clobber one which is still needed.  The copies are then moved into place
+    (which also clears their close-on-exec flag), and everything else is
+    closed.
+
+    @param fdmap: A C{dict} mapping file descriptors in the child to file
+        descriptors in the parent.
+
+    @param openFDs: C{None} if everything above the child's descriptors can be
+        closed with a single C{"closefrom"} action, otherwise the file
+        descriptors which may be open in the parent, to be closed one by one.
+
+    @return: A C{list} of C{("dup2", fd, newfd)}, C{("close", fd)} and
+        C{("closefrom", lowfd)} actions, to be performed in order.
+    """
+    children = sorted(fdmap)
+    targets = sorted(set(fdmap.values()))
+    highest = max(children + [-1])
+    base = max(children + targets + [-1]) + 1
+    copies = {}
+    actions = []
+    for i, target in enumerate(targets):
+        copies[target] = base + i
+        actions.append(("dup2", target, base + i))
+    for child in children:
+        actions.append(("dup2", copies[fdmap[child]], child))
+    for fd in range(highest):
+        if fd not in fdmap:
+            actions.append(("close", fd))
+    if openFDs is None:
+        actions.append(("closefrom", highest + 1))
+    else:
+        for fd in sorted(set(openFDs).union(copies.values())):
+            if fd > highest:
+                actions.append(("close", fd))
+    return actions
+
+
+
+class _PosixSpawner(object):
+    """
+    Start child processes with the C library's C{posix_spawn}.
+
+    Unlike C{os.fork}, C{posix_spawn} does not copy the parent's page tables
+    (which is slow for a large parent) and runs no Python code in the child:
+    the descriptors are arranged and the signal dispositions reset by the C
+    library between C{vfork} and C{exec}.  It is only used with the GNU C
+    library, whose constants are known, and only for children which need
+    nothing it cannot express.
+
+    @ivar _libc: The C library as a C{ctypes.CDLL}, or C{None} if
+        C{posix_spawn} is not usable.  Only valid once C{_loaded} is C{True}.
+
+    @ivar _canChangeDirectory: Whether the C library can change the child's
+        working directory.
+
+    @ivar _canCloseFrom: Whether the C library can close every descriptor
+        above a given one in the child.
+    """
+
+    # From the GNU C library's spawn.h.
+    _POSIX_SPAWN_SETSIGDEF = 0x04
+    _POSIX_SPAWN_USEVFORK = 0x40
+
+    # Comfortably larger than posix_spawn_file_actions_t, posix_spawnattr_t
+    # and sigset_t, whose layouts ctypes does not know.
+    _STRUCT_SIZE = 1024
+
+    _required = [
+        'posix_spawn', 'posix_spawn_file_actions_init',
+        'posix_spawn_file_actions_destroy', 'posix_spawn_file_actions_adddup2',
+        'posix_spawn_file_actions_addclose', 'posix_spawnattr_init',
+        'posix_spawnattr_destroy', 'posix_spawnattr_setflags',
+        'posix_spawnattr_setsigdefault', 'sigemptyset', 'sigaddset']
+
+    _loaded = False
+    _libc = None
+    _canChangeDirectory = False
+    _canCloseFrom = False
+
+    def _load(self):
+        """
+        Find C{posix_spawn} and the functions to go with it, the first time
+        this is called.
+
+        @return: The C library, or C{None} if C{posix_spawn} cannot be used.
+        """
+        if not self._loaded:
+            self._loaded = True
+            if not sys.platform.startswith('linux'):
+                return None
+            try:
+                import ctypes
+                libc = ctypes.CDLL(None, use_errno=True)
+                for name in self._required:
+                    getattr(libc, name)
+            except (ImportError, OSError, AttributeError):
+                return None
+            self._canChangeDirectory = hasattr(
+                libc, 'posix_spawn_file_actions_addchdir_np')
+            self._canCloseFrom = hasattr(
+                libc, 'posix_spawn_file_actions_addclosefrom_np')
+            self._libc = libc
+        return self._libc
+
+
+    def spawn(self, executable, args, environment, path, fdmap):
+        """
+        Start a child process, if C{posix_spawn} can.
+
+        @param executable: The executable to run, found on the C{PATH} of
+            C{environment} like C{os.execvpe} does.
+        @param args: The arguments for the process.
+        @param environment: The environment for the process, or C{None} to
+            inherit this process's.
+        @param path: The working directory for the process, or C{None}.
+        @param fdmap: A C{dict} mapping file descriptors in the child to file
+            descriptors in this process.
+
+        @return: The process ID of the child, or C{None} if it could not be
+            started this way, in which case it should be forked instead so
+            that errors are reported as they always have been.
+        """
+        libc = self._load()
+        if libc is None or (path and not self._canChangeDirectory):
+            return None
+        if environment is None:
+            environment = os.environ
+        program = _findExecutable(executable, environment)
+        if program is None or (path and not os.path.isabs(program)):
+            return None
+        if self._canCloseFrom:
+            actions = _spawnFileActions(fdmap)
+        else:
+            actions = _spawnFileActions(fdmap, _listOpenFDs())
+
+        import ctypes
+        fileActions = ctypes.create_string_buffer(self._STRUCT_SIZE)
+        attributes = ctypes.create_string_buffer(self._STRUCT_SIZE)
+        signals = ctypes.create_string_buffer(self._STRUCT_SIZE)
+        argv = (ctypes.c_char_p * (len(args) + 1))(*args)
+        envp = ["%s=%s" % item for item in environment.items()]
+        envp = (ctypes.c_char_p * (len(envp) + 1))(*envp)
+        pid = ctypes.c_int()
+
+        if libc.posix_spawn_file_actions_init(fileActions):
+            return None
+        try:
+            if libc.posix_spawnattr_init(attributes):
+                return None
+            try:
+                failed = path and libc.posix_spawn_file_actions_addchdir_np(
+                    fileActions, path)
+                for action in actions:
+                    if failed:
+                        break
+                    if action[0] == "dup2":
+                        failed = libc.posix_spawn_file_actions_adddup2(
+                            fileActions, action[1], action[2])
+                    elif action[0] == "close":
+                        failed = libc.posix_spawn_file_actions_addclose(
+                            fileActions, action[1])
+                    else:
+                        failed = libc.posix_spawn_file_actions_addclosefrom_np(
+                            fileActions, action[1])
+                # The child must not inherit the signals the Python
+                # interpreter ignores; see _resetSignalDisposition.
+                libc.sigemptyset(signals)
+                for signalnum in range(1, signal.NSIG):
+                    if signal.getsignal(signalnum) == signal.SIG_IGN:
+                        libc.sigaddset(signals, signalnum)
+                if (failed
+                    or libc.posix_spawnattr_setsigdefault(attributes, signals)
+                    or libc.posix_spawnattr_setflags(
+                        attributes, self._POSIX_SPAWN_SETSIGDEF
+                                    | self._POSIX_SPAWN_USEVFORK)):
+                    return None
+                if libc.posix_spawn(ctypes.byref(pid), program, fileActions,
+                                    attributes, argv, envp):
+                    return None
+                return pid.value
+            finally:
+                libc.posix_spawnattr_destroy(attributes)
+        finally:
+            libc.posix_spawn_file_actions_destroy(fileActions)
+
+
+
+_spawner = _PosixSpawner()
+
+
 class Process(_BaseProcess):
     """
     An operating-system Process.
@@ -595,11 +974,18 @@ class Process(_BaseProcess):
     and fcntl(). These calls may not exist elsewhere so this
     code is not cross-platform. (also, windows can only select
     on sockets...)
+
+    Where the C library provides posix_spawn(), it is used instead of fork()
+    and exec() unless the process must run as a different user or group.
+
+    @ivar _spawner: The L{_PosixSpawner} used to start the process without
+        forking, or C{None} to always fork.
     """
     implements(IProcessTransport)
 
     debug = False
     debug_child = False
+    _spawner = _spawner
 
     status = -1
     pid = None
@@ -674,7 +1060,10 @@ class Process(_BaseProcess):
             if debug: print "helpers", helpers
             # the child only cares about fdmap.values()
 
-            self._fork(path, uid, gid, executable, args, environment, fdmap=fdmap)
+            if not self._spawn(path, uid, gid, executable, args, environment,
+                               fdmap):
+                self._fork(path, uid, gid, executable, args, environment,
+                           fdmap=fdmap)
         except:
             map(os.close, _openedPipes)
             raise
@@ -707,7 +1096,26 @@ class Process(_BaseProcess):
         # processEnded synchronously, triggering an application-visible
         # callback.  That's probably not ideal.  The replacement API for
         # spawnProcess should improve upon this situation.
-        registerReapProcessHandler(self.pid, self)
+        registerReapProcessHandler(self.pid, self, reactor)
+
+
+    def _spawn(self, path, uid, gid, executable, args, environment, fdmap):
+        """
+        Try to start the child process with C{posix_spawn} rather than by
+        forking.
+
+        @return: C{True} if the process was started, C{False} if it must be
+            forked instead.
+        """
+        if (self._spawner is None or uid is not None or gid is not None
+                or self.debug_child):
+            return False
+        pid = self._spawner.spawn(executable, args, environment, path, fdmap)
+        if pid is None:
+            return False
+        self.pid = pid
+        self.status = -1
+        return True
 
 
     def _setupChild(self, fdmap):
@@ -969,7 +1377,7 @@ class PTYProcess(abstract.FileDescriptor, _BaseProcess):
             self.proto.makeConnection(self)
         except:
             log.err()
-        registerReapProcessHandler(self.pid, self)
+        registerReapProcessHandler(self.pid, self, reactor)
 
 
     def _setupChild(self, masterfd, slavefd):
@@ -12,6 +12,7 @@ __metaclass__ = type
 
 import sys
 import time
+import random
 
 from zope.interface import implementer
 
@@ -57,10 +58,18 @@ class LoopingCall:
     @type _runAtStart: C{bool}
     @ivar _runAtStart: A flag indicating whether the 'now' argument was passed
         to L{LoopingCall.start}.
+
+    @type scheduler: L{PeriodicScheduler} or C{None}
+    @ivar scheduler: If not C{None}, a scheduler which runs this call together
+        with every other L{LoopingCall} using it with the same interval, on a
+        single timer.  The calls then happen on the scheduler's schedule for
+        that interval rather than one interval after L{start}.  Like C{clock},
+        this should be set before calling L{start}.
     """
 
     call = None
     running = False
+    scheduler = None
     deferred = None
     interval = None
     _expectNextCallAt = 0.0
@@ -169,6 +178,9 @@ class LoopingCall:
         self._expectNextCallAt = self.starttime
         self.interval = interval
         self._runAtStart = now
+        if self.scheduler is not None and interval:
+            # Count intervals on the schedule this call will actually follow.
+            self.starttime = self.scheduler._bucketFor(interval).startTime()
         if now:
             self()
         else:
@@ -199,7 +211,13 @@ class LoopingCall:
             self.call.cancel()
             self.call = None
             self._expectNextCallAt = self.clock.seconds()
-            self._reschedule()
+            if self.scheduler is not None and self.interval:
+                # Wait for the first run of the bucket which is at least a
+                # whole interval away, as a reset without a scheduler does.
+                self.call = self.scheduler._bucketFor(self.interval).add(
+                    self, fullInterval=True)
+            else:
+                self._reschedule()
 
     def __call__(self):
         def cb(result):
@@ -224,6 +242,10 @@ class LoopingCall:
         """
         Schedule the next iteration of this looping call.
         """
+        if self.scheduler is not None and self.interval:
+            self.call = self.scheduler._bucketFor(self.interval).add(self)
+            return
+
         if self.interval == 0:
             self.call = self.clock.callLater(0, self)
             return
@@ -259,6 +281,209 @@ class LoopingCall:
 
 
 
+class PeriodicScheduler(object):
+    """
+    A scheduler which runs every L{LoopingCall} using it with the same
+    interval together, on a single timer, rather than giving each one a timer
+    of its own.
+
+    To use it, set the C{scheduler} attribute of each L{LoopingCall} before
+    starting it::
+
+        scheduler = PeriodicScheduler()
+        for connection in connections:
+            keepAlive = LoopingCall(connection.ping)
+            keepAlive.scheduler = scheduler
+            keepAlive.start(30, now=False)
+
+    The timer for each interval is rescheduled from when it was due rather than
+    from when it ran, so it does not drift, and calls which miss a run (because
+    the reactor was blocked, or because a L{defer.Deferred} returned by the
+    previous call had not fired yet) join the next one; L{LoopingCall.withCount}
+    reports the runs they missed.
+
+    @ivar clock: The L{IReactorTime} provider used to schedule the timers.  It
+        should be the same as the C{clock} of the L{LoopingCall}s using this
+        scheduler.
+
+    @ivar jitter: The largest number of seconds by which the schedule for an
+        interval is shifted at random when it is first used, so that the
+        timers of different intervals (or of different processes) do not all
+        fire at the same moment.  The shift is never more than the interval.
+    @type jitter: C{float}
+
+    @ivar _buckets: A C{dict} mapping each interval which has been used to the
+        L{_PeriodicBucket} of the calls using it.
+
+    @ivar _random: A no-argument callable returning a random C{float} between
+        0 and 1, used to apply C{jitter}.
+    """
+
+    _random = staticmethod(random.random)
+
+    def __init__(self, clock=None, jitter=0.0):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.jitter = jitter
+        self._buckets = {}
+
+
+    def _bucketFor(self, interval):
+        """
+        Get the bucket of calls with the given interval, creating it if
+        necessary.
+
+        @rtype: L{_PeriodicBucket}
+        """
+        bucket = self._buckets.get(interval)
+        if bucket is None:
+            shift = self._random() * min(self.jitter, interval)
+            bucket = self._buckets[interval] = _PeriodicBucket(
+                self, interval, self.clock.seconds() + interval + shift)
+        return bucket
+
+
+
+class _PeriodicBucket(object):
+    """
+    The L{LoopingCall}s of a L{PeriodicScheduler} which share an interval,
+    and the single timer which runs them.
+
+    @ivar _next: The time at which the calls are next due.
+
+    @ivar _calls: The C{set} of L{_PeriodicEntry}s due to run at C{_next}.
+
+    @ivar _call: The L{IDelayedCall} for C{_next}, or C{None} while the
+        bucket is running its calls or has none.
+
+    @ivar _running: C{True} while the bucket is running its calls.
+    """
+
+    def __init__(self, scheduler, interval, next):
+        self._scheduler = scheduler
+        self._interval = interval
+        self._next = next
+        self._calls = set()
+        self._call = None
+        self._running = False
+
+
+    def startTime(self):
+        """
+        @return: The time, one interval before the calls are next due, from
+            which a L{LoopingCall} joining this bucket should count intervals.
+        """
+        self._catchUp()
+        return self._next - self._interval
+
+
+    def _catchUp(self):
+        """
+        If C{_next} is not in the future (because the bucket was idle, or the
+        reactor was blocked), move it on by whole intervals until it is.
+        """
+        now = self._scheduler.clock.seconds()
+        if self._next <= now:
+            missed = int((now - self._next) // self._interval)
+            self._next += self._interval * (missed + 1)
+
+
+    def add(self, loopingCall, fullInterval=False):
+        """
+        Run C{loopingCall} the next time the calls in this bucket are due.
+
+        @param fullInterval: If C{True}, skip that run if it is less than one
+            interval away, and run C{loopingCall} with the one after instead.
+
+        @return: An object with a C{cancel} method to undo this.
+        @rtype: L{_PeriodicEntry}
+        """
+        entry = _PeriodicEntry(self, loopingCall)
+        if fullInterval:
+            self._catchUp()
+            now = self._scheduler.clock.seconds()
+            entry.skip = self._next - now < self._interval
+        self._calls.add(entry)
+        if self._call is None and not self._running:
+            self._schedule()
+        return entry
+
+
+    def _schedule(self):
+        """
+        Schedule the timer for C{_next}.
+        """
+        self._catchUp()
+        clock = self._scheduler.clock
+        self._call = clock.callLater(self._next - clock.seconds(), self._run)
+
+
+    def _remove(self, entry):
+        """
+        Forget about C{entry}, and stop the timer if it was the last call in
+        the bucket.
+        """
+        self._calls.discard(entry)
+        if not self._calls and self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+
+    def _run(self):
+        """
+        Run all of the calls which are due, and schedule the next run.
+        """
+        self._call = None
+        # Move on to the next run, skipping any which were missed.
+        self._next += self._interval
+        self._catchUp()
+        calls, self._calls = self._calls, set()
+        self._running = True
+        try:
+            for entry in calls:
+                # An earlier call may have stopped this one.
+                if entry.cancelled:
+                    continue
+                if entry.skip:
+                    entry.skip = False
+                    self._calls.add(entry)
+                else:
+                    entry.loopingCall()
+        finally:
+            self._running = False
+            if self._calls:
+                self._schedule()
+
+
+
+class _PeriodicEntry(object):
+    """
+    A L{LoopingCall} waiting in a L{_PeriodicBucket}.  This stands in for the
+    L{IDelayedCall} a L{LoopingCall} would otherwise have.
+
+    @ivar cancelled: C{True} once C{cancel} has been called.
+
+    @ivar skip: C{True} if the call is to sit out the next run of the bucket.
+    """
+
+    cancelled = False
+    skip = False
+
+    def __init__(self, bucket, loopingCall):
+        self.bucket = bucket
+        self.loopingCall = loopingCall
+
+
+    def cancel(self):
+        """
+        Take the L{LoopingCall} out of the bucket.
+        """
+        self.cancelled = True
+        self.bucket._remove(self)
+
+
+
 class SchedulerError(Exception):
     """
     The operation could not be completed because the scheduler or one of its
@@ -326,6 +551,80 @@ class _Timer(object):
 
 
 
+class AdaptiveTimer(object):
+    """
+    A termination predicate factory for L{Cooperator} which sizes each time
+    slice according to how busy the rest of the reactor is.
+
+    The time between the end of one slice and the start of the next is the
+    time the reactor spent on everything else, mostly I/O.  The next slice is
+    sized so that cooperative tasks use at most C{budget} of the total, but is
+    never shorter than C{minSlice} (so that an idle reactor does not make the
+    tasks crawl) nor longer than C{maxSlice} (which bounds the latency the
+    tasks add to every connection).
+
+    @ivar budget: The largest fraction of the reactor's time which should be
+        spent running cooperative tasks while it has other work to do.
+    @type budget: C{float}
+
+    @ivar minSlice: The shortest time slice, in seconds.
+    @type minSlice: C{float}
+
+    @ivar maxSlice: The longest time slice, in seconds.
+    @type maxSlice: C{float}
+
+    @ivar slice: The length of the most recently started time slice.
+    @type slice: C{float}
+
+    @ivar _seconds: A no-argument callable returning the current time.
+
+    @ivar _lastEnd: The time at which the most recent time slice ended, or
+        C{None} if no slice has run yet.
+    """
+
+    def __init__(self, budget=0.5, minSlice=0.001, maxSlice=0.01,
+                 seconds=time.time):
+        """
+        @raise ValueError: If C{budget} is not strictly between 0 and 1 or if
+            C{minSlice} is larger than C{maxSlice}.
+        """
+        if not 0 < budget < 1:
+            raise ValueError("budget must be between 0 and 1, not %r" % (
+                    budget,))
+        if minSlice > maxSlice:
+            raise ValueError("minSlice %r is larger than maxSlice %r" % (
+                    minSlice, maxSlice))
+        self.budget = budget
+        self.minSlice = minSlice
+        self.maxSlice = maxSlice
+        self.slice = maxSlice
+        self._seconds = seconds
+        self._lastEnd = None
+
+
+    def __call__(self):
+        """
+        Start a new time slice.
+
+        @return: A no-argument callable which returns C{True} once the slice
+            is over.
+        """
+        seconds = self._seconds
+        now = seconds()
+        if self._lastEnd is not None:
+            elsewhere = now - self._lastEnd
+            self.slice = min(
+                self.maxSlice,
+                max(self.minSlice,
+                    elsewhere * self.budget / (1 - self.budget)))
+        end = now + self.slice
+        def terminator():
+            self._lastEnd = now = seconds()
+            return now >= end
+        return terminator
+
+
+
 _EPSILON = 0.00000001
 def _defaultScheduler(x):
     from twisted.internet import reactor
@@ -366,13 +665,19 @@ class CooperativeTask(object):
         C{StopIteration}.
 
     @type _completionState: L{TaskFinished}
+
+    @ivar weight: The number of units of work this task may do in a row each
+        time the L{Cooperator} comes round to it, before the next task gets a
+        turn.
+    @type weight: C{int}
     """
 
-    def __init__(self, iterator, cooperator):
+    def __init__(self, iterator, cooperator, weight=1):
         """
         A private constructor: to create a new L{CooperativeTask}, see
         L{Cooperator.cooperate}.
         """
+        self.weight = weight
         self._iterator = iterator
         self._cooperator = cooperator
         self._deferreds = []
@@ -499,8 +804,24 @@ class CooperativeTask(object):
 class Cooperator(object):
     """
     Cooperative task scheduler.
+
+    @ivar iterations: The number of units of work done by all tasks.
+    @type iterations: C{int}
+
+    @ivar timeUsed: The number of seconds spent doing work.
+    @type timeUsed: C{float}
+
+    @ivar tasksStarved: The number of times a task which was ready to do work
+        did not get a turn during a step, because the termination predicate
+        ended the step first.
+    @type tasksStarved: C{int}
     """
 
+    iterations = 0
+    timeUsed = 0.0
+    tasksStarved = 0
+    _seconds = staticmethod(time.time)
+
     def __init__(self,
                  terminationPredicateFactory=_Timer,
                  scheduler=_defaultScheduler,
@@ -512,7 +833,8 @@ class Cooperator(object):
         be invoked at the beginning of each step and should return a
         no-argument callable which will return True when the step should be
         terminated.  The default factory is time-based and allows iterators to
-        run for 1/100th of a second at a time.
+        run for 1/100th of a second at a time.  See L{AdaptiveTimer} for one
+        which adapts to the load on the reactor.
 
         @param scheduler: A one-argument callable which takes a no-argument
         callable and should invoke it at some future point.  This will be used
@@ -531,7 +853,7 @@ class Cooperator(object):
         self._started = started
 
 
-    def coiterate(self, iterator, doneDeferred=None):
+    def coiterate(self, iterator, doneDeferred=None, weight=1):
         """
         Add an iterator to the list of iterators this L{Cooperator} is
         currently running.
@@ -540,24 +862,31 @@ class Cooperator(object):
             the completion deferred.  It is suggested that you use the default,
             which creates a new Deferred for you.
 
+        @param weight: The number of units of work the iterator may do in a
+            row before the next task gets a turn.
+
         @return: a Deferred that will fire when the iterator finishes.
         """
         if doneDeferred is None:
             doneDeferred = defer.Deferred()
-        CooperativeTask(iterator, self).whenDone().chainDeferred(doneDeferred)
+        CooperativeTask(iterator, self, weight).whenDone().chainDeferred(
+            doneDeferred)
         return doneDeferred
 
 
-    def cooperate(self, iterator):
+    def cooperate(self, iterator, weight=1):
         """
         Start running the given iterator as a long-running cooperative task, by
         calling next() on it as a periodic timed event.
 
         @param iterator: the iterator to invoke.
 
+        @param weight: The number of units of work the iterator may do in a
+            row before the next task gets a turn.
+
         @return: a L{CooperativeTask} object representing this task.
         """
-        return CooperativeTask(iterator, self)
+        return CooperativeTask(iterator, self, weight)
 
 
     def _addTask(self, task):
@@ -587,14 +916,28 @@ class Cooperator(object):
     def _tasksWhileNotStopped(self):
         """
         Yield all L{CooperativeTask} objects in a loop as long as this
-        L{Cooperator}'s termination condition has not been met.
+        L{Cooperator}'s termination condition has not been met.  Each task is
+        yielded up to its C{weight} times in a row.
         """
         terminator = self._terminationPredicateFactory()
+        turns = 0
         while self._tasks:
             for t in self._metarator:
+                turns += 1
                 yield t
                 if terminator():
+                    self.tasksStarved += max(0, len(self._tasks) - turns)
                     return
+                if t.weight > 1:
+                    remaining = t.weight - 1
+                    while (remaining and not t._pauseCount
+                           and t._completionState is None):
+                        yield t
+                        if terminator():
+                            self.tasksStarved += max(
+                                0, len(self._tasks) - turns)
+                            return
+                        remaining -= 1
             self._metarator = iter(self._tasks)
 
 
@@ -603,8 +946,13 @@ class Cooperator(object):
         Run one scheduler tick.
         """
         self._delayedCall = None
+        started = self._seconds()
+        iterations = 0
         for taskObj in self._tasksWhileNotStopped():
             taskObj._oneWorkUnit()
+            iterations += 1
+        self.iterations += iterations
+        self.timeUsed += self._seconds() - started
         self._reschedule()
 
 
@@ -657,7 +1005,7 @@ class Cooperator(object):
 
 _theCooperator = Cooperator()
 
-def coiterate(iterator):
+def coiterate(iterator, weight=1):
     """
     Cooperatively iterate over the given iterator, dividing runtime between it
     and all other iterators which have been passed to this function and not yet
@@ -665,22 +1013,28 @@ def coiterate(iterator):
 
     @param iterator: the iterator to invoke.
 
+    @param weight: The number of units of work the iterator may do in a row
+        before the next task gets a turn.
+
     @return: a Deferred that will fire when the iterator finishes.
     """
-    return _theCooperator.coiterate(iterator)
+    return _theCooperator.coiterate(iterator, weight=weight)
 
 
 
-def cooperate(iterator):
+def cooperate(iterator, weight=1):
     """
     Start running the given iterator as a long-running cooperative task, by
     calling next() on it as a periodic timed event.
 
     @param iterator: the iterator to invoke.
 
+    @param weight: The number of units of work the iterator may do in a row
+        before the next task gets a turn.
+
     @return: a L{CooperativeTask} object representing this task.
     """
-    return _theCooperator.cooperate(iterator)
+    return _theCooperator.cooperate(iterator, weight)
 
 
 
@@ -860,10 +1214,10 @@ def react(main, argv=(), _reactor=None):
 
 
 __all__ = [
-    'LoopingCall',
+    'LoopingCall', 'PeriodicScheduler',
 
     'Clock',
 
-    'SchedulerStopped', 'Cooperator', 'coiterate',
+    'SchedulerStopped', 'Cooperator', 'AdaptiveTimer', 'coiterate',
 
     'deferLater', 'react']
@@ -148,8 +148,15 @@ class _AbortingMixin(object):
 
     @ivar _aborting: Set to C{True} when C{abortConnection} is called.
     @type _aborting: C{bool}
+
+    @ivar _connectionAborted: The reason passed to C{connectionLost} after
+        C{abortConnection}.  It carries no traceback, so one instance is
+        shared by every aborted connection, as L{main.CONNECTION_DONE} is by
+        connections closed cleanly.
+    @type _connectionAborted: L{failure.Failure}
     """
     _aborting = False
+    _connectionAborted = failure.Failure(error.ConnectionAborted())
 
     def abortConnection(self):
         """
@@ -165,7 +172,7 @@ class _AbortingMixin(object):
         self.doRead = lambda *args, **kwargs: None
         self.doWrite = lambda *args, **kwargs: None
         self.reactor.callLater(0, self.connectionLost,
-                               failure.Failure(error.ConnectionAborted()))
+                               self._connectionAborted)
 
 
 
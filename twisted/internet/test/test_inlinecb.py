@@ -12,7 +12,8 @@ well.
 from __future__ import division, absolute_import
 
 from twisted.trial.unittest import TestCase
-from twisted.internet.defer import Deferred, returnValue, inlineCallbacks
+from twisted.internet.defer import (
+    Deferred, returnValue, inlineCallbacks, succeed, fail)
 
 class NonLocalExitTests(TestCase):
     """
@@ -88,3 +89,57 @@ class NonLocalExitTests(TestCase):
         self.assertMistakenMethodWarning(results)
 
 
+
+class FiredDeferredTests(TestCase):
+    """
+    An L{inlineCallbacks} generator which yields a L{Deferred} that already
+    has a result is resumed with that result straight away.
+    """
+
+    def test_resultConsumed(self):
+        """
+        The yielded L{Deferred} is left with a result of C{None}, as it would
+        be if a callback had consumed the result.
+        """
+        fired = succeed(1)
+        @inlineCallbacks
+        def inline():
+            result = yield fired
+            returnValue(result + 1)
+        self.assertEqual(self.successResultOf(inline()), 2)
+        self.assertIdentical(fired.result, None)
+
+
+    def test_failureHandled(self):
+        """
+        A failure from the yielded L{Deferred} is raised in the generator, and
+        once the generator handles it, the L{Deferred} no longer has a failure
+        to report as unhandled.
+        """
+        failed = fail(ZeroDivisionError())
+        @inlineCallbacks
+        def inline():
+            try:
+                yield failed
+            except ZeroDivisionError:
+                returnValue("handled")
+        self.assertEqual(self.successResultOf(inline()), "handled")
+        self.assertIdentical(failed.result, None)
+        self.assertIdentical(failed._debugInfo.failResult, None)
+
+
+    def test_pausedDeferredWaits(self):
+        """
+        A L{Deferred} which has a result but is paused does not resume the
+        generator until it is unpaused.
+        """
+        paused = succeed(1)
+        paused.pause()
+        @inlineCallbacks
+        def inline():
+            result = yield paused
+            returnValue(result)
+        d = inline()
+        self.assertNoResult(d)
+        paused.unpause()
+        self.assertEqual(self.successResultOf(d), 1)
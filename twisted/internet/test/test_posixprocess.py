@@ -15,7 +15,7 @@ else:
     from twisted.internet import process
     platformSkip = None
 
-from twisted.trial.unittest import TestCase
+from twisted.trial.unittest import TestCase, SkipTest
 
 
 class FakeFile(object):
@@ -338,3 +338,312 @@ class FileDescriptorTests(TestCase):
             os.close(fd)
         # And it should not appear in the result.
         self.assertNotIn(fd, process._listOpenFDs())
+
+
+
+class SpawnFileActionsTests(TestCase):
+    """
+    Tests for L{process._spawnFileActions}.
+    """
+    if platformSkip:
+        skip = platformSkip
+
+    def test_inPlace(self):
+        """
+        Descriptors which are already where the child wants them are still
+        copied out and back, which clears their close-on-exec flag, and
+        everything above them is closed.
+        """
+        self.assertEqual(
+            process._spawnFileActions({0: 0, 1: 1}),
+            [("dup2", 0, 2), ("dup2", 1, 3), ("dup2", 2, 0), ("dup2", 3, 1),
+             ("closefrom", 2)])
+
+
+    def test_swap(self):
+        """
+        Descriptors which the child wants swapped around, or in more than one
+        place, are all copied out of the way before any is moved into place.
+        """
+        self.assertEqual(
+            process._spawnFileActions({0: 1, 1: 0, 3: 0}),
+            [("dup2", 0, 4), ("dup2", 1, 5),
+             ("dup2", 5, 0), ("dup2", 4, 1), ("dup2", 4, 3),
+             ("close", 2), ("closefrom", 4)])
+
+
+    def test_openFDs(self):
+        """
+        If C{openFDs} is given, each of them and each of the copies above the
+        child's descriptors is closed separately.
+        """
+        self.assertEqual(
+            process._spawnFileActions({0: 7}, [0, 1, 2, 7, 9]),
+            [("dup2", 7, 8), ("dup2", 8, 0),
+             ("close", 1), ("close", 2), ("close", 7), ("close", 8),
+             ("close", 9)])
+
+
+    def test_empty(self):
+        """
+        A child which needs no descriptors gets none.
+        """
+        self.assertEqual(process._spawnFileActions({}), [("closefrom", 0)])
+
+
+
+class FakeSpawner(object):
+    """
+    A stand-in for L{process._PosixSpawner} which records what it is asked to
+    do.
+
+    @ivar pid: The process ID to return from C{spawn}.
+    @ivar calls: The arguments of each call to C{spawn}.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.calls = []
+
+
+    def spawn(self, *args):
+        self.calls.append(args)
+        return self.pid
+
+
+
+class PosixSpawnTests(TestCase):
+    """
+    Tests for starting processes with L{process._PosixSpawner}.
+    """
+    if platformSkip:
+        skip = platformSkip
+
+    def spawn(self, executable, args, path=None):
+        """
+        Spawn a process with L{process._spawner}, with its output going to a
+        pipe.
+
+        @return: The output of the process.
+        """
+        if process._spawner._load() is None:
+            raise SkipTest("posix_spawn is not available")
+        readFD, writeFD = os.pipe()
+        try:
+            pid = process._spawner.spawn(
+                executable, args, None, path, {1: writeFD})
+        finally:
+            os.close(writeFD)
+        self.assertNotIdentical(pid, None)
+        output = []
+        try:
+            while True:
+                data = os.read(readFD, 1024)
+                if not data:
+                    break
+                output.append(data)
+        finally:
+            os.close(readFD)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        return "".join(output)
+
+
+    def test_spawn(self):
+        """
+        L{process._PosixSpawner.spawn} starts the process with the given
+        arguments and only the file descriptors it is given.
+        """
+        output = self.spawn(sys.executable, [
+                sys.executable, "-c",
+                "import os, sys; "
+                "fds = os.listdir('/dev/fd'); "
+                "sys.stdout.write(repr((len(fds), sys.argv[1:])))",
+                "argument"])
+        # /dev/fd lists stdout and the descriptor used to list it.
+        self.assertEqual(output, repr((2, ["argument"])))
+
+
+    def test_path(self):
+        """
+        L{process._PosixSpawner.spawn} runs the process in the given working
+        directory, and finds executables without a path on C{PATH}.
+        """
+        if not process._spawner._canChangeDirectory:
+            raise SkipTest("posix_spawn cannot change directory")
+        directory = os.path.realpath(self.mktemp())
+        os.makedirs(directory)
+        self.assertEqual(self.spawn("pwd", ["pwd"], directory).strip(),
+                         directory)
+
+
+    def test_notFound(self):
+        """
+        L{process._PosixSpawner.spawn} returns C{None} for an executable which
+        cannot be found, so that the child is forked and reports the error.
+        """
+        self.assertIdentical(
+            process._spawner.spawn("no-such-executable", [], {"PATH": ""},
+                                   None, {}),
+            None)
+
+
+    def test_spawnUsed(self):
+        """
+        L{process.Process._spawn} starts the process with its spawner if it
+        can.
+        """
+        proc = process.Process.__new__(process.Process)
+        proc._spawner = FakeSpawner(1234)
+        self.assertTrue(
+            proc._spawn("/", None, None, "true", ["true"], {}, {0: 0}))
+        self.assertEqual(proc.pid, 1234)
+        self.assertEqual(proc._spawner.calls,
+                         [("true", ["true"], {}, "/", {0: 0})])
+
+
+    def test_spawnFailed(self):
+        """
+        L{process.Process._spawn} returns C{False} if the spawner could not
+        start the process.
+        """
+        proc = process.Process.__new__(process.Process)
+        proc._spawner = FakeSpawner(None)
+        self.assertFalse(
+            proc._spawn(None, None, None, "true", ["true"], {}, {}))
+        self.assertIdentical(proc.pid, None)
+
+
+    def test_forkToChangeUser(self):
+        """
+        L{process.Process._spawn} does not use the spawner for a process which
+        must run as another user or group.
+        """
+        proc = process.Process.__new__(process.Process)
+        proc._spawner = FakeSpawner(1234)
+        self.assertFalse(
+            proc._spawn(None, 0, None, "true", ["true"], {}, {}))
+        self.assertFalse(
+            proc._spawn(None, None, 0, "true", ["true"], {}, {}))
+        self.assertEqual(proc._spawner.calls, [])
+
+
+
+class FakeFDSetReactor(object):
+    """
+    A reactor which records the readers added to it.
+
+    @ivar readers: The readers added and not yet removed.
+    """
+    def __init__(self):
+        self.readers = []
+
+
+    def addReader(self, reader):
+        self.readers.append(reader)
+
+
+    def removeReader(self, reader):
+        self.readers.remove(reader)
+
+
+
+class FakeProcess(object):
+    """
+    A process which records attempts to reap it.
+
+    @ivar reaped: The number of times C{reapProcess} was called.
+    """
+    reaped = 0
+
+    def __init__(self, pid):
+        self.pid = pid
+
+
+    def reapProcess(self):
+        self.reaped += 1
+
+
+
+class PidfdReaperTests(TestCase):
+    """
+    Tests for L{process._PidfdReaper}.
+    """
+    if platformSkip:
+        skip = platformSkip
+
+    def setUp(self):
+        self.patch(process, "_pidfdReapers", {})
+        self.patch(process, "_polledProcesses", {})
+        self.reactor = FakeFDSetReactor()
+        self.process = FakeProcess(1234)
+        self.fd, self.other = os.pipe()
+        self.addCleanup(os.close, self.other)
+        self.reaper = process._PidfdReaper(self.reactor, self.process, self.fd)
+        process._pidfdReapers[self.process.pid] = self.reaper
+
+
+    def assertClosed(self, fd):
+        """
+        Assert that C{fd} is not open.
+        """
+        exc = self.assertRaises(OSError, os.fstat, fd)
+        self.assertEqual(exc.errno, errno.EBADF)
+
+
+    def test_watch(self):
+        """
+        L{process._PidfdReaper} watches its pidfd with the reactor, and reaps
+        the process when it becomes readable.
+        """
+        self.assertEqual(self.reactor.readers, [self.reaper])
+        self.assertEqual(self.reaper.fileno(), self.fd)
+        self.reaper.doRead()
+        self.assertEqual(self.process.reaped, 1)
+        self.reaper.stopWatching()
+
+
+    def test_stopWatching(self):
+        """
+        L{process._PidfdReaper.stopWatching} stops watching the pidfd and
+        closes it.
+        """
+        self.reaper.stopWatching()
+        self.assertEqual(self.reactor.readers, [])
+        self.assertClosed(self.fd)
+        self.reaper.stopWatching()
+
+
+    def test_connectionLost(self):
+        """
+        If the reactor stops watching the pidfd, L{process._PidfdReaper}
+        closes it and the process goes back to being polled.
+        """
+        self.reactor.readers.remove(self.reaper)
+        self.reaper.connectionLost(None)
+        self.assertClosed(self.fd)
+        self.assertEqual(process._pidfdReapers, {})
+        self.assertEqual(process._polledProcesses,
+                         {self.process.pid: self.process})
+
+
+    def test_removeAll(self):
+        """
+        When a reactor's C{removeAll} removes a L{process._PidfdReaper}, its
+        pidfd is closed and the process goes back to being polled.  The
+        reaper is not reported as one of the removed selectables, since it
+        belongs to the reactor's process support.
+        """
+        from twisted.internet.selectreactor import SelectReactor
+        reactor = SelectReactor()
+        self.addCleanup(reactor.waker.connectionLost, None)
+        self.reaper.stopWatching()
+        fd, other = os.pipe()
+        self.addCleanup(os.close, other)
+        reaper = process._PidfdReaper(reactor, self.process, fd)
+        process._pidfdReapers[self.process.pid] = reaper
+
+        self.assertEqual(reactor.removeAll(), [])
+        self.assertEqual(reactor.getReaders(), [reactor.waker])
+        self.assertClosed(fd)
+        self.assertEqual(process._pidfdReapers, {})
+        self.assertEqual(process._polledProcesses,
+                         {self.process.pid: self.process})
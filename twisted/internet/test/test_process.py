@@ -9,7 +9,7 @@ __metaclass__ = type
 
 import os, sys, signal, threading
 
-from twisted.trial.unittest import TestCase
+from twisted.trial.unittest import TestCase, SkipTest
 from twisted.internet.test.reactormixins import ReactorBuilder
 from twisted.python.log import msg, err
 from twisted.python.runtime import platform, platformType
@@ -519,6 +519,38 @@ class ProcessTestsBuilder(ProcessTestsBuilderBase):
         self.runReactor(reactor)
 
 
+    def test_reapedWithPidfd(self):
+        """
+        Where pidfds are available, a child process is watched with one and
+        reaped when it exits, without being polled on C{SIGCHLD}.
+        """
+        from twisted.internet import process
+        pidfd = process._openPidfd(os.getpid())
+        if pidfd is None:
+            raise SkipTest("pidfds are not available")
+        os.close(pidfd)
+        self.patch(process, "_reapPolledProcesses", lambda: None)
+
+        reactor = self.buildReactor()
+        ended = Deferred()
+        pids = []
+        def spawn():
+            transport = reactor.spawnProcess(
+                _ShutdownCallbackProcessProtocol(ended), sys.executable,
+                [sys.executable, "-c", "import sys; sys.stdin.read()"],
+                usePTY=self.usePTY, childFDs={0: "w"})
+            pids.append(transport.pid)
+            self.assertIn(transport.pid, process._pidfdReapers)
+            self.assertNotIn(transport.pid, process._polledProcesses)
+            transport.closeStdin()
+        reactor.callWhenRunning(spawn)
+        ended.addCallback(lambda ignored: reactor.stop())
+        self.runReactor(reactor)
+
+        self.assertNotIn(pids[0], process.reapProcessHandlers)
+        self.assertNotIn(pids[0], process._pidfdReapers)
+
+
     # This test is here because PTYProcess never delivers childConnectionLost.
     def test_processEnded(self):
         """
@@ -751,3 +783,71 @@ class PotentialZombieWarningTests(TestCase):
             "Twisted 10.0.0: There is no longer any potential for zombie "
             "process.")
         self.assertEqual(len(warnings), 1)
+
+
+
+class FakeFDSetReactor(object):
+    """
+    Just enough of an L{IReactorFDSet} to watch a pidfd with.
+    """
+    def __init__(self):
+        self.readers = []
+
+
+    def addReader(self, reader):
+        self.readers.append(reader)
+
+
+    def removeReader(self, reader):
+        self.readers.remove(reader)
+
+
+
+class PidfdReaperTests(TestCase):
+    """
+    Tests for L{twisted.internet.process._PidfdReaper}.
+    """
+    if platform.isWindows():
+        skip = "Process reaping is only done on POSIX"
+
+    def test_reapedElsewhere(self):
+        """
+        If the process of a readable pidfd cannot be reaped, because it was
+        already waited for, the pidfd is no longer watched and the process is
+        polled instead.
+        """
+        from twisted.internet import process
+        pid = os.spawnv(os.P_NOWAIT, sys.executable, [sys.executable, "-c", ""])
+        pidfd = process._openPidfd(pid)
+        os.waitpid(pid, 0)
+        if pidfd is None:
+            raise SkipTest("pidfds are not available")
+
+        class Process(process._BaseProcess):
+            def processEnded(self, status):
+                self.status = status
+
+        proc = Process(None)
+        proc.pid = pid
+        reactor = FakeFDSetReactor()
+        reaper = process._PidfdReaper(reactor, proc, pidfd)
+        process.reapProcessHandlers[pid] = proc
+        process._pidfdReapers[pid] = reaper
+        self.addCleanup(process.unregisterReapProcessHandler, pid, proc)
+
+        reaper.doRead()
+
+        self.assertEqual(reactor.readers, [])
+        self.assertIdentical(reaper.fileno(), None)
+        self.assertNotIn(pid, process._pidfdReapers)
+        self.assertIdentical(process._polledProcesses[pid], proc)
+
+
+    def test_unknownMachine(self):
+        """
+        pidfds are not used on machines which may not number the
+        C{pidfd_open} system call as the shared system call table does.
+        """
+        from twisted.internet import process
+        self.patch(process.platform, "machine", lambda: "alpha")
+        self.assertIdentical(process._PidfdOpener()(os.getpid()), None)
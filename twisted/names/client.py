@@ -19,6 +19,7 @@ better caching, respect timeouts
 import os
 import errno
 import warnings
+from collections import deque
 
 from zope.interface import moduleProvides
 
@@ -29,6 +30,7 @@ from twisted.python.filepath import FilePath
 from twisted.internet import error, defer, interfaces, protocol
 from twisted.python import log, failure
 from twisted.names import dns, common
+from twisted.names.error import DNSNotImplementedError, DNSUnknownError
 
 
 
@@ -49,9 +51,45 @@ class Resolver(common.ResolverBase):
     @ivar _reactor: A provider of L{IReactorTCP}, L{IReactorUDP}, and
         L{IReactorTime} which will be used to set up network resources and
         track timeouts.
+
+    @ivar _serverRTT: A C{dict} mapping nameserver addresses to a smoothed
+        estimate, in seconds, of the time each takes to answer a query.  Used
+        to prefer faster servers over slower ones.
+
+    @ivar _outstanding: A C{dict} mapping nameserver addresses to the number
+        of UDP queries currently awaiting a response from each.
+
+    @ivar _backlog: A C{dict} mapping nameserver addresses to a C{deque} of
+        queries which could not be sent immediately because
+        C{maxOutstandingQueries} queries were already outstanding to that
+        server.
+
+    @ivar maxOutstandingQueries: The maximum number of UDP queries which will
+        be outstanding to any one nameserver at a time, or C{None} for no
+        limit.
+
+    @ivar maxTCPConnections: The maximum number of TCP connections which will
+        be used to carry queries made with L{queryTCP}.  Queries are
+        multiplexed over these connections, and a new connection is only
+        opened when every existing one has queries outstanding.
+
+    @ivar tcpIdleTimeout: The number of seconds a TCP connection may go
+        without any outstanding queries before it is closed, or C{None} to
+        leave idle connections open.
+
+    @ivar _idleCalls: A C{dict} mapping idle L{dns.DNSProtocol} instances to
+        the L{IDelayedCall} which will close them.
     """
-    index = 0
     timeout = None
+    maxOutstandingQueries = None
+    maxTCPConnections = 1
+    tcpIdleTimeout = None
+
+    # Weight given to each new round trip time sample when updating the
+    # smoothed estimate, and the factor by which the estimates of servers
+    # which were not used are reduced so that they are eventually tried again.
+    _rttGain = 0.125
+    _rttDecay = 0.98
 
     factory = None
     servers = None
@@ -63,13 +101,17 @@ class Resolver(common.ResolverBase):
     _lastResolvTime = None
     _resolvReadInterval = 60
 
-    def __init__(self, resolv=None, servers=None, timeout=(1, 3, 11, 45), reactor=None):
+    def __init__(self, resolv=None, servers=None, timeout=(1, 3, 11, 45),
+                 reactor=None, maxOutstandingQueries=None,
+                 maxTCPConnections=1, tcpIdleTimeout=None):
         """
         Construct a resolver which will query domain name servers listed in
         the C{resolv.conf(5)}-format file given by C{resolv} as well as
-        those in the given C{servers} list.  Servers are queried in a
-        round-robin fashion.  If given, C{resolv} is periodically checked
-        for modification and re-parsed if it is noticed to have changed.
+        those in the given C{servers} list.  Servers which have not yet been
+        queried are tried in the order they are given, after which servers
+        are preferred according to how quickly they have answered previous
+        queries.  If given, C{resolv} is periodically checked for
+        modification and re-parsed if it is noticed to have changed.
 
         @type servers: C{list} of C{(str, int)} or C{None}
         @param servers: If not None, interpreted as a list of (host, port)
@@ -91,6 +133,20 @@ class Resolver(common.ResolverBase):
             for DNS datagrams, and enforce timeouts.  If not provided, the
             global reactor will be used.
 
+        @type maxOutstandingQueries: C{int} or C{None}
+        @param maxOutstandingQueries: If not C{None}, the maximum number of
+            UDP queries to have outstanding to any single nameserver.  Further
+            queries to that server wait until an earlier one completes.
+
+        @type maxTCPConnections: C{int}
+        @param maxTCPConnections: The maximum number of persistent TCP
+            connections over which to multiplex queries made with
+            L{queryTCP}.
+
+        @type tcpIdleTimeout: C{int} or C{float} or C{None}
+        @param tcpIdleTimeout: If not C{None}, the number of seconds after
+            which a TCP connection with no outstanding queries is closed.
+
         @raise ValueError: Raised if no nameserver addresses can be found.
         """
         common.ResolverBase.__init__(self)
@@ -119,6 +175,15 @@ class Resolver(common.ResolverBase):
 
         self._waiting = {}
 
+        self.maxOutstandingQueries = maxOutstandingQueries
+        self._serverRTT = {}
+        self._outstanding = {}
+        self._backlog = {}
+
+        self.maxTCPConnections = maxTCPConnections
+        self.tcpIdleTimeout = tcpIdleTimeout
+        self._idleCalls = {}
+
         self.maybeParseConfig()
 
 
@@ -126,6 +191,9 @@ class Resolver(common.ResolverBase):
         d = self.__dict__.copy()
         d['connections'] = []
         d['_parseCall'] = None
+        d['_outstanding'] = {}
+        d['_backlog'] = {}
+        d['_idleCalls'] = {}
         return d
 
 
@@ -190,24 +258,67 @@ class Resolver(common.ResolverBase):
         self.dynServers = servers
 
 
-    def pickServer(self):
+    def _orderedServers(self):
+        """
+        Return the addresses of all known nameservers, fastest first.
+
+        Servers are ordered by their smoothed round trip time.  Servers which
+        have not yet answered a query are placed first, in the order they were
+        configured, so that each of them is tried.
+
+        @rtype: C{list}
         """
-        Return the address of a nameserver.
+        rtt = self._serverRTT
+        addresses = self.servers + list(self.dynServers)
+        addresses.sort(key=lambda address: rtt.get(address, 0.0))
+        return addresses
 
-        TODO: Weight servers for response time so faster ones can be
-        preferred.
+
+    def _recordRTT(self, address, elapsed):
         """
-        if not self.servers and not self.dynServers:
-            return None
-        serverL = len(self.servers)
-        dynL = len(self.dynServers)
+        Update the smoothed round trip time estimate of a nameserver with a
+        new sample.
 
-        self.index += 1
-        self.index %= (serverL + dynL)
-        if self.index < serverL:
-            return self.servers[self.index]
+        The estimates of all other servers are decayed slightly so that a
+        server which was slow once is eventually tried again.
+
+        @param address: The address of the server which answered.
+        @param elapsed: The number of seconds the server took to answer.
+        @type elapsed: C{float}
+        """
+        rtt = self._serverRTT
+        for other in rtt:
+            if other != address:
+                rtt[other] *= self._rttDecay
+        previous = rtt.get(address)
+        if previous is None:
+            rtt[address] = elapsed
         else:
-            return self.dynServers[self.index - serverL]
+            rtt[address] = previous + self._rttGain * (elapsed - previous)
+
+
+    def _recordTimeout(self, address, timeout):
+        """
+        Penalize a nameserver which failed to answer a query in time by
+        treating it as at least as slow as the timeout which expired.
+
+        @param address: The address of the server which did not answer.
+        @param timeout: The number of seconds which were allowed for the
+            answer.
+        """
+        self._serverRTT[address] = max(
+            self._serverRTT.get(address, 0.0), timeout)
+
+
+    def pickServer(self):
+        """
+        Return the address of the nameserver expected to answer fastest, or
+        C{None} if there are no nameservers.
+        """
+        addresses = self._orderedServers()
+        if not addresses:
+            return None
+        return addresses[0]
 
 
     def _connectedProtocol(self):
@@ -231,8 +342,11 @@ class Resolver(common.ResolverBase):
         """
         self.connections.append(protocol)
         for (d, q, t) in self.pending:
-            self.queryTCP(q, t).chainDeferred(d)
+            # A new connection being lost is not a reason to expect a retry
+            # to fare any better, so these queries are not retried.
+            self._queryTCP(q, t, False).chainDeferred(d)
         del self.pending[:]
+        self._connectionIdle(protocol)
 
 
     def connectionLost(self, protocol):
@@ -241,6 +355,36 @@ class Resolver(common.ResolverBase):
         """
         if protocol in self.connections:
             self.connections.remove(protocol)
+        idleCall = self._idleCalls.pop(protocol, None)
+        if idleCall is not None:
+            idleCall.cancel()
+
+
+    def _connectionIdle(self, protocol):
+        """
+        If C{tcpIdleTimeout} is set and the given connection has no
+        outstanding queries, arrange for it to be closed once the timeout
+        passes without it being used.
+
+        @type protocol: L{dns.DNSProtocol}
+        """
+        if (self.tcpIdleTimeout is None or protocol.liveMessages
+                or protocol in self._idleCalls
+                or protocol not in self.connections):
+            return
+        self._idleCalls[protocol] = self._reactor.callLater(
+            self.tcpIdleTimeout, self._closeIdleConnection, protocol)
+
+
+    def _closeIdleConnection(self, protocol):
+        """
+        Stop using an idle TCP connection and close it.
+
+        @type protocol: L{dns.DNSProtocol}
+        """
+        del self._idleCalls[protocol]
+        self.connections.remove(protocol)
+        protocol.transport.loseConnection()
 
 
     def messageReceived(self, message, protocol, address = None):
@@ -248,26 +392,97 @@ class Resolver(common.ResolverBase):
 
 
     def _query(self, *args):
+        """
+        Issue a query using C{*args} with L{_issueQuery}, or, if
+        C{maxOutstandingQueries} queries are already outstanding to the
+        server it is addressed to, queue it until one of them completes.
+
+        A query which stays queued for longer than its timeout fails with
+        L{dns.DNSQueryTimeoutError} without being sent, so that it may be
+        retried with another server.
+
+        @param *args: Positional arguments to be passed to
+            L{DNSDatagramProtocol.query}.
+
+        @return: A L{Deferred} which will be called back with the result of the
+            query.
+        """
+        address = args[0]
+        limit = self.maxOutstandingQueries
+        if limit is None or self._outstanding.get(address, 0) < limit:
+            return self._issueQuery(args)
+
+        d = defer.Deferred()
+        backlog = self._backlog.setdefault(address, deque())
+        def expire():
+            backlog.remove(entry)
+            if not backlog:
+                del self._backlog[address]
+            if len(args) > 3:
+                id = args[3]
+            else:
+                id = None
+            d.errback(dns.DNSQueryTimeoutError(id))
+        entry = (d, args, self._reactor.callLater(args[2], expire))
+        backlog.append(entry)
+        return d
+
+
+    def _issueQuery(self, args):
         """
         Get a new L{DNSDatagramProtocol} instance from L{_connectedProtocol},
-        issue a query to it using C{*args}, and arrange for it to be
+        issue a query to it using C{args}, and arrange for it to be
         disconnected from its transport after the query completes.
 
-        @param *args: Positional arguments to be passed to
+        The time taken to answer is used to update the round trip time
+        estimate of the server, and when the query completes the next query
+        queued for the same server, if any, is issued.
+
+        @param args: Positional arguments to be passed to
             L{DNSDatagramProtocol.query}.
 
         @return: A L{Deferred} which will be called back with the result of the
             query.
         """
+        address = args[0]
+        self._outstanding[address] = self._outstanding.get(address, 0) + 1
+        started = self._reactor.seconds()
         protocol = self._connectedProtocol()
         d = protocol.query(*args)
         def cbQueried(result):
             protocol.transport.stopListening()
+            if not isinstance(result, failure.Failure):
+                self._recordRTT(address, self._reactor.seconds() - started)
+            elif result.check(dns.DNSQueryTimeoutError):
+                self._recordTimeout(address, args[2])
+            self._queryFinished(address)
             return result
         d.addBoth(cbQueried)
         return d
 
 
+    def _queryFinished(self, address):
+        """
+        Note that a query to a nameserver has completed and issue the next
+        query waiting for that server, if there is one.
+
+        @param address: The address of the server the query was sent to.
+        """
+        outstanding = self._outstanding[address] - 1
+        if outstanding:
+            self._outstanding[address] = outstanding
+        else:
+            del self._outstanding[address]
+
+        backlog = self._backlog.get(address)
+        if backlog:
+            d, args, timeoutCall = backlog.popleft()
+            if not backlog:
+                del self._backlog[address]
+            timeoutCall.cancel()
+            self._issueQuery(args).chainDeferred(d)
+
+
     def queryUDP(self, queries, timeout = None):
         """
         Make a number of DNS queries via UDP.
@@ -286,12 +501,12 @@ class Resolver(common.ResolverBase):
         if timeout is None:
             timeout = self.timeout
 
-        addresses = self.servers + list(self.dynServers)
+        addresses = self._orderedServers()
         if not addresses:
             return defer.fail(IOError("No domain name servers available"))
 
-        # Make sure we go through servers in the list in the order they were
-        # specified.
+        # Make sure we go through servers in the list starting with the one
+        # expected to answer fastest.
         addresses.reverse()
 
         used = addresses.pop()
@@ -340,18 +555,64 @@ class Resolver(common.ResolverBase):
         @type timeout: C{int}
         @param timeout: The number of seconds after which to fail.
 
+        Queries are sent over the existing connection with the fewest
+        outstanding queries.  A new connection is only opened if there are
+        none, or if all of them are busy and fewer than C{maxTCPConnections}
+        are open.  A query sent over a connection which was already open is
+        retried once if the connection is lost before it is answered, since
+        the server may have closed the connection as idle just as the query
+        was sent.
+
         @rtype: C{Deferred}
         """
-        if not len(self.connections):
-            address = self.pickServer()
-            if address is None:
-                return defer.fail(IOError("No domain name servers available"))
-            host, port = address
-            self._reactor.connectTCP(host, port, self.factory)
+        return self._queryTCP(queries, timeout, True)
+
+
+    def _queryTCP(self, queries, timeout, retry):
+        """
+        Implement L{queryTCP}.
+
+        @param retry: If C{True}, retry the query once if its connection is
+            lost before it is answered.
+        """
+        if self.connections:
+            protocol = min(
+                self.connections,
+                key=lambda connection: len(connection.liveMessages))
+            if (not protocol.liveMessages or self.pending
+                    or len(self.connections) >= self.maxTCPConnections):
+                idleCall = self._idleCalls.pop(protocol, None)
+                if idleCall is not None:
+                    idleCall.cancel()
+                d = protocol.query(queries, timeout)
+                def cbQueried(result):
+                    self._connectionIdle(protocol)
+                    return result
+                d.addBoth(cbQueried)
+                if retry:
+                    d.addErrback(self._reissueTCP, queries, timeout)
+                return d
+        elif self.pending:
+            # A connection is already being established; the query will be
+            # sent over it once it is.
             self.pending.append((defer.Deferred(), queries, timeout))
             return self.pending[-1][0]
-        else:
-            return self.connections[0].query(queries, timeout)
+
+        address = self.pickServer()
+        if address is None:
+            return defer.fail(IOError("No domain name servers available"))
+        host, port = address
+        self._reactor.connectTCP(host, port, self.factory)
+        self.pending.append((defer.Deferred(), queries, timeout))
+        return self.pending[-1][0]
+
+
+    def _reissueTCP(self, reason, queries, timeout):
+        """
+        Retry a TCP query whose connection was closed before it was answered.
+        """
+        reason.trap(error.ConnectionClosed)
+        return self._queryTCP(queries, timeout, False)
 
 
     def filterAnswers(self, message):
@@ -409,12 +670,74 @@ class Resolver(common.ResolverBase):
 
     # This one doesn't ever belong on UDP
     def lookupZone(self, name, timeout=10):
+        controller = AXFRController(name, defer.Deferred())
+        return self._transferZone(controller, timeout).addCallback(
+            lambda records: (records, [], []))
+
+
+    def streamZone(self, name, recordsReceived, timeout=10):
+        """
+        Perform a zone transfer, delivering the records of the zone as they
+        arrive instead of collecting them all in memory.
+
+        @type name: C{bytes}
+        @param name: The name of the zone to transfer.
+
+        @param recordsReceived: A one-argument callable which will be called
+            with a C{list} of L{dns.RRHeader} instances each time a message of
+            the transfer is received.  The first record of the first list and
+            the last record of the last list are the zone's SOA record.
+
+        @type timeout: C{int}
+        @param timeout: The number of seconds after which to give up on the
+            transfer.
+
+        @return: A L{Deferred} which fires with the SOA L{dns.RRHeader} of the
+            zone once the whole zone has been received.
+        """
+        return self._transferZone(
+            AXFRController(name, defer.Deferred(), recordsReceived), timeout)
+
+
+    def streamZoneChanges(self, name, soa, zone, timeout=10):
+        """
+        Perform an incremental zone transfer (RFC 1995), delivering the
+        changes made to the zone since the version identified by C{soa}.
+
+        @type name: C{bytes}
+        @param name: The name of the zone to transfer.
+
+        @type soa: L{dns.RRHeader}
+        @param soa: The SOA record of the version of the zone already held.
+
+        @param zone: The object to which the changes are delivered, as
+            described by L{IXFRController}.
+
+        @type timeout: C{int}
+        @param timeout: The number of seconds after which to give up on the
+            transfer.
+
+        @return: A L{Deferred} which fires with the current SOA
+            L{dns.RRHeader} of the zone once the transfer is complete.
+        """
+        return self._transferZone(
+            IXFRController(name, soa, defer.Deferred(), zone), timeout)
+
+
+    def _transferZone(self, controller, timeout):
+        """
+        Let C{controller} issue its zone transfer query over a new TCP
+        connection.
+
+        @param controller: An L{AXFRController} or L{IXFRController}.
+
+        @return: A L{Deferred} which fires with the result of the controller.
+        """
         address = self.pickServer()
         if address is None:
             return defer.fail(IOError('No domain name servers available'))
         host, port = address
-        d = defer.Deferred()
-        controller = AXFRController(name, d)
+        d = controller.deferred
         factory = DNSClientFactory(controller, timeout)
         factory.noisy = False #stfu
 
@@ -422,7 +745,7 @@ class Resolver(common.ResolverBase):
         controller.timeoutCall = self._reactor.callLater(
             timeout or 10, self._timeoutZone, d, controller,
             connector, timeout or 10)
-        return d.addCallback(self._cbLookupZone, connector)
+        return d.addBoth(self._cbTransferZone, connector)
 
 
     def _timeoutZone(self, d, controller, connector, seconds):
@@ -432,20 +755,35 @@ class Resolver(common.ResolverBase):
         d.errback(error.TimeoutError("Zone lookup timed out after %d seconds" % (seconds,)))
 
 
-    def _cbLookupZone(self, result, connector):
+    def _cbTransferZone(self, result, connector):
         connector.disconnect()
-        return (result, [], [])
+        return result
 
 
 
 class AXFRController:
+    """
+    Issue an AXFR query over a L{dns.DNSProtocol} connection and collect the
+    response, which may be spread over many messages.
+
+    @ivar recordsReceived: C{None} to collect all of the records of the zone
+        in C{records}, or a one-argument callable to which the records of each
+        message are passed as they arrive instead.
+
+    @ivar deferred: A L{Deferred} which fires when the transfer is complete,
+        with C{records} or, if C{recordsReceived} is given, with C{soa}.
+
+    @ivar _received: The number of records received so far.
+    """
     timeoutCall = None
 
-    def __init__(self, name, deferred):
+    def __init__(self, name, deferred, recordsReceived=None):
         self.name = name
         self.deferred = deferred
+        self.recordsReceived = recordsReceived
         self.soa = None
         self.records = []
+        self._received = 0
 
 
     def connectionMade(self, protocol):
@@ -467,23 +805,167 @@ class AXFRController:
         # According to http://cr.yp.to/djbdns/axfr-notes.html,
         # 'authority' and 'additional' are always empty, and only
         # 'answers' is present.
-        self.records.extend(message.answers)
-        if not self.records:
+        answers = message.answers
+        if not answers:
             return
-        if not self.soa:
-            if self.records[0].type == dns.SOA:
-                #print "first SOA!"
-                self.soa = self.records[0]
-        if len(self.records) > 1 and self.records[-1].type == dns.SOA:
+        if not self._received and answers[0].type == dns.SOA:
+            #print "first SOA!"
+            self.soa = answers[0]
+        self._received += len(answers)
+        if self.recordsReceived is None:
+            self.records.extend(answers)
+        else:
+            self.recordsReceived(answers)
+        if self._received > 1 and answers[-1].type == dns.SOA:
             #print "It's the second SOA! We're done."
             if self.timeoutCall is not None:
                 self.timeoutCall.cancel()
                 self.timeoutCall = None
             if self.deferred is not None:
-                self.deferred.callback(self.records)
+                if self.recordsReceived is None:
+                    self.deferred.callback(self.records)
+                else:
+                    self.deferred.callback(self.soa)
+                self.deferred = None
+
+
+
+class IXFRController(AXFRController):
+    """
+    Issue an IXFR query (RFC 1995) over a L{dns.DNSProtocol} connection and
+    deliver the changes in the response to a zone object as they arrive.
+
+    The zone object must have three methods, each taking a C{list} of
+    L{dns.RRHeader} instances:
+
+      - C{recordsDeleted} and C{recordsAdded} are called, in the order in
+        which the changes must be applied, if the server responds with the
+        differences between the version identified by C{currentSOA} and its
+        current version.
+
+      - C{recordsReceived} is called, as by L{AXFRController}, if the server
+        responds with the whole zone instead.
+
+    None of them are called if the zone has not changed.
+
+    If the server responds with an error, or with something other than an
+    SOA record, C{deferred} fails with a L{twisted.names.error.DomainError}:
+    the server does not support IXFR for the zone, and a full transfer
+    (L{AXFRController}) should be used instead.
+
+    @ivar currentSOA: The SOA L{dns.RRHeader} of the version of the zone
+        already held.
+
+    @ivar zone: The object to which the changes are delivered.
+
+    @ivar deferred: A L{Deferred} which fires with the current SOA
+        L{dns.RRHeader} of the zone once the transfer is complete.
+
+    @ivar _state: The part of the response the next record belongs to.
+    """
+    _START, _SECOND, _FULL, _DELETING, _ADDING, _DONE = range(6)
+
+    def __init__(self, name, currentSOA, deferred, zone):
+        AXFRController.__init__(self, name, deferred, zone.recordsReceived)
+        self.currentSOA = currentSOA
+        self.zone = zone
+        self._state = self._START
+
+
+    def connectionMade(self, protocol):
+        message = dns.Message(protocol.pickID(), recDes=0)
+        message.queries = [dns.Query(self.name, dns.IXFR, dns.IN)]
+        message.authority = [self.currentSOA]
+        protocol.writeMessage(message)
+
+
+    def messageReceived(self, message, protocol):
+        """
+        Classify the records of a response message and deliver them to
+        C{zone}, completing the transfer once the final SOA record arrives.
+        """
+        if self._state == self._START:
+            if message.rCode != dns.OK:
+                self._fail(common.ResolverBase._errormap.get(
+                    message.rCode, DNSUnknownError)(message))
+                return
+            if not message.answers or message.answers[0].type != dns.SOA:
+                self._fail(DNSNotImplementedError(message))
+                return
+
+        serial = self.currentSOA.payload.serial
+        batches = []
+        deliver = batch = None
+
+        for record in message.answers:
+            state = self._state
+            isSOA = record.type == dns.SOA
+            if state == self._DONE:
+                break
+            elif state == self._START:
+                self.soa = record
+                if isSOA and record.payload.serial == serial:
+                    state = self._DONE
+                else:
+                    state = self._SECOND
+            elif state == self._SECOND and isSOA and (
+                    record.payload.serial == serial):
+                state = self._DELETING
+            elif state in (self._SECOND, self._FULL):
+                if deliver != self.zone.recordsReceived:
+                    deliver, batch = self.zone.recordsReceived, []
+                    batches.append((deliver, batch))
+                if state == self._SECOND:
+                    # The first record was the start of a full transfer.
+                    batch.append(self.soa)
+                batch.append(record)
+                if isSOA:
+                    state = self._DONE
+                else:
+                    state = self._FULL
+            elif isSOA:
+                if state == self._DELETING:
+                    state = self._ADDING
+                elif record.payload.serial == self.soa.payload.serial:
+                    state = self._DONE
+                else:
+                    state = self._DELETING
+            else:
+                if state == self._DELETING:
+                    method = self.zone.recordsDeleted
+                else:
+                    method = self.zone.recordsAdded
+                if method != deliver:
+                    deliver, batch = method, []
+                    batches.append((deliver, batch))
+                batch.append(record)
+            self._state = state
+
+        for deliver, batch in batches:
+            deliver(batch)
+
+        if self._state == self._DONE:
+            if self.timeoutCall is not None:
+                self.timeoutCall.cancel()
+                self.timeoutCall = None
+            if self.deferred is not None:
+                self.deferred.callback(self.soa)
                 self.deferred = None
 
 
+    def _fail(self, reason):
+        """
+        Give up on the transfer, failing C{deferred} with C{reason}.
+        """
+        self._state = self._DONE
+        if self.timeoutCall is not None:
+            self.timeoutCall.cancel()
+            self.timeoutCall = None
+        if self.deferred is not None:
+            d, self.deferred = self.deferred, None
+            d.errback(reason)
+
+
 
 from twisted.internet.base import ThreadedResolver as _ThreadedResolverImpl
 
@@ -2391,10 +2391,16 @@ class DNSProtocol(DNSMixin, protocol.Protocol):
 
     def connectionLost(self, reason):
         """
-        Notify the controller that this protocol is no longer
-        connected.
+        Notify the controller that this protocol is no longer connected and
+        fail all outstanding queries with C{reason}.
         """
         self.controller.connectionLost(self)
+        liveMessages = self.liveMessages
+        self.liveMessages = {}
+        if liveMessages:
+            for d, canceller in liveMessages.values():
+                canceller.cancel()
+                d.errback(reason)
 
 
     def dataReceived(self, data):
@@ -90,12 +90,26 @@ class SecondaryAuthority(common.ResolverBase):
 
     @ivar _reactor: The reactor to use to perform the zone transfers, or C{None}
         to use the global reactor.
+
+    @ivar _newSOA: During a full zone transfer, the SOA of the zone being
+        received, as a C{(name, payload)} tuple.
+    @ivar _newRecords: During a full zone transfer, the C{dict} of records
+        of the zone being received, which replaces C{records} once the
+        transfer completes.
+    @ivar _changes: During an incremental zone transfer, a C{list} of
+        C{(added, records)} tuples giving the changes received so far, which
+        are applied to C{records} once the transfer completes.
+    @ivar _notified: C{True} if a NOTIFY message was received while a zone
+        transfer was in progress, so that another transfer is needed once it
+        completes.
     """
 
     transferring = False
     soa = records = None
     _port = 53
     _reactor = None
+    _newSOA = _newRecords = _changes = None
+    _notified = False
 
     def __init__(self, primaryIP, domain):
         common.ResolverBase.__init__(self)
@@ -127,9 +141,22 @@ class SecondaryAuthority(common.ResolverBase):
 
 
     def transfer(self):
+        """
+        Bring the zone up to date with the primary server.
+
+        The first transfer retrieves the whole zone with AXFR.  Later
+        transfers use IXFR, so only the changes made since the version
+        already held are retrieved, unless the server chooses to send the
+        whole zone anyway.  If the server does not support IXFR, AXFR is used
+        instead.  Records are indexed as they arrive and the new
+        version of the zone replaces the old one once the transfer completes.
+
+        @return: A L{Deferred} which fires when the transfer is complete, or
+            C{None} if a transfer is already in progress.
+        """
         if self.transferring:
             return
-        self.transfering = True
+        self.transferring = True
 
         reactor = self._reactor
         if reactor is None:
@@ -137,12 +164,87 @@ class SecondaryAuthority(common.ResolverBase):
 
         resolver = client.Resolver(
             servers=[(self.primary, self._port)], reactor=reactor)
-        return resolver.lookupZone(self.domain
-            ).addCallback(self._cbZone
+        if self.soa is None:
+            d = resolver.streamZone(self.domain, self.recordsReceived)
+        else:
+            name, payload = self.soa
+            current = dns.RRHeader(name, dns.SOA, dns.IN, payload=payload)
+            d = resolver.streamZoneChanges(self.domain, current, self)
+            d.addErrback(self._ebIncremental, resolver)
+        return d.addCallback(self._cbZone
             ).addErrback(self._ebZone
+            ).addBoth(self._transferFinished
             )
 
 
+    def notifyReceived(self, name, host):
+        """
+        Handle a NOTIFY message (RFC 1996) announcing that a zone has changed
+        by starting a zone transfer, if it is about this zone and came from
+        the primary server.
+
+        @type name: C{str}
+        @param name: The name of the zone which changed.
+
+        @type host: C{str}
+        @param host: The address the message was received from.
+
+        @return: C{True} if the message was accepted, C{False} otherwise.
+        """
+        if name.lower() != self.domain.lower() or host != self.primary:
+            return False
+        if self.transferring:
+            self._notified = True
+        else:
+            self.transfer()
+        return True
+
+
+    def recordsReceived(self, records):
+        """
+        Add records received during a full zone transfer to the new version of
+        the zone.
+
+        @type records: C{list} of L{dns.RRHeader}
+        """
+        if self._newRecords is None:
+            self._newRecords = {}
+        r = self._newRecords
+        for rec in records:
+            name = str(rec.name).lower()
+            if rec.type == dns.SOA:
+                # The zone's SOA record begins and ends the transfer; only
+                # keep one copy of it.
+                if self._newSOA is not None:
+                    continue
+                self._newSOA = (name, rec.payload)
+            r.setdefault(name, []).append(rec.payload)
+
+
+    def recordsDeleted(self, records):
+        """
+        Note records removed from the zone, received during an incremental
+        zone transfer.
+
+        @type records: C{list} of L{dns.RRHeader}
+        """
+        if self._changes is None:
+            self._changes = []
+        self._changes.append((False, records))
+
+
+    def recordsAdded(self, records):
+        """
+        Note records added to the zone, received during an incremental zone
+        transfer.
+
+        @type records: C{list} of L{dns.RRHeader}
+        """
+        if self._changes is None:
+            self._changes = []
+        self._changes.append((True, records))
+
+
     def _lookup(self, name, cls, type, timeout=None):
         if not self.soa or not self.records:
             return defer.fail(failure.Failure(dns.DomainError(name)))
@@ -154,26 +256,68 @@ class SecondaryAuthority(common.ResolverBase):
 
     lookupZone = FileAuthority.__dict__['lookupZone']
 
-    def _cbZone(self, zone):
-        ans, _, _ = zone
-        self.records = r = {}
-        for rec in ans:
-            if not self.soa and rec.type == dns.SOA:
-                self.soa = (str(rec.name).lower(), rec.payload)
-            else:
-                r.setdefault(str(rec.name).lower(), []).append(rec.payload)
+    def _cbZone(self, soa):
+        """
+        Replace the zone with the newly transferred version, or apply the
+        changes received by an incremental transfer to it.
+
+        @param soa: The current SOA L{dns.RRHeader} of the zone.
+        """
+        if self._newRecords is not None:
+            self.records = self._newRecords
+            self.soa = self._newSOA
+        elif self._changes is not None:
+            r = self.records
+            for added, records in self._changes:
+                for rec in records:
+                    name = str(rec.name).lower()
+                    if added:
+                        r.setdefault(name, []).append(rec.payload)
+                    elif rec.payload in r.get(name, ()):
+                        r[name].remove(rec.payload)
+                        if not r[name]:
+                            del r[name]
+            name = self.soa[0]
+            zone = r.setdefault(name, [])
+            zone[:] = [rec for rec in zone if rec.TYPE != dns.SOA]
+            zone.append(soa.payload)
+            self.soa = (name, soa.payload)
+
+
+    def _ebIncremental(self, reason, resolver):
+        """
+        Fall back to a full zone transfer if the primary server refused an
+        incremental one.
+        """
+        reason.trap(dns.DomainError)
+        self._newSOA = self._newRecords = self._changes = None
+        return resolver.streamZone(self.domain, self.recordsReceived)
+
 
     def _ebZone(self, failure):
         log.msg("Updating %s from %s failed during zone transfer" % (self.domain, self.primary))
         log.err(failure)
 
-    def update(self):
-        self.transfer().addCallbacks(self._cbTransferred, self._ebTransferred)
 
-    def _cbTransferred(self, result):
+    def _transferFinished(self, ignored):
+        """
+        Discard the state of a finished zone transfer, and start another one
+        if a NOTIFY message arrived while it was in progress.
+        """
+        self._newSOA = self._newRecords = self._changes = None
         self.transferring = False
+        if self._notified:
+            self._notified = False
+            self.transfer()
+
+    def update(self):
+        """
+        Start a zone transfer, unless one is already in progress.
+        """
+        d = self.transfer()
+        if d is not None:
+            d.addErrback(self._ebTransferred)
 
     def _ebTransferred(self, failure):
-        self.transferred = False
         log.msg("Transferring %s from %s failed after zone transfer" % (self.domain, self.primary))
         log.err(failure)
@@ -155,12 +155,53 @@ class DNSServerFactory(protocol.ServerFactory):
 
 
     def handleNotify(self, message, protocol, address):
-        message.rCode = dns.ENOTIMP
+        """
+        Pass a NOTIFY message (RFC 1996) on to the authorities which can act
+        on it, such as L{twisted.names.secondary.SecondaryAuthority}, and
+        acknowledge it if any of them accepted it.
+        """
+        if address is None:
+            host = protocol.transport.getPeer().host
+        else:
+            host = address[0]
+
+        accepted = False
+        for query in message.queries:
+            name = str(query.name)
+            if self._notifyAuthorities(self.resolver.resolvers, name, host):
+                accepted = True
+
+        if accepted:
+            message.rCode = dns.OK
+            message.auth = 1
+        else:
+            message.rCode = dns.EREFUSED
         self.sendReply(protocol, message, address)
         if self.verbose:
             log.msg("Notify message from %r" % (address,))
 
 
+    def _notifyAuthorities(self, resolvers, name, host):
+        """
+        Call C{notifyReceived} on each of the given resolvers, and of the
+        resolvers of any L{resolve.ResolverChain} among them, which has such
+        a method.
+
+        @return: C{True} if any of them accepted the notification.
+        """
+        accepted = False
+        for resolver in resolvers:
+            if isinstance(resolver, resolve.ResolverChain):
+                notified = self._notifyAuthorities(
+                    resolver.resolvers, name, host)
+            else:
+                notifyReceived = getattr(resolver, 'notifyReceived', None)
+                notified = (notifyReceived is not None
+                            and notifyReceived(name, host))
+            accepted = accepted or notified
+        return accepted
+
+
     def handleOther(self, message, protocol, address):
         message.rCode = dns.ENOTIMP
         self.sendReply(protocol, message, address)
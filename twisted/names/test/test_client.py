@@ -5,6 +5,8 @@
 Test cases for L{twisted.names.client}.
 """
 
+import struct
+
 from zope.interface.verify import verifyClass, verifyObject
 
 from twisted.python import failure
@@ -13,6 +15,7 @@ from twisted.python.runtime import platform
 
 from twisted.internet import defer
 from twisted.internet.error import CannotListenError, ConnectionRefusedError
+from twisted.internet.error import ConnectionDone, ConnectionLost
 from twisted.internet.interfaces import IResolver
 from twisted.internet.test.modulehelpers import AlternateReactor
 from twisted.internet.task import Clock
@@ -796,6 +799,256 @@ class ResolverTests(unittest.TestCase):
 
 
 
+class PersistentTCPTests(unittest.TestCase):
+    """
+    Tests for the multiplexing of queries over persistent TCP connections by
+    L{client.Resolver.queryTCP}.
+    """
+    def setUp(self):
+        self.reactor = proto_helpers.MemoryReactorClock()
+        self.resolver = client.Resolver(
+            servers=[('192.0.2.100', 53)], reactor=self.reactor,
+            maxTCPConnections=2, tcpIdleTimeout=30)
+
+
+    def connect(self):
+        """
+        Connect a new L{dns.DNSProtocol} for the most recent TCP connection
+        attempt of the resolver.
+
+        @return: The connected protocol.
+        """
+        factory = self.reactor.tcpClients[-1][2]
+        protocol = factory.buildProtocol(None)
+        protocol.callLater = self.reactor.callLater
+        protocol.makeConnection(proto_helpers.StringTransport())
+        return protocol
+
+
+    def respond(self, protocol, id):
+        """
+        Deliver an empty response to the query with the given id to the
+        protocol.
+        """
+        response = dns.Message(id=id, answer=1).toStr()
+        protocol.dataReceived(struct.pack('!H', len(response)) + response)
+
+
+    def test_singleConnectionAttempt(self):
+        """
+        Queries made while the first connection is being established wait
+        for it instead of opening more connections, and are all sent over it
+        once it is established.
+        """
+        self.resolver.queryTCP([dns.Query(b'example.com')])
+        self.resolver.queryTCP([dns.Query(b'example.net')])
+        self.assertEqual(len(self.reactor.tcpClients), 1)
+
+        protocol = self.connect()
+        self.assertEqual(len(protocol.liveMessages), 2)
+        self.assertEqual(self.resolver.pending, [])
+
+
+    def test_idleConnectionReused(self):
+        """
+        A query made after earlier queries on a connection have been answered
+        is sent over the same connection.
+        """
+        self.resolver.queryTCP([dns.Query(b'example.com')])
+        protocol = self.connect()
+        id, = protocol.liveMessages.keys()
+        self.respond(protocol, id)
+
+        self.resolver.queryTCP([dns.Query(b'example.net')])
+        self.assertEqual(len(self.reactor.tcpClients), 1)
+        self.assertEqual(len(protocol.liveMessages), 1)
+
+
+    def test_busyConnectionsMultiplexed(self):
+        """
+        When every connection has outstanding queries, a new connection is
+        opened, up to C{maxTCPConnections}, beyond which queries are
+        multiplexed over the least busy existing connection.
+        """
+        self.resolver.queryTCP([dns.Query(b'example.com')])
+        first = self.connect()
+
+        self.resolver.queryTCP([dns.Query(b'example.net')])
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+        second = self.connect()
+        self.assertEqual(len(second.liveMessages), 1)
+
+        self.resolver.queryTCP([dns.Query(b'example.org')])
+        self.resolver.queryTCP([dns.Query(b'example.info')])
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+        self.assertEqual(len(first.liveMessages), 2)
+        self.assertEqual(len(second.liveMessages), 2)
+
+
+    def test_responsesMatchedById(self):
+        """
+        Responses to queries multiplexed over one connection are delivered to
+        the query with the same message id, in whatever order they arrive.
+        """
+        self.resolver.maxTCPConnections = 1
+        first = self.resolver.queryTCP([dns.Query(b'example.com')])
+        second = self.resolver.queryTCP([dns.Query(b'example.net')])
+        protocol = self.connect()
+
+        sent = protocol.transport.value()
+        length, = struct.unpack('!H', sent[:2])
+        firstMessage = dns.Message()
+        firstMessage.fromStr(sent[2:2 + length])
+        secondMessage = dns.Message()
+        secondMessage.fromStr(sent[4 + length:])
+
+        self.respond(protocol, secondMessage.id)
+        self.assertNoResult(first)
+        self.assertEqual(self.successResultOf(second).id, secondMessage.id)
+        self.respond(protocol, firstMessage.id)
+        self.assertEqual(self.successResultOf(first).id, firstMessage.id)
+
+
+    def test_idleTimeout(self):
+        """
+        A connection which has had no outstanding queries for
+        C{tcpIdleTimeout} seconds is closed and no longer used.
+        """
+        self.resolver.queryTCP([dns.Query(b'example.com')], 60)
+        protocol = self.connect()
+        id, = protocol.liveMessages.keys()
+
+        self.reactor.advance(29)
+        self.respond(protocol, id)
+        self.reactor.advance(29)
+        self.assertFalse(protocol.transport.disconnecting)
+        self.reactor.advance(1)
+        self.assertTrue(protocol.transport.disconnecting)
+        self.assertEqual(self.resolver.connections, [])
+
+        self.resolver.queryTCP([dns.Query(b'example.net')])
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+
+
+    def test_usePostponesIdleTimeout(self):
+        """
+        Sending a query over an idle connection cancels its idle timeout.
+        """
+        self.resolver.queryTCP([dns.Query(b'example.com')])
+        protocol = self.connect()
+        id, = protocol.liveMessages.keys()
+        self.respond(protocol, id)
+
+        self.reactor.advance(20)
+        self.resolver.queryTCP([dns.Query(b'example.net')], 60)
+        self.reactor.advance(20)
+        self.assertFalse(protocol.transport.disconnecting)
+
+
+    def test_noIdleTimeoutByDefault(self):
+        """
+        If no C{tcpIdleTimeout} is given, idle connections are left open.
+        """
+        resolver = client.Resolver(
+            servers=[('192.0.2.100', 53)], reactor=self.reactor)
+        resolver.queryTCP([dns.Query(b'example.com')])
+        protocol = self.connect()
+        id, = protocol.liveMessages.keys()
+        self.respond(protocol, id)
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
+
+
+    def test_retryAfterConnectionLost(self):
+        """
+        A query sent over an established connection which is lost before the
+        query is answered is sent again over a new connection.
+        """
+        self.resolver.queryTCP([dns.Query(b'example.com')])
+        protocol = self.connect()
+        id, = protocol.liveMessages.keys()
+        self.respond(protocol, id)
+
+        d = self.resolver.queryTCP([dns.Query(b'example.net')])
+        protocol.connectionLost(failure.Failure(ConnectionDone()))
+        self.assertNoResult(d)
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+
+        protocol = self.connect()
+        id, = protocol.liveMessages.keys()
+        self.respond(protocol, id)
+        self.assertEqual(self.successResultOf(d).id, id)
+
+
+    def test_retriedOnce(self):
+        """
+        If the connection over which a query is retried is also lost, the
+        query fails with the reason the connection was lost.
+        """
+        self.resolver.queryTCP([dns.Query(b'example.com')])
+        protocol = self.connect()
+        id, = protocol.liveMessages.keys()
+        self.respond(protocol, id)
+
+        d = self.resolver.queryTCP([dns.Query(b'example.net')])
+        protocol.connectionLost(failure.Failure(ConnectionDone()))
+        self.connect().connectionLost(failure.Failure(ConnectionLost()))
+        self.failureResultOf(d, ConnectionLost)
+
+
+    def test_newConnectionNotRetried(self):
+        """
+        Queries waiting for a new connection are not retried if that
+        connection is lost before they are answered.
+        """
+        d = self.resolver.queryTCP([dns.Query(b'example.com')])
+        self.connect().connectionLost(failure.Failure(ConnectionLost()))
+        self.failureResultOf(d, ConnectionLost)
+        self.assertEqual(len(self.reactor.tcpClients), 1)
+
+
+
+class StreamZoneTests(unittest.TestCase):
+    """
+    Tests for L{client.Resolver.streamZone}.
+    """
+    def test_recordsDelivered(self):
+        """
+        L{client.Resolver.streamZone} issues an AXFR query over a new TCP
+        connection, passes the records of each response message to the given
+        callable and fires its L{Deferred} with the SOA record of the zone,
+        disconnecting, once the transfer is complete.
+        """
+        reactor = proto_helpers.MemoryReactorClock()
+        resolver = client.Resolver(
+            servers=[('192.0.2.100', 53)], reactor=reactor)
+        received = []
+        d = resolver.streamZone(b'example.com', received.append)
+
+        factory = reactor.tcpClients[0][2]
+        protocol = factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport()
+        protocol.makeConnection(transport)
+        request = dns.Message()
+        request.fromStr(transport.value()[2:])
+        self.assertEqual(
+            request.queries, [dns.Query(b'example.com', dns.AXFR, dns.IN)])
+
+        soa = dns.RRHeader(
+            b'example.com', dns.SOA, payload=dns.Record_SOA(serial=1))
+        a = dns.RRHeader(
+            b'www.example.com', dns.A, payload=dns.Record_A('192.0.2.1'))
+        for answers in [[soa, a], [soa]]:
+            response = dns.Message(id=request.id, answer=1)
+            response.answers = answers
+            protocol.controller.messageReceived(response, protocol)
+
+        self.assertEqual(received, [[soa, a], [soa]])
+        self.assertIdentical(self.successResultOf(d), soa)
+        self.assertTrue(reactor.connectors[0]._disconnected)
+        self.assertEqual(reactor.getDelayedCalls(), [])
+
+
+
 class ClientTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -1192,6 +1445,180 @@ class RetryLogic(unittest.TestCase):
 
 
 
+class ServerSelectionTests(unittest.TestCase):
+    """
+    Tests for the selection of nameservers by L{client.Resolver} according to
+    how quickly they have answered earlier queries.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.protocol = StubDNSDatagramProtocol()
+        self.servers = [('192.0.2.1', 53), ('192.0.2.2', 53)]
+        self.resolver = client.Resolver(
+            servers=self.servers, reactor=self.clock)
+        self.resolver._connectedProtocol = lambda: self.protocol
+
+
+    def test_unmeasuredServersInOrder(self):
+        """
+        Before any queries have been answered, L{client.Resolver.pickServer}
+        returns the first configured server.
+        """
+        self.assertEqual(self.resolver.pickServer(), self.servers[0])
+
+
+    def test_noServers(self):
+        """
+        L{client.Resolver.pickServer} returns C{None} if there are no
+        nameservers.
+        """
+        self.resolver.servers = []
+        self.assertIdentical(self.resolver.pickServer(), None)
+
+
+    def test_fasterServerPreferred(self):
+        """
+        Once each server has answered a query, L{client.Resolver.queryUDP}
+        sends new queries to the server which answered most quickly first.
+        """
+        queries = self.protocol.queries
+
+        self.resolver.queryUDP([dns.Query(b'example.com')])
+        self.clock.advance(0.5)
+        queries.pop()[-1].callback(dns.Message())
+
+        # The second server has not been measured yet, so it is tried next.
+        self.resolver.queryUDP([dns.Query(b'example.com')])
+        self.assertEqual(queries[-1][0], self.servers[1])
+        self.clock.advance(0.1)
+        queries.pop()[-1].callback(dns.Message())
+
+        self.resolver.queryUDP([dns.Query(b'example.com')])
+        self.assertEqual(queries[-1][0], self.servers[1])
+        self.assertEqual(self.resolver.pickServer(), self.servers[1])
+
+
+    def test_timeoutPenalized(self):
+        """
+        A server which fails to answer a query within the timeout is treated
+        as at least as slow as that timeout, so other servers are preferred.
+        """
+        queries = self.protocol.queries
+
+        d = self.resolver.queryUDP([dns.Query(b'example.com')], timeout=(5,))
+        queries.pop()[-1].errback(DNSQueryTimeoutError(0))
+        self.assertEqual(queries[-1][0], self.servers[1])
+        queries.pop()[-1].callback(dns.Message())
+        self.successResultOf(d)
+
+        self.assertEqual(self.resolver._serverRTT[self.servers[0]], 5 * 0.98)
+        self.assertEqual(self.resolver.pickServer(), self.servers[1])
+
+
+    def test_smoothedRoundTripTime(self):
+        """
+        Each new round trip time measurement moves the estimate for a server
+        an eighth of the way towards the measured value, and the estimates of
+        other servers are decayed.
+        """
+        self.resolver._recordRTT(self.servers[0], 2.0)
+        self.resolver._recordRTT(self.servers[1], 1.0)
+        self.assertEqual(
+            self.resolver._serverRTT,
+            {self.servers[0]: 2.0 * 0.98, self.servers[1]: 1.0})
+        self.resolver._serverRTT[self.servers[0]] = 2.0
+        self.resolver._recordRTT(self.servers[0], 10.0)
+        self.assertEqual(
+            self.resolver._serverRTT,
+            {self.servers[0]: 3.0, self.servers[1]: 0.98})
+
+
+
+class OutstandingQueryLimitTests(unittest.TestCase):
+    """
+    Tests for the limit L{client.Resolver} places on the number of queries
+    outstanding to each nameserver.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.protocol = StubDNSDatagramProtocol()
+        self.resolver = client.Resolver(
+            servers=[('192.0.2.1', 53)], reactor=self.clock,
+            maxOutstandingQueries=1)
+        self.resolver._connectedProtocol = lambda: self.protocol
+
+
+    def test_unlimitedByDefault(self):
+        """
+        If no limit is given, queries are sent as soon as they are made.
+        """
+        self.protocol = StubDNSDatagramProtocol()
+        resolver = client.Resolver(
+            servers=[('192.0.2.1', 53)], reactor=self.clock)
+        resolver._connectedProtocol = lambda: self.protocol
+        resolver.queryUDP([dns.Query(b'example.com')])
+        resolver.queryUDP([dns.Query(b'example.net')])
+        self.assertEqual(len(self.protocol.queries), 2)
+
+
+    def test_queuedUntilAnswered(self):
+        """
+        A query made while C{maxOutstandingQueries} queries are outstanding to
+        the server is sent once one of the outstanding queries is answered,
+        and its result is delivered to the caller.
+        """
+        queries = self.protocol.queries
+        first = self.resolver.queryUDP([dns.Query(b'example.com')])
+        second = self.resolver.queryUDP([dns.Query(b'example.net')])
+        self.assertEqual(len(queries), 1)
+
+        queries.pop(0)[-1].callback(dns.Message())
+        self.successResultOf(first)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0][1], [dns.Query(b'example.net')])
+
+        response = dns.Message()
+        queries.pop(0)[-1].callback(response)
+        self.assertIdentical(self.successResultOf(second), response)
+        self.assertEqual(self.resolver._outstanding, {})
+        self.assertEqual(self.resolver._backlog, {})
+
+
+    def test_queuedTimeout(self):
+        """
+        A query which waits in the queue for longer than its timeout fails
+        with L{DNSQueryTimeoutError} and is retried without ever having been
+        sent.
+        """
+        queries = self.protocol.queries
+        self.resolver.queryUDP([dns.Query(b'example.com')], timeout=(1, 3))
+        second = self.resolver.queryUDP(
+            [dns.Query(b'example.net')], timeout=(1,))
+        self.assertEqual(len(queries), 1)
+
+        self.clock.advance(1)
+        self.failureResultOf(second, defer.TimeoutError)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.resolver._backlog, {})
+
+
+    def test_timeoutFreesSlot(self):
+        """
+        A query which times out frees its slot, allowing a queued query to be
+        sent.
+        """
+        queries = self.protocol.queries
+        first = self.resolver.queryUDP(
+            [dns.Query(b'example.com')], timeout=(1,))
+        self.resolver.queryUDP([dns.Query(b'example.net')], timeout=(5,))
+        queries.pop(0)[-1].errback(DNSQueryTimeoutError(0))
+        self.failureResultOf(first, defer.TimeoutError)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0][1], [dns.Query(b'example.net')])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
 class ThreadedResolverTests(unittest.TestCase):
     """
     Tests for L{client.ThreadedResolver}.
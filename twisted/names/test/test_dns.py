@@ -972,6 +972,20 @@ class DNSProtocolTestCase(unittest.TestCase):
         self.assertEqual(self.controller.connections, [])
 
 
+    def test_connectionLostFailsQueries(self):
+        """
+        When L{dns.DNSProtocol} is disconnected, queries which have not been
+        answered fail with the reason the connection was lost and their
+        timeouts are cancelled.
+        """
+        d = self.proto.query([dns.Query(b'foo')])
+        self.proto.connectionLost(
+            Failure(ConnectionDone("Fake Connection Done")))
+        self.failureResultOf(d, ConnectionDone)
+        self.assertEqual(self.proto.liveMessages, {})
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
     def test_queryTimeout(self):
         """
         Test that query timeouts after some seconds.
@@ -13,10 +13,11 @@ from twisted.trial import unittest
 
 from twisted.internet import reactor, defer, error
 from twisted.internet.defer import succeed
-from twisted.names import client, server, common, authority, dns
+from twisted.names import client, server, common, authority, dns, resolve
 from twisted.python import failure
 from twisted.names.dns import Message
 from twisted.names.error import DomainError
+from twisted.names.error import DNSNotImplementedError, DNSQueryRefusedError
 from twisted.names.client import Resolver
 from twisted.names.secondary import (
     SecondaryAuthorityService, SecondaryAuthority)
@@ -482,6 +483,56 @@ class DNSServerFactoryTests(unittest.TestCase):
         self._messageReceivedTest('handleOther', Message(opCode=opCode))
 
 
+    def _notifyTest(self, authorities, name, address=('192.0.2.1', 53)):
+        """
+        Pass a NOTIFY message for the given zone, from the given address, to
+        a L{DNSServerFactory} with the given authorities.
+
+        @return: The reply written by the factory.
+        """
+        replies = []
+        class FakeProtocol(object):
+            def writeMessage(self, message, address):
+                replies.append(message)
+
+        factory = server.DNSServerFactory(authorities)
+        message = Message(opCode=dns.OP_NOTIFY)
+        message.queries = [dns.Query(name, dns.SOA, dns.IN)]
+        factory.messageReceived(message, FakeProtocol(), address)
+        return replies[0]
+
+
+    def test_notifyAccepted(self):
+        """
+        L{DNSServerFactory.handleNotify} passes the zone name and sender of a
+        NOTIFY message to the C{notifyReceived} method of its authorities,
+        including those inside a L{resolve.ResolverChain}, and replies with
+        C{OK} if any of them accepted it.
+        """
+        notified = []
+        class FakeAuthority(object):
+            def notifyReceived(self, name, host):
+                notified.append((name, host))
+                return True
+
+        authority = FakeAuthority()
+        reply = self._notifyTest(
+            [object(), resolve.ResolverChain([authority])], 'example.com')
+        self.assertEqual(notified, [('example.com', '192.0.2.1')])
+        self.assertEqual(reply.rCode, dns.OK)
+        self.assertTrue(reply.answer)
+
+
+    def test_notifyRefused(self):
+        """
+        L{DNSServerFactory.handleNotify} replies with C{EREFUSED} if none of
+        its authorities accept a NOTIFY message.
+        """
+        secondary = SecondaryAuthority('192.0.2.1', 'example.com')
+        reply = self._notifyTest([secondary], 'example.org')
+        self.assertEqual(reply.rCode, dns.EREFUSED)
+
+
     def test_connectionTracking(self):
         """
         The C{connectionMade} and C{connectionLost} methods of
@@ -501,6 +552,384 @@ class DNSServerFactoryTests(unittest.TestCase):
         self.assertEqual(factory.connections, [])
 
 
+class IXFRControllerTests(unittest.TestCase):
+    """
+    Tests for L{client.IXFRController}.
+    """
+    def setUp(self):
+        self.changes = []
+        self.d = defer.Deferred()
+        self.current = self._soa(1)
+        self.controller = client.IXFRController(
+            'example.com', self.current, self.d, self)
+
+
+    def recordsReceived(self, records):
+        self.changes.append(('received', records))
+
+
+    def recordsDeleted(self, records):
+        self.changes.append(('deleted', records))
+
+
+    def recordsAdded(self, records):
+        self.changes.append(('added', records))
+
+
+    def _soa(self, serial):
+        return dns.RRHeader(
+            'example.com', dns.SOA, payload=dns.Record_SOA(serial=serial))
+
+
+    def _a(self, name, address):
+        return dns.RRHeader(name, dns.A, payload=dns.Record_A(address))
+
+
+    def _deliver(self, *messages):
+        for answers in messages:
+            m = Message(answer=1)
+            m.answers = answers
+            self.controller.messageReceived(m, None)
+
+
+    def test_query(self):
+        """
+        L{client.IXFRController} sends an IXFR query with the SOA record of
+        the version of the zone already held in its authority section.
+        """
+        transport = StringTransport()
+        proto = dns.DNSProtocol(self.controller)
+        proto.makeConnection(transport)
+        msg = Message()
+        msg.fromStr(transport.value()[2:])
+        self.assertEqual(
+            msg.queries, [dns.Query('example.com', dns.IXFR, dns.IN)])
+        self.assertEqual(
+            [(rr.type, rr.payload.serial) for rr in msg.authority],
+            [(dns.SOA, 1)])
+
+
+    def test_upToDate(self):
+        """
+        If the response is only the SOA record of the version already held,
+        the transfer is complete and no changes are delivered.
+        """
+        self._deliver([self._soa(1)])
+        self.assertEqual(self.changes, [])
+        self.assertEqual(self.successResultOf(self.d), self._soa(1))
+
+
+    def test_incremental(self):
+        """
+        The records of each difference sequence in an incremental response
+        are delivered as deletions and additions, in order, and the transfer
+        completes with the final SOA record, however the response is split
+        into messages.
+        """
+        one, two = self._a('a.example.com', '192.0.2.1'), self._a(
+            'b.example.com', '192.0.2.2')
+        self._deliver(
+            [self._soa(3), self._soa(1), one],
+            [self._soa(2), two, self._soa(2)],
+            [two, self._soa(3), one],
+            [self._soa(3)])
+        self.assertEqual(self.changes, [
+                ('deleted', [one]), ('added', [two]),
+                ('deleted', [two]), ('added', [one])])
+        self.assertEqual(self.successResultOf(self.d), self._soa(3))
+
+
+    def test_full(self):
+        """
+        If the server responds with the whole zone, as for an AXFR query, the
+        records are delivered to C{recordsReceived}.
+        """
+        one = self._a('a.example.com', '192.0.2.1')
+        self._deliver([self._soa(2), one], [self._soa(2)])
+        self.assertEqual(self.changes, [
+                ('received', [self._soa(2), one]),
+                ('received', [self._soa(2)])])
+        self.assertEqual(self.successResultOf(self.d), self._soa(2))
+
+
+    def test_errorResponse(self):
+        """
+        If the server responds to the IXFR query with an error, the transfer
+        fails with the corresponding L{DomainError}.
+        """
+        m = Message(answer=1, rCode=dns.EREFUSED)
+        self.controller.messageReceived(m, None)
+        self.failureResultOf(self.d, DNSQueryRefusedError)
+        self.assertEqual(self.changes, [])
+
+
+    def test_noSOA(self):
+        """
+        If the first message of the response does not begin with an SOA
+        record, IXFR is not supported for the zone and the transfer fails
+        with L{DNSNotImplementedError}.
+        """
+        self._deliver([])
+        self.failureResultOf(self.d, DNSNotImplementedError)
+
+        self.d = defer.Deferred()
+        self.controller = client.IXFRController(
+            'example.com', self.current, self.d, self)
+        self._deliver([self._a('a.example.com', '192.0.2.1')])
+        self.failureResultOf(self.d, DNSNotImplementedError)
+        self.assertEqual(self.changes, [])
+
+
+
+class SecondaryTransferTests(unittest.TestCase):
+    """
+    Tests for the zone transfers of L{SecondaryAuthority}.
+    """
+    def setUp(self):
+        self.secondary = SecondaryAuthority.fromServerAddressAndDomain(
+            ('192.0.2.1', 53), 'example.com')
+        self.secondary._reactor = self.reactor = MemoryReactorClock()
+
+
+    def _soa(self, serial):
+        return dns.RRHeader(
+            'example.com', dns.SOA, payload=dns.Record_SOA(serial=serial))
+
+
+    def _a(self, name, address):
+        return dns.RRHeader(name, dns.A, payload=dns.Record_A(address))
+
+
+    def _transfer(self, *messages):
+        """
+        Start a zone transfer and deliver the given lists of answers to it as
+        the response.
+
+        @return: The query sent by the secondary.
+        """
+        d = self.secondary.transfer()
+        factory = self.reactor.tcpClients[-1][2]
+        proto = factory.buildProtocol(None)
+        transport = StringTransport()
+        proto.makeConnection(transport)
+        query = Message()
+        query.fromStr(transport.value()[2:])
+        for answers in messages:
+            m = Message(id=query.id, answer=1)
+            m.answers = answers
+            proto.controller.messageReceived(m, proto)
+        self.successResultOf(d)
+        return query
+
+
+    def test_fullTransfer(self):
+        """
+        The first transfer retrieves the whole zone with AXFR, streaming the
+        records into a new index which becomes the zone once the transfer is
+        complete.
+        """
+        one = self._a('a.example.com', '192.0.2.1')
+        two = self._a('A.example.com', '192.0.2.2')
+        query = self._transfer([self._soa(1), one], [two, self._soa(1)])
+
+        self.assertEqual(query.queries[0].type, dns.AXFR)
+        self.assertEqual(
+            self.secondary.soa, ('example.com', self._soa(1).payload))
+        self.assertEqual(self.secondary.records, {
+                'example.com': [self._soa(1).payload],
+                'a.example.com': [one.payload, two.payload]})
+        self.assertFalse(self.secondary.transferring)
+
+
+    def test_incrementalTransfer(self):
+        """
+        Once the zone is held, transfers use IXFR and the changes received
+        are applied to the zone once the transfer is complete.
+        """
+        one = self._a('a.example.com', '192.0.2.1')
+        two = self._a('b.example.com', '192.0.2.2')
+        self._transfer([self._soa(1), one, self._soa(1)])
+        records = self.secondary.records
+
+        query = self._transfer(
+            [self._soa(2), self._soa(1), one, self._soa(2), two,
+             self._soa(2)])
+
+        self.assertEqual(query.queries[0].type, dns.IXFR)
+        self.assertEqual(query.authority[0].payload.serial, 1)
+        self.assertIdentical(self.secondary.records, records)
+        self.assertEqual(self.secondary.records, {
+                'example.com': [self._soa(2).payload],
+                'b.example.com': [two.payload]})
+        self.assertEqual(
+            self.secondary.soa, ('example.com', self._soa(2).payload))
+
+
+    def test_upToDate(self):
+        """
+        If the primary server reports that the zone has not changed, the zone
+        is left as it is.
+        """
+        self._transfer([self._soa(1), self._soa(1)])
+        records = self.secondary.records
+        self._transfer([self._soa(1)])
+        self.assertIdentical(self.secondary.records, records)
+        self.assertEqual(
+            self.secondary.soa, ('example.com', self._soa(1).payload))
+
+
+    def test_notifyStartsTransfer(self):
+        """
+        A NOTIFY message about the zone from the primary server starts a zone
+        transfer.
+        """
+        self.assertTrue(
+            self.secondary.notifyReceived('EXAMPLE.com', '192.0.2.1'))
+        self.assertTrue(self.secondary.transferring)
+        self.assertEqual(len(self.reactor.tcpClients), 1)
+
+
+    def test_notifyIgnored(self):
+        """
+        NOTIFY messages about other zones or from hosts other than the
+        primary server are not accepted.
+        """
+        self.assertFalse(
+            self.secondary.notifyReceived('example.org', '192.0.2.1'))
+        self.assertFalse(
+            self.secondary.notifyReceived('example.com', '192.0.2.2'))
+        self.assertEqual(self.reactor.tcpClients, [])
+
+
+    def test_notifyDuringTransfer(self):
+        """
+        A NOTIFY message received while a transfer is in progress causes
+        another transfer to start once it completes.
+        """
+        d = self.secondary.transfer()
+        self.secondary.notifyReceived('example.com', '192.0.2.1')
+        self.assertEqual(len(self.reactor.tcpClients), 1)
+
+        proto = self.reactor.tcpClients[0][2].buildProtocol(None)
+        proto.makeConnection(StringTransport())
+        m = Message(answer=1)
+        m.answers = [self._soa(1), self._soa(1)]
+        proto.controller.messageReceived(m, proto)
+        self.successResultOf(d)
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+        self.assertTrue(self.secondary.transferring)
+
+
+    def test_updateDuringTransfer(self):
+        """
+        L{SecondaryAuthority.update} does nothing if a transfer is already in
+        progress.
+        """
+        self.secondary.notifyReceived('example.com', '192.0.2.1')
+        self.secondary.update()
+        self.assertEqual(len(self.reactor.tcpClients), 1)
+        self.assertTrue(self.secondary.transferring)
+
+
+    def test_updateAfterNotify(self):
+        """
+        A transfer started by L{SecondaryAuthority.update} that is followed
+        by another one, because a NOTIFY message arrived while it was in
+        progress, leaves C{transferring} set while that one runs.
+        """
+        self.secondary.update()
+        self.secondary.notifyReceived('example.com', '192.0.2.1')
+
+        proto = self.reactor.tcpClients[0][2].buildProtocol(None)
+        proto.makeConnection(StringTransport())
+        m = Message(answer=1)
+        m.answers = [self._soa(1), self._soa(1)]
+        proto.controller.messageReceived(m, proto)
+        self.assertEqual(len(self.reactor.tcpClients), 2)
+        self.assertTrue(self.secondary.transferring)
+
+
+    def test_incrementalRefused(self):
+        """
+        If the primary server responds to the IXFR query with an error, the
+        zone is transferred again with AXFR.
+        """
+        one = self._a('a.example.com', '192.0.2.1')
+        self._transfer([self._soa(1), self._soa(1)])
+
+        d = self.secondary.transfer()
+        proto = self.reactor.tcpClients[-1][2].buildProtocol(None)
+        proto.makeConnection(StringTransport())
+        proto.controller.messageReceived(
+            Message(answer=1, rCode=dns.ENOTIMP), proto)
+        self.assertEqual(len(self.reactor.tcpClients), 3)
+
+        proto = self.reactor.tcpClients[-1][2].buildProtocol(None)
+        transport = StringTransport()
+        proto.makeConnection(transport)
+        query = Message()
+        query.fromStr(transport.value()[2:])
+        self.assertEqual(query.queries[0].type, dns.AXFR)
+        m = Message(id=query.id, answer=1)
+        m.answers = [self._soa(2), one, self._soa(2)]
+        proto.controller.messageReceived(m, proto)
+        self.successResultOf(d)
+        self.assertEqual(self.secondary.records, {
+                'example.com': [self._soa(2).payload],
+                'a.example.com': [one.payload]})
+
+
+
+class SecondaryAgainstPrimaryTests(unittest.TestCase):
+    """
+    Tests for L{SecondaryAuthority} transferring a zone from a
+    L{server.DNSServerFactory}, which does not support IXFR.
+    """
+    def setUp(self):
+        self.primary = NoFileAuthority(
+            soa=('example.com', dns.Record_SOA(serial=1)),
+            records={'example.com': [dns.Record_SOA(serial=1)]})
+        self.factory = server.DNSServerFactory([self.primary])
+        port = reactor.listenTCP(0, self.factory, interface="127.0.0.1")
+        self.addCleanup(port.stopListening)
+        self.secondary = SecondaryAuthority.fromServerAddressAndDomain(
+            ('127.0.0.1', port.getHost().port), 'example.com')
+
+
+    def tearDown(self):
+        for conn in self.factory.connections[:]:
+            conn.transport.loseConnection()
+
+
+    def test_refresh(self):
+        """
+        After the first transfer, changes to the zone are picked up by
+        falling back to AXFR when the primary rejects the IXFR query.
+        """
+        def changeZone(ignored):
+            soa = dns.Record_SOA(serial=2)
+            self.primary.soa = ('example.com', soa)
+            self.primary.records = {
+                'example.com': [soa],
+                'a.example.com': [dns.Record_A('192.0.2.1')]}
+            return self.secondary.transfer()
+
+        def checkZone(ignored):
+            self.assertEqual(self.secondary.soa[1].serial, 2)
+            self.assertEqual(
+                [r.dottedQuad()
+                 for r in self.secondary.records['a.example.com']],
+                ['192.0.2.1'])
+            # The primary logs the IXFR query it could not answer.
+            self.flushLoggedErrors(NotImplementedError)
+
+        d = self.secondary.transfer()
+        d.addCallback(changeZone)
+        d.addCallback(checkZone)
+        return d
+
+
+
 class HelperTestCase(unittest.TestCase):
     def testSerialGenerator(self):
         f = self.mktemp()
@@ -567,6 +996,27 @@ class AXFRTest(unittest.TestCase):
         self.assertEqual(self.results, self.records)
 
 
+    def test_streamedRecords(self):
+        """
+        If L{client.AXFRController} is given a C{recordsReceived} callable,
+        the records of each message are passed to it as they arrive instead of
+        being collected, and its L{Deferred} fires with the SOA record of the
+        zone.
+        """
+        received = []
+        d = defer.Deferred()
+        controller = client.AXFRController(
+            'fooby.com', d, recordsReceived=received.append)
+        records = self.records[:]
+        while records:
+            m = self._makeMessage()
+            m.answers = [records.pop(0)]
+            controller.messageReceived(m, None)
+            self.assertEqual(controller.records, [])
+        self.assertEqual(received, [[record] for record in self.records])
+        self.assertIdentical(self.successResultOf(d), self.soa)
+
+
 
 class ResolvConfHandling(unittest.TestCase):
     def testMissing(self):
@@ -176,9 +176,12 @@ __metaclass__ = type
 import types, warnings
 
 from cStringIO import StringIO
-from struct import pack
+from struct import pack, Struct
 import decimal, datetime
 from itertools import count
+from collections import deque
+from functools import partial
+from operator import methodcaller
 
 from zope.interface import Interface, implements
 
@@ -186,7 +189,7 @@ from twisted.python.reflect import accumulateClassDict
 from twisted.python.failure import Failure
 from twisted.python import log, filepath
 
-from twisted.internet.interfaces import IFileDescriptorReceiver
+from twisted.internet.interfaces import IFileDescriptorReceiver, IPushProducer
 from twisted.internet.main import CONNECTION_LOST
 from twisted.internet.error import PeerVerifyError, ConnectionLost
 from twisted.internet.error import ConnectionClosed
@@ -210,12 +213,23 @@ COMMAND = '_command'
 ERROR = '_error'
 ERROR_CODE = '_error_code'
 ERROR_DESCRIPTION = '_error_description'
+STREAM = '_stream'
+STREAM_CHUNK = '_stream_chunk'
+STREAM_END = '_stream_end'
+STREAM_FAIL = '_stream_fail'
+STREAM_CREDIT = '_stream_credit'
+STREAM_STOP = '_stream_stop'
 UNKNOWN_ERROR_CODE = 'UNKNOWN'
 UNHANDLED_ERROR_CODE = 'UNHANDLED'
 
 MAX_KEY_LENGTH = 0xff
 MAX_VALUE_LENGTH = 0xffff
 
+# Pack and unpack the 16 bit length prefixes of keys and values.
+_lengthPrefix = Struct("!H")
+_packLength = _lengthPrefix.pack
+_unpackLength = _lengthPrefix.unpack_from
+
 
 class IArgumentType(Interface):
     """
@@ -513,6 +527,15 @@ class IncompatibleVersions(AmpError):
     """
 
 
+class StreamFailed(AmpError):
+    """
+    The data of a L{Stream} argument could not be transferred completely,
+    either because its source failed on the sending side or because its
+    consumer asked it to stop on the receiving side.
+    """
+
+
+
 PROTOCOL_ERRORS = {UNHANDLED_ERROR_CODE: UnhandledCommand}
 
 class AmpBox(dict):
@@ -539,27 +562,48 @@ class AmpBox(dict):
         @return: a str encoded according to the rules described in the module
         docstring.
         """
-        i = self.items()
-        i.sort()
         L = []
-        w = L.append
-        for k, v in i:
-            if type(k) == unicode:
-                raise TypeError("Unicode key not allowed: %r" % k)
-            if type(v) == unicode:
-                raise TypeError(
-                    "Unicode value for key %r not allowed: %r" % (k, v))
-            if len(k) > MAX_KEY_LENGTH:
-                raise TooLong(True, True, k, None)
-            if len(v) > MAX_VALUE_LENGTH:
-                raise TooLong(False, True, v, k)
-            for kv in k, v:
-                w(pack("!H", len(kv)))
-                w(kv)
-        w(pack("!H", 0))
+        self._serializeInto(L)
         return ''.join(L)
 
 
+    def _serializeInto(self, parts):
+        """
+        Append my wire encoding to a list of strings.
+
+        This lets several boxes be encoded into one buffer and written with a
+        single join.  If I can not be encoded, C{parts} is left as it was.
+
+        @param parts: A C{list} of C{str} to append to.
+
+        @raise TypeError: If one of my keys or values is C{unicode}.
+
+        @raise TooLong: If one of my keys or values is too long to encode.
+        """
+        mark = len(parts)
+        w = parts.append
+        try:
+            for k in sorted(self):
+                v = self[k]
+                if type(k) == unicode:
+                    raise TypeError("Unicode key not allowed: %r" % k)
+                if type(v) == unicode:
+                    raise TypeError(
+                        "Unicode value for key %r not allowed: %r" % (k, v))
+                if len(k) > MAX_KEY_LENGTH:
+                    raise TooLong(True, True, k, None)
+                if len(v) > MAX_VALUE_LENGTH:
+                    raise TooLong(False, True, v, k)
+                w(_packLength(len(k)))
+                w(k)
+                w(_packLength(len(v)))
+                w(v)
+        except:
+            del parts[mark:]
+            raise
+        w('\x00\x00')
+
+
     def _sendTo(self, proto):
         """
         Serialize and send this box to a Amp instance.  By the time it is being
@@ -599,6 +643,7 @@ class QuitBox(AmpBox):
         Immediately call loseConnection after sending.
         """
         super(QuitBox, self)._sendTo(proto)
+        proto._flushBoxes()
         proto.transport.loseConnection()
 
 
@@ -638,6 +683,270 @@ class _SwitchBox(AmpBox):
 
 
 
+class _OutgoingStream(object):
+    """
+    (Private) The sending half of a L{Stream} argument.
+
+    Chunks are read from C{source} only when the receiver has granted credit
+    for them, so no more than one window of a stream's data is ever buffered
+    on its behalf, no matter how large the source is.
+
+    @ivar credit: the number of chunks the receiver is currently prepared to
+        accept.
+    """
+
+    def __init__(self, dispatcher, streamID, source, chunkSize):
+        self.dispatcher = dispatcher
+        self.streamID = streamID
+        self.source = source
+        self.chunkSize = chunkSize
+        self.credit = 0
+
+
+    def creditReceived(self, credit):
+        """
+        The receiver is prepared to accept C{credit} more chunks; read and send
+        them.
+        """
+        self.credit += credit
+        while self.credit > 0:
+            try:
+                data = self.source.read(self.chunkSize)
+            except:
+                log.err(None, "Reading stream %s failed" % (self.streamID,))
+                self._finish(STREAM_FAIL, 'Stream source failed')
+                return
+            if not data:
+                self._finish(STREAM_END, '')
+                return
+            self.credit -= 1
+            self.dispatcher._emitStreamBox(self.streamID, STREAM_CHUNK, data)
+
+
+    def _finish(self, key, value):
+        """
+        Tell the receiver that no more chunks will follow, and forget about
+        this stream.
+        """
+        self.stop()
+        self.dispatcher._emitStreamBox(self.streamID, key, value)
+
+
+    def stop(self):
+        """
+        Send no more chunks, because the receiver asked us to stop, the
+        connection was lost, or the source is exhausted.
+        """
+        self.credit = 0
+        self.dispatcher._outgoingStreams.pop(self.streamID, None)
+
+
+
+class _IncomingStream(object):
+    """
+    (Private) The receiving half of a L{Stream} argument; this is the object
+    given to application code in place of the stream's data.
+
+    Up to C{window} chunks are granted to the sender as soon as the argument
+    is received, and more are granted as the consumer passed to L{deliverTo}
+    accepts them.  While that consumer is paused, no more credit is granted,
+    so the sender stops once the chunks it was already granted are used up.
+    A sender which sends more chunks than it has been granted fails the
+    transfer, so no more than C{window} chunks are ever buffered.
+
+    @ivar window: the number of chunks the sender is allowed to have in
+        flight.
+
+    @ivar _credit: the number of chunks the sender has been granted and has
+        not sent yet.
+    """
+    implements(IPushProducer)
+
+    _consumer = None
+    _deferred = None
+    _result = None
+    _paused = False
+
+    def __init__(self, dispatcher, streamID, window):
+        self.dispatcher = dispatcher
+        self.streamID = streamID
+        self.window = window
+        self._buffer = deque()
+        self._delivered = 0
+        self._credit = window
+        dispatcher._emitStreamBox(streamID, STREAM_CREDIT, str(window))
+
+
+    def deliverTo(self, consumer):
+        """
+        Write the data of this stream to C{consumer} as it arrives.
+
+        @param consumer: an L{IConsumer} provider; this object is registered
+            with it as a streaming producer for the duration of the transfer.
+
+        @return: a L{Deferred} which fires with C{None} once all of the data
+            has been written, or fails with L{StreamFailed} or the reason the
+            connection was lost if the transfer did not complete.
+        """
+        if self._consumer is not None or self._deferred is not None:
+            raise RuntimeError("This stream is already being delivered")
+        if isinstance(self._result, Failure):
+            return fail(self._result)
+        self._consumer = consumer
+        result = self._deferred = Deferred()
+        consumer.registerProducer(self, True)
+        self._deliver()
+        return result
+
+
+    def _deliver(self):
+        """
+        Write buffered chunks to the consumer while it is not paused, then
+        either grant the sender more credit or finish the transfer.
+        """
+        buffer = self._buffer
+        while buffer and not self._paused and self._consumer is not None:
+            self._consumer.write(buffer.popleft())
+            self._delivered += 1
+        if self._consumer is None:
+            return
+        if self._result is not None:
+            if not buffer:
+                self._finish()
+        elif not self._paused and self._delivered * 2 >= self.window:
+            delivered, self._delivered = self._delivered, 0
+            self._credit += delivered
+            self.dispatcher._emitStreamBox(
+                self.streamID, STREAM_CREDIT, str(delivered))
+
+
+    def _finish(self):
+        """
+        Unregister from the consumer and report the outcome of the transfer.
+        """
+        consumer, self._consumer = self._consumer, None
+        consumer.unregisterProducer()
+        self._fireDeferred()
+
+
+    def _fireDeferred(self):
+        deferred, self._deferred = self._deferred, None
+        if self._result is True:
+            deferred.callback(None)
+        else:
+            deferred.errback(self._result)
+
+
+    def chunkReceived(self, data):
+        if self._credit <= 0:
+            self._stop(StreamFailed(
+                    "The sender exceeded the window of the stream"))
+            return
+        self._credit -= 1
+        self._buffer.append(data)
+        if self._consumer is not None:
+            self._deliver()
+
+
+    def endReceived(self):
+        self._result = True
+        if self._consumer is not None:
+            self._deliver()
+
+
+    def failReceived(self, description):
+        self._abort(Failure(StreamFailed(description)))
+
+
+    def connectionLost(self, reason):
+        self._abort(reason)
+
+
+    def _abort(self, reason):
+        """
+        Discard any buffered data and fail the transfer with C{reason}.
+        """
+        self.dispatcher._incomingStreams.pop(self.streamID, None)
+        self._buffer.clear()
+        self._result = reason
+        if self._consumer is not None:
+            self._finish()
+
+
+    def _close(self):
+        """
+        The responder for the command this stream was sent with has finished.
+        If the sender is still sending, tell it to stop and fail the
+        transfer, since nothing will read the rest of the data.
+        """
+        self._stop(StreamFailed(
+                "The command finished before the stream was read"))
+
+
+    def _stop(self, reason):
+        """
+        Tell the sender to stop, if it is still sending, and fail the
+        transfer with C{reason}.
+
+        @type reason: L{StreamFailed}
+        """
+        streams = self.dispatcher._incomingStreams
+        if streams.pop(self.streamID, None) is not self:
+            return
+        self.dispatcher._emitStreamBox(self.streamID, STREAM_STOP, '')
+        self._abort(Failure(reason))
+
+
+    def pauseProducing(self):
+        self._paused = True
+
+
+    def resumeProducing(self):
+        self._paused = False
+        if self._consumer is not None:
+            self._deliver()
+
+
+    def stopProducing(self):
+        """
+        The consumer does not want any more data; tell the sender to stop.
+        """
+        if self._consumer is None:
+            return
+        self._consumer = None
+        if self.dispatcher._incomingStreams.pop(self.streamID, None) is self:
+            self.dispatcher._emitStreamBox(self.streamID, STREAM_STOP, '')
+        self._buffer.clear()
+        self._result = Failure(
+            StreamFailed("Consumer asked the stream to stop"))
+        self._fireDeferred()
+
+
+
+class _StringCall(object):
+    """
+    (Private) A command sent with L{BoxDispatcher.callRemoteString}, which
+    can wait in the same queue as L{Command}s while
+    L{BoxDispatcher.maxOutstandingCalls} is reached.
+    """
+
+    def __init__(self, command, box, requiresAnswer):
+        self.command = command
+        self.box = box
+        self.requiresAnswer = requiresAnswer
+
+
+    def _doCommand(self, proto):
+        """
+        Send the command.
+
+        @return: See L{BoxDispatcher.callRemoteString}.
+        """
+        return proto._sendBoxCommand(
+            self.command, self.box, self.requiresAnswer)
+
+
+
 class BoxDispatcher:
     """
     A L{BoxDispatcher} dispatches '_ask', '_answer', and '_error' L{AmpBox}es,
@@ -661,6 +970,25 @@ class BoxDispatcher:
     @ivar boxSender: an object which can send boxes, via the L{_sendBox}
     method, such as an L{AMP} instance.
     @type boxSender: L{IBoxSender}
+
+    @ivar maxOutstandingCalls: the largest number of commands sent with
+        L{callRemote} or L{callRemoteString} which may be awaiting an answer
+        at once, or C{None} for no limit.  Further calls are queued, in order,
+        until answers arrive, and producers registered with
+        L{registerCallProducer} are paused while the limit is reached.
+    @type maxOutstandingCalls: C{int} or C{NoneType}
+
+    @ivar _newOutgoingStreams: the L{_OutgoingStream}s created for the box
+        being serialized, which are claimed by the call or answer it is sent
+        with, or stopped by L{_discardNewOutgoingStreams} if it is not sent.
+
+    @ivar _callStreams: a dictionary mapping request IDs to the
+        L{_OutgoingStream}s sent as arguments of those requests, which are
+        dropped when the answer arrives.
+
+    @ivar _receivedStreams: while a command is being dispatched, a list of
+        the L{_IncomingStream}s received as its arguments, which are closed
+        when its responder finishes; otherwise C{None}.
     """
 
     implements(IBoxReceiver)
@@ -668,10 +996,20 @@ class BoxDispatcher:
     _failAllReason = None
     _outstandingRequests = None
     _counter = 0L
+    _streamCounter = 0
+    _callProducersPaused = False
+    _receivedStreams = None
     boxSender = None
+    maxOutstandingCalls = None
 
     def __init__(self, locator):
         self._outstandingRequests = {}
+        self._pendingCalls = deque()
+        self._callProducers = []
+        self._outgoingStreams = {}
+        self._incomingStreams = {}
+        self._newOutgoingStreams = []
+        self._callStreams = {}
         self.locator = locator
 
 
@@ -704,6 +1042,16 @@ class BoxDispatcher:
         self._outstandingRequests = None # we can never send another request
         for key, value in OR:
             value.errback(reason)
+        pending = self._pendingCalls
+        while pending:
+            command, waiting = pending.popleft()
+            if waiting is not None:
+                waiting.errback(reason)
+        self._callStreams.clear()
+        for stream in self._outgoingStreams.values():
+            stream.stop()
+        for stream in self._incomingStreams.values():
+            stream.connectionLost(reason)
 
 
     def _nextTag(self):
@@ -743,7 +1091,10 @@ class BoxDispatcher:
 
         @raise ProtocolSwitched: if the protocol has been switched.
         """
+        streams, self._newOutgoingStreams = self._newOutgoingStreams, []
         if self._failAllReason is not None:
+            for stream in streams:
+                stream.stop()
             return fail(self._failAllReason)
         box[COMMAND] = command
         tag = self._nextTag()
@@ -752,6 +1103,8 @@ class BoxDispatcher:
         box._sendTo(self.boxSender)
         if requiresAnswer:
             result = self._outstandingRequests[tag] = Deferred()
+            if streams:
+                self._callStreams[tag] = streams
         else:
             result = None
         return result
@@ -773,8 +1126,7 @@ class BoxDispatcher:
         @return: a Deferred which fires the AmpBox that holds the response to
         this command, or None, as specified by requiresAnswer.
         """
-        box = Box(kw)
-        return self._sendBoxCommand(command, box, requiresAnswer)
+        return self._makeCall(_StringCall(command, Box(kw), requiresAnswer))
 
 
     def callRemote(self, commandType, *a, **kw):
@@ -818,7 +1170,101 @@ class BoxDispatcher:
             co = commandType(*a, **kw)
         except:
             return fail()
-        return co._doCommand(self)
+        return self._makeCall(co)
+
+
+    def _makeCall(self, co):
+        """
+        Send a command, or queue it if L{maxOutstandingCalls} commands are
+        already awaiting answers.
+
+        @param co: a L{Command} instance, or another object with a
+            C{requiresAnswer} attribute and a C{_doCommand} method, such as a
+            L{_StringCall}.
+
+        @return: See L{callRemote}.
+        """
+        if self.maxOutstandingCalls is not None and self._callsBlocked():
+            if co.requiresAnswer:
+                result = Deferred()
+            else:
+                result = None
+            self._pendingCalls.append((co, result))
+        else:
+            result = co._doCommand(self)
+        if self.maxOutstandingCalls is not None:
+            self._updateCallProducers()
+        return result
+
+
+    def _callsBlocked(self):
+        """
+        Determine whether a new call must wait for an earlier one to be
+        answered before it can be sent.
+        """
+        if self._failAllReason is not None:
+            return False
+        return bool(self._pendingCalls) or (
+            len(self._outstandingRequests) >= self.maxOutstandingCalls)
+
+
+    def _sendPendingCalls(self):
+        """
+        Send as many queued calls as L{maxOutstandingCalls} now allows, in the
+        order they were made.
+        """
+        pending = self._pendingCalls
+        while pending and (
+            self._failAllReason is not None or
+            self.maxOutstandingCalls is None or
+            len(self._outstandingRequests) < self.maxOutstandingCalls):
+            co, waiting = pending.popleft()
+            try:
+                result = co._doCommand(self)
+            except:
+                result = fail()
+            if waiting is not None:
+                result.chainDeferred(waiting)
+            elif result is not None:
+                result.addErrback(log.err)
+        self._updateCallProducers()
+
+
+    def _updateCallProducers(self):
+        """
+        Pause the producers registered with L{registerCallProducer} when the
+        limit on outstanding calls is reached, and resume them when it no
+        longer is.
+        """
+        blocked = self.maxOutstandingCalls is not None and self._callsBlocked()
+        if blocked != self._callProducersPaused:
+            self._callProducersPaused = blocked
+            for producer in self._callProducers[:]:
+                if blocked:
+                    producer.pauseProducing()
+                else:
+                    producer.resumeProducing()
+
+
+    def registerCallProducer(self, producer):
+        """
+        Register an object which makes calls with L{callRemote} so that it is
+        paused while L{maxOutstandingCalls} calls are awaiting answers.
+
+        @param producer: an L{IPushProducer} provider.  It is paused
+            immediately if the limit has already been reached.
+        """
+        self._callProducers.append(producer)
+        if self._callProducersPaused:
+            producer.pauseProducing()
+
+
+    def unregisterCallProducer(self, producer):
+        """
+        Stop pausing and resuming a producer previously passed to
+        L{registerCallProducer}.
+        """
+        self._callProducers.remove(producer)
 
 
     def unhandledError(self, failure):
@@ -837,10 +1283,24 @@ class BoxDispatcher:
         @param box: an AmpBox with a value for its L{ANSWER} key.
         """
         question = self._outstandingRequests.pop(box[ANSWER])
+        self._dropCallStreams(box[ANSWER])
+        if self._pendingCalls or self._callProducersPaused:
+            self._sendPendingCalls()
         question.addErrback(self.unhandledError)
         question.callback(box)
 
 
+    def _dropCallStreams(self, tag):
+        """
+        Stop sending the L{Stream} arguments of a command which has been
+        answered, since its responder will not read any more of them.
+
+        @param tag: the request ID of the command.
+        """
+        for stream in self._callStreams.pop(tag, ()):
+            stream.stop()
+
+
     def _errorReceived(self, box):
         """
         An AMP box was received that answered a command previously sent with
@@ -850,6 +1310,9 @@ class BoxDispatcher:
         and L{ERROR_DESCRIPTION} keys.
         """
         question = self._outstandingRequests.pop(box[ERROR])
+        self._dropCallStreams(box[ERROR])
+        if self._pendingCalls or self._callProducersPaused:
+            self._sendPendingCalls()
         question.addErrback(self.unhandledError)
         errorCode = box[ERROR_CODE]
         description = box[ERROR_DESCRIPTION]
@@ -866,6 +1329,9 @@ class BoxDispatcher:
         keys.
         """
         def formatAnswer(answerBox):
+            # Streams in the response belong to no call; they are sent until
+            # the caller has read them or asks to stop.
+            self._newOutgoingStreams = []
             answerBox[ANSWER] = box[ASK]
             return answerBox
         def formatError(error):
@@ -886,13 +1352,36 @@ class BoxDispatcher:
             errorBox[ERROR_DESCRIPTION] = desc
             errorBox[ERROR_CODE] = code
             return errorBox
-        deferred = self.dispatchCommand(box)
+        received = self._receivedStreams = []
+        try:
+            deferred = self.dispatchCommand(box)
+        finally:
+            self._receivedStreams = None
+        if received:
+            deferred.addBoth(self._closeReceivedStreams, received)
         if ASK in box:
             deferred.addCallbacks(formatAnswer, formatError)
             deferred.addCallback(self._safeEmit)
+        # Streams in a response which is not sent, because the response could
+        # not be serialized completely or was not asked for, are never read.
+        deferred.addBoth(self._discardNewOutgoingStreams)
         deferred.addErrback(self.unhandledError)
 
 
+    def _closeReceivedStreams(self, result, streams):
+        """
+        Close the L{Stream} arguments of a command once its responder has
+        finished, before its answer is sent.
+
+        @param result: the result of the responder, which is passed through.
+
+        @param streams: the L{_IncomingStream}s received with the command.
+        """
+        for stream in streams:
+            stream._close()
+        return result
+
+
     def ampBoxReceived(self, box):
         """
         An AmpBox was received, representing a command, or an answer to a
@@ -902,8 +1391,9 @@ class BoxDispatcher:
         @param box: an AmpBox
 
         @raise NoEmptyBoxes: when a box is received that does not contain an
-        '_answer', '_command' / '_ask', or '_error' key; i.e. one which does not
-        fit into the command / response protocol defined by AMP.
+        '_answer', '_command' / '_ask', '_error' or '_stream' key; i.e. one
+        which does not fit into the command / response protocol defined by
+        AMP.
         """
         if ANSWER in box:
             self._answerReceived(box)
@@ -911,10 +1401,90 @@ class BoxDispatcher:
             self._errorReceived(box)
         elif COMMAND in box:
             self._commandReceived(box)
+        elif STREAM in box:
+            self._streamBoxReceived(box)
         else:
             raise NoEmptyBoxes(box)
 
 
+    def _streamBoxReceived(self, box):
+        """
+        An AMP box was received which carries data or flow control for a
+        L{Stream} argument.  Boxes for streams which have already finished are
+        ignored, since some may still be in flight when a stream is stopped.
+
+        @param box: an L{AmpBox} with a value for its L{STREAM} key.
+        """
+        streamID = box[STREAM]
+        if STREAM_CREDIT in box or STREAM_STOP in box:
+            stream = self._outgoingStreams.get(streamID)
+            if stream is None:
+                return
+            if STREAM_STOP in box:
+                stream.stop()
+            else:
+                stream.creditReceived(int(box[STREAM_CREDIT]))
+        else:
+            stream = self._incomingStreams.get(streamID)
+            if stream is None:
+                return
+            if STREAM_CHUNK in box:
+                stream.chunkReceived(box[STREAM_CHUNK])
+            elif STREAM_END in box:
+                del self._incomingStreams[streamID]
+                stream.endReceived()
+            else:
+                stream.failReceived(box.get(STREAM_FAIL, ''))
+
+
+    def _sendStream(self, source, chunkSize):
+        """
+        Prepare to send the contents of C{source} as a L{Stream} argument.
+
+        @return: the identifier of the new stream.
+        """
+        self._streamCounter += 1
+        streamID = '%x' % (self._streamCounter,)
+        stream = self._outgoingStreams[streamID] = _OutgoingStream(
+            self, streamID, source, chunkSize)
+        self._newOutgoingStreams.append(stream)
+        return streamID
+
+
+    def _discardNewOutgoingStreams(self, result=None):
+        """
+        Stop the L{_OutgoingStream}s created for a box which is not going to
+        be sent, because serializing it failed or its sender did not want
+        it.
+
+        @param result: returned, so that this can be used as a callback.
+        """
+        streams, self._newOutgoingStreams = self._newOutgoingStreams, []
+        for stream in streams:
+            stream.stop()
+        return result
+
+
+    def _receiveStream(self, streamID, window):
+        """
+        Begin receiving a L{Stream} argument sent by the peer.
+
+        @return: the object to give to application code for the stream.
+        """
+        stream = self._incomingStreams[streamID] = _IncomingStream(
+            self, streamID, window)
+        if self._receivedStreams is not None:
+            self._receivedStreams.append(stream)
+        return stream
+
+
+    def _emitStreamBox(self, streamID, key, value):
+        """
+        Send a box belonging to a stream.
+        """
+        self._safeEmit(AmpBox({STREAM: streamID, key: value}))
+
+
     def _safeEmit(self, aBox):
         """
         Emit a box, ignoring L{ProtocolSwitched} and L{ConnectionLost} errors
@@ -1461,17 +2031,28 @@ class AmpList(Argument):
         Argument.__init__(self, optional)
 
 
+    def _getCodec(self):
+        """
+        Get the L{_ArgumentCodec} for C{subargs}, making it the first time it
+        is needed or if C{subargs} has been replaced.
+        """
+        codec = self.__dict__.get('_codec')
+        if codec is None or codec.arglist is not self.subargs:
+            codec = self._codec = _ArgumentCodec(self.subargs)
+        return codec
+
+
     def fromStringProto(self, inString, proto):
-        boxes = parseString(inString)
-        values = [_stringsToObjects(box, self.subargs, proto)
-                  for box in boxes]
-        return values
+        toObjects = self._getCodec().toObjects
+        return [toObjects(box, proto) for box in _splitBoxes(inString)]
 
 
     def toStringProto(self, inObject, proto):
-        return ''.join([_objectsToStrings(
-                    objects, self.subargs, Box(), proto
-                    ).serialize() for objects in inObject])
+        toStrings = self._getCodec().toStrings
+        parts = []
+        for objects in inObject:
+            toStrings(objects, Box(), proto)._serializeInto(parts)
+        return ''.join(parts)
 
 
 
@@ -1541,6 +2122,258 @@ class Descriptor(Integer):
 
 
 
+class Stream(Argument):
+    """
+    Transfer the contents of a file-like object, which may be far larger than
+    the limit on the length of a single value, as a series of boxes following
+    the one which carries the argument.
+
+    The sender passes any object with a C{read(size)} method.  It is read one
+    chunk at a time, and only as fast as the receiver grants credit for
+    chunks, so neither side holds more than a window of the data in memory.
+    The receiver gets an object with a C{deliverTo(consumer)} method, which
+    registers itself as a streaming producer with the given L{IConsumer},
+    writes the data to it, and returns a L{Deferred} which fires when all of
+    the data has been written, or fails with L{StreamFailed} or the reason
+    the connection was lost if the transfer could not be completed.
+
+    A stream sent as an argument of a command lasts only until the command's
+    responder finishes: if the responder has not read all of it by then, the
+    sender is told to stop and the transfer fails with L{StreamFailed}.  A
+    stream sent in a response lasts until the caller has read it or stops
+    it.
+
+    This argument type requires the protocols at both ends of the connection
+    to be L{BoxDispatcher}s, such as L{AMP}.
+
+    @ivar window: the number of chunks which the sender may have in flight
+        before the receiver's consumer has accepted any of them.
+
+    @ivar chunkSize: the number of bytes read from the source for each box.
+    """
+    chunkSize = MAX_VALUE_LENGTH
+
+    def __init__(self, optional=False, window=8):
+        Argument.__init__(self, optional)
+        self.window = window
+
+
+    def fromStringProto(self, inString, proto):
+        """
+        Start receiving the stream identified by C{inString}.
+        """
+        return proto._receiveStream(inString, self.window)
+
+
+    def toStringProto(self, inObject, proto):
+        """
+        Arrange for the contents of C{inObject} to be sent once the receiver
+        asks for them, and return the identifier of the stream.
+        """
+        return proto._sendStream(inObject, self.chunkSize)
+
+
+
+def _overrides(argument, name, base):
+    """
+    (Private) Determine whether an argument replaces one of the methods it
+    would otherwise inherit from C{base}.
+
+    @param argument: an L{IArgumentType} provider.
+
+    @param name: the name of a method of C{base}.
+
+    @param base: the class whose implementation of C{name} is wanted.
+
+    @return: C{True} unless C{argument} uses C{base}'s own C{name}.
+    """
+    if name in getattr(argument, '__dict__', ()):
+        return True
+    method = getattr(type(argument), name, None)
+    original = getattr(base, name)
+    return getattr(method, 'im_func', method) is not original.im_func
+
+
+
+def _argumentConverter(argument, protoName, plainName):
+    """
+    (Private) Pick the fastest callable which converts values for an
+    L{Argument} in one direction.
+
+    @param protoName: C{'fromStringProto'} or C{'toStringProto'}.
+
+    @param plainName: C{'fromString'} or C{'toString'}.
+
+    @return: a 2-tuple of the converter and a flag which is true if the
+        converter takes the protocol as its second argument.  The converter is
+        C{None} if values need no conversion at all.
+    """
+    if _overrides(argument, protoName, Argument):
+        return getattr(argument, protoName), True
+    key = (type(argument), plainName)
+    if key in _fastConverters and plainName not in vars(argument):
+        return _fastConverters[key], False
+    return getattr(argument, plainName), False
+
+
+
+# Converters which do the same as the fromString and toString methods of
+# these argument types, without going through the methods.
+_fastConverters = {
+    (String, 'fromString'): None,
+    (String, 'toString'): None,
+    (Unicode, 'fromString'): partial(unicode, encoding='utf-8'),
+    (Unicode, 'toString'): methodcaller('encode', 'utf-8'),
+    }
+
+
+
+class _ArgumentCodec(object):
+    """
+    (Private) An argument list, as used for L{Command.arguments},
+    L{Command.response} and L{AmpList}, prepared ahead of time for converting
+    between boxes and dictionaries of Python objects.
+
+    As long as every argument in the list is an L{Argument} which only
+    customizes the C{fromString}/C{toString} or
+    C{fromStringProto}/C{toStringProto} layer, conversion is done by a loop
+    over precomputed names and converter functions.  Otherwise every
+    conversion goes through the arguments' C{fromBox} and C{toBox} methods,
+    as done by L{_stringsToObjects} and L{_objectsToStrings}.
+
+    @ivar arglist: the list of 2-tuples of wire names and argument objects
+        this codec was made from.
+
+    @ivar names: a C{set} of the Python names of the arguments.
+
+    @ivar required: a C{list} of the Python names of the arguments which are
+        not optional, in order.
+    """
+
+    def __init__(self, arglist):
+        self.arglist = arglist
+        self.names = set()
+        self.required = []
+        decoders = []
+        encoders = []
+        for wireName, argument in arglist:
+            pythonName = _wireNameToPythonIdentifier(wireName)
+            self.names.add(pythonName)
+            optional = getattr(argument, 'optional', False)
+            if not optional:
+                self.required.append(pythonName)
+            if decoders is not None:
+                if (isinstance(argument, Argument) and
+                    not _overrides(argument, 'fromBox', Argument) and
+                    not _overrides(argument, 'retrieve', Argument)):
+                    decoders.append((wireName, pythonName, optional) +
+                                    _argumentConverter(
+                            argument, 'fromStringProto', 'fromString'))
+                else:
+                    decoders = None
+            if encoders is not None:
+                if (isinstance(argument, Argument) and
+                    not _overrides(argument, 'toBox', Argument) and
+                    not _overrides(argument, 'retrieve', Argument)):
+                    encoders.append((wireName, pythonName, optional) +
+                                    _argumentConverter(
+                            argument, 'toStringProto', 'toString'))
+                else:
+                    encoders = None
+        self._decoders = decoders
+        self._encoders = encoders
+
+
+    def toObjects(self, strings, proto):
+        """
+        Convert an AmpBox to a dictionary of Python objects.
+
+        @see: L{_stringsToObjects}
+        """
+        if self._decoders is None:
+            return _stringsToObjects(strings, self.arglist, proto)
+        objects = {}
+        for wireName, pythonName, optional, convert, withProto in (
+            self._decoders):
+            if optional:
+                value = strings.get(wireName)
+                if value is None:
+                    objects[pythonName] = None
+                    continue
+            else:
+                value = strings[wireName]
+            if convert is None:
+                objects[pythonName] = value
+            elif withProto:
+                objects[pythonName] = convert(value, proto)
+            else:
+                objects[pythonName] = convert(value)
+        return objects
+
+
+    def toStrings(self, objects, strings, proto):
+        """
+        Convert a dictionary of Python objects into an AmpBox.
+
+        Anything other than a C{dict} is left to L{_objectsToStrings}, so
+        that a responder returning the wrong thing fails the same way whatever
+        its response schema.
+
+        @see: L{_objectsToStrings}
+        """
+        if self._encoders is None or not isinstance(objects, dict):
+            return _objectsToStrings(objects, self.arglist, strings, proto)
+        for wireName, pythonName, optional, convert, withProto in (
+            self._encoders):
+            if optional:
+                value = objects.get(pythonName)
+                if value is None:
+                    continue
+            else:
+                value = objects[pythonName]
+            if convert is None:
+                strings[wireName] = value
+            elif withProto:
+                strings[wireName] = convert(value, proto)
+            else:
+                strings[wireName] = convert(value)
+        return strings
+
+
+
+def _splitBoxes(data):
+    """
+    (Private) Parse a string of complete serialized boxes, as used for the
+    value of an L{AmpList} argument.
+
+    @param data: a C{str} holding some amp-encoded boxes.
+
+    @return: a C{list} of L{AmpBox}es.
+    """
+    boxes = []
+    box = AmpBox()
+    offset = 0
+    end = len(data)
+    while end - offset >= 2:
+        keyLength, = _unpackLength(data, offset)
+        if not keyLength:
+            boxes.append(box)
+            box = AmpBox()
+            offset += 2
+            continue
+        valueStart = offset + keyLength + 4
+        if valueStart > end:
+            break
+        valueLength, = _unpackLength(data, valueStart - 2)
+        valueEnd = valueStart + valueLength
+        if valueEnd > end:
+            break
+        box[data[offset + 2:valueStart - 2]] = data[valueStart:valueEnd]
+        offset = valueEnd
+    return boxes
+
+
+
 class Command:
     """
     Subclass me to specify an AMP Command.
@@ -1585,11 +2418,13 @@ class Command:
     class __metaclass__(type):
         """
         Metaclass hack to establish reverse-mappings for 'errors' and
-        'fatalErrors' as class vars.
+        'fatalErrors' as class vars, and to prepare the argument and response
+        lists for use.
         """
         def __new__(cls, name, bases, attrs):
             reverseErrors = attrs['reverseErrors'] = {}
             er = attrs['allErrors'] = {}
+            attrs['_codecs'] = {}
             if 'commandName' not in attrs:
                 attrs['commandName'] = name
             newtype = type.__new__(cls, name, bases, attrs)
@@ -1603,6 +2438,8 @@ class Command:
             for v, k in fatalErrors.iteritems():
                 reverseErrors[k] = v
                 er[v] = k
+            newtype._getCodec('arguments')
+            newtype._getCodec('response')
             return newtype
 
     arguments = []
@@ -1628,16 +2465,32 @@ class Command:
         @raise InvalidSignature: if you forgot any required arguments.
         """
         self.structured = kw
-        givenArgs = kw.keys()
-        forgotten = []
-        for name, arg in self.arguments:
-            pythonName = _wireNameToPythonIdentifier(name)
-            if pythonName not in givenArgs and not arg.optional:
-                forgotten.append(pythonName)
+        forgotten = [pythonName
+                     for pythonName in self._getCodec('arguments').required
+                     if pythonName not in kw]
         if forgotten:
             raise InvalidSignature("forgot %s for %s" % (
                     ', '.join(forgotten), self.commandName))
-        forgotten = []
+
+
+    def _getCodec(cls, attribute):
+        """
+        Get the L{_ArgumentCodec} for one of my argument lists.
+
+        Codecs are made when the command class is created, and again if the
+        list is later replaced.
+
+        @param attribute: C{'arguments'} or C{'response'}.
+
+        @return: an L{_ArgumentCodec}.
+        """
+        arglist = getattr(cls, attribute)
+        codecs = cls.__dict__['_codecs']
+        codec = codecs.get(attribute)
+        if codec is None or codec.arglist is not arglist:
+            codec = codecs[attribute] = _ArgumentCodec(arglist)
+        return codec
+    _getCodec = classmethod(_getCodec)
 
 
     def makeResponse(cls, objects, proto):
@@ -1657,7 +2510,7 @@ class Command:
             responseType = cls.responseType()
         except:
             return fail()
-        return _objectsToStrings(objects, cls.response, responseType, proto)
+        return cls._getCodec('response').toStrings(objects, responseType, proto)
     makeResponse = classmethod(makeResponse)
 
 
@@ -1674,16 +2527,13 @@ class Command:
 
         @return: An instance of this L{Command}'s C{commandType}.
         """
-        allowedNames = set()
-        for (argName, ignored) in cls.arguments:
-            allowedNames.add(_wireNameToPythonIdentifier(argName))
-
+        codec = cls._getCodec('arguments')
+        allowedNames = codec.names
         for intendedArg in objects:
             if intendedArg not in allowedNames:
                 raise InvalidSignature(
                     "%s is not a valid argument" % (intendedArg,))
-        return _objectsToStrings(objects, cls.arguments, cls.commandType(),
-                                 proto)
+        return codec.toStrings(objects, cls.commandType(), proto)
     makeArguments = classmethod(makeArguments)
 
 
@@ -1699,7 +2549,7 @@ class Command:
         @return: A mapping of response-argument names to the parsed
         forms.
         """
-        return _stringsToObjects(box, cls.response, protocol)
+        return cls._getCodec('response').toObjects(box, protocol)
     parseResponse = classmethod(parseResponse)
 
 
@@ -1714,7 +2564,7 @@ class Command:
 
         @return: A mapping of argument names to the parsed forms.
         """
-        return _stringsToObjects(box, cls.arguments, protocol)
+        return cls._getCodec('arguments').toObjects(box, protocol)
     parseArguments = classmethod(parseArguments)
 
 
@@ -1773,9 +2623,13 @@ class Command:
                                                UnknownRemoteError)
             return Failure(errorType(rje.description))
 
-        d = proto._sendBoxCommand(self.commandName,
-                                  self.makeArguments(self.structured, proto),
-                                  self.requiresAnswer)
+        try:
+            d = proto._sendBoxCommand(
+                self.commandName, self.makeArguments(self.structured, proto),
+                self.requiresAnswer)
+        finally:
+            # Only left over if makeArguments failed part of the way through.
+            proto._discardNewOutgoingStreams()
 
         if self.requiresAnswer:
             d.addCallback(self.parseResponse, proto)
@@ -2079,6 +2933,10 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
 
     @ivar boxReceiver: an L{IBoxReceiver} provider, whose L{ampBoxReceived}
     method will be invoked for each L{AmpBox} that is received.
+
+    @ivar _outgoing: While received data is being parsed, a C{list} of the
+        encoded boxes sent in response, to be written to the transport in one
+        go once parsing is done; otherwise C{None}.
     """
 
     implements(IBoxSender)
@@ -2088,6 +2946,7 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
     _locked = False
     _currentKey = None
     _currentBox = None
+    _outgoing = None
 
     _keyLengthLimitExceeded = False
 
@@ -2121,6 +2980,9 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
         # loop will break and not attempt to look at something that isn't a
         # length prefix.
         self.recvd = ''
+        # Anything we have said so far must reach the peer before the new
+        # protocol gets a chance to say anything.
+        self._flushBoxes()
         # Finally, do the actual work of setting up the protocol and delivering
         # its first chunk of data, if one is available.
         self.innerProtocol = newProto
@@ -2134,7 +2996,12 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
         """
         Send a amp.Box to my peer.
 
-        Note: transport.write is never called outside of this method.
+        Boxes sent while received data is being handled - typically answers
+        to the commands in it - are collected and written to the transport
+        together when handling finishes, rather than one write per box.
+
+        Note: transport.write is never called outside of this method and
+        L{_flushBoxes}.
 
         @param box: an AmpBox.
 
@@ -2149,10 +3016,24 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
             raise ConnectionLost()
         if self._startingTLSBuffer is not None:
             self._startingTLSBuffer.append(box)
+        elif self._outgoing is not None:
+            box._serializeInto(self._outgoing)
         else:
             self.transport.write(box.serialize())
 
 
+    def _flushBoxes(self):
+        """
+        Write any boxes collected by L{sendBox} while handling received data
+        to the transport.
+        """
+        outgoing = self._outgoing
+        if outgoing:
+            self._outgoing = []
+            if self.transport is not None:
+                self.transport.write(''.join(outgoing))
+
+
     def makeConnection(self, transport):
         """
         Notify L{boxReceiver} that it is about to receive boxes from this
@@ -2175,7 +3056,76 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
         if self.innerProtocol is not None:
             self.innerProtocol.dataReceived(data)
             return
-        return Int16StringReceiver.dataReceived(self, data)
+        if self._outgoing is not None:
+            # Re-entrant delivery; the outermost call will write the replies.
+            self._parseBoxes(data)
+            return
+        self._outgoing = []
+        try:
+            self._parseBoxes(data)
+        finally:
+            self._flushBoxes()
+            self._outgoing = None
+
+
+    def _parseBoxes(self, data):
+        """
+        Deliver every complete box in the data received so far to
+        L{boxReceiver}.
+
+        This does the work of L{Int16StringReceiver.dataReceived} and the
+        C{proto_*} methods in a single pass over the buffer.  Key/value pairs
+        of a box which has not been completely received are parsed into
+        C{_currentBox} as they arrive and only the unparsed remainder is kept
+        in C{_unprocessed}.
+
+        @param data: Newly received bytes.
+        @type data: C{str}
+        """
+        if self._unprocessed:
+            data = self._unprocessed[self._compatibilityOffset:] + data
+        box = self._currentBox
+        offset = 0
+        end = len(data)
+        maxKeyLength = self._MAX_KEY_LENGTH
+        while end - offset >= 2 and not self.paused:
+            keyLength, = _unpackLength(data, offset)
+            if not keyLength:
+                # The end of a box.
+                offset += 2
+                if box is None:
+                    box = AmpBox()
+                self._currentBox = None
+                # Let _switchTo find any bytes after this box through recvd.
+                self._unprocessed = data
+                self._compatibilityOffset = offset
+                self.boxReceiver.ampBoxReceived(box)
+                box = None
+                if 'recvd' in self.__dict__:
+                    data = self.__dict__.pop('recvd')
+                    offset = 0
+                    end = len(data)
+                continue
+            if keyLength > maxKeyLength:
+                self._currentBox = box
+                self._unprocessed = data
+                self._compatibilityOffset = offset
+                self.lengthLimitExceeded(keyLength)
+                return
+            valueStart = offset + keyLength + 4
+            if valueStart > end:
+                break
+            valueLength, = _unpackLength(data, valueStart - 2)
+            valueEnd = valueStart + valueLength
+            if valueEnd > end:
+                break
+            if box is None:
+                box = AmpBox()
+            box[data[offset + 2:valueStart - 2]] = data[valueStart:valueEnd]
+            offset = valueEnd
+        self._currentBox = box
+        self._unprocessed = data[offset:]
+        self._compatibilityOffset = 0
 
 
     def connectionLost(self, reason):
@@ -2303,6 +3253,8 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
         self._justStartedTLS = True
         if verifyAuthorities is None:
             verifyAuthorities = ()
+        # Whatever was sent before this point goes out in the clear.
+        self._flushBoxes()
         self.transport.startTLS(certificate.options(*verifyAuthorities))
         stlsb = self._startingTLSBuffer
         if stlsb is not None:
@@ -2329,6 +3281,7 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver,
             "Dropping connection!  To avoid, add errbacks to ALL remote "
             "commands!")
         if self.transport is not None:
+            self._flushBoxes()
             self.transport.loseConnection()
 
 
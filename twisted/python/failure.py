@@ -29,6 +29,31 @@ traceupLength = 4
 class DefaultException(Exception):
     pass
 
+
+
+_parentsCache = {}
+
+def _parents(excType):
+    """
+    Compute the value of L{Failure.parents} for an exception type.
+
+    The fully qualified names of an exception class's bases are only worked
+    out once per class, since failures of the same few types are created over
+    and over again.
+
+    @return: a new C{list}.
+    """
+    try:
+        return list(_parentsCache[excType])
+    except (KeyError, TypeError):
+        pass
+    if inspect.isclass(excType) and issubclass(excType, Exception):
+        parents = tuple(map(reflect.qual, getmro(excType)))
+        _parentsCache[excType] = parents
+        return list(parents)
+    return [excType]
+
+
 def format_frames(frames, write, detail="default"):
     """Format and write frames.
 
@@ -159,10 +184,16 @@ class Failure:
     @ivar type: The exception's class.
     @ivar stack: list of frames, innermost last, excluding C{Failure.__init__}.
     @ivar frames: list of frames, innermost first.
+
+    Unless C{captureVars} is set, C{stack} and C{frames} are only built from
+    the traceback the first time either is used, since most failures are
+    handled without their frames ever being looked at.  Only the function
+    name, file name and line number of each calling frame are recorded
+    straight away, in C{_stackEntries}, since the calling frames go on running
+    (or finish, or are suspended generators) and cannot be looked at later.
     """
 
     pickled = 0
-    stack = None
 
     # The opcode of "yield" in Python bytecode. We need this in _findFailure in
     # order to identify whether an exception was thrown by a
@@ -231,28 +262,39 @@ class Failure:
             elif _PY3:
                 tb = self.value.__traceback__
 
-        frames = self.frames = []
-        stack = self.stack = []
-
         # added 2003-06-23 by Chris Armstrong. Yes, I actually have a
         # use case where I need this traceback object, and I've made
         # sure that it'll be cleaned up.
         self.tb = tb
+        self.parents = _parents(self.type)
 
-        if tb:
-            f = tb.tb_frame
-        elif not isinstance(self.value, Failure):
+        if tb is None:
             # we don't do frame introspection since it's expensive,
             # and if we were passed a plain exception with no
             # traceback, it's not useful anyway
-            f = stackOffset = None
+            self.frames = []
+            self.stack = []
+            return
 
+        f = tb.tb_frame
         while stackOffset and f:
             # This excludes this Failure.__init__ frame from the
             # stack, leaving it to start with our caller instead.
             f = f.f_back
             stackOffset -= 1
 
+        if not captureVars:
+            # Defer building the frames; see the class docstring.
+            entries = self._stackEntries = []
+            while f:
+                code = f.f_code
+                entries.append((code.co_name, code.co_filename, f.f_lineno))
+                f = f.f_back
+            return
+
+        frames = self.frames = []
+        stack = self.stack = []
+
         # Keeps the *full* stack.  Formerly in spread.pb.print_excFullStack:
         #
         #   The need for this function arises from the fact that several
@@ -262,19 +304,16 @@ class Failure:
         #   what called upon the PB object.
 
         while f:
-            if captureVars:
-                localz = f.f_locals.copy()
-                if f.f_locals is f.f_globals:
-                    globalz = {}
-                else:
-                    globalz = f.f_globals.copy()
-                for d in globalz, localz:
-                    if "__builtins__" in d:
-                        del d["__builtins__"]
-                localz = localz.items()
-                globalz = globalz.items()
+            localz = f.f_locals.copy()
+            if f.f_locals is f.f_globals:
+                globalz = {}
             else:
-                localz = globalz = ()
+                globalz = f.f_globals.copy()
+            for d in globalz, localz:
+                if "__builtins__" in d:
+                    del d["__builtins__"]
+            localz = localz.items()
+            globalz = globalz.items()
             stack.insert(0, (
                 f.f_code.co_name,
                 f.f_code.co_filename,
@@ -286,19 +325,16 @@ class Failure:
 
         while tb is not None:
             f = tb.tb_frame
-            if captureVars:
-                localz = f.f_locals.copy()
-                if f.f_locals is f.f_globals:
-                    globalz = {}
-                else:
-                    globalz = f.f_globals.copy()
-                for d in globalz, localz:
-                    if "__builtins__" in d:
-                        del d["__builtins__"]
-                localz = list(localz.items())
-                globalz = list(globalz.items())
+            localz = f.f_locals.copy()
+            if f.f_locals is f.f_globals:
+                globalz = {}
             else:
-                localz = globalz = ()
+                globalz = f.f_globals.copy()
+            for d in globalz, localz:
+                if "__builtins__" in d:
+                    del d["__builtins__"]
+            localz = list(localz.items())
+            globalz = list(globalz.items())
             frames.append((
                 f.f_code.co_name,
                 f.f_code.co_filename,
@@ -307,11 +343,43 @@ class Failure:
                 globalz,
                 ))
             tb = tb.tb_next
-        if inspect.isclass(self.type) and issubclass(self.type, Exception):
-            parentCs = getmro(self.type)
-            self.parents = list(map(reflect.qual, parentCs))
-        else:
-            self.parents = [self.type]
+
+
+    def __getattr__(self, name):
+        """
+        Build C{frames} and C{stack} the first time either is used.
+
+        C{stack} is C{None} for a L{Failure} which has neither, such as one
+        restored from an old pickle.
+        """
+        if name == 'frames' or name == 'stack':
+            if '_stackEntries' in self.__dict__:
+                self._extractFrames()
+                return self.__dict__[name]
+            if name == 'stack':
+                return None
+        raise AttributeError(name)
+
+
+    def _extractFrames(self):
+        """
+        Build C{frames} from C{tb}, and C{stack} from the calling frames
+        recorded in C{_stackEntries}.
+        """
+        entries = self.__dict__.pop('_stackEntries')
+        frames = []
+        stack = []
+        tb = self.tb
+        if tb is not None:
+            for name, filename, lineno in reversed(entries):
+                stack.append((name, filename, lineno, (), ()))
+            while tb is not None:
+                f = tb.tb_frame
+                frames.append((f.f_code.co_name, f.f_code.co_filename,
+                               tb.tb_lineno, (), ()))
+                tb = tb.tb_next
+        self.frames = frames
+        self.stack = stack
 
     def trap(self, *errorTypes):
         """Trap this failure if its type is in a predetermined list.
@@ -458,15 +526,11 @@ class Failure:
         """
         if self.pickled:
             return self.__dict__
+        if '_stackEntries' in self.__dict__:
+            self._extractFrames()
         c = self.__dict__.copy()
 
-        c['frames'] = [
-            [
-                v[0], v[1], v[2],
-                _safeReprVars(v[3]),
-                _safeReprVars(v[4]),
-            ] for v in self.frames
-        ]
+        c['frames'] = _safeReprFrames(self.frames)
 
         # added 2003-06-23. See comment above in __init__
         c['tb'] = None
@@ -474,13 +538,7 @@ class Failure:
         if self.stack is not None:
             # XXX: This is a band-aid.  I can't figure out where these
             # (failure.stack is None) instances are coming from.
-            c['stack'] = [
-                [
-                    v[0], v[1], v[2],
-                    _safeReprVars(v[3]),
-                    _safeReprVars(v[4]),
-                ] for v in self.stack
-            ]
+            c['stack'] = _safeReprFrames(self.stack)
 
         c['pickled'] = 1
         return c
@@ -626,6 +684,24 @@ def _safeReprVars(varsDictItems):
     return [(name, reflect.safe_repr(obj)) for (name, obj) in varsDictItems]
 
 
+
+def _safeReprFrames(frames):
+    """
+    Convert frames, as kept in L{Failure.frames} and L{Failure.stack}, into
+    the form in which they are pickled, with the reprs of any locals and
+    globals captured for them in place of the objects themselves.
+
+    @param frames: a sequence of (methodname, filename, lineno, locals,
+        globals) tuples.
+    @returns: a list of [methodname, filename, lineno, locals, globals] lists.
+    """
+    return [
+        [name, filename, lineno,
+         _safeReprVars(localz) if localz else [],
+         _safeReprVars(globalz) if globalz else []]
+        for (name, filename, lineno, localz, globalz) in frames]
+
+
 # slyphon: make post-morteming exceptions tweakable
 
 DO_POST_MORTEM = True
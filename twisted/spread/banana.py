@@ -31,6 +31,23 @@ def int2b128(integer, stream):
         integer = integer >> 7
 
 
+def _int2b128(integer):
+    """
+    Return the base 128 encoding of a non-negative integer, as written by
+    L{int2b128}, as a single string.
+
+    @type integer: C{int} or C{long}
+    @rtype: C{str}
+    """
+    if integer < 0x80:
+        return chr(integer)
+    digits = []
+    while integer:
+        digits.append(chr(integer & 0x7f))
+        integer >>= 7
+    return ''.join(digits)
+
+
 def b1282int(st):
     """
     Convert an integer represented as a base 128 string into an C{int} or
@@ -153,75 +170,86 @@ class Banana(protocol.Protocol, styles.Ephemeral):
             self.callExpressionReceived(item)
 
     buffer = ''
+    _wanted = 0
 
     def dataReceived(self, chunk):
+        """
+        Decode as many tokens as possible from the data received so far.
+
+        Tokens are parsed in place by advancing an offset through the
+        buffered data, which is only copied once per call to keep what is
+        left over.  While the body of a long string is still arriving, chunks
+        are collected without being parsed until enough data is available to
+        complete it.
+        """
+        if self._wanted:
+            self._pending.append(chunk)
+            self._pendingSize += len(chunk)
+            if len(self.buffer) + self._pendingSize < self._wanted:
+                return
+            chunk = ''.join(self._pending)
+            del self._pending, self._pendingSize
+            self._wanted = 0
+
         buffer = self.buffer + chunk
+        end = len(buffer)
+        offset = 0
         listStack = self.listStack
         gotItem = self.gotItem
-        while buffer:
-            assert self.buffer != buffer, "This ain't right: %s %s" % (repr(self.buffer), repr(buffer))
-            self.buffer = buffer
-            pos = 0
-            for ch in buffer:
-                if ch >= HIGH_BIT_SET:
-                    break
-                pos = pos + 1
-            else:
-                if pos > self.prefixLimit:
-                    raise BananaError("Security precaution: more than %d bytes of prefix" % (self.prefixLimit,))
-                return
-            num = buffer[:pos]
-            typebyte = buffer[pos]
-            rest = buffer[pos+1:]
-            if len(num) > self.prefixLimit:
-                raise BananaError("Security precaution: longer than %d bytes worth of prefix" % (self.prefixLimit,))
-            if typebyte == LIST:
-                num = b1282int(num)
-                if num > SIZE_LIMIT:
-                    raise BananaError("Security precaution: List too long.")
-                listStack.append((num, []))
-                buffer = rest
-            elif typebyte == STRING:
-                num = b1282int(num)
-                if num > SIZE_LIMIT:
-                    raise BananaError("Security precaution: String too long.")
-                if len(rest) >= num:
-                    buffer = rest[num:]
-                    gotItem(rest[:num])
-                else:
+        prefixLimit = self.prefixLimit
+        try:
+            while offset < end:
+                pos = offset
+                while pos < end and buffer[pos] < HIGH_BIT_SET:
+                    pos += 1
+                if pos == end:
+                    if pos - offset > prefixLimit:
+                        raise BananaError("Security precaution: more than %d bytes of prefix" % (prefixLimit,))
                     return
-            elif typebyte == INT:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(num)
-            elif typebyte == LONGINT:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(num)
-            elif typebyte == LONGNEG:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(-num)
-            elif typebyte == NEG:
-                buffer = rest
-                num = -b1282int(num)
-                gotItem(num)
-            elif typebyte == VOCAB:
-                buffer = rest
-                num = b1282int(num)
-                gotItem(self.incomingVocabulary[num])
-            elif typebyte == FLOAT:
-                if len(rest) >= 8:
-                    buffer = rest[8:]
-                    gotItem(struct.unpack("!d", rest[:8])[0])
+                if pos - offset > prefixLimit:
+                    raise BananaError("Security precaution: longer than %d bytes worth of prefix" % (prefixLimit,))
+                num = b1282int(buffer[offset:pos])
+                typebyte = buffer[pos]
+                start = pos + 1
+                if typebyte == LIST:
+                    if num > SIZE_LIMIT:
+                        raise BananaError("Security precaution: List too long.")
+                    offset = start
+                    listStack.append((num, []))
+                elif typebyte == STRING:
+                    if num > SIZE_LIMIT:
+                        raise BananaError("Security precaution: String too long.")
+                    if end - start < num:
+                        self._wanted = start + num - offset
+                        self._pending = []
+                        self._pendingSize = 0
+                        return
+                    offset = start + num
+                    gotItem(buffer[start:offset])
+                elif typebyte == INT or typebyte == LONGINT:
+                    offset = start
+                    gotItem(num)
+                elif typebyte == NEG or typebyte == LONGNEG:
+                    offset = start
+                    gotItem(-num)
+                elif typebyte == VOCAB:
+                    offset = start
+                    gotItem(self.incomingVocabulary[num])
+                elif typebyte == FLOAT:
+                    if end - start < 8:
+                        self._wanted = start + 8 - offset
+                        self._pending = []
+                        self._pendingSize = 0
+                        return
+                    offset = start + 8
+                    gotItem(struct.unpack("!d", buffer[start:offset])[0])
                 else:
-                    return
-            else:
-                raise NotImplementedError(("Invalid Type Byte %r" % (typebyte,)))
-            while listStack and (len(listStack[-1][1]) == listStack[-1][0]):
-                item = listStack.pop()[1]
-                gotItem(item)
-        self.buffer = ''
+                    raise NotImplementedError(("Invalid Type Byte %r" % (typebyte,)))
+                while listStack and (len(listStack[-1][1]) == listStack[-1][0]):
+                    item = listStack.pop()[1]
+                    gotItem(item)
+        finally:
+            self.buffer = buffer[offset:]
 
 
     def expressionReceived(self, lst):
@@ -280,52 +308,47 @@ class Banana(protocol.Protocol, styles.Ephemeral):
         self.isClient = isClient
 
     def sendEncoded(self, obj):
-        io = cStringIO.StringIO()
-        self._encode(obj, io.write)
-        value = io.getvalue()
-        self.transport.write(value)
+        """
+        Encode C{obj} into a single buffer and write it to the transport all
+        at once.
+        """
+        encoded = bytearray()
+        self._encode(obj, encoded.extend)
+        self.transport.write(bytes(encoded))
 
     def _encode(self, obj, write):
-        if isinstance(obj, (list, tuple)):
+        if isinstance(obj, str):
+            # TODO: an API for extending banana...
+            if self.currentDialect == "pb" and obj in self.outgoingSymbols:
+                write(_int2b128(self.outgoingSymbols[obj]) + VOCAB)
+            else:
+                if len(obj) > SIZE_LIMIT:
+                    raise BananaError(
+                        "string is too long to send (%d)" % (len(obj),))
+                write(_int2b128(len(obj)) + STRING)
+                write(obj)
+        elif isinstance(obj, (list, tuple)):
             if len(obj) > SIZE_LIMIT:
                 raise BananaError(
                     "list/tuple is too long to send (%d)" % (len(obj),))
-            int2b128(len(obj), write)
-            write(LIST)
+            write(_int2b128(len(obj)) + LIST)
+            encode = self._encode
             for elem in obj:
-                self._encode(elem, write)
+                encode(elem, write)
         elif isinstance(obj, (int, long)):
             if obj < self._smallestLongInt or obj > self._largestLongInt:
                 raise BananaError(
                     "int/long is too large to send (%d)" % (obj,))
             if obj < self._smallestInt:
-                int2b128(-obj, write)
-                write(LONGNEG)
+                write(_int2b128(-obj) + LONGNEG)
             elif obj < 0:
-                int2b128(-obj, write)
-                write(NEG)
+                write(_int2b128(-obj) + NEG)
             elif obj <= self._largestInt:
-                int2b128(obj, write)
-                write(INT)
+                write(_int2b128(obj) + INT)
             else:
-                int2b128(obj, write)
-                write(LONGINT)
+                write(_int2b128(obj) + LONGINT)
         elif isinstance(obj, float):
-            write(FLOAT)
-            write(struct.pack("!d", obj))
-        elif isinstance(obj, str):
-            # TODO: an API for extending banana...
-            if self.currentDialect == "pb" and obj in self.outgoingSymbols:
-                symbolID = self.outgoingSymbols[obj]
-                int2b128(symbolID, write)
-                write(VOCAB)
-            else:
-                if len(obj) > SIZE_LIMIT:
-                    raise BananaError(
-                        "string is too long to send (%d)" % (len(obj),))
-                int2b128(len(obj), write)
-                write(STRING)
-                write(obj)
+            write(FLOAT + struct.pack("!d", obj))
         else:
             raise BananaError("could not send object: %r" % (obj,))
 
@@ -354,5 +377,6 @@ def decode(st):
         _i.dataReceived(st)
     finally:
         _i.buffer = ''
+        _i._wanted = 0
         del _i.expressionReceived
     return l[0]
@@ -81,6 +81,7 @@ from types import InstanceType
 from types import NoneType
 from types import ClassType
 import copy
+from functools import partial
 
 import datetime
 from types import BooleanType
@@ -370,6 +371,11 @@ class _Jellier:
         self._ref_id = 1
         self.persistentStore = persistentStore
         self.invoker = invoker
+        # Map types to the bound method which jellies them, and classes to
+        # their qualified name (or None if they are not allowed); see
+        # _resolveType and _isClassAllowed.
+        self._typeHandlers = {}
+        self._classNames = {}
 
 
     def _cook(self, object):
@@ -456,104 +462,262 @@ class _Jellier:
 
 
     def jelly(self, obj):
-        if isinstance(obj, Jellyable):
-            preRef = self._checkMutable(obj)
-            if preRef:
-                return preRef
-            return obj.jellyFor(self)
         objType = type(obj)
-        if self.taster.isTypeAllowed(qual(objType)):
-            # "Immutable" Types
-            if ((objType is StringType) or
-                (objType is IntType) or
-                (objType is LongType) or
-                (objType is FloatType)):
-                return obj
-            elif objType is MethodType:
-                return ["method",
-                        obj.im_func.__name__,
-                        self.jelly(obj.im_self),
-                        self.jelly(obj.im_class)]
-
-            elif UnicodeType and objType is UnicodeType:
-                return ['unicode', obj.encode('UTF-8')]
-            elif objType is NoneType:
-                return ['None']
-            elif objType is FunctionType:
-                name = obj.__name__
-                return ['function', str(pickle.whichmodule(obj, obj.__name__))
-                        + '.' +
-                        name]
-            elif objType is ModuleType:
-                return ['module', obj.__name__]
-            elif objType is BooleanType:
-                return ['boolean', obj and 'true' or 'false']
-            elif objType is datetime.datetime:
-                if obj.tzinfo:
-                    raise NotImplementedError(
-                        "Currently can't jelly datetime objects with tzinfo")
-                return ['datetime', '%s %s %s %s %s %s %s' % (
-                    obj.year, obj.month, obj.day, obj.hour,
-                    obj.minute, obj.second, obj.microsecond)]
-            elif objType is datetime.time:
-                if obj.tzinfo:
-                    raise NotImplementedError(
-                        "Currently can't jelly datetime objects with tzinfo")
-                return ['time', '%s %s %s %s' % (obj.hour, obj.minute,
-                                                 obj.second, obj.microsecond)]
-            elif objType is datetime.date:
-                return ['date', '%s %s %s' % (obj.year, obj.month, obj.day)]
-            elif objType is datetime.timedelta:
-                return ['timedelta', '%s %s %s' % (obj.days, obj.seconds,
-                                                   obj.microseconds)]
-            elif objType is ClassType or issubclass(objType, type):
-                return ['class', qual(obj)]
-            elif objType is decimal.Decimal:
-                return self.jelly_decimal(obj)
+        handler = self._typeHandlers.get(objType)
+        if handler is None:
+            handler = self._resolveType(objType)
+            self._typeHandlers[objType] = handler
+        return handler(obj)
+
+
+    def _resolveType(self, objType):
+        """
+        (internal) Work out, once per type, how instances of C{objType} are to
+        be jellied.
+
+        The security decision for the type and the choice of serialization
+        routine are made here and remembered for the rest of this jellier's
+        lifetime, so that L{jelly} only has to do a dictionary lookup per
+        object.
+
+        @param objType: The type of an object about to be jellied.
+
+        @return: A one-argument callable which jellies an object of type
+            C{objType}.
+        """
+        allowed = self.taster.isTypeAllowed(qual(objType))
+        if objType is InstanceType:
+            # Every classic instance has the same type, so whether one is
+            # Jellyable can only be told object by object.
+            if allowed:
+                return self._jellyClassicInstance
+            return self._jellyInsecureInstance
+        if issubclass(objType, Jellyable):
+            return self._jellyJellyable
+        if not allowed:
+            return self._jellyInsecure
+        function = self._jellyDispatch.get(objType)
+        if function is not None:
+            return function.__get__(self, self.__class__)
+        if issubclass(objType, type):
+            return self._jellyClass
+        return self._jellyInstance
+
+
+    def _isClassAllowed(self, klass):
+        """
+        (internal) Ask the taster whether instances of C{klass} may be
+        jellied, remembering the answer.
+
+        @return: The fully qualified name of C{klass} if it is allowed, or
+            C{None} if it is not.
+        """
+        try:
+            return self._classNames[klass]
+        except KeyError:
+            if self.taster.isClassAllowed(klass):
+                className = qual(klass)
             else:
-                preRef = self._checkMutable(obj)
-                if preRef:
-                    return preRef
-                # "Mutable" Types
-                sxp = self.prepare(obj)
-                if objType is ListType:
-                    sxp.extend(self._jellyIterable(list_atom, obj))
-                elif objType is TupleType:
-                    sxp.extend(self._jellyIterable(tuple_atom, obj))
-                elif objType in DictTypes:
-                    sxp.append(dictionary_atom)
-                    for key, val in obj.items():
-                        sxp.append([self.jelly(key), self.jelly(val)])
-                elif objType is set or objType is _sets.Set:
-                    sxp.extend(self._jellyIterable(set_atom, obj))
-                elif objType is frozenset or objType is _sets.ImmutableSet:
-                    sxp.extend(self._jellyIterable(frozenset_atom, obj))
-                else:
-                    className = qual(obj.__class__)
-                    persistent = None
-                    if self.persistentStore:
-                        persistent = self.persistentStore(obj, self)
-                    if persistent is not None:
-                        sxp.append(persistent_atom)
-                        sxp.append(persistent)
-                    elif self.taster.isClassAllowed(obj.__class__):
-                        sxp.append(className)
-                        if hasattr(obj, "__getstate__"):
-                            state = obj.__getstate__()
-                        else:
-                            state = obj.__dict__
-                        sxp.append(self.jelly(state))
-                    else:
-                        self.unpersistable(
-                            "instance of class %s deemed insecure" %
-                            qual(obj.__class__), sxp)
-                return self.preserve(obj, sxp)
+                className = None
+            self._classNames[klass] = className
+            return className
+
+
+    def _jellyJellyable(self, obj):
+        preRef = self._checkMutable(obj)
+        if preRef:
+            return preRef
+        return obj.jellyFor(self)
+
+
+    def _jellyClassicInstance(self, obj):
+        if isinstance(obj, Jellyable):
+            return self._jellyJellyable(obj)
+        return self._jellyInstance(obj)
+
+
+    def _jellyInsecureInstance(self, obj):
+        if isinstance(obj, Jellyable):
+            return self._jellyJellyable(obj)
+        raise InsecureJelly("Class not allowed for instance: %s %s" %
+                            (obj.__class__, obj))
+
+
+    def _jellyInsecure(self, obj):
+        raise InsecureJelly("Type not allowed for object: %s %s" %
+                            (type(obj), obj))
+
+
+    def _jellyImmutable(self, obj):
+        return obj
+
+
+    def _jellyMethod(self, obj):
+        return ["method",
+                obj.im_func.__name__,
+                self.jelly(obj.im_self),
+                self.jelly(obj.im_class)]
+
+
+    def _jellyUnicode(self, obj):
+        return ['unicode', obj.encode('UTF-8')]
+
+
+    def _jellyNone(self, obj):
+        return ['None']
+
+
+    def _jellyFunction(self, obj):
+        name = obj.__name__
+        return ['function', str(pickle.whichmodule(obj, obj.__name__))
+                + '.' +
+                name]
+
+
+    def _jellyModule(self, obj):
+        return ['module', obj.__name__]
+
+
+    def _jellyBoolean(self, obj):
+        return ['boolean', obj and 'true' or 'false']
+
+
+    def _jellyDatetime(self, obj):
+        if obj.tzinfo:
+            raise NotImplementedError(
+                "Currently can't jelly datetime objects with tzinfo")
+        return ['datetime', '%s %s %s %s %s %s %s' % (
+            obj.year, obj.month, obj.day, obj.hour,
+            obj.minute, obj.second, obj.microsecond)]
+
+
+    def _jellyTime(self, obj):
+        if obj.tzinfo:
+            raise NotImplementedError(
+                "Currently can't jelly datetime objects with tzinfo")
+        return ['time', '%s %s %s %s' % (obj.hour, obj.minute,
+                                         obj.second, obj.microsecond)]
+
+
+    def _jellyDate(self, obj):
+        return ['date', '%s %s %s' % (obj.year, obj.month, obj.day)]
+
+
+    def _jellyTimedelta(self, obj):
+        return ['timedelta', '%s %s %s' % (obj.days, obj.seconds,
+                                           obj.microseconds)]
+
+
+    def _jellyClass(self, obj):
+        return ['class', qual(obj)]
+
+
+    def _jellyDecimal(self, obj):
+        return self.jelly_decimal(obj)
+
+
+    def _jellyList(self, obj):
+        preRef = self._checkMutable(obj)
+        if preRef:
+            return preRef
+        sxp = self.prepare(obj)
+        sxp.extend(self._jellyIterable(list_atom, obj))
+        return self.preserve(obj, sxp)
+
+
+    def _jellyTuple(self, obj):
+        preRef = self._checkMutable(obj)
+        if preRef:
+            return preRef
+        sxp = self.prepare(obj)
+        sxp.extend(self._jellyIterable(tuple_atom, obj))
+        return self.preserve(obj, sxp)
+
+
+    def _jellyDictionary(self, obj):
+        preRef = self._checkMutable(obj)
+        if preRef:
+            return preRef
+        sxp = self.prepare(obj)
+        sxp.append(dictionary_atom)
+        jelly = self.jelly
+        for key, val in obj.items():
+            sxp.append([jelly(key), jelly(val)])
+        return self.preserve(obj, sxp)
+
+
+    def _jellySet(self, obj):
+        preRef = self._checkMutable(obj)
+        if preRef:
+            return preRef
+        sxp = self.prepare(obj)
+        sxp.extend(self._jellyIterable(set_atom, obj))
+        return self.preserve(obj, sxp)
+
+
+    def _jellyFrozenset(self, obj):
+        preRef = self._checkMutable(obj)
+        if preRef:
+            return preRef
+        sxp = self.prepare(obj)
+        sxp.extend(self._jellyIterable(frozenset_atom, obj))
+        return self.preserve(obj, sxp)
+
+
+    def _jellyInstance(self, obj):
+        preRef = self._checkMutable(obj)
+        if preRef:
+            return preRef
+        sxp = self.prepare(obj)
+        persistent = None
+        if self.persistentStore:
+            persistent = self.persistentStore(obj, self)
+        if persistent is not None:
+            sxp.append(persistent_atom)
+            sxp.append(persistent)
         else:
-            if objType is InstanceType:
-                raise InsecureJelly("Class not allowed for instance: %s %s" %
-                                    (obj.__class__, obj))
-            raise InsecureJelly("Type not allowed for object: %s %s" %
-                                (objType, obj))
+            className = self._isClassAllowed(obj.__class__)
+            if className is not None:
+                sxp.append(className)
+                if hasattr(obj, "__getstate__"):
+                    state = obj.__getstate__()
+                else:
+                    state = obj.__dict__
+                sxp.append(self.jelly(state))
+            else:
+                self.unpersistable(
+                    "instance of class %s deemed insecure" %
+                    qual(obj.__class__), sxp)
+        return self.preserve(obj, sxp)
+
+    # Serialization routines for objects whose type is exactly one of these;
+    # anything else is a class or an instance.  Subclasses of these types are
+    # deliberately not included, as they are jellied as instances.
+    _jellyDispatch = {
+        StringType: _jellyImmutable,
+        IntType: _jellyImmutable,
+        LongType: _jellyImmutable,
+        FloatType: _jellyImmutable,
+        MethodType: _jellyMethod,
+        UnicodeType: _jellyUnicode,
+        NoneType: _jellyNone,
+        FunctionType: _jellyFunction,
+        ModuleType: _jellyModule,
+        BooleanType: _jellyBoolean,
+        datetime.datetime: _jellyDatetime,
+        datetime.time: _jellyTime,
+        datetime.date: _jellyDate,
+        datetime.timedelta: _jellyTimedelta,
+        ClassType: _jellyClass,
+        decimal.Decimal: _jellyDecimal,
+        ListType: _jellyList,
+        TupleType: _jellyTuple,
+        DictionaryType: _jellyDictionary,
+        set: _jellySet,
+        _sets.Set: _jellySet,
+        frozenset: _jellyFrozenset,
+        _sets.ImmutableSet: _jellyFrozenset,
+        }
 
 
     def _jellyIterable(self, atom, obj):
@@ -612,6 +776,8 @@ class _Unjellier:
         self.references = {}
         self.postCallbacks = []
         self.invoker = invoker
+        # Map type tags to the callable which unjellies them; see _resolveTag.
+        self._tagHandlers = {}
 
 
     def unjellyFull(self, obj):
@@ -625,52 +791,92 @@ class _Unjellier:
         if type(obj) is not types.ListType:
             return obj
         jelType = obj[0]
+        handler = self._tagHandlers.get(jelType)
+        if handler is None:
+            handler = self._resolveTag(jelType)
+            self._tagHandlers[jelType] = handler
+        return handler(obj)
+
+
+    def _resolveTag(self, jelType):
+        """
+        (internal) Work out, once per type tag, how expressions tagged with
+        C{jelType} are to be unjellied.
+
+        The security checks for the tag and the lookup of whatever unjellies
+        it - a registered copier or factory, one of the C{_unjelly_} methods
+        or a class named by the tag - are done here and remembered for the
+        rest of this unjellier's lifetime.
+
+        @param jelType: The first element of a jellied list.
+
+        @raise InsecureJelly: If the tag, or the module or class it names, is
+            not allowed by the taster.
+
+        @return: A one-argument callable which unjellies a list tagged with
+            C{jelType}.
+        """
         if not self.taster.isTypeAllowed(jelType):
             raise InsecureJelly(jelType)
         regClass = unjellyableRegistry.get(jelType)
         if regClass is not None:
-            if isinstance(regClass, ClassType):
-                inst = _Dummy() # XXX chomp, chomp
-                inst.__class__ = regClass
-                method = inst.unjellyFor
-            elif isinstance(regClass, type):
-                # regClass.__new__ does not call regClass.__init__
-                inst = regClass.__new__(regClass)
-                method = inst.unjellyFor
-            else:
-                method = regClass # this is how it ought to be done
-            val = method(self, obj)
-            if hasattr(val, 'postUnjelly'):
-                self.postCallbacks.append(inst.postUnjelly)
-            return val
+            return partial(self._unjellyRegistered, regClass)
         regFactory = unjellyableFactoryRegistry.get(jelType)
         if regFactory is not None:
-            state = self.unjelly(obj[1])
-            inst = regFactory(state)
-            if hasattr(inst, 'postUnjelly'):
-                self.postCallbacks.append(inst.postUnjelly)
-            return inst
+            return partial(self._unjellyFactory, regFactory)
         thunk = getattr(self, '_unjelly_%s'%jelType, None)
         if thunk is not None:
-            ret = thunk(obj[1:])
+            return partial(self._unjellyBuiltin, thunk)
+        nameSplit = jelType.split('.')
+        modName = '.'.join(nameSplit[:-1])
+        if not self.taster.isModuleAllowed(modName):
+            raise InsecureJelly(
+                "Module %s not allowed (in type %s)." % (modName, jelType))
+        clz = namedObject(jelType)
+        if not self.taster.isClassAllowed(clz):
+            raise InsecureJelly("Class %s not allowed." % jelType)
+        return partial(self._unjellyClassInstance, clz)
+
+
+    def _unjellyRegistered(self, regClass, obj):
+        if isinstance(regClass, ClassType):
+            inst = _Dummy() # XXX chomp, chomp
+            inst.__class__ = regClass
+            method = inst.unjellyFor
+        elif isinstance(regClass, type):
+            # regClass.__new__ does not call regClass.__init__
+            inst = regClass.__new__(regClass)
+            method = inst.unjellyFor
         else:
-            nameSplit = jelType.split('.')
-            modName = '.'.join(nameSplit[:-1])
-            if not self.taster.isModuleAllowed(modName):
-                raise InsecureJelly(
-                    "Module %s not allowed (in type %s)." % (modName, jelType))
-            clz = namedObject(jelType)
-            if not self.taster.isClassAllowed(clz):
-                raise InsecureJelly("Class %s not allowed." % jelType)
-            if hasattr(clz, "__setstate__"):
-                ret = _newInstance(clz)
-                state = self.unjelly(obj[1])
-                ret.__setstate__(state)
-            else:
-                state = self.unjelly(obj[1])
-                ret = _newInstance(clz, state)
-            if hasattr(clz, 'postUnjelly'):
-                self.postCallbacks.append(ret.postUnjelly)
+            method = regClass # this is how it ought to be done
+        val = method(self, obj)
+        if hasattr(val, 'postUnjelly'):
+            self.postCallbacks.append(val.postUnjelly)
+        return val
+
+
+    def _unjellyFactory(self, regFactory, obj):
+        state = self.unjelly(obj[1])
+        inst = regFactory(state)
+        if hasattr(inst, 'postUnjelly'):
+            self.postCallbacks.append(inst.postUnjelly)
+        return inst
+
+
+    def _unjellyBuiltin(self, thunk, obj):
+        return thunk(obj[1:])
+
+
+    def _unjellyClassInstance(self, clz, obj):
+        if hasattr(clz, "__setstate__"):
+            ret = _newInstance(clz)
+            state = self.unjelly(obj[1])
+            ret.__setstate__(state)
+        else:
+            state = self.unjelly(obj[1])
+            ret = _newInstance(clz, state)
+        if hasattr(clz, 'postUnjelly'):
+            self.postCallbacks.append(ret.postUnjelly)
         return ret
 
 
@@ -758,12 +964,37 @@ class _Unjellier:
         return o
 
 
-    def _unjelly_tuple(self, lst):
+    def _unjellyItems(self, lst):
+        """
+        (internal) Unjelly each element of a sequence into a new list.
+
+        Elements which can not be resolved yet are left in the list as
+        L{NotKnown} placeholders which will replace themselves once their
+        referent has been unjellied.
+
+        @param lst: A sequence of jellied elements.
+        @type lst: C{list}
+
+        @return: A two-tuple of the new list and a flag which is true if every
+            element was resolved.
+        @rtype: C{tuple}
+        """
         l = range(len(lst))
-        finished = 1
+        finished = True
+        unjelly = self.unjelly
         for elem in l:
-            if isinstance(self.unjellyInto(l, elem, lst[elem]), NotKnown):
-                finished = 0
+            o = lst[elem]
+            if type(o) is ListType:
+                o = unjelly(o)
+                if isinstance(o, NotKnown):
+                    o.addDependant(l, elem)
+                    finished = False
+            l[elem] = o
+        return l, finished
+
+
+    def _unjelly_tuple(self, lst):
+        l, finished = self._unjellyItems(lst)
         if finished:
             return tuple(l)
         else:
@@ -771,10 +1002,7 @@ class _Unjellier:
 
 
     def _unjelly_list(self, lst):
-        l = range(len(lst))
-        for elem in l:
-            self.unjellyInto(l, elem, lst[elem])
-        return l
+        return self._unjellyItems(lst)[0]
 
 
     def _unjellySetOrFrozenset(self, lst, containerType):
@@ -786,12 +1014,7 @@ class _Unjellier:
 
         @param containerType: the type of C{set} to use.
         """
-        l = range(len(lst))
-        finished = True
-        for elem in l:
-            data = self.unjellyInto(l, elem, lst[elem])
-            if isinstance(data, NotKnown):
-                finished = False
+        l, finished = self._unjellyItems(lst)
         if not finished:
             return _Container(l, containerType)
         else:
@@ -814,10 +1037,25 @@ class _Unjellier:
 
     def _unjelly_dictionary(self, lst):
         d = {}
+        unjelly = self.unjelly
         for k, v in lst:
+            key = unjelly(k)
+            if not isinstance(key, NotKnown):
+                value = unjelly(v)
+                if not isinstance(value, NotKnown):
+                    d[key] = value
+                    continue
+            # Something is still unresolved; let a placeholder fill in the
+            # entry when it is.
             kvd = _DictKeyAndValue(d)
-            self.unjellyInto(kvd, 0, k)
-            self.unjellyInto(kvd, 1, v)
+            if isinstance(key, NotKnown):
+                key.addDependant(kvd, 0)
+                kvd[0] = key
+                self.unjellyInto(kvd, 1, v)
+            else:
+                kvd[0] = key
+                value.addDependant(kvd, 1)
+                kvd[1] = value
         return d
 
 
@@ -416,6 +416,7 @@ class CopyableFailure(failure.Failure, Copyable):
         """
         state = self.__dict__.copy()
         state['tb'] = None
+        state.pop('_stackEntries', None)
         state['frames'] = []
         state['stack'] = []
         state['value'] = str(self.value) # Exception instance
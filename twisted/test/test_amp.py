@@ -400,6 +400,17 @@ class AmpBoxTests(unittest.TestCase):
         self.assertRaises(TypeError, a.serialize)
 
 
+    def test_serializeFailureLeavesBufferAlone(self):
+        """
+        If a box can not be serialized into a list of strings shared with
+        other boxes, nothing is appended to that list.
+        """
+        parts = ['previous box']
+        a = amp.AmpBox(a='value', b=u'value')
+        self.assertRaises(TypeError, a._serializeInto, parts)
+        self.assertEqual(parts, ['previous box'])
+
+
 
 class ParsingTest(unittest.TestCase):
 
@@ -1152,6 +1163,65 @@ class BinaryProtocolTests(unittest.TestCase):
         self.assertRaises(amp.ProtocolSwitched, a._unlockFromSwitch)
 
 
+    def test_receiveBoxesInPieces(self):
+        """
+        L{amp.BinaryBoxProtocol} delivers the same boxes however the bytes of
+        a stream of boxes are split up by the transport.
+        """
+        boxes = [amp.Box({"first": "box", "k": "v" * 300}), amp.Box(),
+                 amp.Box({"third": "box"})]
+        a = amp.BinaryBoxProtocol(self)
+        for count, box in enumerate(boxes):
+            data = box.serialize()
+            for byte in data[:-1]:
+                a.dataReceived(byte)
+            self.assertEqual(len(self.boxes), count)
+            a.dataReceived(data[-1])
+        self.assertEqual(self.boxes, boxes)
+
+
+    def test_repliesCoalesced(self):
+        """
+        Boxes sent while L{amp.BinaryBoxProtocol} is delivering the boxes in a
+        chunk of received data are written to the transport in one call once
+        the chunk has been handled.
+        """
+        class EchoingReceiver:
+            def startReceivingBoxes(self, sender):
+                self.sender = sender
+            def ampBoxReceived(self, box):
+                self.sender.sendBox(box)
+        a = amp.BinaryBoxProtocol(EchoingReceiver())
+        a.makeConnection(self)
+        first = amp.Box({"first": "box"})
+        second = amp.Box({"second": "box"})
+        a.dataReceived(first.serialize() + second.serialize())
+        self.assertEqual(self.data, [first.serialize() + second.serialize()])
+
+
+    def test_quitBoxWrittenBeforeDisconnect(self):
+        """
+        A L{amp.QuitBox} sent while handling received data is written to the
+        transport before the connection is closed.
+        """
+        events = []
+        class QuittingReceiver:
+            def startReceivingBoxes(self, sender):
+                self.sender = sender
+            def ampBoxReceived(self, box):
+                amp.QuitBox(box)._sendTo(self.sender)
+        class RecordingTransport(StringTransport):
+            def write(self, data):
+                events.append(data)
+            def loseConnection(self):
+                events.append(None)
+        a = amp.BinaryBoxProtocol(QuittingReceiver())
+        a.makeConnection(RecordingTransport())
+        box = amp.Box({"last": "box"})
+        a.dataReceived(box.serialize())
+        self.assertEqual(events, [box.serialize(), None])
+
+
     def test_protocolSwitchLoseConnection(self):
         """
         When the protocol is switched, it should notify its nested protocol of
@@ -2621,6 +2691,75 @@ class CommandTestCase(unittest.TestCase):
             None)
 
 
+    def test_simpleArgumentTypes(self):
+        """
+        L{Command.makeArguments} and L{Command.parseArguments} convert the
+        values of the basic argument types to and from their wire encodings.
+        """
+        class Basic(amp.Command):
+            arguments = [('integer', amp.Integer()),
+                         ('string', amp.String()),
+                         ('unicode', amp.Unicode()),
+                         ('boolean', amp.Boolean()),
+                         ('float', amp.Float()),
+                         ('dash-optional', amp.String(optional=True))]
+        objects = {'integer': 7, 'string': 'bytes', 'unicode': u'caf\xe9',
+                   'boolean': False, 'float': 1.5}
+        strings = {'integer': '7', 'string': 'bytes', 'unicode': 'caf\xc3\xa9',
+                   'boolean': 'False', 'float': '1.5'}
+        self.assertEqual(Basic.makeArguments(objects, None), strings)
+        objects['dash_optional'] = None
+        self.assertEqual(Basic.parseArguments(strings, None), objects)
+        strings['dash-optional'] = 'given'
+        objects['dash_optional'] = 'given'
+        self.assertEqual(Basic.parseArguments(strings, None), objects)
+        self.assertEqual(Basic.makeArguments(objects, None), strings)
+
+
+    def test_missingArgument(self):
+        """
+        L{Command.parseArguments} raises L{KeyError} if a required argument is
+        missing from the box.
+        """
+        self.assertRaises(KeyError, Hello.parseArguments, {}, None)
+        self.assertRaises(
+            KeyError, ProtocolIncludingCommand.parseArguments, {}, None)
+
+
+    def test_overriddenConversion(self):
+        """
+        A subclass of one of the basic argument types which overrides
+        C{toString} or C{fromString} has its own methods used.
+        """
+        class Reversed(amp.String):
+            def toString(self, inObject):
+                return inObject[::-1]
+            def fromString(self, inString):
+                return inString[::-1] + "!"
+        class Reversing(amp.Command):
+            arguments = [('value', Reversed())]
+        self.assertEqual(
+            Reversing.makeArguments({'value': 'abc'}, None), {'value': 'cba'})
+        self.assertEqual(
+            Reversing.parseArguments({'value': 'cba'}, None),
+            {'value': 'abc!'})
+
+
+    def test_replacedArguments(self):
+        """
+        If the argument list of a L{Command} is replaced after the class is
+        created, the new list is used.
+        """
+        class Replaced(amp.Command):
+            arguments = [('old', amp.Integer())]
+        Replaced.arguments = [('new', amp.Integer())]
+        self.assertEqual(Replaced.makeArguments({'new': 3}, None), {'new': '3'})
+        self.assertEqual(Replaced.parseArguments({'new': '3'}, None),
+                         {'new': 3})
+        self.assertRaises(amp.InvalidSignature, Replaced)
+
+
+
 class ListOfTestsMixin:
     """
     Base class for testing L{ListOf}, a parameterized zero-or-more argument
@@ -3079,6 +3218,468 @@ class DescriptorTests(unittest.TestCase):
 
 
 
+class Upload(amp.Command):
+    arguments = [('data', amp.Stream())]
+    response = [('length', amp.Integer())]
+
+
+
+class Ignore(amp.Command):
+    arguments = [('data', amp.Stream())]
+    response = []
+
+
+
+class Peek(amp.Command):
+    arguments = [('data', amp.Stream())]
+    response = []
+
+
+
+class Download(amp.Command):
+    arguments = [('length', amp.Integer())]
+    response = [('data', amp.Stream(window=2))]
+
+
+
+class DownloadUnanswered(Download):
+    commandName = 'Download'
+    requiresAnswer = False
+
+
+
+class UploadCounted(amp.Command):
+    arguments = [('data', amp.Stream()), ('count', amp.Integer())]
+    response = []
+
+
+
+class CountingSource(object):
+    """
+    A file-like object which produces a fixed number of bytes and records how
+    often it was read.
+
+    @ivar reads: the number of times C{read} has been called.
+    """
+    reads = 0
+
+    def __init__(self, length, fail=False):
+        self.remaining = length
+        self.fail = fail
+
+
+    def read(self, size):
+        self.reads += 1
+        if self.fail:
+            raise IOError("Disk on fire")
+        size = min(size, self.remaining)
+        self.remaining -= size
+        return 'x' * size
+
+
+
+class StreamingProtocol(amp.AMP):
+    """
+    A protocol which keeps the streams it is sent for the tests to consume,
+    and sends streams of the requested length.
+
+    @ivar streams: the incoming stream objects received as L{Upload}
+        arguments.
+
+    @ivar sources: the L{CountingSource}s sent in L{Download} responses.
+
+    @ivar failSources: whether those sources fail when they are read.
+    """
+    failSources = False
+
+    def __init__(self):
+        amp.AMP.__init__(self)
+        self.streams = []
+        self.sources = []
+
+
+    def upload(self, data):
+        self.streams.append(data)
+        consumer = StringTransport()
+        d = data.deliverTo(consumer)
+        d.addCallback(lambda ignored: {'length': len(consumer.value())})
+        return d
+    Upload.responder(upload)
+
+
+    def ignore(self, data):
+        self.streams.append(data)
+        return {}
+    Ignore.responder(ignore)
+
+
+    def peek(self, data):
+        self.streams.append(data)
+        self.peeked = data.deliverTo(StringTransport())
+        return {}
+    Peek.responder(peek)
+
+
+    def download(self, length):
+        source = CountingSource(length, self.failSources)
+        self.sources.append(source)
+        return {'data': source}
+    Download.responder(download)
+
+
+
+class StreamTests(unittest.TestCase):
+    """
+    Tests for L{amp.Stream}, an argument type for transferring more data than
+    fits in a single value.
+    """
+    def setUp(self):
+        self.client, self.server, self.pump = connectedServerAndClient(
+            StreamingProtocol, StreamingProtocol)
+
+
+    def test_largePayload(self):
+        """
+        The contents of a file-like object passed as a L{amp.Stream} argument
+        are delivered to the receiving side's consumer, in chunks no longer
+        than the limit on a single value.
+        """
+        source = CountingSource(amp.MAX_VALUE_LENGTH * 20 + 10)
+        answers = []
+        self.client.callRemote(Upload, data=source).addCallback(answers.append)
+        self.pump.flush()
+        self.assertEqual(answers, [{'length': amp.MAX_VALUE_LENGTH * 20 + 10}])
+        self.assertEqual(source.reads, 22)
+        self.assertEqual(self.client._outgoingStreams, {})
+        self.assertEqual(self.server._incomingStreams, {})
+
+
+    def test_unreadStreamClosed(self):
+        """
+        A stream argument which the responder does not read is closed once
+        the responder has finished, so that neither side keeps it, and it can
+        no longer be delivered.
+        """
+        source = CountingSource(amp.MAX_VALUE_LENGTH * 100)
+        answers = []
+        self.client.callRemote(Ignore, data=source).addCallback(answers.append)
+        self.pump.flush()
+        self.assertEqual(answers, [{}])
+        self.assertEqual(self.client._outgoingStreams, {})
+        self.assertEqual(self.client._callStreams, {})
+        self.assertEqual(self.server._incomingStreams, {})
+        self.assertTrue(source.reads <= 9)
+        [stream] = self.server.streams
+        return self.assertFailure(
+            stream.deliverTo(StringTransport()), amp.StreamFailed)
+
+
+    def test_partlyReadStreamClosed(self):
+        """
+        If the responder has not finished reading a stream argument when it
+        finishes, the transfer fails with L{amp.StreamFailed} and the sender
+        stops.
+        """
+        source = CountingSource(amp.MAX_VALUE_LENGTH * 100)
+        answers = []
+        self.client.callRemote(Peek, data=source).addCallback(answers.append)
+        self.pump.flush()
+        self.assertEqual(answers, [{}])
+        self.assertEqual(self.client._outgoingStreams, {})
+        self.assertEqual(self.server._incomingStreams, {})
+        self.assertTrue(source.reads <= 9)
+        return self.assertFailure(self.server.peeked, amp.StreamFailed)
+
+
+    def test_answerDropsStream(self):
+        """
+        A stream argument is dropped by the sender when the answer or error
+        for its command arrives, even if the receiver did not stop it.
+        """
+        for key in [amp.ANSWER, amp.ERROR]:
+            d = self.client.callRemote(Ignore, data=CountingSource(10))
+            d.addErrback(lambda failure: None)
+            self.assertEqual(len(self.client._outgoingStreams), 1)
+            [tag] = self.client._outstandingRequests
+            box = amp.AmpBox({key: tag})
+            if key == amp.ERROR:
+                box[amp.ERROR_CODE] = 'ERROR'
+                box[amp.ERROR_DESCRIPTION] = 'failed'
+            self.client.ampBoxReceived(box)
+            self.assertEqual(self.client._outgoingStreams, {})
+            self.assertEqual(self.client._callStreams, {})
+
+
+    def test_streamInResponse(self):
+        """
+        A L{amp.Stream} can be returned in the response to a command.
+        """
+        responses = []
+        self.client.callRemote(Download, length=100000).addCallback(
+            responses.append)
+        self.pump.flush()
+        consumer = StringTransport()
+        finished = []
+        responses[0]['data'].deliverTo(consumer).addCallback(finished.append)
+        self.pump.flush()
+        self.assertEqual(finished, [None])
+        self.assertEqual(consumer.value(), 'x' * 100000)
+        self.assertIdentical(consumer.producer, None)
+        self.assertEqual(self.client._incomingStreams, {})
+        self.assertEqual(self.server._outgoingStreams, {})
+
+
+    def test_windowLimitsReads(self):
+        """
+        The sender reads no more than one window of chunks from the source
+        until the receiver has delivered some of them to a consumer.
+        """
+        responses = []
+        self.client.callRemote(Download, length=1000000).addCallback(
+            responses.append)
+        self.pump.flush()
+        [source] = self.server.sources
+        self.assertEqual(source.reads, 2)
+        stream = responses[0]['data']
+        stream.deliverTo(StringTransport())
+        self.pump.flush()
+        self.assertEqual(source.remaining, 0)
+
+
+    def test_pausedConsumerStopsSender(self):
+        """
+        While the consumer pauses the incoming stream, no more credit is
+        granted to the sender, and resuming the stream completes the transfer.
+        """
+        responses = []
+        self.client.callRemote(Download, length=1000000).addCallback(
+            responses.append)
+        self.pump.flush()
+        [source] = self.server.sources
+        stream = responses[0]['data']
+        consumer = StringTransport()
+        stream.pauseProducing()
+        finished = []
+        stream.deliverTo(consumer).addCallback(finished.append)
+        self.pump.flush()
+        self.assertEqual(source.reads, 2)
+        self.assertEqual(consumer.value(), '')
+        stream.resumeProducing()
+        self.pump.flush()
+        self.assertEqual(finished, [None])
+        self.assertEqual(len(consumer.value()), 1000000)
+
+
+    def test_stopProducing(self):
+        """
+        When the consumer stops the incoming stream, the L{Deferred} returned
+        by C{deliverTo} fails with L{amp.StreamFailed} and the sender stops
+        reading its source.
+        """
+        responses = []
+        self.client.callRemote(Download, length=1000000).addCallback(
+            responses.append)
+        self.pump.flush()
+        [source] = self.server.sources
+        stream = responses[0]['data']
+        consumer = StringTransport()
+        stream.pauseProducing()
+        d = stream.deliverTo(consumer)
+        stream.stopProducing()
+        self.pump.flush()
+        self.assertEqual(source.reads, 2)
+        self.assertEqual(self.server._outgoingStreams, {})
+        return self.assertFailure(d, amp.StreamFailed)
+
+
+    def test_sourceFailure(self):
+        """
+        If reading the source fails, the error is logged on the sending side
+        and the receiver's L{Deferred} fails with L{amp.StreamFailed}.
+        """
+        responses = []
+        self.server.failSources = True
+        self.client.callRemote(Download, length=0).addCallback(
+            responses.append)
+        self.pump.flush()
+        self.assertEqual(len(self.flushLoggedErrors(IOError)), 1)
+        d = responses[0]['data'].deliverTo(StringTransport())
+        return self.assertFailure(d, amp.StreamFailed)
+
+
+    def test_connectionLost(self):
+        """
+        Incoming streams fail with the reason the connection was lost.
+        """
+        responses = []
+        self.client.callRemote(Download, length=1000000).addCallback(
+            responses.append)
+        self.pump.flush()
+        consumer = StringTransport()
+        d = responses[0]['data'].deliverTo(consumer)
+        self.client.connectionLost(Failure(error.ConnectionDone()))
+        self.assertIdentical(consumer.producer, None)
+        return self.assertFailure(d, error.ConnectionDone)
+
+
+    def test_windowExceeded(self):
+        """
+        If the sender sends more chunks than it has been granted, the
+        transfer fails with L{amp.StreamFailed}, the extra chunk is not
+        buffered, and the sender is told to stop.
+        """
+        responses = []
+        self.client.callRemote(Download, length=1000000).addCallback(
+            responses.append)
+        self.pump.flush()
+        stream = responses[0]['data']
+        self.client.ampBoxReceived(amp.AmpBox({
+                    amp.STREAM: stream.streamID, amp.STREAM_CHUNK: 'x'}))
+        self.assertEqual(self.client._incomingStreams, {})
+        self.pump.flush()
+        self.assertEqual(self.server._outgoingStreams, {})
+        return self.assertFailure(
+            stream.deliverTo(StringTransport()), amp.StreamFailed)
+
+
+    def test_argumentsFailPartway(self):
+        """
+        If serializing the arguments of a command fails after a stream
+        argument has been prepared, the stream is dropped rather than left to
+        be claimed by the next command.
+        """
+        self.assertRaises(
+            ValueError, self.client.callRemote, UploadCounted,
+            data=CountingSource(10), count='many')
+        self.assertEqual(self.client._outgoingStreams, {})
+        self.assertEqual(self.client._newOutgoingStreams, [])
+
+
+    def test_unansweredResponseStream(self):
+        """
+        A stream in the response to a command which did not ask for an
+        answer is dropped, since the response is never sent.
+        """
+        self.client.callRemote(DownloadUnanswered, length=10)
+        self.pump.flush()
+        [source] = self.server.sources
+        self.assertEqual(source.reads, 0)
+        self.assertEqual(self.server._outgoingStreams, {})
+        self.assertEqual(self.server._newOutgoingStreams, [])
+
+
+
+class RecordingProducer(object):
+    """
+    A push producer which records whether it is paused.
+    """
+    implements(interfaces.IPushProducer)
+
+    paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+    def stopProducing(self):
+        pass
+
+
+
+class OutstandingCallLimitTests(unittest.TestCase):
+    """
+    Tests for L{amp.BoxDispatcher.maxOutstandingCalls}.
+    """
+    def setUp(self):
+        self.client, self.server, self.pump = connectedServerAndClient(
+            SimpleSymmetricCommandProtocol, SimpleSymmetricCommandProtocol)
+        self.client.maxOutstandingCalls = 2
+
+
+    def test_callsQueued(self):
+        """
+        Calls beyond the limit are not sent until earlier calls are answered,
+        and are answered in the order they were made.
+        """
+        answers = []
+        for text in 'abcde':
+            self.client.sendHello(text).addCallback(
+                lambda result: answers.append(result['hello']))
+        self.assertEqual(len(self.client._outstandingRequests), 2)
+        self.assertEqual(len(self.client._pendingCalls), 3)
+        self.pump.flush()
+        self.assertEqual(answers, list('abcde'))
+        self.assertEqual(len(self.client._pendingCalls), 0)
+
+
+    def test_noAnswerCallsKeepOrder(self):
+        """
+        Calls which require no answer are queued behind earlier calls, so that
+        they are sent in the order they were made.
+        """
+        self.client.sendHello('a')
+        self.client.sendHello('b')
+        self.assertIdentical(
+            self.client.callRemote(NoAnswerHello, hello='c'), None)
+        self.assertEqual(len(self.client._pendingCalls), 1)
+        self.pump.flush()
+        self.assertEqual(len(self.client._pendingCalls), 0)
+        self.assertTrue(self.server.greeted)
+
+
+    def test_callRemoteString(self):
+        """
+        Calls made with L{amp.BoxDispatcher.callRemoteString} count towards
+        the limit and are queued with other calls.
+        """
+        answers = []
+        for text in 'abc':
+            self.client.callRemoteString('hello', hello=text).addCallback(
+                lambda box: answers.append(box['hello']))
+        self.client.sendHello('d').addCallback(
+            lambda result: answers.append(result['hello']))
+        self.assertEqual(len(self.client._outstandingRequests), 2)
+        self.assertEqual(len(self.client._pendingCalls), 2)
+        self.pump.flush()
+        self.assertEqual(answers, list('abcd'))
+
+
+    def test_callProducerPaused(self):
+        """
+        A producer registered with L{amp.BoxDispatcher.registerCallProducer}
+        is paused while the limit is reached and resumed when answers arrive.
+        """
+        producer = RecordingProducer()
+        self.client.registerCallProducer(producer)
+        self.client.sendHello('a')
+        self.assertFalse(producer.paused)
+        self.client.sendHello('b')
+        self.assertTrue(producer.paused)
+        late = RecordingProducer()
+        self.client.registerCallProducer(late)
+        self.assertTrue(late.paused)
+        self.pump.flush()
+        self.assertFalse(producer.paused)
+        self.assertFalse(late.paused)
+
+
+    def test_queuedCallsFailOnConnectionLost(self):
+        """
+        Queued calls fail with the reason the connection was lost.
+        """
+        sent = [self.client.sendHello('a'), self.client.sendHello('b')]
+        d = self.client.sendHello('c')
+        self.client.connectionLost(Failure(error.ConnectionDone()))
+        for outstanding in sent:
+            self.assertFailure(outstanding, error.ConnectionDone)
+        return self.assertFailure(d, error.ConnectionDone)
+
+
+
 class DateTimeTests(unittest.TestCase):
     """
     Tests for L{amp.DateTime}, L{amp._FixedOffsetTZInfo}, and L{amp.utc}.
@@ -180,6 +180,73 @@ class BananaTestCase(unittest.TestCase):
             self.enc.dataReceived(byte)
         assert self.result == foo, "%s!=%s" % (repr(self.result), repr(foo))
 
+    def test_severalExpressions(self):
+        """
+        Several expressions received in one chunk are each delivered to
+        C{expressionReceived}, in order.
+        """
+        results = []
+        self.enc.expressionReceived = results.append
+        self.enc.sendEncoded(["one", 1])
+        self.enc.sendEncoded(2.5)
+        self.enc.sendEncoded("three")
+        self.enc.dataReceived(self.io.getvalue())
+        self.assertEqual(results, [["one", 1], 2.5, "three"])
+        self.assertEqual(self.enc.buffer, '')
+
+
+    def test_stringInPieces(self):
+        """
+        A string whose body arrives over many chunks is delivered once it is
+        complete, followed by whatever else the last chunk held.
+        """
+        results = []
+        self.enc.expressionReceived = results.append
+        value = "x" * 10000
+        self.enc.sendEncoded(value)
+        self.enc.sendEncoded(1)
+        data = self.io.getvalue()
+        for i in range(0, len(data) - 5, 1000):
+            self.enc.dataReceived(data[i:i + 1000])
+            self.assertEqual(results, [])
+        self.enc.dataReceived(data[i + 1000:])
+        self.assertEqual(results, [value, 1])
+        self.assertEqual(self.enc.buffer, '')
+
+
+    def test_consumedBeforeDelivery(self):
+        """
+        If C{expressionReceived} raises an exception, the expression which
+        was being delivered is not delivered again with the next data.
+        """
+        results = []
+        def expressionReceived(obj):
+            results.append(obj)
+            if len(results) == 1:
+                raise ZeroDivisionError()
+        self.enc.expressionReceived = expressionReceived
+        self.enc.sendEncoded("first")
+        self.assertRaises(
+            ZeroDivisionError, self.enc.dataReceived, self.io.getvalue())
+        self.io.truncate(0)
+        self.enc.sendEncoded("second")
+        self.enc.dataReceived(self.io.getvalue())
+        self.assertEqual(results, ["first", "second"])
+
+
+    def test_encodedInOneWrite(self):
+        """
+        L{banana.Banana.sendEncoded} writes the whole encoding of an
+        expression to the transport with a single call.
+        """
+        writes = []
+        self.enc.transport.write = writes.append
+        self.enc.sendEncoded([1, "two", [3.0, -4]])
+        self.assertEqual(writes, [
+                '\x03\x80\x01\x81\x03\x82two\x02\x80\x84'
+                '@\x08\x00\x00\x00\x00\x00\x00\x04\x83'])
+
+
     def feed(self, data):
         for byte in data:
             self.enc.dataReceived(byte)
@@ -287,6 +287,97 @@ class TestCooperator(unittest.TestCase):
         self.assertEqual(coop._delayedCall, calls[0])
 
 
+    def test_weight(self):
+        """
+        A task cooperating with a C{weight} does that many units of work in a
+        row before the next task gets a turn.
+        """
+        work = []
+        def worker(name):
+            while True:
+                work.append(name)
+                yield None
+        units = []
+        def terminator():
+            units.append(None)
+            return len(units) % 8 == 0
+        scheduler = FakeScheduler()
+        coop = task.Cooperator(scheduler=scheduler,
+                               terminationPredicateFactory=lambda: terminator)
+        coop.cooperate(worker('heavy'), weight=3)
+        coop.cooperate(worker('light'))
+        scheduler.pump()
+        self.assertEqual(work, ['heavy'] * 3 + ['light'] + ['heavy'] * 3 +
+                               ['light'])
+        coop.stop()
+
+
+    def test_weightEndsWhenPaused(self):
+        """
+        A task which pauses on a L{defer.Deferred} gives up the rest of its
+        turn, whatever its C{weight}.
+        """
+        work = []
+        def waiter():
+            work.append('waiter')
+            yield defer.Deferred()
+        def worker():
+            while True:
+                work.append('worker')
+                yield None
+        scheduler = FakeScheduler()
+        coop = task.Cooperator(
+            scheduler=scheduler,
+            terminationPredicateFactory=lambda: lambda: len(work) >= 3)
+        coop.cooperate(waiter(), weight=5)
+        coop.cooperate(worker(), weight=5)
+        scheduler.pump()
+        self.assertEqual(work, ['waiter', 'worker', 'worker'])
+        coop.stop()
+
+
+    def test_statistics(self):
+        """
+        L{Cooperator.iterations} counts the units of work done, and
+        L{Cooperator.timeUsed} the time spent doing them.
+        """
+        clock = task.Clock()
+        def worker():
+            for i in range(3):
+                clock.advance(0.25)
+                yield i
+        scheduler = FakeScheduler()
+        coop = task.Cooperator(scheduler=scheduler,
+                               terminationPredicateFactory=lambda: lambda: False)
+        coop._seconds = clock.seconds
+        coop.coiterate(worker())
+        scheduler.pump()
+        self.assertEqual(coop.iterations, 4)
+        self.assertEqual(coop.timeUsed, 0.75)
+        self.assertEqual(coop.tasksStarved, 0)
+
+
+    def test_tasksStarved(self):
+        """
+        L{Cooperator.tasksStarved} counts each task which was ready to work
+        but did not get to during a step.
+        """
+        def worker():
+            while True:
+                yield None
+        scheduler = FakeScheduler()
+        coop = task.Cooperator(scheduler=scheduler,
+                               terminationPredicateFactory=lambda: lambda: True)
+        for i in range(3):
+            coop.cooperate(worker())
+        scheduler.pump()
+        self.assertEqual(coop.tasksStarved, 2)
+        scheduler.pump()
+        self.assertEqual(coop.tasksStarved, 4)
+        self.assertEqual(coop.iterations, 2)
+        coop.stop()
+
+
     def test_runningWhenStarted(self):
         """
         L{Cooperator.running} reports C{True} if the L{Cooperator}
@@ -358,6 +449,79 @@ class AliasTests(unittest.TestCase):
 
 
 
+class AdaptiveTimerTests(unittest.TestCase):
+    """
+    Tests for L{task.AdaptiveTimer}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.timer = task.AdaptiveTimer(
+            budget=0.25, minSlice=0.001, maxSlice=0.01,
+            seconds=self.clock.seconds)
+
+
+    def runSlice(self):
+        """
+        Start a time slice and run it until it is over.
+
+        @return: The length of the slice.
+        """
+        started = self.clock.seconds()
+        terminator = self.timer()
+        while not terminator():
+            self.clock.advance(0.0005)
+        return self.clock.seconds() - started
+
+
+    def test_firstSlice(self):
+        """
+        The first time slice lasts for C{maxSlice}.
+        """
+        self.assertAlmostEqual(self.runSlice(), 0.01)
+
+
+    def test_busyReactor(self):
+        """
+        After the reactor has spent time elsewhere, the next slice is sized so
+        that the cooperator uses no more than C{budget} of the total.
+        """
+        self.runSlice()
+        self.clock.advance(0.015)
+        self.assertAlmostEqual(self.runSlice(), 0.005)
+        self.assertAlmostEqual(self.timer.slice, 0.005)
+
+
+    def test_idleReactor(self):
+        """
+        The slice is never shorter than C{minSlice}, even if the reactor had
+        nothing else to do.
+        """
+        self.runSlice()
+        self.assertAlmostEqual(self.runSlice(), 0.001)
+
+
+    def test_veryBusyReactor(self):
+        """
+        The slice is never longer than C{maxSlice}.
+        """
+        self.runSlice()
+        self.clock.advance(10)
+        self.assertAlmostEqual(self.runSlice(), 0.01)
+
+
+    def test_invalidArguments(self):
+        """
+        L{task.AdaptiveTimer} raises L{ValueError} if C{budget} is not between
+        0 and 1 or C{minSlice} is larger than C{maxSlice}.
+        """
+        self.assertRaises(ValueError, task.AdaptiveTimer, budget=0)
+        self.assertRaises(ValueError, task.AdaptiveTimer, budget=1)
+        self.assertRaises(ValueError, task.AdaptiveTimer,
+                          minSlice=0.1, maxSlice=0.01)
+
+
+
 class RunStateTests(unittest.TestCase):
     """
     Tests to verify the behavior of L{CooperativeTask.pause},
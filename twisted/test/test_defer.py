@@ -829,6 +829,57 @@ class DeferredTestCase(unittest.SynchronousTestCase, ImmediateFailureMixin):
         self.assertEqual(exception.args, (exceptionMessage,))
 
 
+    def test_callbacksDiscardedAfterRunning(self):
+        """
+        Callbacks are removed from L{Deferred.callbacks} once they have run,
+        and those which have not run yet because the L{Deferred} is waiting
+        for the result of another L{Deferred} are kept.
+        """
+        inner = defer.Deferred()
+        deferred = defer.Deferred()
+        deferred.addCallback(lambda ignored: None)
+        deferred.addCallback(lambda ignored: inner)
+        deferred.addCallback(lambda result: result + 1)
+        deferred.addErrback(lambda failure: None)
+        deferred.callback(None)
+        self.assertEqual(len(deferred.callbacks), 2)
+        inner.callback(1)
+        self.assertEqual(deferred.callbacks, [])
+        self.assertEqual(inner.callbacks, [])
+        self.assertEqual(self.successResultOf(deferred), 2)
+
+
+    def test_arbitraryAttributes(self):
+        """
+        Attributes which L{Deferred} does not use itself can still be set on
+        an instance.
+        """
+        deferred = defer.Deferred()
+        deferred.reqid = 7
+        self.assertEqual(deferred.reqid, 7)
+
+
+    def test_subclassWithoutInit(self):
+        """
+        A subclass of L{Deferred} whose C{__init__} does not call
+        L{Deferred.__init__} still works, provided it sets C{callbacks}, as
+        before L{Deferred} stored its state in slots.
+        """
+        class LegacyDeferred(defer.Deferred):
+            def __init__(self):
+                self.callbacks = []
+
+        deferred = LegacyDeferred()
+        self.assertFalse(deferred.called)
+        self.assertEqual(deferred.paused, 0)
+        results = []
+        deferred.addCallback(results.append)
+        deferred.callback(3)
+        self.assertEqual(results, [3])
+        self.assertTrue(deferred.called)
+        self.assertRaises(AttributeError, getattr, deferred, 'missing')
+
+
     def test_synchronousImplicitChain(self):
         """
         If a first L{Deferred} with a result is returned from a callback on a
@@ -522,6 +522,83 @@ class FailureTestCase(SynchronousTestCase):
         self.assertEqual(f.getTracebackObject(), None)
 
 
+    def test_framesBuiltWhenUsed(self):
+        """
+        The frames of a L{failure.Failure} created without C{captureVars} are
+        only built the first time they are used, and are the same as those
+        which would have been built straight away.
+        """
+        f = getDivisionFailure()
+        self.assertNotIn('frames', f.__dict__)
+        eager = getDivisionFailure(captureVars=True)
+        self.assertEqual([frame[:3] for frame in f.frames],
+                         [frame[:3] for frame in eager.frames])
+        self.assertEqual([frame[3:] for frame in f.frames],
+                         [((), ())] * len(f.frames))
+
+
+    def test_stackLineNumbersRecordedAtCreation(self):
+        """
+        The line numbers in L{failure.Failure.stack} are those at which the
+        calling frames were executing when the L{failure.Failure} was created,
+        even if the stack is only built after those frames have moved on.
+        """
+        f, line = getDivisionFailure(), sys._getframe().f_lineno
+        code = sys._getframe().f_code
+        stack = f.stack
+        self.assertEqual(stack[-1][:3], (code.co_name, code.co_filename, line))
+
+
+    def test_stackOfSuspendedGenerator(self):
+        """
+        The stack of a L{failure.Failure} created inside a generator, which
+        is only built after the generator has been suspended, lists the
+        frames which called the generator when the L{failure.Failure} was
+        created.
+        """
+        failures = []
+        def generator():
+            failures.append((getDivisionFailure(), sys._getframe().f_lineno))
+            yield
+        def outer():
+            g = generator()
+            g.next()
+            return sys._getframe().f_lineno - 1
+        outerLine = outer()
+        [(f, generatorLine)] = failures
+        filename = outer.func_code.co_filename
+        self.assertEqual(
+            [entry[:3] for entry in f.stack[-2:]],
+            [('outer', filename, outerLine),
+             ('generator', filename, generatorLine)])
+
+
+    def test_cleanFailureBuildsFrames(self):
+        """
+        L{failure.Failure.cleanFailure} builds the frames of a
+        L{failure.Failure} which have not been used yet before discarding the
+        traceback.
+        """
+        f = getDivisionFailure()
+        f.cleanFailure()
+        self.assertIdentical(f.tb, None)
+        self.assertNotIn('_stackEntries', f.__dict__)
+        self.assertEqual(f.frames[-1][0], 'getDivisionFailure')
+        self.assertNotEqual(f.stack, [])
+
+
+    def test_parentsNotShared(self):
+        """
+        Each L{failure.Failure} gets its own list of parents, even though they
+        are only computed once for each exception type.
+        """
+        first = failure.Failure(ZeroDivisionError())
+        first.parents.append('extra')
+        second = failure.Failure(ZeroDivisionError())
+        self.assertEqual(second.parents,
+                         list(map(reflect.qual, ZeroDivisionError.__mro__)))
+
+
     def test_tracebackFromExceptionInPython3(self):
         """
         If a L{failure.Failure} is constructed with an exception but no
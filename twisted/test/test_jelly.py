@@ -7,7 +7,10 @@ Test cases for L{jelly} object serialization.
 
 import datetime
 import decimal
+import gc
+import weakref
 
+from twisted.python.reflect import qual
 from twisted.spread import jelly, pb
 from twisted.trial import unittest
 from twisted.test.proto_helpers import StringTransport
@@ -112,6 +115,61 @@ class SimpleJellyTest:
 
 
 
+class CountingSecurityOptions(jelly.DummySecurityOptions):
+    """
+    Security options which allow everything and record each question they are
+    asked.
+
+    @ivar types: The type names passed to C{isTypeAllowed}.
+    @ivar classes: The classes passed to C{isClassAllowed}.
+    """
+
+    def __init__(self):
+        self.types = []
+        self.classes = []
+
+
+    def isTypeAllowed(self, typeName):
+        self.types.append(typeName)
+        return 1
+
+
+    def isClassAllowed(self, klass):
+        self.classes.append(klass)
+        return 1
+
+
+
+class DefaultCopyable(pb.Copyable):
+    """
+    A L{pb.Copyable} which copies its instance dictionary under its own name.
+    """
+
+
+
+class CustomCopyable(pb.Copyable):
+    """
+    A L{pb.Copyable} which chooses its own type tag and state.
+    """
+
+    def getTypeToCopy(self):
+        return "custom"
+
+
+    def getStateToCopyFor(self, perspective):
+        return {"perspective": perspective}
+
+
+
+class DummyInvoker:
+    """
+    An invoker with just enough of L{pb.Broker} for L{pb.Copyable}.
+    """
+    serializingPerspective = "perspective"
+
+
+
+
 class JellyTestCase(unittest.TestCase):
     """
     Testcases for L{jelly} module serialization.
@@ -555,6 +613,118 @@ class JellyTestCase(unittest.TestCase):
             self._check_newstyle(x, y)
 
 
+    def test_typeCheckedOnce(self):
+        """
+        The taster is asked about each type only once per call to
+        L{jelly.jelly}, however many objects of that type are jellied.
+        """
+        taster = CountingSecurityOptions()
+        jelly.jelly([1, 2, [3, 4], "a", "b"], taster)
+        self.assertEqual(
+            sorted(taster.types),
+            ["__builtin__.int", "__builtin__.list", "__builtin__.str"])
+
+
+    def test_classCheckedOnce(self):
+        """
+        The taster is asked about each class only once per call to
+        L{jelly.jelly}, however many of its instances are jellied.
+        """
+        taster = CountingSecurityOptions()
+        jelly.jelly([A(), A(), C()], taster)
+        self.assertEqual(taster.classes, [A, C])
+
+
+    def test_tagCheckedOnce(self):
+        """
+        The taster is asked about each type tag only once per call to
+        L{jelly.unjelly}, however many expressions carry that tag.
+        """
+        taster = CountingSecurityOptions()
+        result = jelly.unjelly(jelly.jelly([[1], [2], (3,)]), taster)
+        self.assertEqual(result, [[1], [2], (3,)])
+        self.assertEqual(sorted(taster.types), ["list", "tuple"])
+
+
+    def test_listSubclass(self):
+        """
+        An instance of a subclass of C{list} is jellied as an instance of that
+        class rather than as a plain list.
+        """
+        global ListSubclass
+        class ListSubclass(list):
+            pass
+        obj = ListSubclass([1, 2])
+        obj.attribute = 3
+        result = jelly.unjelly(jelly.jelly(obj))
+        self.assertIsInstance(result, ListSubclass)
+        self.assertEqual(result.attribute, 3)
+
+
+    def test_dictionaryReferencingContainer(self):
+        """
+        A dictionary whose value is the tuple which contains it, and so is not
+        known until the dictionary has been unjellied, is restored with the
+        identity of that tuple.
+        """
+        container = ({}, 1)
+        container[0]["container"] = container
+        result = jelly.unjelly(jelly.jelly(container))
+        self.assertIdentical(result[0]["container"], result)
+
+
+    def test_copyableDefaultState(self):
+        """
+        A L{pb.Copyable} which does not override any of the methods deciding
+        what is copied is jellied with its qualified class name and instance
+        dictionary.
+        """
+        obj = DefaultCopyable()
+        obj.x = 1
+        self.assertEqual(
+            jelly.jelly(obj, invoker=DummyInvoker()),
+            [qual(DefaultCopyable), ["dictionary", ["x", 1]]])
+
+
+    def test_copyableCustomState(self):
+        """
+        The type tag and state of a L{pb.Copyable} which overrides
+        C{getTypeToCopy} and C{getStateToCopyFor} are the ones it chooses.
+        """
+        self.assertEqual(
+            jelly.jelly(CustomCopyable(), invoker=DummyInvoker()),
+            ["custom", ["dictionary", ["perspective", "perspective"]]])
+
+
+    def test_copyableNonMethodOverride(self):
+        """
+        A L{pb.Copyable} which overrides one of the methods deciding what is
+        copied with something other than a plain function, such as a
+        C{staticmethod}, has it called.
+        """
+        class StaticCopyable(pb.Copyable):
+            getTypeToCopy = staticmethod(lambda: "static")
+
+        self.assertEqual(
+            jelly.jelly(StaticCopyable(), invoker=DummyInvoker()),
+            ["static", ["dictionary"]])
+
+
+    def test_copyableClassNotKept(self):
+        """
+        Working out the type tag of a L{pb.Copyable} subclass does not keep
+        the class alive.
+        """
+        class TemporaryCopyable(pb.Copyable):
+            pass
+
+        jelly.jelly(TemporaryCopyable(), invoker=DummyInvoker())
+        ref = weakref.ref(TemporaryCopyable)
+        del TemporaryCopyable
+        gc.collect()
+        self.assertIdentical(ref(), None)
+
+
     def test_referenceable(self):
         """
         A L{pb.Referenceable} instance jellies to a structure which unjellies to
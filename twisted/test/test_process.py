@@ -1129,6 +1129,8 @@ class PosixProcessBase:
         """
         Raise an error during execvpe to check error management.
         """
+        # execvpe is only called in a forked child.
+        self.patch(process.Process, "_spawner", None)
         cmd = self.getCommand('false')
 
         d = defer.Deferred()
@@ -1660,7 +1662,9 @@ class MockProcessTestCase(unittest.TestCase):
     def setUp(self):
         """
         Replace L{process} os, fcntl, sys, switchUID, fdesc and pty modules
-        with the mock class L{MockOS}.
+        with the mock class L{MockOS}, and make L{process.Process} fork rather
+        than use C{posix_spawn} and poll its fake child rather than open a
+        pidfd for it.
         """
         if gc.isenabled():
             self.addCleanup(gc.enable)
@@ -1677,6 +1681,8 @@ class MockProcessTestCase(unittest.TestCase):
         self.patch(process.Process, "processReaderFactory", DumbProcessReader)
         self.patch(process.Process, "processWriterFactory", DumbProcessWriter)
         self.patch(process, "pty", self.mockos)
+        self.patch(process.Process, "_spawner", None)
+        self.patch(process, "_openPidfd", lambda pid: None)
 
         self.mocksig = MockSignal()
         self.patch(process, "signal", self.mocksig)
@@ -1687,6 +1693,7 @@ class MockProcessTestCase(unittest.TestCase):
         Reset processes registered for reap.
         """
         process.reapProcessHandlers = {}
+        process._polledProcesses = {}
 
 
     def test_mockFork(self):
@@ -565,6 +565,198 @@ class LoopTestCase(unittest.TestCase):
 
 
 
+class PeriodicSchedulerTests(unittest.TestCase):
+    """
+    Tests for L{task.PeriodicScheduler}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.scheduler = task.PeriodicScheduler(self.clock)
+
+
+    def loopingCall(self, f, *a, **kw):
+        """
+        Create a L{task.LoopingCall} using C{self.clock} and
+        C{self.scheduler}.
+        """
+        lc = TestableLoopingCall(self.clock, f, *a, **kw)
+        lc.scheduler = self.scheduler
+        return lc
+
+
+    def test_sharedTimer(self):
+        """
+        L{task.LoopingCall}s with the same interval started at different times
+        share one timer, and all run when it fires.
+        """
+        ran = []
+        for i in range(10):
+            self.loopingCall(ran.append, i).start(1, now=False)
+            self.clock.advance(0.05)
+        self.assertEqual(len(self.clock.calls), 1)
+        self.clock.advance(0.5)
+        self.assertEqual(sorted(ran), list(range(10)))
+        self.assertEqual(self.clock.seconds(), 1)
+        self.assertEqual(len(self.clock.calls), 1)
+
+
+    def test_intervals(self):
+        """
+        Each interval gets a timer of its own.
+        """
+        ran = []
+        self.loopingCall(ran.append, 'fast').start(1, now=False)
+        self.loopingCall(ran.append, 'slow').start(3, now=False)
+        self.assertEqual(len(self.clock.calls), 2)
+        self.clock.pump([1, 1])
+        self.assertEqual(ran, ['fast', 'fast'])
+        self.clock.advance(1)
+        self.assertEqual(sorted(ran), ['fast', 'fast', 'fast', 'slow'])
+
+
+    def test_reset(self):
+        """
+        Resetting a L{task.LoopingCall} which uses a scheduler skips the
+        bucket's next run if it is less than an interval away, and the call
+        joins the run after it.
+        """
+        ran = []
+        first = self.loopingCall(ran.append, 'first')
+        first.start(2, now=False)
+        self.clock.advance(1)
+        second = self.loopingCall(ran.append, 'second')
+        second.start(2, now=False)
+        second.reset()
+        self.clock.advance(1)
+        self.assertEqual(ran, ['first'])
+        self.assertEqual(len(self.clock.calls), 1)
+        self.clock.advance(2)
+        self.assertEqual(sorted(ran), ['first', 'first', 'second'])
+
+
+    def test_resetOneIntervalBefore(self):
+        """
+        A L{task.LoopingCall} which uses a scheduler and is reset a whole
+        interval before the bucket's next run stays in that run.
+        """
+        ran = []
+        lc = self.loopingCall(ran.append, None)
+        lc.start(1, now=False)
+        self.clock.callLater(1, lc.reset)
+        self.clock.advance(1)
+        self.assertEqual(ran, [None])
+        self.clock.advance(1)
+        self.assertEqual(ran, [None, None])
+
+
+    def test_noDrift(self):
+        """
+        The timer is rescheduled from when it was due, not from when it ran.
+        """
+        times = []
+        self.loopingCall(lambda: times.append(self.clock.seconds())).start(
+            1, now=False)
+        self.clock.pump([1.5, 0.5, 1])
+        self.assertEqual(times, [1.5, 2, 3])
+
+
+    def test_stop(self):
+        """
+        Stopping the last L{task.LoopingCall} with an interval cancels its
+        timer, and starting one again resumes the same schedule from its next
+        due time.
+        """
+        ran = []
+        first = self.loopingCall(ran.append, 'first')
+        first.start(1, now=False)
+        self.clock.advance(0.5)
+        second = self.loopingCall(ran.append, 'second')
+        second.start(1, now=False)
+        first.stop()
+        self.assertEqual(len(self.clock.calls), 1)
+        second.stop()
+        self.assertEqual(self.clock.calls, [])
+        self.clock.advance(1.75)
+        first.start(1, now=False)
+        self.clock.advance(0.25)
+        self.assertEqual(ran, [])
+        self.clock.advance(0.5)
+        self.assertEqual(ran, ['first'])
+        first.stop()
+
+
+    def test_stoppedByEarlierCall(self):
+        """
+        A L{task.LoopingCall} stopped by another one run by the same timer is
+        not run.
+        """
+        ran = []
+        calls = []
+        def stopOthers():
+            ran.append(None)
+            for lc in calls:
+                if lc.running and lc.call is not None:
+                    lc.stop()
+        for i in range(2):
+            calls.append(self.loopingCall(stopOthers))
+            calls[-1].start(1, now=False)
+        self.clock.advance(1)
+        self.assertEqual(ran, [None])
+        self.clock.advance(1)
+        self.assertEqual(ran, [None, None])
+        for lc in calls:
+            if lc.running:
+                lc.stop()
+
+
+    def test_withCount(self):
+        """
+        L{task.LoopingCall.withCount} counts the runs of the shared timer, so
+        that a call which missed some because its previous L{defer.Deferred}
+        had not fired is told how many.
+        """
+        counts = []
+        deferreds = []
+        def count(n):
+            counts.append(n)
+            deferreds.append(defer.Deferred())
+            return deferreds[-1]
+        self.clock.advance(0.25)
+        other = self.loopingCall(lambda: None)
+        other.start(1, now=False)
+        self.clock.advance(0.5)
+        lc = task.LoopingCall.withCount(count)
+        lc.clock = self.clock
+        lc.scheduler = self.scheduler
+        lc.start(1)
+        self.assertEqual(counts, [1])
+        deferreds[-1].callback(None)
+        self.clock.advance(0.5)
+        self.assertEqual(counts, [1, 1])
+        self.clock.advance(2.5)
+        deferreds[-1].callback(None)
+        self.clock.advance(0.5)
+        self.assertEqual(counts, [1, 1, 3])
+        other.stop()
+        lc.stop()
+
+
+    def test_jitter(self):
+        """
+        The schedule for an interval is shifted by up to C{jitter} seconds
+        when it is first used.
+        """
+        scheduler = task.PeriodicScheduler(self.clock, jitter=0.5)
+        scheduler._random = lambda: 0.5
+        lc = TestableLoopingCall(self.clock, lambda: None)
+        lc.scheduler = scheduler
+        lc.start(2, now=False)
+        self.assertEqual(self.clock.calls[0].getTime(), 2.25)
+        lc.stop()
+
+
+
 class ReactorLoopTestCase(unittest.TestCase):
     # Slightly inferior tests which exercise interactions with an actual
     # reactor.
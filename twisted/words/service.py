@@ -37,12 +37,21 @@ from twisted.python.components import registerAdapter
 from twisted.cred import portal, credentials, error as ecred
 from twisted.spread import pb
 from twisted.words.protocols import irc
-from twisted.internet import defer, protocol
+from twisted.internet import defer, protocol, interfaces
 from twisted.python import log, failure, reflect
 from twisted import copyright
 
 
 class Group(object):
+    """
+    A group of chat clients which receive each other's messages.
+
+    @ivar fanouts: The number of messages delivered to the group.
+    @ivar fanoutTime: The total time, in seconds, taken to hand messages to
+        every member of the group.
+    @ivar maxFanoutTime: The longest time, in seconds, taken to hand one
+        message to every member of the group.
+    """
     implements(iwords.IGroup)
 
     def __init__(self, name):
@@ -52,6 +61,9 @@ class Group(object):
             "topic": "",
             "topic_author": "",
             }
+        self.fanouts = 0
+        self.fanoutTime = 0.0
+        self.maxFanoutTime = 0.0
 
 
     def _ebUserCall(self, err, p):
@@ -101,14 +113,41 @@ class Group(object):
 
 
     def receive(self, sender, recipient, message):
+        """
+        Deliver a message to every member of the group but its sender.
+
+        Members which can be sent pre-encoded messages (see
+        L{IRCUser._broadcastKey}) are sent the same bytes as every other
+        member with the same key, so the message is only formatted once for
+        each kind of member rather than once for each member.
+        """
         assert recipient is self
+        start = time()
         receives = []
-        for p in self.users.itervalues():
-            if p is not sender:
+        encoded = {}
+        # Sending to a member can disconnect it, and remove it from the group.
+        for p in self.users.values():
+            if p is sender:
+                continue
+            getKey = getattr(p, '_broadcastKey', None)
+            key = getKey and getKey()
+            if key is None:
                 d = defer.maybeDeferred(p.receive, sender, self, message)
                 d.addErrback(self._ebUserCall, p=p)
                 receives.append(d)
+                continue
+            data = encoded.get(key)
+            if data is None:
+                data = encoded[key] = p._encodeReceive(sender, self, message)
+            try:
+                p._broadcast(data)
+            except:
+                receives.append(defer.fail().addErrback(self._ebUserCall, p=p))
         defer.DeferredList(receives).addCallback(self._cbUserCall)
+        elapsed = time() - start
+        self.fanouts += 1
+        self.fanoutTime += elapsed
+        self.maxFanoutTime = max(self.maxFanoutTime, elapsed)
         return defer.succeed(None)
 
 
@@ -177,6 +216,84 @@ class User(object):
 NICKSERV = 'NickServ!NickServ@services'
 
 
+class _SendQueue(object):
+    """
+    Output buffered for a client while its transport is not keeping up.
+
+    L{_SendQueue} is registered as a streaming producer with the transport
+    of an L{IRCUser}, and everything sent to the user goes through it.
+    While the transport has paused it, output is held here, up to
+    C{maxSize} bytes, and written out when the transport resumes it.
+
+    @ivar policy: What to do with output which does not fit in the queue:
+        C{'drop'} to discard messages relayed from other users (anything
+        else is kept regardless), or C{'disconnect'} to abort the connection.
+        The connection is aborted rather than closed, since closing it would
+        wait for the transport to write out its buffer, which a client that
+        has stopped reading never lets it do.
+    @ivar dropped: The number of relayed messages discarded.
+    """
+    implements(interfaces.IPushProducer)
+
+    paused = False
+    stopped = False
+
+    def __init__(self, transport, maxSize, policy):
+        self.transport = transport
+        self.maxSize = maxSize
+        self.policy = policy
+        self.pending = []
+        self.size = 0
+        self.dropped = 0
+
+
+    def write(self, data, droppable=False):
+        """
+        Send C{data}, or queue it if the transport is paused.
+
+        @param droppable: Whether C{data} may be discarded under the C{'drop'}
+            policy.
+        """
+        if self.stopped:
+            return
+        if not self.paused:
+            self.transport.write(data)
+            return
+        if self.size + len(data) > self.maxSize:
+            if self.policy == 'disconnect':
+                self.stopProducing()
+                abort = getattr(self.transport, 'abortConnection', None)
+                if abort is None:
+                    abort = self.transport.loseConnection
+                abort()
+                return
+            if droppable:
+                self.dropped += 1
+                return
+        self.pending.append(data)
+        self.size += len(data)
+
+
+    def pauseProducing(self):
+        self.paused = True
+
+
+    def resumeProducing(self):
+        self.paused = False
+        if self.pending:
+            pending = self.pending
+            self.pending = []
+            self.size = 0
+            self.transport.writeSequence(pending)
+
+
+    def stopProducing(self):
+        self.stopped = True
+        self.pending = []
+        self.size = 0
+
+
+
 class IRCUser(irc.IRC):
     """
     Protocol instance representing an IRC user connected to the server.
@@ -198,11 +315,32 @@ class IRCUser(irc.IRC):
     # How to handle unicode (TODO: Make this customizable on a per-user basis)
     encoding = 'utf-8'
 
+    # How many bytes of output to hold for a client which is not keeping up,
+    # and what to do when there is more; see _SendQueue.
+    sendQueueSize = 2 ** 20
+    sendQueuePolicy = 'drop'
+
+    _sendQueue = None
+
     # Twisted callbacks
     def connectionMade(self):
         self.irc_PRIVMSG = self.irc_NICKSERV_PRIVMSG
         self.realm = self.factory.realm
         self.hostname = self.realm.name
+        self._sendQueue = _SendQueue(
+            self.transport, self.sendQueueSize, self.sendQueuePolicy)
+        if interfaces.IConsumer.providedBy(self.transport):
+            self.transport.registerProducer(self._sendQueue, True)
+
+
+    def sendLine(self, line):
+        if self._sendQueue is None:
+            irc.IRC.sendLine(self, line)
+        else:
+            if self.encoding is not None:
+                if isinstance(line, unicode):
+                    line = line.encode(self.encoding)
+            self._sendQueue.write("%s%s%s" % (line, irc.CR, irc.LF))
 
 
     def connectionLost(self, reason):
@@ -254,6 +392,54 @@ class IRCUser(irc.IRC):
                 L)
 
 
+    def _broadcastKey(self):
+        """
+        Identify the bytes L{receive} sends for a group message.
+
+        @return: A key which is the same for all clients to which
+            L{_encodeReceive} gives the same bytes for the same message, or
+            C{None} if L{receive}, or the C{privmsg} or C{sendLine} methods
+            it uses, have been overridden and it must be called.
+        """
+        for name in ('receive', 'privmsg', 'sendLine'):
+            method = getattr(getattr(self, name), 'im_func', None)
+            if method is not getattr(IRCUser, name).im_func:
+                return None
+        return (self.__class__, self.hostname, self.encoding)
+
+
+    def _encodeReceive(self, sender, recipient, message):
+        """
+        Format and encode a message as L{receive} would send it.
+
+        @return: The encoded PRIVMSG lines, including delimiters.
+        @rtype: C{str}
+        """
+        if iwords.IGroup.providedBy(recipient):
+            recipientName = '#' + recipient.name
+        else:
+            recipientName = recipient.name
+        prefix = '%s!%s@%s' % (sender.name, sender.name, self.hostname)
+        text = message.get('text', '<an unrepresentable message>')
+        lines = []
+        for L in text.splitlines():
+            line = ":%s PRIVMSG %s :%s" % (
+                prefix, recipientName, irc.lowQuote(L))
+            if self.encoding is not None:
+                if isinstance(line, unicode):
+                    line = line.encode(self.encoding)
+            lines.append("%s%s%s" % (line, irc.CR, irc.LF))
+        return ''.join(lines)
+
+
+    def _broadcast(self, data):
+        """
+        Send bytes from L{_encodeReceive}, which may be dropped if this
+        client is not keeping up.
+        """
+        self._sendQueue.write(data, droppable=True)
+
+
     def groupMetaUpdate(self, group, meta):
         if 'topic' in meta:
             topic = meta['topic']
@@ -7,11 +7,13 @@ Tests for L{twisted.words.service}.
 
 import time
 
+from zope.interface import implements
+
 from twisted.trial import unittest
 from twisted.test import proto_helpers
 
 from twisted.cred import portal, credentials, checkers
-from twisted.words import ewords, service
+from twisted.words import ewords, iwords, service
 from twisted.words.protocols import irc
 from twisted.spread import pb
 from twisted.internet.defer import Deferred, DeferredList, maybeDeferred, succeed
@@ -156,6 +158,26 @@ class TestUser(object):
         self.lastMessage = lastMessage
 
 
+class TestChatClient(object):
+    """
+    An L{iwords.IChatClient} which records the messages it receives.
+    """
+    implements(iwords.IChatClient)
+
+    def __init__(self, name):
+        self.name = name
+        self.received = []
+
+
+    def userJoined(self, group, user):
+        pass
+
+
+    def receive(self, sender, recipient, message):
+        self.received.append((sender, recipient, message))
+
+
+
 class TestPortal(object):
     def __init__(self):
         self.logins = []
@@ -519,6 +541,205 @@ class IRCProtocolTestCase(unittest.TestCase):
         self.assertEqual(event[0][2], ['#somechannel', 'Hello, world.'])
 
 
+    def _groupMembers(self, *names):
+        """
+        Log in users with the given names and have them join #somechannel.
+
+        @return: The L{TestCaseUserAgg}s for the users, with nothing in their
+            transports.
+        """
+        self.successResultOf(self.realm.createGroup(u"somechannel"))
+        users = []
+        for name in names:
+            user = self._loggedInUser(name)
+            user.write("JOIN #somechannel\r\n")
+            users.append(user)
+        for user in users:
+            user.transport.clear()
+        return users
+
+
+    def test_groupMessageEncodedOnce(self):
+        """
+        A message to a group is formatted once, and the same bytes are sent
+        to every other member of the group.
+        """
+        user, first, second = self._groupMembers(
+            u'useruser', u'firstuser', u'someguy')
+        calls = []
+        encodeReceive = service.IRCUser._encodeReceive
+        def recordingEncodeReceive(self, *args):
+            calls.append(args)
+            return encodeReceive(self, *args)
+        self.patch(service.IRCUser, '_encodeReceive', recordingEncodeReceive)
+
+        user.write('PRIVMSG #somechannel :Hello, world.\r\n')
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(user.transport.value(), '')
+        self.assertEqual(
+            first.transport.value(),
+            ':useruser!useruser@realmname PRIVMSG #somechannel '
+            ':Hello, world.\r\n')
+        self.assertEqual(second.transport.value(), first.transport.value())
+
+
+    def test_groupMessageOtherClients(self):
+        """
+        Group members which are not L{service.IRCUser}s have their C{receive}
+        method called for messages to the group.
+        """
+        (user,) = self._groupMembers(u'useruser')
+        group = self.successResultOf(self.realm.getGroup(u"somechannel"))
+        client = TestChatClient(u'client')
+        group.add(client)
+
+        user.write('PRIVMSG #somechannel :Hello, world.\r\n')
+
+        self.assertEqual(
+            client.received,
+            [(user.protocol, group, {"text": u"Hello, world."})])
+
+
+    def test_groupMessageStatistics(self):
+        """
+        L{service.Group} records how many messages it has delivered and how
+        long it took to hand them to every member.
+        """
+        user, other = self._groupMembers(u'useruser', u'otheruser')
+        group = self.successResultOf(self.realm.getGroup(u"somechannel"))
+        # User.send also checks the time, before the group does.
+        times = [10.0, 10.0, 10.5, 20.0, 20.0, 20.25]
+        self.patch(service, 'time', lambda: times.pop(0))
+
+        user.write('PRIVMSG #somechannel :one\r\n')
+        user.write('PRIVMSG #somechannel :two\r\n')
+
+        self.assertEqual(group.fanouts, 2)
+        self.assertEqual(group.fanoutTime, 0.75)
+        self.assertEqual(group.maxFanoutTime, 0.5)
+
+
+    def test_sendQueue(self):
+        """
+        While its transport is paused, output for a user is queued, and it
+        is written when the transport resumes.
+        """
+        user, other = self._groupMembers(u'useruser', u'otheruser')
+        other.transport.producer.pauseProducing()
+
+        user.write('PRIVMSG #somechannel :Hello, world.\r\n')
+        self.assertEqual(other.transport.value(), '')
+
+        other.transport.producer.resumeProducing()
+        self.assertEqual(
+            other.transport.value(),
+            ':useruser!useruser@realmname PRIVMSG #somechannel '
+            ':Hello, world.\r\n')
+
+
+    def test_sendQueueDrop(self):
+        """
+        Group messages which do not fit in the send queue of a user are
+        dropped if its C{sendQueuePolicy} is C{'drop'}.  Other output to the
+        user is kept.
+        """
+        user, other = self._groupMembers(u'useruser', u'otheruser')
+        queue = other.protocol._sendQueue
+        queue.maxSize = 100
+        queue.pauseProducing()
+
+        user.write('PRIVMSG #somechannel :%s\r\n' % ('a' * 40,))
+        user.write('PRIVMSG #somechannel :%s\r\n' % ('b' * 40,))
+        other.write('PRIVMSG nousernamedthis :Hello\r\n')
+        queue.resumeProducing()
+
+        self.assertEqual(queue.dropped, 1)
+        response = self._response(other)
+        self.assertEqual(
+            [(command, args[-1]) for (prefix, command, args) in response],
+            [('PRIVMSG', 'a' * 40), ('401', 'No such nick/channel.')])
+
+
+    def test_sendQueueDisconnect(self):
+        """
+        A user whose send queue overflows is disconnected if its
+        C{sendQueuePolicy} is C{'disconnect'}.
+        """
+        user, other = self._groupMembers(u'useruser', u'otheruser')
+        queue = other.protocol._sendQueue
+        queue.maxSize = 10
+        queue.policy = 'disconnect'
+        queue.pauseProducing()
+
+        user.write('PRIVMSG #somechannel :Hello, world.\r\n')
+
+        self.assertFalse(other.transport.connected)
+        queue.resumeProducing()
+        self.assertEqual(other.transport.value(), '')
+
+
+    def test_sendQueueDisconnectStalled(self):
+        """
+        When the send queue overflows under the C{'disconnect'} policy, the
+        connection is aborted, since a transport which stays paused would
+        never finish closing it.
+        """
+        class StalledTransport(proto_helpers.StringTransport):
+            aborted = False
+            def loseConnection(self):
+                pass
+            def abortConnection(self):
+                self.aborted = True
+
+        transport = StalledTransport()
+        queue = service._SendQueue(transport, 10, 'disconnect')
+        queue.pauseProducing()
+
+        queue.write('Hello, world.\r\n')
+
+        self.assertTrue(transport.aborted)
+        queue.write('more\r\n')
+        queue.resumeProducing()
+        self.assertEqual(transport.value(), '')
+
+
+    def test_groupMessageOverriddenPrivmsg(self):
+        """
+        A member whose C{privmsg} method has been overridden has it called
+        for group messages, rather than being sent pre-encoded bytes.
+        """
+        user, other = self._groupMembers(u'useruser', u'otheruser')
+        calls = []
+        other.protocol.privmsg = lambda *args: calls.append(args)
+
+        user.write('PRIVMSG #somechannel :Hello, world.\r\n')
+
+        self.assertEqual(
+            calls,
+            [('useruser!useruser@realmname', '#somechannel',
+              u'Hello, world.')])
+        self.assertEqual(other.transport.value(), '')
+
+
+    def test_groupMessageOverriddenSendLine(self):
+        """
+        A member whose C{sendLine} method has been overridden has it called
+        for group messages, rather than being sent pre-encoded bytes.
+        """
+        user, other = self._groupMembers(u'useruser', u'otheruser')
+        lines = []
+        other.protocol.sendLine = lines.append
+
+        user.write('PRIVMSG #somechannel :Hello, world.\r\n')
+
+        self.assertEqual(
+            lines,
+            [u':useruser!useruser@realmname PRIVMSG #somechannel '
+             u':Hello, world.'])
+        self.assertEqual(other.transport.value(), '')
+
+
     def testPrivateMessage(self):
         user = self._loggedInUser(u'useruser')
 